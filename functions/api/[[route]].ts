@@ -11,6 +11,7 @@ import { userRoutes } from '../../server/routes/user'
 import { adminRoutes } from '../../server/routes/admin'
 import { authRoutes } from '../../server/routes/auth'
 import { badgeRoutes } from '../../server/routes/badge'
+import type { IngestMessage } from '../../server/lib/schemas'
 
 type Env = {
   Bindings: {
@@ -21,6 +22,9 @@ type Env = {
     GOOGLE_CLIENT_ID: string
     GOOGLE_CLIENT_SECRET: string
     CRON_SECRET: string
+    SUBREQUEST_LIMIT?: string
+    INGEST_COALESCE_MS?: string
+    INGEST_QUEUE?: Queue<IngestMessage>
   }
 }
 
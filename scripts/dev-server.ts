@@ -12,6 +12,8 @@ import { dataRoutes } from '../server/routes/data'
 import { userRoutes } from '../server/routes/user'
 import { adminRoutes } from '../server/routes/admin'
 import { authRoutes } from '../server/routes/auth'
+import { MemoryQueue } from '../server/lib/queue'
+import type { IngestMessage } from '../server/lib/schemas'
 import * as fs from 'fs'
 import * as path from 'path'
 
@@ -28,6 +30,21 @@ function loadFixture(name: string): unknown {
 const mockChartData = loadFixture('chart-data.json')
 const mockUserStats = loadFixture('user-stats.json')
 const mockUserSummary = loadFixture('user-summary.json')
+/** Reshape the wide fixture for ?format=columnar requests (fields= is ignored). */
+function mockChartColumns(wide: { data: Record<string, string | number>[]; models: string[] }) {
+  const suffixes = { submissions: '', prompts: '_prompts', unique_outputs: '_unique_outputs', drifted: '_drifted', consistency: '_consistency' }
+  const dates = wide.data.map((p) => p.date as string)
+  const series: Record<string, Record<string, (number | null)[]>> = {}
+  for (const model of wide.models) {
+    series[model] = {}
+    for (const [field, suffix] of Object.entries(suffixes)) {
+      series[model][field] = wide.data.map((p) => (p[`${model}${suffix}`] as number | undefined) ?? null)
+    }
+  }
+  const { data: _data, ...rest } = wide
+  return { ...rest, dates, series }
+}
+
 const mockSession = { user: { id: 'dev-user-mock-id', name: 'Dev User' }, token: 'mock-dev-token' }
 
 type Env = {
@@ -39,6 +56,7 @@ type Env = {
     GOOGLE_CLIENT_ID: string
     GOOGLE_CLIENT_SECRET: string
     CRON_SECRET: string
+    INGEST_QUEUE?: Queue<IngestMessage>
   }
 }
 
@@ -59,6 +77,17 @@ function loadEnv(): Record<string, string> {
 
 const envVars = loadEnv()
 
+// INGEST_QUEUE=memory binds an in-memory ingest queue so submits answer 202.
+// There is no R2 binding here, so consumed batches are only logged.
+const devQueue = (process.env.INGEST_QUEUE || envVars.INGEST_QUEUE) === 'memory'
+  ? new MemoryQueue<IngestMessage>('ingest')
+  : null
+if (devQueue) {
+  setInterval(() => devQueue.drain(async (batch) => {
+    console.log(`Ingest queue: consumed ${batch.messages.length} message(s)`)
+  }), 5000)
+}
+
 const app = new Hono<Env>()
 
 // Inject env bindings for all API routes
@@ -70,13 +99,16 @@ app.use('/api/*', async (c, next) => {
   bindings.GOOGLE_CLIENT_ID = process.env.GOOGLE_CLIENT_ID || envVars.GOOGLE_CLIENT_ID || ''
   bindings.GOOGLE_CLIENT_SECRET = process.env.GOOGLE_CLIENT_SECRET || envVars.GOOGLE_CLIENT_SECRET || ''
   bindings.CRON_SECRET = process.env.CRON_SECRET || envVars.CRON_SECRET || ''
+  if (devQueue) c.env.INGEST_QUEUE = devQueue as unknown as Queue<IngestMessage>
   await next()
 })
 
 // Mock routes — registered first so they take precedence in dev
 if (mockChartData) {
   console.log('Mock fixtures loaded — /api/data/chart, /api/user/*, /api/auth/session use mock data')
-  app.get('/api/data/chart', (c) => c.json(mockChartData))
+  app.get('/api/data/chart', (c) => c.json(c.req.query('format') === 'columnar'
+    ? mockChartColumns(mockChartData as Parameters<typeof mockChartColumns>[0])
+    : mockChartData))
   app.get('/api/user/me/stats', (c) => c.json(mockUserStats))
   app.get('/api/user/me/summary', (c) => c.json(mockUserSummary))
   app.get('/api/auth/session', (c) => c.json(mockSession))
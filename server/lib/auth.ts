@@ -2,6 +2,7 @@
  * JWT auth helpers using jose (Workers-compatible).
  */
 import { SignJWT, jwtVerify } from 'jose'
+import { sha256Hex } from './crypto'
 
 export interface TokenPayload {
   userId: string
@@ -39,10 +40,6 @@ export async function verifyToken(token: string, jwtSecret: string): Promise<Tok
  *   createHash('sha256').update(`${provider}:${accountId}`).digest('hex').substring(0, 16)
  */
 export async function deriveUserId(provider: string, accountId: string): Promise<string> {
-  const data = new TextEncoder().encode(`${provider}:${accountId}`)
-  const hash = await crypto.subtle.digest('SHA-256', data)
-  const hex = Array.from(new Uint8Array(hash))
-    .map((b) => b.toString(16).padStart(2, '0'))
-    .join('')
+  const hex = await sha256Hex(`${provider}:${accountId}`)
   return hex.substring(0, 16)
 }
@@ -0,0 +1,30 @@
+// @vitest-environment node
+import { describe, it, expect } from 'vitest'
+import { createHash } from 'crypto'
+import { createBloomFilter, bloomMayContain } from './bloom'
+
+const userId = (i: number) => createHash('sha256').update(`user-${i}`).digest('hex')
+
+describe('bloom filter', () => {
+  it('never misses an added value', () => {
+    const users = Array.from({ length: 200 }, (_, i) => userId(i))
+    const filter = createBloomFilter(users)
+    expect(users.every((u) => bloomMayContain(filter, u))).toBe(true)
+  })
+
+  it('keeps false positives near the target rate', () => {
+    const filter = createBloomFilter(Array.from({ length: 200 }, (_, i) => userId(i)))
+    let hits = 0
+    for (let i = 1000; i < 11_000; i++) if (bloomMayContain(filter, userId(i))) hits++
+    expect(hits / 10_000).toBeLessThan(0.03)
+  })
+
+  it('sizes the filter by distinct values and survives JSON', () => {
+    const filter = createBloomFilter(['a', 'a', 'a', 'b'])
+    expect(filter.m).toBe(64)
+    const copy = JSON.parse(JSON.stringify(filter))
+    expect(bloomMayContain(copy, 'a')).toBe(true)
+    expect(bloomMayContain(copy, 'b')).toBe(true)
+    expect(createBloomFilter(Array.from({ length: 1000 }, (_, i) => userId(i))).m).toBeGreaterThan(9000)
+  })
+})
@@ -0,0 +1,62 @@
+/**
+ * Bloom filters over strings, kept in the archive manifest so a job can tell
+ * which archives cannot hold a value without opening them. Probes come from
+ * double hashing over two FNV-1a variants; the bit array travels as base64.
+ */
+
+export interface BloomFilter {
+  m: number      // bits
+  k: number      // probes per value
+  bits: string   // base64 of the m/8-byte bit array
+}
+
+const DEFAULT_FP_RATE = 0.01
+
+function fnv1a(value: string, basis: number): number {
+  let h = basis
+  for (let i = 0; i < value.length; i++) {
+    h ^= value.charCodeAt(i)
+    h = Math.imul(h, 0x01000193)
+  }
+  return h >>> 0
+}
+
+function forEachProbe(value: string, m: number, k: number, fn: (bit: number) => void): void {
+  const h1 = fnv1a(value, 0x811c9dc5)
+  const h2 = fnv1a(value, 0x050c5d1f) | 1
+  for (let i = 0; i < k; i++) fn(((h1 + Math.imul(i, h2)) >>> 0) % m)
+}
+
+function toBase64(bytes: Uint8Array): string {
+  let s = ''
+  for (let i = 0; i < bytes.length; i++) s += String.fromCharCode(bytes[i])
+  return btoa(s)
+}
+
+function fromBase64(b64: string): Uint8Array {
+  const s = atob(b64)
+  const bytes = new Uint8Array(s.length)
+  for (let i = 0; i < s.length; i++) bytes[i] = s.charCodeAt(i)
+  return bytes
+}
+
+/** A filter over the distinct `values`, sized for `fpRate` false positives. */
+export function createBloomFilter(values: Iterable<string>, fpRate: number = DEFAULT_FP_RATE): BloomFilter {
+  const distinct = new Set(values)
+  const n = Math.max(1, distinct.size)
+  const m = Math.max(64, Math.ceil((-n * Math.log(fpRate)) / (Math.LN2 * Math.LN2) / 8) * 8)
+  const k = Math.max(1, Math.round((m / n) * Math.LN2))
+  const bits = new Uint8Array(m / 8)
+  for (const v of distinct) forEachProbe(v, m, k, (bit) => { bits[bit >> 3] |= 1 << (bit & 7) })
+  return { m, k, bits: toBase64(bits) }
+}
+
+/** False means `value` was certainly not added; true means it may have been. */
+export function bloomMayContain(filter: BloomFilter, value: string): boolean {
+  const bits = fromBase64(filter.bits)
+  let hit = true
+  forEachProbe(value, filter.m, filter.k, (bit) => {
+    if ((bits[bit >> 3] & (1 << (bit & 7))) === 0) hit = false
+  })
+  return hit
+}
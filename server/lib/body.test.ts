@@ -0,0 +1,52 @@
+// @vitest-environment node
+import { describe, it, expect } from 'vitest'
+import { readJsonBody, bodyErrorStatus } from './body'
+
+const encoder = new TextEncoder()
+
+async function compress(text: string, format: CompressionFormat): Promise<Uint8Array> {
+  const stream = new Blob([encoder.encode(text)]).stream().pipeThrough(new CompressionStream(format))
+  return new Uint8Array(await new Response(stream).arrayBuffer())
+}
+
+function post(body: BodyInit, encoding?: string): Request {
+  return new Request('http://localhost/', {
+    method: 'POST',
+    body,
+    headers: encoding ? { 'Content-Encoding': encoding } : {},
+  })
+}
+
+async function statusOf(promise: Promise<unknown>): Promise<number | undefined> {
+  try {
+    await promise
+  } catch (err) {
+    return bodyErrorStatus(err)
+  }
+  return 200
+}
+
+describe('readJsonBody', () => {
+  const payload = { results: Array.from({ length: 50 }, (_, i) => ({ output: `the same long output text ${i % 3}` })) }
+  const json = JSON.stringify(payload)
+
+  it('parses identity, gzip and deflate bodies alike', async () => {
+    expect(await readJsonBody(post(json), 1 << 20)).toEqual(payload)
+    expect(await readJsonBody(post(await compress(json, 'gzip'), 'gzip'), 1 << 20)).toEqual(payload)
+    expect(await readJsonBody(post(await compress(json, 'deflate'), 'deflate'), 1 << 20)).toEqual(payload)
+  })
+
+  it('caps decoded bytes, not wire bytes', async () => {
+    // ~8 MiB of zeros compresses to a few KiB
+    const bomb = await compress(`"${'0'.repeat(8 << 20)}"`, 'gzip')
+    expect(bomb.length).toBeLessThan(64 << 10)
+    expect(await statusOf(readJsonBody(post(bomb, 'gzip'), 1 << 20))).toBe(413)
+    expect(await statusOf(readJsonBody(post(json), 100))).toBe(413)
+  })
+
+  it('rejects unknown encodings, corrupt data and invalid JSON', async () => {
+    expect(await statusOf(readJsonBody(post(json, 'br'), 1 << 20))).toBe(415)
+    expect(await statusOf(readJsonBody(post(json, 'gzip'), 1 << 20))).toBe(400)
+    expect(await statusOf(readJsonBody(post('{"a":'), 1 << 20))).toBe(400)
+  })
+})
@@ -0,0 +1,94 @@
+/**
+ * Request body decoding for the submit routes: Content-Encoding gzip/deflate
+ * through DecompressionStream, with a cap on decoded bytes so a small
+ * compressed upload cannot expand without bound (zip bombs).
+ */
+
+const DECODERS: Record<string, CompressionFormat> = {
+  gzip: 'gzip',
+  'x-gzip': 'gzip',
+  deflate: 'deflate',
+}
+
+export type BodyErrorStatus = 400 | 413 | 415
+
+function statusError(status: BodyErrorStatus, message: string): Error & { status: BodyErrorStatus } {
+  const err = new Error(message) as Error & { status: BodyErrorStatus }
+  err.status = status
+  return err
+}
+
+/** The HTTP status attached to a body error, if `err` is one. */
+export function bodyErrorStatus(err: unknown): BodyErrorStatus | undefined {
+  return (err as { status?: BodyErrorStatus } | null)?.status
+}
+
+/**
+ * The request body, decompressed per Content-Encoding. Reading it fails with
+ * status 413 once more than `maxBytes` decoded bytes arrive (the source is
+ * cancelled at that point) and with 400 if the data does not match its
+ * encoding. An unsupported encoding throws 415 immediately.
+ */
+export function decodedBody(req: Request, maxBytes: number): ReadableStream<Uint8Array> | null {
+  if (!req.body) return null
+  const encoding = (req.headers.get('Content-Encoding') ?? '').trim().toLowerCase()
+  let source = req.body
+  if (encoding !== '' && encoding !== 'identity') {
+    const format = DECODERS[encoding]
+    if (!format) throw statusError(415, `Unsupported Content-Encoding: ${encoding}`)
+    source = source.pipeThrough(new DecompressionStream(format))
+  }
+
+  const reader = source.getReader()
+  let decodedBytes = 0
+  return new ReadableStream<Uint8Array>({
+    async pull(controller) {
+      let chunk: ReadableStreamReadResult<Uint8Array>
+      try {
+        chunk = await reader.read()
+      } catch {
+        controller.error(statusError(400, `Body is not valid ${encoding || 'data'}`))
+        return
+      }
+      if (chunk.done) {
+        controller.close()
+        return
+      }
+      decodedBytes += chunk.value.length
+      if (decodedBytes > maxBytes) {
+        controller.error(statusError(413, `Decoded body exceeds ${maxBytes} bytes`))
+        await reader.cancel().catch(() => {})
+        return
+      }
+      controller.enqueue(chunk.value)
+    },
+    cancel(reason) {
+      return reader.cancel(reason)
+    },
+  })
+}
+
+/**
+ * Read and parse a JSON body through decodedBody.
+ * Throws an error carrying status 400 / 413 / 415 when it cannot.
+ */
+export async function readJsonBody(req: Request, maxBytes: number): Promise<unknown> {
+  const body = decodedBody(req, maxBytes)
+  if (!body) throw statusError(400, 'Request body required')
+
+  const reader = body.getReader()
+  const decoder = new TextDecoder()
+  let text = ''
+  for (;;) {
+    const { done, value } = await reader.read()
+    if (done) break
+    text += decoder.decode(value, { stream: true })
+  }
+  text += decoder.decode()
+
+  try {
+    return JSON.parse(text)
+  } catch {
+    throw statusError(400, 'Invalid JSON')
+  }
+}
@@ -1,40 +1,81 @@
 import { describe, it, expect, vi, beforeEach } from 'vitest'
-import type { StorageRecord } from './schemas'
+import type { StorageRecord, ChartJson, ChartDelta, ArchiveManifestJson, ArchiveManifestPartitionJson, ErasureJobJson } from './schemas'
 
-// Mock storage module before importing buffer
-vi.mock('./storage', () => ({
+// Mock storage I/O before importing buffer (SubrequestBudget stays real)
+vi.mock('./storage', async (importOriginal) => ({
+  ...(await importOriginal<typeof import('./storage')>()),
   downloadFileWithEtag: vi.fn(),
+  downloadFileIfChanged: vi.fn(),
   uploadFile: vi.fn(),
+  uploadFileWithMetadata: vi.fn(),
   uploadFileConditional: vi.fn(),
   listFiles: vi.fn(),
+  listFilesWithMetadata: vi.fn(),
+  listPrefixes: vi.fn(),
   downloadFile: vi.fn(),
+  downloadMany: vi.fn(),
+  uploadMany: vi.fn(),
   deleteFiles: vi.fn(),
   deleteFile: vi.fn(),
 }))
 
 import {
   writeBufferEntry,
-  updateUserSummary,
+  writeSummaryDelta,
+  writeCoalesced,
+  coalesceWindowFromEnv,
+  readUserSummary,
+  foldSummaryDeltas,
   readChartJson,
-  writeDelta,
+  readChartJsonCached,
+  readChartRange,
+  readChartResponseBody,
+  pickChartLevel,
+  invalidateChartCache,
+  buildChartResponse,
+  buildChartColumns,
   mergeDeltas,
+  compactBuffer,
+  rebuildChartJsonIncremental,
+  migrateArchives,
+  exportArchiveCsv,
+  exportArchivesCsv,
+  readOutput,
   deleteUserFromBuffer,
+  requestErasure,
+  advanceErasureJob,
+  runErasureJobs,
 } from './buffer'
 import {
   downloadFileWithEtag,
+  downloadFileIfChanged,
   uploadFile,
+  uploadFileWithMetadata,
   uploadFileConditional,
   listFiles,
+  listFilesWithMetadata,
+  listPrefixes,
   downloadFile,
+  downloadMany,
+  uploadMany,
   deleteFiles,
   deleteFile,
+  SubrequestBudget,
 } from './storage'
+import { readSegmentRecords, readSegmentAggregateRows, writeSegment } from './segment'
+import { createBloomFilter, bloomMayContain } from './bloom'
 
 const mockDownloadFileWithEtag = vi.mocked(downloadFileWithEtag)
+const mockDownloadFileIfChanged = vi.mocked(downloadFileIfChanged)
 const mockUploadFile = vi.mocked(uploadFile)
+const mockUploadFileWithMetadata = vi.mocked(uploadFileWithMetadata)
 const mockUploadFileConditional = vi.mocked(uploadFileConditional)
 const mockListFiles = vi.mocked(listFiles)
+const mockListFilesWithMetadata = vi.mocked(listFilesWithMetadata)
+const mockListPrefixes = vi.mocked(listPrefixes)
 const mockDownloadFile = vi.mocked(downloadFile)
+const mockDownloadMany = vi.mocked(downloadMany)
+const mockUploadMany = vi.mocked(uploadMany)
 const mockDeleteFiles = vi.mocked(deleteFiles)
 const mockDeleteFile = vi.mocked(deleteFile)
 
@@ -58,6 +99,25 @@ async function gunzip(data: Uint8Array): Promise<Uint8Array> {
 const encoder = new TextEncoder()
 const decoder = new TextDecoder()
 
+/** Split an ingest entry into its chart delta header and its gzipped CSV rows. */
+function ingestParts(body: Uint8Array): { header: ChartDelta; rows: Uint8Array } {
+  expect(decoder.decode(body.subarray(0, 4))).toBe('PING')
+  const end = 8 + new DataView(body.buffer, body.byteOffset).getUint32(4, true)
+  return { header: JSON.parse(decoder.decode(body.subarray(8, end))), rows: body.subarray(end) }
+}
+
+/** An ingest entry as writeBufferEntry writes it. */
+async function ingestEntry(header: ChartDelta, csv: string): Promise<Uint8Array> {
+  const json = encoder.encode(JSON.stringify(header))
+  const rows = await gzip(encoder.encode(csv))
+  const body = new Uint8Array(8 + json.length + rows.length)
+  body.set(encoder.encode('PING'))
+  new DataView(body.buffer).setUint32(4, json.length, true)
+  body.set(json, 8)
+  body.set(rows, 8 + json.length)
+  return body
+}
+
 // Fake R2 bucket (only used as first arg, actual calls are mocked)
 const fakeBucket = {} as R2Bucket
 
@@ -81,207 +141,640 @@ function makeRecord(overrides: Partial<StorageRecord> = {}): StorageRecord {
 
 beforeEach(() => {
   vi.clearAllMocks()
+  invalidateChartCache()
+  // No tagged buffer entries or summary deltas unless a test lists some
+  mockListFilesWithMetadata.mockResolvedValue([])
+  mockListPrefixes.mockResolvedValue([])
+  // Batch helpers fan out to the single-object mocks so tests can assert on those
+  mockDownloadMany.mockImplementation((bucket, keys, budget) =>
+    Promise.all(keys.map((key) => mockDownloadFile(bucket, key, budget)))
+  )
+  mockUploadMany.mockImplementation(async (bucket, files, budget) => {
+    const etags: string[] = []
+    for (const { key, body } of files) etags.push(await mockUploadFile(bucket, key, body, budget))
+    return etags
+  })
 })
 
 describe('writeBufferEntry', () => {
-  it('writes a gzipped CSV entry file with headers', async () => {
-    mockUploadFile.mockResolvedValue(undefined)
-
-    await writeBufferEntry(fakeBucket, [makeRecord()])
+  it('writes one ingest entry with the chart delta header and gzipped CSV rows, tagged with its user', async () => {
+    await writeBufferEntry(fakeBucket, [makeRecord(), makeRecord()])
 
-    expect(mockUploadFile).toHaveBeenCalledTimes(1)
-    const [, key, body] = mockUploadFile.mock.calls[0]
-    expect(key).toMatch(/^_buffer\/entries\/\d+_[a-z0-9]+\.csv\.gz$/)
-    const csv = decoder.decode(await gunzip(body))
+    expect(mockUploadFileWithMetadata).toHaveBeenCalledTimes(1)
+    expect(mockUploadFile).not.toHaveBeenCalled()
+    const [, key, body, metadata] = mockUploadFileWithMetadata.mock.calls[0]
+    expect(key).toMatch(/^_buffer\/entries\/\d+_[a-z0-9]+\.ing$/)
+    expect(metadata).toEqual({ user_id: 'user1', rows: '2' })
+    const { header, rows } = ingestParts(body)
+    expect(header.ts).toBe(Number(key.split('/')[2].split('_')[0]))
+    expect(header.bucket).toMatch(/^\d{4}-\d{2}-\d{2}-\d{2}$/)
+    expect(header.records).toEqual([
+      { model_id: 'gpt-5', prompt_id: 'prompt1', output_hash: 'sha256:abc', user_id: 'user1' },
+      { model_id: 'gpt-5', prompt_id: 'prompt1', output_hash: 'sha256:abc', user_id: 'user1' },
+    ])
+    const csv = decoder.decode(await gunzip(rows))
     expect(csv).toContain('id,timestamp,user_id')
     expect(csv).toContain('00000000-0000-4000-8000-000000000001')
     expect(csv).toContain('gpt-5')
   })
 
+  it('dates the key and the chart bucket by `at` when given', async () => {
+    const at = new Date('2026-02-21T09:30:00.000Z')
+    await writeBufferEntry(fakeBucket, [makeRecord()], at)
+
+    const [, key, body] = mockUploadFileWithMetadata.mock.calls[0]
+    expect(key).toMatch(new RegExp(`^_buffer/entries/${at.getTime()}_[a-z0-9]+\\.ing$`))
+    expect(ingestParts(body).header).toMatchObject({ ts: at.getTime(), bucket: '2026-02-21-09' })
+  })
+
+  it('leaves an entry mixing users untagged', async () => {
+    await writeBufferEntry(fakeBucket, [makeRecord(), makeRecord({ user_id: 'user2' })])
+    expect(mockUploadFileWithMetadata).not.toHaveBeenCalled()
+    expect(mockUploadFile).toHaveBeenCalledTimes(1)
+  })
+
   it('skips when no records', async () => {
     await writeBufferEntry(fakeBucket, [])
     expect(mockUploadFile).not.toHaveBeenCalled()
+    expect(mockUploadFileWithMetadata).not.toHaveBeenCalled()
   })
 
   it('escapes CSV fields with commas and quotes', async () => {
-    mockUploadFile.mockResolvedValue(undefined)
-
     await writeBufferEntry(fakeBucket, [
       makeRecord({ output: 'has "quotes" and, commas' }),
     ])
 
-    const [, , body] = mockUploadFile.mock.calls[0]
-    const csv = decoder.decode(await gunzip(body))
+    const [, , body] = mockUploadFileWithMetadata.mock.calls[0]
+    const csv = decoder.decode(await gunzip(ingestParts(body).rows))
     expect(csv).toContain('"has ""quotes"" and, commas"')
   })
 })
 
-describe('updateUserSummary', () => {
-  it('creates new v3 summary when none exists', async () => {
-    mockDownloadFileWithEtag.mockResolvedValue({ body: null, etag: null })
-    mockUploadFile.mockResolvedValue(undefined)
+describe('writeCoalesced', () => {
+  it('shares one entry and summary delta per user, flushing at the record cap', async () => {
+    const a = writeCoalesced(fakeBucket, 'user1', [makeRecord()], 10_000)
+    const b = writeCoalesced(fakeBucket, 'user2', [makeRecord({ user_id: 'user2' })], 10)
+    const c = writeCoalesced(fakeBucket, 'user1', [makeRecord()], 10_000)
 
-    const summary = await updateUserSummary(fakeBucket, 'user1', [makeRecord()])
+    // 500 rows close user1's batch without waiting out its window
+    writeCoalesced(fakeBucket, 'user1', Array.from({ length: 498 }, () => makeRecord()), 10_000)
+    await Promise.all([a.entry, a.summary, b.entry, b.summary, c.entry, c.summary])
 
-    expect(summary.version).toBe(3)
-    expect(summary.total_submissions).toBe(1)
-    expect(summary.submissions_by_date['2026-02-21']['gpt-5']).toBe(1)
-    expect(summary.model_submissions['gpt-5']).toBe(1)
+    const entries = mockUploadFileWithMetadata.mock.calls.filter(([, key]) => key.startsWith('_buffer/entries/'))
+    expect(entries.map(([, , , meta]) => meta)).toEqual([
+      { user_id: 'user1', rows: '500' },
+      { user_id: 'user2', rows: '1' },
+    ])
+    expect(mockUploadFileWithMetadata.mock.calls.filter(([, key]) => key.startsWith('_summary_deltas/'))).toHaveLength(2)
   })
 
-  it('accumulates multiple records', async () => {
-    mockDownloadFileWithEtag.mockResolvedValue({ body: null, etag: null })
-    mockUploadFile.mockResolvedValue(undefined)
+  it('fails every request in a batch when its write fails', async () => {
+    mockUploadFileWithMetadata.mockRejectedValue(new Error('R2 down'))
+    const a = writeCoalesced(fakeBucket, 'user1', [makeRecord()], 5)
+    const b = writeCoalesced(fakeBucket, 'user1', [makeRecord()], 5)
+    const settled = await Promise.allSettled([a.entry, b.entry, b.summary])
+    expect(settled.map((r) => r.status)).toEqual(['rejected', 'rejected', 'rejected'])
+    mockUploadFileWithMetadata.mockReset()
+  })
+
+  it("hands the flush to the opener's waitUntil", async () => {
+    const kept: Promise<unknown>[] = []
+    const a = writeCoalesced(fakeBucket, 'user1', [makeRecord()], 5, (work) => { kept.push(work) })
+    const b = writeCoalesced(fakeBucket, 'user1', [makeRecord()], 5, (work) => { kept.push(work) })
+
+    // Only the opener runs the timer, so only it keeps its invocation alive
+    expect(kept).toHaveLength(1)
+    await kept[0]
+    await Promise.all([a.entry, b.entry])
+    expect(mockUploadFileWithMetadata.mock.calls.filter(([, key]) => key.startsWith('_buffer/entries/'))
+      .map(([, , , meta]) => meta)).toEqual([{ user_id: 'user1', rows: '2' }])
+  })
+
+  it('writes a joiner on its own when the batch it joined is not flushed in time', async () => {
+    // The opener's window stands in for a timer that never fires
+    writeCoalesced(fakeBucket, 'user3', [makeRecord({ user_id: 'user3' })], 10_000)
+    const joiner = writeCoalesced(fakeBucket, 'user3', [makeRecord({ user_id: 'user3', prompt_id: 'p2' })], 5)
+    await joiner.entry
+
+    const entries = () => mockUploadFileWithMetadata.mock.calls.filter(([, key]) => key.startsWith('_buffer/entries/'))
+    expect(entries().map(([, , , meta]) => meta)).toEqual([{ user_id: 'user3', rows: '1' }])
+    // The batch no longer holds the joiner's row
+    await writeCoalesced(fakeBucket, 'user3', Array.from({ length: 499 }, () => makeRecord({ user_id: 'user3' })), 10_000).entry
+    expect(entries()[1][3]).toEqual({ user_id: 'user3', rows: '500' })
+  })
 
-    const summary = await updateUserSummary(fakeBucket, 'user1', [
+  it('reads its window from the binding', () => {
+    expect(coalesceWindowFromEnv(undefined)).toBe(0)
+    expect(coalesceWindowFromEnv('oops')).toBe(0)
+    expect(coalesceWindowFromEnv('50')).toBe(50)
+    expect(coalesceWindowFromEnv('60000')).toBe(1000)
+  })
+})
+
+describe('user summaries', () => {
+  const deltaKey = (ts: number, rand = 'abc') => `_summary_deltas/user1/${ts}_${rand}.json`
+  const listed = (key: string, counts: unknown) => ({ key, customMetadata: { counts: JSON.stringify(counts) } })
+
+  it('writes a submit as an append-only delta without reading the summary', async () => {
+    await writeSummaryDelta(fakeBucket, 'user1', [
       makeRecord(),
       makeRecord({ id: 'test-id-2', model_id: 'gpt-4' }),
       makeRecord({ id: 'test-id-3' }),
     ])
 
-    expect(summary.total_submissions).toBe(3)
-    expect(summary.submissions_by_date['2026-02-21']['gpt-5']).toBe(2)
-    expect(summary.submissions_by_date['2026-02-21']['gpt-4']).toBe(1)
-    expect(summary.model_submissions['gpt-5']).toBe(2)
-    expect(summary.model_submissions['gpt-4']).toBe(1)
+    expect(mockDownloadFileWithEtag).not.toHaveBeenCalled()
+    expect(mockUploadFileConditional).not.toHaveBeenCalled()
+    const [, key, body, metadata] = mockUploadFileWithMetadata.mock.calls[0]
+    expect(key).toMatch(/^_summary_deltas\/user1\/\d+_[a-z0-9]+\.json$/)
+    const delta = { '2026-02-21': { 'gpt-5': 2, 'gpt-4': 1 } }
+    expect(JSON.parse(decoder.decode(body))).toEqual(delta)
+    expect(JSON.parse(metadata.counts)).toEqual(delta)
   })
 
-  it('migrates v1 summary (date_counts) to v3', async () => {
-    const existing = JSON.stringify({
-      date_counts: { '2026-02-20': { 'gpt-4': 3 } },
-      total_submissions: 3,
+  it('reads the summary plus pending deltas not yet folded in', async () => {
+    mockJsonFiles({
+      '_users/user1/summary.json': {
+        version: 3,
+        submissions_by_date: { '2026-02-20': { 'gpt-4': 3 } },
+        model_submissions: { 'gpt-4': 3 },
+        total_submissions: 3,
+        folded_through: deltaKey(2000),
+      },
+    })
+    mockListFilesWithMetadata.mockResolvedValue([
+      listed(deltaKey(1000), { '2026-02-20': { 'gpt-4': 3 } }),   // folded, not yet deleted
+      listed(deltaKey(3000), { '2026-02-21': { 'gpt-5': 1 } }),
+      { key: deltaKey(4000), customMetadata: {} },                   // too large to inline
+    ])
+    mockDownloadFile.mockResolvedValue(encoder.encode(JSON.stringify({ '2026-02-21': { 'gpt-4': 2 } })))
+
+    const summary = await readUserSummary(fakeBucket, 'user1')
+
+    expect(summary).toEqual({
+      version: 3,
+      submissions_by_date: { '2026-02-20': { 'gpt-4': 3 }, '2026-02-21': { 'gpt-5': 1, 'gpt-4': 2 } },
+      model_submissions: { 'gpt-4': 5, 'gpt-5': 1 },
+      total_submissions: 6,
     })
-    mockDownloadFileWithEtag.mockResolvedValue({
-      body: encoder.encode(existing),
-      etag: '"e1"',
+    expect(mockDownloadFile).toHaveBeenCalledTimes(1)
+    // One listing page, however many deltas are pending
+    expect(mockListFilesWithMetadata).toHaveBeenCalledWith(fakeBucket, '_summary_deltas/user1/', 1000, undefined)
+  })
+
+  it('migrates v1 summary (date_counts) to v3', async () => {
+    mockJsonFiles({
+      '_users/user1/summary.json': { date_counts: { '2026-02-20': { 'gpt-4': 3 } }, total_submissions: 3 },
     })
-    mockUploadFileConditional.mockResolvedValue(undefined)
+    mockListFilesWithMetadata.mockResolvedValue([listed(deltaKey(1000), { '2026-02-21': { 'gpt-5': 1 } })])
 
-    const summary = await updateUserSummary(fakeBucket, 'user1', [makeRecord()])
+    const summary = await readUserSummary(fakeBucket, 'user1')
 
-    expect(summary.version).toBe(3)
-    expect(summary.total_submissions).toBe(4)
-    expect(summary.submissions_by_date['2026-02-20']['gpt-4']).toBe(3)
-    expect(summary.submissions_by_date['2026-02-21']['gpt-5']).toBe(1)
-    expect(summary.model_submissions['gpt-4']).toBe(3)
-    expect(summary.model_submissions['gpt-5']).toBe(1)
+    expect(summary!.version).toBe(3)
+    expect(summary!.total_submissions).toBe(4)
+    expect(summary!.submissions_by_date['2026-02-20']['gpt-4']).toBe(3)
+    expect(summary!.submissions_by_date['2026-02-21']['gpt-5']).toBe(1)
+    expect(summary!.model_submissions['gpt-4']).toBe(3)
+    expect(summary!.model_submissions['gpt-5']).toBe(1)
   })
 
   it('migrates v2 summary (Welford date_stats) to v3', async () => {
-    const existing = JSON.stringify({
-      version: 2,
-      date_stats: { '2026-02-20': { 'gpt-4': { n: 2, mean: 0.8, m2: 0.1, count: 5 } } },
-      model_stats: { 'gpt-4': { n: 2, mean: 0.8, m2: 0.1, count: 5 } },
-      total_submissions: 5,
-      total_scored: 2,
-    })
-    mockDownloadFileWithEtag.mockResolvedValue({
-      body: encoder.encode(existing),
-      etag: '"e2"',
+    mockJsonFiles({
+      '_users/user1/summary.json': {
+        version: 2,
+        date_stats: { '2026-02-20': { 'gpt-4': { n: 2, mean: 0.8, m2: 0.1, count: 5 } } },
+        model_stats: { 'gpt-4': { n: 2, mean: 0.8, m2: 0.1, count: 5 } },
+        total_submissions: 5,
+        total_scored: 2,
+      },
     })
-    mockUploadFileConditional.mockResolvedValue(undefined)
+    mockListFilesWithMetadata.mockResolvedValue([])
 
-    const summary = await updateUserSummary(fakeBucket, 'user1', [makeRecord()])
+    const summary = await readUserSummary(fakeBucket, 'user1')
 
-    expect(summary.version).toBe(3)
-    expect(summary.total_submissions).toBe(6)
+    expect(summary!.version).toBe(3)
+    expect(summary!.total_submissions).toBe(5)
     // v2 count was 5, migrated as submission count
-    expect(summary.submissions_by_date['2026-02-20']['gpt-4']).toBe(5)
-    expect(summary.submissions_by_date['2026-02-21']['gpt-5']).toBe(1)
+    expect(summary!.submissions_by_date['2026-02-20']['gpt-4']).toBe(5)
   })
+
+  it('is null for a user with no summary and no deltas', async () => {
+    mockJsonFiles({})
+    mockListFilesWithMetadata.mockResolvedValue([])
+    expect(await readUserSummary(fakeBucket, 'user1')).toBeNull()
+  })
+
+  it('folds settled deltas into summary.json at compaction and deletes them', async () => {
+    const now = Date.now()
+    mockJsonFiles({})
+    mockListPrefixes.mockResolvedValue(['_summary_deltas/user1/'])
+    mockListFilesWithMetadata.mockResolvedValue([
+      listed(deltaKey(now - 120_000), { '2026-02-21': { 'gpt-5': 2 } }),
+      listed(deltaKey(now - 90_000), { '2026-02-21': { 'gpt-5': 1 } }),
+      listed(deltaKey(now - 1_000), { '2026-02-21': { 'gpt-5': 7 } }),   // may still have PUTs in flight behind it
+    ])
+
+    const result = await foldSummaryDeltas(fakeBucket)
+
+    expect(result).toEqual({ usersFolded: 1, deltasFolded: 2 })
+    const [, key, body] = mockUploadFile.mock.calls[0]
+    expect(key).toBe('_users/user1/summary.json')
+    expect(JSON.parse(decoder.decode(body))).toMatchObject({
+      total_submissions: 3,
+      folded_through: deltaKey(now - 90_000),
+    })
+    expect(mockDeleteFiles).toHaveBeenCalledWith(
+      fakeBucket, [deltaKey(now - 120_000), deltaKey(now - 90_000)], expect.any(SubrequestBudget))
+    // Every user fit: the next run starts from the first one again
+    expect(mockUploadFile).toHaveBeenCalledTimes(1)
+  })
+
+  it('takes users in turn from the stored cursor, each reading only its own deltas', async () => {
+    const old = Date.now() - 120_000
+    mockJsonFiles({ '_maintenance/summary_fold.json': { version: 1, after: 'user1' } })
+    const prefixes = ['_summary_deltas/user1/', '_summary_deltas/user2/', '_summary_deltas/user3/', '_summary_deltas/user4/']
+    mockListPrefixes.mockImplementation(async (_bucket, _prefix, max, startAfter) =>
+      prefixes.filter((p) => !startAfter || p > startAfter).slice(0, max))
+    mockListFilesWithMetadata.mockImplementation(async (_bucket, prefix) =>
+      [listed(`${prefix}${old}_abc.json`, { '2026-02-21': { 'gpt-5': 1 } })])
+
+    // Cursor read, user listing, two users at 4 calls each, cursor write
+    const result = await foldSummaryDeltas(fakeBucket, new SubrequestBudget(11))
+
+    expect(result).toEqual({ usersFolded: 2, deltasFolded: 2 })
+    expect(mockListPrefixes).toHaveBeenCalledWith(
+      fakeBucket, '_summary_deltas/', 2, '_summary_deltas/user1/\uffff', expect.any(SubrequestBudget))
+    expect(mockListFilesWithMetadata.mock.calls.map(([, prefix]) => prefix))
+      .toEqual(['_summary_deltas/user2/', '_summary_deltas/user3/'])
+    const cursor = mockUploadFile.mock.calls.find(([, key]) => key === '_maintenance/summary_fold.json')!
+    expect(JSON.parse(decoder.decode(cursor[2]))).toEqual({ version: 1, after: 'user3' })
+  })
+
+  it('wraps around to the first user once the cursor is past the last', async () => {
+    mockJsonFiles({ '_maintenance/summary_fold.json': { version: 1, after: 'user9' } })
+    mockListPrefixes.mockImplementation(async (_bucket, _prefix, _max, startAfter) =>
+      startAfter ? [] : ['_summary_deltas/user1/'])
+
+    const result = await foldSummaryDeltas(fakeBucket)
+
+    expect(result).toEqual({ usersFolded: 0, deltasFolded: 0 })
+    expect(mockListPrefixes).toHaveBeenCalledTimes(2)
+    expect(mockListFilesWithMetadata).toHaveBeenCalledWith(
+      fakeBucket, '_summary_deltas/user1/', 1000, expect.any(SubrequestBudget))
+    const [, key, body] = mockUploadFile.mock.calls[0]
+    expect(key).toBe('_maintenance/summary_fold.json')
+    expect(JSON.parse(decoder.decode(body))).toEqual({ version: 1, after: '' })
+  })
+})
+
+/** Serve JSON objects by key through every download mock; other keys are missing. */
+function mockJsonFiles(files: Record<string, unknown>, etag = 'e1') {
+  const body = (key: string) => files[key] === undefined ? null : encoder.encode(JSON.stringify(files[key]))
+  mockDownloadFileWithEtag.mockImplementation(async (_bucket, key) => {
+    const b = body(key)
+    return { body: b, etag: b ? etag : null }
+  })
+  mockDownloadFileIfChanged.mockImplementation(async (_bucket, key, current) => {
+    const b = body(key)
+    if (!b) return { body: null, etag: null, notModified: false }
+    if (current === etag) return { body: null, etag, notModified: true }
+    return { body: b, etag, notModified: false }
+  })
+  mockDownloadFile.mockImplementation(async (_bucket, key) => {
+    const b = body(key)
+    if (!b) throw new Error(`Not found: ${key}`)
+    return b
+  })
+}
+
+const stats = (submissions: number, drifted = 0) =>
+  ({ submissions, prompts_tested: submissions, unique_outputs: submissions, drifted_prompts: drifted })
+
+const chartIndex = (months: string[], total = 1): ChartJson => ({
+  version: 7, months, models: ['gpt-5'], total_submissions: total, total_contributors: 1,
+  last_updated: '2026-02-21T00:00:00.000Z',
 })
 
+const shard = (month: string, data: Record<string, unknown>) => ({ version: 1, month, data })
+
 describe('readChartJson', () => {
-  it('returns empty v5 structure when file missing', async () => {
+  it('returns an empty v7 index when file missing', async () => {
     mockDownloadFileWithEtag.mockResolvedValue({ body: null, etag: null })
     const chart = await readChartJson(fakeBucket)
-    expect(chart.version).toBe(5)
-    expect(chart.data).toEqual({})
+    expect(chart.version).toBe(7)
+    expect(chart.months).toEqual([])
     expect(chart.models).toEqual([])
     expect(chart.total_submissions).toBe(0)
-    expect(chart._prev_hashes).toEqual({})
-    expect(chart._known_users).toEqual([])
   })
 
-  it('migrates v3 chart to v5 on read (daily keys get -00 suffix)', async () => {
-    const json = JSON.stringify({
-      version: 3,
-      data: {
-        '2026-02-21': {
-          'gpt-5': { submissions: 5, prompts_tested: 3, unique_outputs: 3, drifted_prompts: 0 }
-        }
+  it('migrates a v3 chart on read (daily keys get -00 suffix)', async () => {
+    mockJsonFiles({
+      '_aggregated/chart_data.json': {
+        version: 3,
+        data: { '2026-02-21': { 'gpt-5': stats(5) } },
+        models: ['gpt-5'],
+        total_submissions: 5,
+        total_contributors: 1,
       },
-      models: ['gpt-5'],
-      total_submissions: 5,
-      total_contributors: 1,
-    })
-    mockDownloadFileWithEtag.mockResolvedValue({
-      body: encoder.encode(json),
-      etag: '"e1"',
     })
 
     const chart = await readChartJson(fakeBucket)
-    expect(chart.version).toBe(5)
-    expect(chart._prev_hashes).toEqual({})
-    expect(chart._known_users).toEqual([])
+    expect(chart.version).toBe(7)
     expect(chart.total_submissions).toBe(5)
-    expect(chart.data['2026-02-21-00']['gpt-5'].submissions).toBe(5)
+    expect(chart.months).toEqual(['2026-02'])
   })
 
-  it('migrates existing v4 chart JSON (daily keys get -00 suffix)', async () => {
-    const json = JSON.stringify({
-      version: 4,
-      data: {
-        '2026-02-21': {
-          'gpt-5': { submissions: 5, prompts_tested: 3, unique_outputs: 3, drifted_prompts: 0 }
-        }
+  it('strips writer state and buckets from a legacy v4 chart', async () => {
+    mockJsonFiles({
+      '_aggregated/chart_data.json': {
+        version: 4,
+        data: { '2026-02-21': { 'gpt-5': stats(5) } },
+        models: ['gpt-5'],
+        total_submissions: 5,
+        total_contributors: 1,
+        _prev_hashes: { 'gpt-5|prompt1': 'sha256:abc' },
+        _known_users: ['user1'],
       },
-      models: ['gpt-5'],
-      total_submissions: 5,
-      total_contributors: 1,
-      _prev_hashes: { 'gpt-5|prompt1': 'sha256:abc' },
-      _known_users: ['user1'],
-    })
-    mockDownloadFileWithEtag.mockResolvedValue({
-      body: encoder.encode(json),
-      etag: '"e1"',
     })
 
     const chart = await readChartJson(fakeBucket)
-    expect(chart.version).toBe(5)
-    expect(chart.data['2026-02-21-00']['gpt-5'].submissions).toBe(5)
-    expect(chart._prev_hashes['gpt-5|prompt1']).toBe('sha256:abc')
-    expect(chart._known_users).toEqual(['user1'])
+    expect(chart.version).toBe(7)
+    expect(chart).not.toHaveProperty('data')
+    expect(chart).not.toHaveProperty('_prev_hashes')
+    expect(chart).not.toHaveProperty('_known_users')
   })
 })
 
-describe('writeDelta', () => {
-  it('writes a delta file to _deltas/{day}/', async () => {
+describe('readChartJsonCached', () => {
+  it('serves repeat reads from the isolate without touching R2', async () => {
+    mockJsonFiles({ '_aggregated/chart_data.json': chartIndex([], 5) })
+
+    const first = await readChartJsonCached(fakeBucket)
+    const second = await readChartJsonCached(fakeBucket)
+
+    expect(first.total_submissions).toBe(5)
+    expect(second).toBe(first)
+    expect(mockDownloadFileIfChanged).toHaveBeenCalledTimes(1)
+    expect(mockDownloadFileIfChanged).toHaveBeenCalledWith(fakeBucket, '_aggregated/chart_data.json', null)
+  })
+
+  it('revalidates with the cached etag once the TTL expires', async () => {
+    const now = vi.spyOn(Date, 'now')
+    now.mockReturnValue(1_000_000)
+    mockJsonFiles({ '_aggregated/chart_data.json': chartIndex([], 5) })
+    const first = await readChartJsonCached(fakeBucket)
+
+    now.mockReturnValue(1_000_000 + 60_000)
+    const second = await readChartJsonCached(fakeBucket)
+
+    expect(second).toBe(first)
+    expect(mockDownloadFileIfChanged).toHaveBeenLastCalledWith(fakeBucket, '_aggregated/chart_data.json', 'e1')
+    now.mockRestore()
+  })
+
+  it('is invalidated by writers in the same isolate', async () => {
+    mockJsonFiles({ '_aggregated/chart_data.json': chartIndex([], 5) })
+    await readChartJsonCached(fakeBucket)
+
+    // mergeDeltas rewrites the chart
+    mockJsonFiles({
+      '_aggregated/chart_data.json': chartIndex([], 5),
+      '_deltas/2026-02-21/1000_abc.json': {
+        ts: 1000,
+        bucket: '2026-02-21-14',
+        records: [{ model_id: 'gpt-5', prompt_id: 'p1', output_hash: 'sha256:abc', user_id: 'user1' }],
+      },
+    })
+    mockListFiles.mockResolvedValue(['_deltas/2026-02-21/1000_abc.json'])
     mockUploadFile.mockResolvedValue(undefined)
+    mockDeleteFiles.mockResolvedValue(undefined)
+    await mergeDeltas(fakeBucket)
+
+    mockJsonFiles({ '_aggregated/chart_data.json': chartIndex(['2026-02'], 6) }, 'e2')
+    const after = await readChartJsonCached(fakeBucket)
+    expect(after.total_submissions).toBe(6)
+    expect(mockDownloadFileIfChanged).toHaveBeenLastCalledWith(fakeBucket, '_aggregated/chart_data.json', null)
+  })
+})
 
-    await writeDelta(fakeBucket, [makeRecord()])
+describe('readChartRange', () => {
+  const files = {
+    '_aggregated/chart_data.json': chartIndex(['2026-01', '2026-02', '2026-03']),
+    '_aggregated/chart/2026-01.json': shard('2026-01', { '2026-01-31-23': { 'gpt-5': stats(1) } }),
+    '_aggregated/chart/2026-02.json': shard('2026-02', {
+      '2026-02-01-00': { 'gpt-5': stats(2) },
+      '2026-02-21-14': { 'gpt-5': stats(3) },
+    }),
+    '_aggregated/chart/2026-03.json': shard('2026-03', { '2026-03-01-00': { 'gpt-5': stats(4) } }),
+  }
 
-    expect(mockUploadFile).toHaveBeenCalledTimes(1)
-    const [, key, body] = mockUploadFile.mock.calls[0]
-    expect(key).toMatch(/^_deltas\/\d{4}-\d{2}-\d{2}\/\d+_[a-z0-9]+\.json$/)
+  it('reads only the month shards overlapping the range', async () => {
+    mockJsonFiles(files)
+
+    const { chart, data } = await readChartRange(fakeBucket, { start: '2026-02-01', end: '2026-02-21' })
 
-    const delta = JSON.parse(decoder.decode(body))
-    expect(delta.records).toHaveLength(1)
-    expect(delta.records[0].model_id).toBe('gpt-5')
-    expect(delta.records[0].prompt_id).toBe('prompt1')
-    expect(delta.records[0].output_hash).toBe('sha256:abc')
-    expect(delta.records[0].user_id).toBe('user1')
-    expect(delta.bucket).toMatch(/^\d{4}-\d{2}-\d{2}-\d{2}$/)
-    expect(typeof delta.ts).toBe('number')
+    expect(chart.months).toEqual(['2026-01', '2026-02', '2026-03'])
+    expect(Object.keys(data)).toEqual(['2026-02-01-00', '2026-02-21-14'])
+    const fetched = mockDownloadFileIfChanged.mock.calls.map(([, key]) => key)
+    expect(fetched).toEqual(['_aggregated/chart_data.json', '_aggregated/chart/2026-02.json'])
   })
 
-  it('skips when no records', async () => {
-    await writeDelta(fakeBucket, [])
-    expect(mockUploadFile).not.toHaveBeenCalled()
+  it('applies hourly bounds within a shard', async () => {
+    mockJsonFiles(files)
+    const { data } = await readChartRange(fakeBucket, { start: '2026-02-01-01', end: '2026-03-01' })
+    expect(Object.keys(data).sort()).toEqual(['2026-02-21-14', '2026-03-01-00'])
+  })
+
+  it('reuses cached shards while the index is unchanged', async () => {
+    mockJsonFiles(files)
+    await readChartRange(fakeBucket, { start: '2026-02-01' })
+    mockDownloadFileIfChanged.mockClear()
+
+    const { data } = await readChartRange(fakeBucket, { start: '2026-02-01' })
+    expect(Object.keys(data)).toHaveLength(3)
+    expect(mockDownloadFileIfChanged).not.toHaveBeenCalled()
+  })
+
+  it('sums weekly partials from adjacent month shards', async () => {
+    // 2026-02-02 is a Monday; 2026-03-02 is the Monday after the month boundary
+    mockJsonFiles({
+      '_aggregated/chart_data.json': chartIndex(['2026-02', '2026-03']),
+      '_aggregated/chart/2026-02.json': {
+        ...shard('2026-02', { '2026-02-27-10': { 'gpt-5': stats(2) } }),
+        version: 2,
+        daily: { '2026-02-27': { 'gpt-5': stats(2) } },
+        weekly: { '2026-02-23': { 'gpt-5': stats(2) } },
+      },
+      // v1 shard: rollups are derived on read
+      '_aggregated/chart/2026-03.json': shard('2026-03', {
+        '2026-03-01-08': { 'gpt-5': stats(3, 1) },
+        '2026-03-02-08': { 'gpt-5': stats(4) },
+      }),
+    })
+
+    const { data } = await readChartRange(fakeBucket, { start: '2026-03-01' }, '1w')
+    expect(data).toEqual({
+      '2026-02-23': { 'gpt-5': stats(5, 1) },
+      '2026-03-02': { 'gpt-5': stats(4) },
+    })
+
+    const daily = await readChartRange(fakeBucket, { start: '2026-03-01' }, '1d')
+    expect(Object.keys(daily.data)).toEqual(['2026-03-01', '2026-03-02'])
+  })
+
+  it('serves a legacy chart from its inline buckets', async () => {
+    mockJsonFiles({
+      '_aggregated/chart_data.json': {
+        version: 5,
+        data: { '2026-01-31-23': { 'gpt-5': stats(1) }, '2026-02-21-14': { 'gpt-5': stats(3) } },
+        models: ['gpt-5'],
+        total_submissions: 4,
+        total_contributors: 1,
+        _prev_hashes: {},
+        _known_users: ['user1'],
+      },
+    })
+
+    const { data } = await readChartRange(fakeBucket, { start: '2026-02-01' })
+    expect(Object.keys(data)).toEqual(['2026-02-21-14'])
+    expect(mockDownloadFileIfChanged).toHaveBeenCalledTimes(1)
+  })
+})
+
+describe('readChartResponseBody', () => {
+  // 2026-02-23 is a Monday, so that week has days in both shards
+  const files = {
+    '_aggregated/chart_data.json': chartIndex(['2026-01', '2026-02', '2026-03']),
+    '_aggregated/chart/2026-01.json': shard('2026-01', { '2026-01-31-23': { 'gpt-5': stats(1) } }),
+    '_aggregated/chart/2026-02.json': shard('2026-02', {
+      '2026-02-21-14': { 'gpt-5': stats(3) },
+      '2026-02-27-10': { 'gpt-5': stats(2), 'claude-4': stats(2, 1) },
+    }),
+    '_aggregated/chart/2026-03.json': shard('2026-03', {
+      '2026-03-01-08': { 'gpt-5': stats(3, 1) },
+      '2026-03-02-08': { 'claude-4': stats(4) },
+    }),
+  }
+
+  it('produces the body the builders make from the same buckets', async () => {
+    mockJsonFiles(files)
+    const ranges = [{}, { start: '2026-02-01' }, { start: '2026-02-27', end: '2026-03-01' }, { start: '2026-02-21-15' }]
+    for (const level of ['1h', '1d', '1w'] as const) {
+      for (const range of ranges) {
+        const { chart, data } = await readChartRange(fakeBucket, range, level)
+        const wide = JSON.parse(await readChartResponseBody(fakeBucket, range, level))
+        expect(wide).toEqual(buildChartResponse(chart, data, level))
+        const fields = ['prompts', 'consistency'] as const
+        const columnar = JSON.parse(await readChartResponseBody(fakeBucket, range, level, 'columnar', fields))
+        expect(columnar).toEqual(buildChartColumns(chart, data, level, fields))
+      }
+    }
+  })
+
+  it('serves stored fragments without reading the month shards', async () => {
+    mockJsonFiles({
+      '_aggregated/chart_data.json': chartIndex(['2026-02']),
+      '_aggregated/chart/2026-02/1d.json': {
+        version: 1,
+        month: '2026-02',
+        granularity: '1d',
+        dates: ['2026-02-20', '2026-02-21'],
+        series: {
+          'gpt-5': { submissions: 'null,3', prompts: 'null,3', unique_outputs: 'null,3', drifted: 'null,1', consistency: 'null,0.6' },
+          'claude-4': { submissions: '2,null', prompts: '2,null', unique_outputs: '1,null', drifted: '0,null', consistency: '1,null' },
+        },
+      },
+    })
+
+    const body = JSON.parse(await readChartResponseBody(fakeBucket, { end: '2026-02-21' }, '1d', 'columnar', ['submissions']))
+    expect(body.dates).toEqual(['2026-02-20', '2026-02-21'])
+    expect(body.series).toEqual({ 'gpt-5': { submissions: [null, 3] }, 'claude-4': { submissions: [2, null] } })
+    const fetched = mockDownloadFileIfChanged.mock.calls.map(([, key]) => key)
+    expect(fetched).toEqual(['_aggregated/chart_data.json', '_aggregated/chart/2026-02/1d.json'])
+  })
+})
+
+describe('pickChartLevel', () => {
+  const index = chartIndex(['2025-01', '2026-02'])
+
+  it('serves the coarsest stored level within the requested granularity', () => {
+    expect(pickChartLevel(index, {})).toBe('1h')
+    expect(pickChartLevel(index, {}, { granularityHours: 4 })).toBe('1h')
+    expect(pickChartLevel(index, {}, { granularityHours: 24 })).toBe('1d')
+    expect(pickChartLevel(index, {}, { granularityHours: 24 * 30 })).toBe('1w')
+  })
+
+  it('coarsens until the range fits max_points', () => {
+    const month = { start: '2026-02-01', end: '2026-02-28' }  // 672 hours
+    expect(pickChartLevel(index, month, { maxPoints: 1000 })).toBe('1h')
+    expect(pickChartLevel(index, month, { maxPoints: 500 })).toBe('1d')
+    expect(pickChartLevel(index, month, { maxPoints: 10 })).toBe('1w')
+    // Unbounded ranges span from the first stored month
+    expect(pickChartLevel(index, { end: '2026-02-28' }, { maxPoints: 500 })).toBe('1d')
+  })
+})
+
+describe('buildChartResponse', () => {
+  it('flattens buckets into sorted points with derived consistency', () => {
+    const response = buildChartResponse({
+      version: 7,
+      months: ['2026-02'],
+      models: ['gpt-5'],
+      total_submissions: 6,
+      total_contributors: 1,
+      last_updated: '2026-02-21T15:00:00.000Z',
+    }, {
+      '2026-02-21-14': { 'gpt-5': { submissions: 4, prompts_tested: 4, unique_outputs: 5, drifted_prompts: 1 } },
+      '2026-02-20-10': { 'gpt-5': { submissions: 2, prompts_tested: 0, unique_outputs: 0, drifted_prompts: 0 } },
+    })
+
+    expect(response.data.map((p) => p.date)).toEqual(['2026-02-20-10', '2026-02-21-14'])
+    expect(response.data[1]).toEqual({
+      date: '2026-02-21-14',
+      'gpt-5': 4,
+      'gpt-5_prompts': 4,
+      'gpt-5_unique_outputs': 5,
+      'gpt-5_drifted': 1,
+      'gpt-5_consistency': 0.75,
+    })
+    expect(response.data[0]['gpt-5_consistency']).toBe(1.0)
+    expect(response).not.toHaveProperty('months')
+    expect(response.total_submissions).toBe(6)
+  })
+})
+
+describe('buildChartColumns', () => {
+  it('aligns one array per model and field with the sorted dates', () => {
+    const columns = buildChartColumns(chartIndex(['2026-02']), {
+      '2026-02-21-14': { 'gpt-5': { submissions: 4, prompts_tested: 4, unique_outputs: 5, drifted_prompts: 1 } },
+      '2026-02-20-10': {
+        'gpt-5': stats(2),
+        'claude': stats(1),
+      },
+    }, '1h', ['submissions', 'consistency'])
+
+    expect(columns.dates).toEqual(['2026-02-20-10', '2026-02-21-14'])
+    expect(columns.series['gpt-5']).toEqual({ submissions: [2, 4], consistency: [1, 0.75] })
+    // No data for a model in a bucket is null, not zero
+    expect(columns.series['claude']).toEqual({ submissions: [1, null], consistency: [1, null] })
   })
 })
 
 describe('mergeDeltas', () => {
+  const delta = (ts: number, bucket: string, prompt = 'p1', hash = 'sha256:abc', user = 'user1') => ({
+    ts,
+    bucket,
+    records: [{ model_id: 'gpt-5', prompt_id: prompt, output_hash: hash, user_id: user }],
+  })
+  const uploaded = (key: string) => {
+    const call = mockUploadFile.mock.calls.find(([, k]) => k === key)
+    return call ? JSON.parse(decoder.decode(call[2])) : undefined
+  }
+
+  beforeEach(() => {
+    mockUploadFile.mockResolvedValue(undefined)
+    mockDeleteFiles.mockResolvedValue(undefined)
+  })
+
   it('returns merged=0 when no deltas exist', async () => {
     mockDownloadFileWithEtag.mockResolvedValue({ body: null, etag: null })
     mockListFiles.mockResolvedValue([])
@@ -291,76 +784,697 @@ describe('mergeDeltas', () => {
   })
 
   it('merges single delta into empty chart', async () => {
-    // Empty chart
-    mockDownloadFileWithEtag.mockResolvedValue({ body: null, etag: null })
-
-    // One delta file (v5 format with bucket)
-    const delta = {
-      ts: 1000,
-      bucket: '2026-02-21-14',
-      records: [
-        { model_id: 'gpt-5', prompt_id: 'p1', output_hash: 'sha256:abc', user_id: 'user1' },
-        { model_id: 'gpt-5', prompt_id: 'p2', output_hash: 'sha256:def', user_id: 'user1' },
-      ],
-    }
+    mockJsonFiles({
+      '_deltas/2026-02-21/1000_abc123.json': {
+        ts: 1000,
+        bucket: '2026-02-21-14',
+        records: [
+          { model_id: 'gpt-5', prompt_id: 'p1', output_hash: 'sha256:abc', user_id: 'user1' },
+          { model_id: 'gpt-5', prompt_id: 'p2', output_hash: 'sha256:def', user_id: 'user1' },
+        ],
+      },
+    })
     mockListFiles.mockResolvedValue(['_deltas/2026-02-21/1000_abc123.json'])
-    mockDownloadFile.mockResolvedValue(encoder.encode(JSON.stringify(delta)))
-    mockUploadFile.mockResolvedValue(undefined)
-    mockDeleteFiles.mockResolvedValue(undefined)
 
     const result = await mergeDeltas(fakeBucket)
     expect(result.merged).toBe(1)
 
-    // Verify chart written
-    expect(mockUploadFile).toHaveBeenCalledTimes(1)
-    const [, key, body] = mockUploadFile.mock.calls[0]
-    expect(key).toBe('_aggregated/chart_data.json')
+    // Shard and its fragments first, then state and index — readers never see a month before its shard
+    expect(mockUploadFile.mock.calls.map(([, key]) => key)).toEqual([
+      '_aggregated/chart/2026-02.json',
+      '_aggregated/chart/2026-02/1h.json',
+      '_aggregated/chart/2026-02/1d.json',
+      '_aggregated/chart/2026-02/1w.json',
+      '_aggregated/chart_state.json',
+      '_aggregated/chart_data.json',
+    ])
+
+    const month = uploaded('_aggregated/chart/2026-02.json')
+    expect(month.data['2026-02-21-14']['gpt-5'].submissions).toBe(2)
+    expect(uploaded('_aggregated/chart/2026-02/1d.json')).toEqual({
+      version: 1,
+      month: '2026-02',
+      granularity: '1d',
+      dates: ['2026-02-21'],
+      series: { 'gpt-5': { submissions: '2', prompts: '2', unique_outputs: '2', drifted: '0', consistency: '1' } },
+    })
+    expect(month.data['2026-02-21-14']['gpt-5'].prompts_tested).toBe(2)
+    // Rollups are rewritten with the hourly buckets
+    expect(month.daily['2026-02-21']['gpt-5'].submissions).toBe(2)
+    expect(month.weekly['2026-02-16']['gpt-5'].submissions).toBe(2)
 
-    const chart = JSON.parse(decoder.decode(body))
-    expect(chart.version).toBe(5)
-    expect(chart.data['2026-02-21-14']['gpt-5'].submissions).toBe(2)
-    expect(chart.data['2026-02-21-14']['gpt-5'].prompts_tested).toBe(2)
+    const chart = uploaded('_aggregated/chart_data.json')
+    expect(chart.version).toBe(7)
+    expect(chart.months).toEqual(['2026-02'])
     expect(chart.models).toEqual(['gpt-5'])
-    expect(chart._known_users).toEqual(['user1'])
     expect(chart.total_contributors).toBe(1)
-    expect(chart._prev_hashes['gpt-5|p1']).toBe('sha256:abc')
-    expect(chart._prev_hashes['gpt-5|p2']).toBe('sha256:def')
+    expect(chart).not.toHaveProperty('data')
+
+    const state = uploaded('_aggregated/chart_state.json')
+    expect(state.known_users).toEqual(['user1'])
+    expect(state.prev_hashes['gpt-5|p1']).toBe('sha256:abc')
+    expect(state.prev_hashes['gpt-5|p2']).toBe('sha256:def')
 
     // Verify deltas deleted
-    expect(mockDeleteFiles).toHaveBeenCalledWith(fakeBucket, ['_deltas/2026-02-21/1000_abc123.json'])
+    expect(mockDeleteFiles).toHaveBeenCalledWith(
+      fakeBucket,
+      ['_deltas/2026-02-21/1000_abc123.json'],
+      expect.any(SubrequestBudget)
+    )
+  })
+
+  it('reads and rewrites only the month shards the deltas touch', async () => {
+    mockJsonFiles({
+      '_aggregated/chart_data.json': chartIndex(['2026-01', '2026-02']),
+      '_aggregated/chart/2026-01.json': shard('2026-01', { '2026-01-10-00': { 'gpt-5': stats(1) } }),
+      '_aggregated/chart/2026-02.json': shard('2026-02', { '2026-02-20-10': { 'gpt-5': stats(1) } }),
+      '_deltas/2026-02-21/2000_xyz.json': delta(2000, '2026-02-21-14'),
+    })
+    mockListFiles.mockResolvedValue(['_deltas/2026-02-21/2000_xyz.json'])
+
+    await mergeDeltas(fakeBucket)
+
+    const read = mockDownloadFile.mock.calls.map(([, key]) => key)
+    expect(read).not.toContain('_aggregated/chart/2026-01.json')
+    expect(uploaded('_aggregated/chart/2026-01.json')).toBeUndefined()
+    expect(Object.keys(uploaded('_aggregated/chart/2026-02.json').data)).toEqual(['2026-02-20-10', '2026-02-21-14'])
+    expect(uploaded('_aggregated/chart_data.json').months).toEqual(['2026-01', '2026-02'])
+  })
+
+  it('reads only as many deltas as the budget allows', async () => {
+    const keys = ['_deltas/2026-02-21/a.json', '_deltas/2026-02-21/b.json', '_deltas/2026-02-21/c.json']
+    mockJsonFiles(Object.fromEntries(keys.map((k) => [k, delta(1000, '2026-02-21-14')])))
+    mockListFiles.mockResolvedValue(keys)
+
+    // Storage is mocked so nothing is charged; 10 calls minus index + state
+    // writes, the batch delete, and the month shard read + shard and fragment
+    // writes leaves room for 2 delta reads
+    const result = await mergeDeltas(fakeBucket, new SubrequestBudget(10))
+    expect(result).toEqual({ merged: 2, deltasRemaining: 1 })
+    expect(mockDeleteFiles).toHaveBeenCalledWith(fakeBucket, keys.slice(0, 2), expect.any(SubrequestBudget))
   })
 
   it('detects drift when hash changes', async () => {
-    // Existing chart with prev_hashes (v5 format)
-    const existingChart = JSON.stringify({
-      version: 5,
-      data: { '2026-02-20-10': { 'gpt-5': { submissions: 1, prompts_tested: 1, unique_outputs: 1, drifted_prompts: 0 } } },
-      models: ['gpt-5'],
-      total_submissions: 1,
-      total_contributors: 1,
-      _prev_hashes: { 'gpt-5|p1': 'sha256:old' },
-      _known_users: ['user1'],
+    mockJsonFiles({
+      '_aggregated/chart_data.json': chartIndex(['2026-02']),
+      '_aggregated/chart/2026-02.json': shard('2026-02', { '2026-02-20-10': { 'gpt-5': stats(1) } }),
+      '_aggregated/chart_state.json': { version: 1, prev_hashes: { 'gpt-5|p1': 'sha256:old' }, known_users: ['user1'] },
+      '_deltas/2026-02-21/2000_xyz.json': delta(2000, '2026-02-21-14', 'p1', 'sha256:new'),
     })
-    mockDownloadFileWithEtag.mockResolvedValue({ body: encoder.encode(existingChart), etag: '"e1"' })
-
-    // Delta with changed hash for same prompt
-    const delta = {
-      ts: 2000,
-      bucket: '2026-02-21-14',
-      records: [
-        { model_id: 'gpt-5', prompt_id: 'p1', output_hash: 'sha256:new', user_id: 'user1' },
-      ],
-    }
     mockListFiles.mockResolvedValue(['_deltas/2026-02-21/2000_xyz.json'])
-    mockDownloadFile.mockResolvedValue(encoder.encode(JSON.stringify(delta)))
-    mockUploadFile.mockResolvedValue(undefined)
-    mockDeleteFiles.mockResolvedValue(undefined)
 
     await mergeDeltas(fakeBucket)
 
-    const chart = JSON.parse(decoder.decode(mockUploadFile.mock.calls[0][2]))
-    expect(chart.data['2026-02-21-14']['gpt-5'].drifted_prompts).toBe(1)
-    expect(chart._prev_hashes['gpt-5|p1']).toBe('sha256:new')
+    expect(uploaded('_aggregated/chart/2026-02.json').data['2026-02-21-14']['gpt-5'].drifted_prompts).toBe(1)
+    expect(uploaded('_aggregated/chart_state.json').prev_hashes['gpt-5|p1']).toBe('sha256:new')
+  })
+
+  it('splits a legacy chart into index, state and shards on its first rewrite', async () => {
+    mockJsonFiles({
+      '_aggregated/chart_data.json': {
+        version: 5,
+        data: { '2026-01-10-00': { 'gpt-5': stats(1) }, '2026-02-20-10': { 'gpt-5': stats(1) } },
+        models: ['gpt-5'],
+        total_submissions: 2,
+        total_contributors: 1,
+        _prev_hashes: { 'gpt-5|p1': 'sha256:old' },
+        _known_users: ['user1'],
+      },
+      '_deltas/2026-02-21/2000_xyz.json': delta(2000, '2026-02-21-14', 'p1', 'sha256:new', 'user2'),
+    })
+    mockListFiles.mockResolvedValue(['_deltas/2026-02-21/2000_xyz.json'])
+
+    await mergeDeltas(fakeBucket)
+
+    const chart = uploaded('_aggregated/chart_data.json')
+    expect(chart.version).toBe(7)
+    expect(chart.months).toEqual(['2026-01', '2026-02'])
+    expect(chart).not.toHaveProperty('data')
+    expect(chart).not.toHaveProperty('_prev_hashes')
+    expect(chart.total_contributors).toBe(2)
+
+    expect(uploaded('_aggregated/chart/2026-01.json').data['2026-01-10-00']['gpt-5'].submissions).toBe(1)
+    expect(uploaded('_aggregated/chart/2026-02.json').data['2026-02-21-14']['gpt-5'].drifted_prompts).toBe(1)
+
+    const state = uploaded('_aggregated/chart_state.json')
+    expect(state.known_users).toEqual(['user1', 'user2'])
+    expect(state.prev_hashes['gpt-5|p1']).toBe('sha256:new')
+  })
+})
+
+describe('compactBuffer', () => {
+  it('archives entries as a new segment without reading existing archives', async () => {
+    const csv =
+      'id,timestamp,user_id,model_id,prompt_id,output,output_hash,metadata_json,year,month,day\n' +
+      '00000000-0000-4000-8000-000000000001,2026-02-21T00:00:00Z,user1,gpt-5,p1,out1,sha256:a,{},2026,2,21'
+    const compressed = await gzip(encoder.encode(csv))
+
+    mockListFiles.mockImplementation(async (_bucket, prefix) =>
+      prefix === '_buffer/entries/' ? ['_buffer/entries/123_abc.csv.gz'] : []
+    )
+    mockDownloadFile.mockResolvedValue(compressed)
+    mockDownloadFileWithEtag.mockResolvedValue({ body: null, etag: null })
+    mockUploadFile.mockImplementation(async (_bucket, key) => (key.startsWith('_archive/2') ? 'etag-segment' : 'etag'))
+    mockDeleteFiles.mockResolvedValue(undefined)
+
+    const result = await compactBuffer(fakeBucket)
+    expect(result.archived).toBe(1)
+
+    // Only the entry file is downloaded — no archive read-modify-write
+    expect(mockDownloadFile).toHaveBeenCalledTimes(1)
+    expect(mockDownloadFile).toHaveBeenCalledWith(
+      fakeBucket,
+      '_buffer/entries/123_abc.csv.gz',
+      expect.any(SubrequestBudget)
+    )
+    for (const [, key] of mockDownloadFileWithEtag.mock.calls) {
+      expect(key).not.toMatch(/^_archive\/\d/)
+    }
+
+    // The columnar segment, its sidecar, the batch journal and the new manifest root and partition
+    expect(mockUploadFile).toHaveBeenCalledTimes(5)
+    const [, key, body] = mockUploadFile.mock.calls[0]
+    expect(key).toMatch(/^_archive\/\d{4}-\d{2}-\d{2}\/\d+_[a-z0-9]+\.seg$/)
+    const [record] = await readSegmentRecords(body)
+    expect(record.id).toBe('00000000-0000-4000-8000-000000000001')
+    expect(record.output).toBe('out1')
+
+    const [, sidecarKey, sidecarBody] = mockUploadFile.mock.calls[1]
+    expect(sidecarKey).toBe(key.replace(/^_archive\//, '_archive_idx/'))
+    expect(await readSegmentAggregateRows(sidecarBody)).toEqual([{
+      timestamp: '2026-02-21T00:00:00Z', user_id: 'user1', model_id: 'gpt-5', prompt_id: 'p1',
+      output_hash: 'sha256:a', year: 2026, month: 2, day: 21,
+    }])
+
+    const [, journalKey, journalBody] = mockUploadFile.mock.calls[2]
+    expect(journalKey).toBe('_maintenance/compact_batch.json')
+    const journal = JSON.parse(decoder.decode(journalBody))
+    expect(journal.entries).toEqual(['_buffer/entries/123_abc.csv.gz'])
+
+    const [, manifestKey, manifestBody] = mockUploadFile.mock.calls[3]
+    expect(manifestKey).toBe('_archive/_manifest.json')
+    const manifest = JSON.parse(decoder.decode(manifestBody)) as ArchiveManifestJson
+    const month = key.slice('_archive/'.length, '_archive/'.length + 7)
+    expect(manifest.complete).toBe(false)
+    expect(manifest.partitions).toEqual({ [month]: '2026-02-21T00:00:00Z' })
+    expect(manifest.compacted_batch).toBe(journal.id)
+    const [, partitionKey, partitionBody] = mockUploadFile.mock.calls[4]
+    expect(partitionKey).toBe(`_archive/_manifest/${month}.json`)
+    const partition = JSON.parse(decoder.decode(partitionBody)) as ArchiveManifestPartitionJson
+    expect(partition.archives).toEqual([{
+      key, rows: 1, bytes: body.length, raw_bytes: expect.any(Number), etag: 'etag-segment',
+      min_ts: '2026-02-21T00:00:00Z', max_ts: '2026-02-21T00:00:00Z', models: ['gpt-5'],
+      user_bloom: expect.any(Object), output_bloom: expect.any(Object),
+    }])
+
+    expect(mockDeleteFiles).toHaveBeenCalledWith(
+      fakeBucket,
+      ['_buffer/entries/123_abc.csv.gz'],
+      expect.any(SubrequestBudget)
+    )
+    expect(mockDeleteFile).toHaveBeenLastCalledWith(fakeBucket, '_maintenance/compact_batch.json', expect.any(SubrequestBudget))
+  })
+  it('merges the chart from ingest entry headers without separate delta files', async () => {
+    const ts = Date.UTC(2026, 1, 21, 14)
+    const key = `_buffer/entries/${ts}_abc.ing`
+    const body = await ingestEntry(
+      { ts, bucket: '2026-02-21-14', records: [{ model_id: 'gpt-5', prompt_id: 'p1', output_hash: 'sha256:a', user_id: 'user1' }] },
+      'id,timestamp,user_id,model_id,prompt_id,output,output_hash,metadata_json,year,month,day\n' +
+      '00000000-0000-4000-8000-000000000001,2026-02-21T14:00:00Z,user1,gpt-5,p1,out1,sha256:a,{},2026,2,21'
+    )
+    mockListFiles.mockImplementation(async (_bucket, prefix) => (prefix === '_buffer/entries/' ? [key] : []))
+    mockDownloadFile.mockResolvedValue(body)
+    mockDownloadFileWithEtag.mockResolvedValue({ body: null, etag: null })
+    mockUploadFile.mockResolvedValue('etag')
+    mockDeleteFiles.mockResolvedValue(undefined)
+
+    const result = await compactBuffer(fakeBucket)
+    expect(result).toMatchObject({ archived: 1, deltasMerged: 1 })
+
+    // The entry is the only object read; the chart shard comes from its header
+    expect(mockDownloadFile.mock.calls.map(([, k]) => k)).toEqual([key])
+    const shardCall = mockUploadFile.mock.calls.find(([, k]) => k === '_aggregated/chart/2026-02.json')!
+    const month = JSON.parse(decoder.decode(shardCall[2]))
+    expect(month.data['2026-02-21-14']['gpt-5'].submissions).toBe(1)
+
+    // The entry goes only after both the archive and the chart hold it
+    const i = mockDeleteFiles.mock.calls.findIndex(([, keys]) => keys.includes(key))
+    expect(mockDeleteFiles.mock.calls[i][1]).toEqual([key])
+    expect(mockDeleteFiles.mock.invocationCallOrder[i]).toBeGreaterThan(Math.max(...mockUploadFile.mock.invocationCallOrder))
+    const state = JSON.parse(decoder.decode(mockUploadMany.mock.calls.flatMap(([, files]) => files)
+      .find((f) => f.key === '_aggregated/chart_state.json')!.body))
+    expect(state.merged_batch).toBe(JSON.parse(decoder.decode(
+      mockUploadFile.mock.calls.find(([, k]) => k === '_maintenance/compact_batch.json')![2])).id)
+  })
+
+  describe('resuming a batch a failed run journaled', () => {
+    const ts = Date.UTC(2026, 1, 21, 14)
+    const key = `_buffer/entries/${ts}_abc.ing`
+    const later = `_buffer/entries/${ts + 1000}_def.ing`
+    const journal = { version: 1, id: 'b1', entries: [key] }
+    const root = { version: 2, complete: true, indexed_since: '2026-01-01T00:00:00.000Z', partitions: {}, compacted_batch: 'b1' }
+
+    beforeEach(() => {
+      mockListFiles.mockImplementation(async (_bucket, prefix) => (prefix === '_buffer/entries/' ? [key, later] : []))
+      mockUploadFile.mockResolvedValue('etag')
+      mockDeleteFiles.mockResolvedValue(undefined)
+    })
+
+    /** Serve `files` plus the journaled entry; the later entry is never read. */
+    async function mockBatch(files: Record<string, unknown>): Promise<void> {
+      mockJsonFiles(files)
+      const body = await ingestEntry(
+        { ts, bucket: '2026-02-21-14', records: [{ model_id: 'gpt-5', prompt_id: 'p1', output_hash: 'sha256:a', user_id: 'user1' }] },
+        'id,timestamp,user_id,model_id,prompt_id,output,output_hash,metadata_json,year,month,day\n' +
+        '00000000-0000-4000-8000-000000000001,2026-02-21T14:00:00Z,user1,gpt-5,p1,out1,sha256:a,{},2026,2,21'
+      )
+      mockDownloadFile.mockImplementation(async (_bucket, k) => {
+        if (k !== key) throw new Error(`Not found: ${k}`)
+        return body
+      })
+    }
+
+    it('does not archive again what the manifest lists, but merges the chart it missed', async () => {
+      await mockBatch({
+        '_maintenance/compact_batch.json': journal,
+        '_archive/_manifest.json': root,
+        '_aggregated/chart_state.json': { version: 1, prev_hashes: {}, known_users: [], merged_batch: 'b0' },
+      })
+
+      const result = await compactBuffer(fakeBucket)
+
+      // The later entry waits for the next batch
+      expect(result).toMatchObject({ archived: 0, deltasMerged: 1, entriesRemaining: 1 })
+      expect(mockDownloadFile.mock.calls.map(([, k]) => k)).toEqual([key])
+      expect(mockUploadFile.mock.calls.filter(([, k]) => k.startsWith('_archive') || k.startsWith('_maintenance/'))).toEqual([])
+      const shard = mockUploadMany.mock.calls.flatMap(([, files]) => files).find((f) => f.key === '_aggregated/chart/2026-02.json')!
+      expect(JSON.parse(decoder.decode(shard.body)).data['2026-02-21-14']['gpt-5'].submissions).toBe(1)
+      expect(mockDeleteFiles).toHaveBeenCalledWith(fakeBucket, [key], expect.any(SubrequestBudget))
+      expect(mockDeleteFile).toHaveBeenCalledWith(fakeBucket, '_maintenance/compact_batch.json', expect.any(SubrequestBudget))
+    })
+
+    it('only deletes the entries once the chart holds them too', async () => {
+      await mockBatch({
+        '_maintenance/compact_batch.json': journal,
+        '_archive/_manifest.json': root,
+        '_aggregated/chart_data.json': chartIndex(['2026-02']),
+        '_aggregated/chart_state.json': { version: 1, prev_hashes: {}, known_users: [], merged_batch: 'b1' },
+      })
+
+      const result = await compactBuffer(fakeBucket)
+
+      expect(result).toMatchObject({ archived: 0, deltasMerged: 0 })
+      expect(mockUploadFile).not.toHaveBeenCalled()
+      expect(mockUploadMany).not.toHaveBeenCalled()
+      expect(mockDeleteFiles).toHaveBeenCalledWith(fakeBucket, [key], expect.any(SubrequestBudget))
+    })
+
+    it('archives it again when its manifest update never landed', async () => {
+      await mockBatch({
+        '_maintenance/compact_batch.json': journal,
+        '_archive/_manifest.json': { ...root, compacted_batch: 'b0' },
+      })
+
+      expect(await compactBuffer(fakeBucket)).toMatchObject({ archived: 1, deltasMerged: 1 })
+      const manifest = mockUploadFileConditional.mock.calls.find(([, k]) => k === '_archive/_manifest.json')!
+      expect(JSON.parse(decoder.decode(manifest[2])).compacted_batch).toBe('b1')
+      // Same batch, same journal: it is not written again
+      expect(mockUploadFile.mock.calls.map(([, k]) => k)).not.toContain('_maintenance/compact_batch.json')
+    })
+  })
+})
+
+describe('archive sidecars', () => {
+  it('rebuilds from the sidecar instead of the full archive when one exists', async () => {
+    const sidecar =
+      'timestamp,user_id,model_id,prompt_id,output_hash,year,month,day\n' +
+      '2026-02-21T08:00:00Z,user1,gpt-5,p1,sha256:a,2026,2,21\n' +
+      '2026-02-21T09:00:00Z,"user,2",gpt-5,p1,sha256:b,2026,2,21'
+    const archive =
+      'id,timestamp,user_id,model_id,prompt_id,output,output_hash,metadata_json,year,month,day\n' +
+      '00000000-0000-4000-8000-000000000001,2026-02-20T08:00:00Z,user1,gpt-4,p1,out,sha256:c,{},2026,2,20'
+    const files: Record<string, Uint8Array> = {
+      '_archive_idx/2026-02-21/1_a.csv.gz': await gzip(encoder.encode(sidecar)),
+      '_archive/2026-02-20/1_b.csv.gz': await gzip(encoder.encode(archive)),
+    }
+    mockListFiles.mockImplementation(async (_bucket, prefix) => {
+      if (prefix === '_archive/') return ['_archive/2026-02-20/1_b.csv.gz', '_archive/2026-02-21/1_a.csv.gz']
+      if (prefix === '_archive_idx/') return ['_archive_idx/2026-02-21/1_a.csv.gz']
+      return []
+    })
+    mockDownloadFile.mockImplementation(async (_bucket, key) => files[key] ?? null)
+    mockDownloadFileWithEtag.mockResolvedValue({ body: null, etag: null })
+
+    const result = await rebuildChartJsonIncremental(fakeBucket)
+    expect(result.archivesProcessed).toBe(2)
+
+    const read = mockDownloadFile.mock.calls.map(([, key]) => key)
+    expect(read).toContain('_archive_idx/2026-02-21/1_a.csv.gz')
+    expect(read).not.toContain('_archive/2026-02-21/1_a.csv.gz')
+    // Archives written before sidecars existed are still read in full
+    expect(read).toContain('_archive/2026-02-20/1_b.csv.gz')
+
+    const shard = mockUploadMany.mock.calls.flatMap(([, files]) => files)
+      .find(({ key }) => key === '_aggregated/chart/2026-02.json')!
+    const { data } = JSON.parse(decoder.decode(shard.body)) as { data: Record<string, Record<string, { submissions: number }>> }
+    expect(data['2026-02-20-08']['gpt-4'].submissions).toBe(1)
+    expect(data['2026-02-21-08']['gpt-5'].submissions).toBe(1)
+    expect(data['2026-02-21-09']['gpt-5'].submissions).toBe(1)
+  })
+})
+
+describe('columnar archives', () => {
+  it('rebuilds from segments and skips CSV leftovers of an interrupted migration', async () => {
+    const files: Record<string, Uint8Array> = {
+      '_archive/2026-02-21/1_a.seg': await writeSegment([makeRecord(), makeRecord({ model_id: 'gpt-4' })]),
+      '_archive/2026-02-21/1_a.csv.gz': await gzip(encoder.encode('id,timestamp\n')),
+    }
+    mockListFiles.mockImplementation(async (_bucket, prefix) => (prefix === '_archive/' ? Object.keys(files) : []))
+    mockDownloadFile.mockImplementation(async (_bucket, key) => files[key])
+    mockDownloadFileWithEtag.mockResolvedValue({ body: null, etag: null })
+
+    const result = await rebuildChartJsonIncremental(fakeBucket)
+    expect(result.archivesProcessed).toBe(1)
+    expect(mockDownloadFile.mock.calls.map(([, key]) => key)).toEqual(['_archive/2026-02-21/1_a.seg'])
+
+    const shard = mockUploadMany.mock.calls.flatMap(([, files]) => files)
+      .find(({ key }) => key === '_aggregated/chart/2026-02.json')!
+    const { data } = JSON.parse(decoder.decode(shard.body)) as { data: Record<string, Record<string, unknown>> }
+    expect(Object.keys(data['2026-02-21-12']).sort()).toEqual(['gpt-4', 'gpt-5'])
+  })
+})
+
+describe('archive migration', () => {
+  const csv =
+    'id,timestamp,user_id,model_id,prompt_id,output,output_hash,metadata_json,year,month,day\n' +
+    '00000000-0000-4000-8000-000000000001,2026-02-20T08:00:00.000Z,user1,gpt-4,p1,"a, b",sha256:c,{},2026,2,20'
+
+  beforeEach(async () => {
+    const files: Record<string, Uint8Array> = {
+      '_archive/2026-02-20.csv.gz': await gzip(encoder.encode(csv)),
+      '_archive/2026-02-21/1_a.csv.gz': await gzip(encoder.encode(csv)),
+      '_archive/2026-02-22/1_b.seg': await writeSegment([makeRecord()]),
+    }
+    mockListFiles.mockImplementation(async (_bucket, prefix) => {
+      if (prefix === '_archive/') return Object.keys(files)
+      if (prefix === '_archive_idx/') return ['_archive_idx/2026-02-21/1_a.csv.gz']
+      return []
+    })
+    mockDownloadFile.mockImplementation(async (_bucket, key) => files[key])
+    mockDownloadFileWithEtag.mockImplementation(async (_bucket, key) =>
+      ({ body: files[key] ?? null, etag: files[key] ? 'e' : null }))
+  })
+
+  it('rewrites CSV archives as segments, drops the CSV objects and completes the manifest', async () => {
+    const result = await migrateArchives(fakeBucket)
+    expect(result).toMatchObject({ migrated: 2, indexed: 1, archivesRemaining: 0, done: true })
+
+    const written = Object.fromEntries(mockUploadFile.mock.calls.map(([, key, body]) => [key, body]))
+    expect(Object.keys(written).sort()).toEqual([
+      '_archive/2026-02-20.seg',
+      '_archive/2026-02-21/1_a.seg',
+      '_archive/_manifest.json',
+      '_archive/_manifest/2026-02.json',
+      '_archive_idx/2026-02-20.seg',
+      '_archive_idx/2026-02-21/1_a.seg',
+    ])
+    const manifest = JSON.parse(decoder.decode(written['_archive/_manifest.json'])) as ArchiveManifestJson
+    expect(manifest.complete).toBe(true)
+    expect(manifest.partitions).toEqual({ '2026-02': '2026-02-20T08:00:00.000Z' })
+    const partition = JSON.parse(decoder.decode(written['_archive/_manifest/2026-02.json'])) as ArchiveManifestPartitionJson
+    expect(partition.archives.map((e) => [e.key, e.rows, e.models])).toEqual([
+      ['_archive/2026-02-20.seg', 1, ['gpt-4']],
+      ['_archive/2026-02-21/1_a.seg', 1, ['gpt-4']],
+      ['_archive/2026-02-22/1_b.seg', 1, ['gpt-5']],
+    ])
+    const [record] = await readSegmentRecords(written['_archive/2026-02-21/1_a.seg'])
+    expect(record).toMatchObject({ user_id: 'user1', output: 'a, b', output_hash: 'sha256:c', day: 20 })
+
+    expect(mockDeleteFiles).toHaveBeenCalledWith(fakeBucket, [
+      '_archive/2026-02-20.csv.gz',
+      '_archive/2026-02-21/1_a.csv.gz',
+      '_archive_idx/2026-02-21/1_a.csv.gz',
+    ], expect.any(SubrequestBudget))
+  })
+
+  it('converts only as many archives as the budget allows', async () => {
+    // Mocked calls are not charged: room for one archive (3) plus the deletes and manifest update
+    const result = await migrateArchives(fakeBucket, new SubrequestBudget(9))
+    expect(result).toMatchObject({ migrated: 1, indexed: 0, archivesRemaining: 2, done: false })
+    const manifestWrite = mockUploadFile.mock.calls.find(([, key]) => key === '_archive/_manifest.json')!
+    expect(JSON.parse(decoder.decode(manifestWrite[2])).complete).toBe(false)
+  })
+
+  it('deletes segments a failed compaction left out of the manifest instead of indexing them', async () => {
+    const orphan = `_archive/2026-02-23/${Date.parse('2026-02-23T00:00:00Z')}_x.seg`
+    const young = `_archive/2026-02-23/${Date.now()}_y.seg`
+    const files: Record<string, Uint8Array> = {
+      '_archive/_manifest.json': encoder.encode(JSON.stringify({
+        version: 2, complete: true, indexed_since: '2026-02-01T00:00:00.000Z', partitions: {},
+      })),
+      '_archive/2026-01-20/1_a.seg': await writeSegment([makeRecord({ month: 1 })]),
+      [orphan]: await writeSegment([makeRecord()]),
+      [young]: await writeSegment([makeRecord()]),
+    }
+    mockListFiles.mockImplementation(async (_bucket, prefix) =>
+      (prefix === '_archive/' ? Object.keys(files) : []))
+    mockDownloadFileWithEtag.mockImplementation(async (_bucket, key) =>
+      ({ body: files[key] ?? null, etag: files[key] ? 'e' : null }))
+
+    const result = await migrateArchives(fakeBucket)
+    // The pre-manifest segment is indexed; the one still inside the grace period is left alone
+    expect(result).toMatchObject({ indexed: 1, orphansRemoved: 1, archivesRemaining: 0, done: true })
+    expect(mockDeleteFiles).toHaveBeenCalledWith(fakeBucket, [orphan, orphan.replace('_archive/', '_archive_idx/')], expect.any(SubrequestBudget))
+    const partition = mockUploadFile.mock.calls.find(([, key]) => key === '_archive/_manifest/2026-01.json')!
+    expect((JSON.parse(decoder.decode(partition[2])) as ArchiveManifestPartitionJson).archives.map((e) => e.key))
+      .toEqual(['_archive/2026-01-20/1_a.seg'])
+    expect(mockUploadFile.mock.calls.map(([, key]) => key)).not.toContain('_archive/_manifest/2026-02.json')
+  })
+
+  it('refuses to run during an incremental rebuild', async () => {
+    mockDownloadFileWithEtag.mockResolvedValue({ body: encoder.encode('{"processedArchives":[]}'), etag: 'e' })
+    await expect(migrateArchives(fakeBucket)).rejects.toMatchObject({ status: 409 })
+    expect(mockUploadFile).not.toHaveBeenCalled()
+  })
+
+  it('exports either format as CSV', async () => {
+    const fromCsv = await exportArchiveCsv(fakeBucket, '_archive/2026-02-20.csv.gz')
+    expect(fromCsv!.csv).toContain('"a, b"')
+    const fromSegment = await exportArchiveCsv(fakeBucket, '_archive/2026-02-22/1_b.seg')
+    expect(fromSegment!.unresolved).toBe(0)
+    expect(fromSegment!.csv.split('\n')).toEqual([
+      'id,timestamp,user_id,model_id,prompt_id,output,output_hash,metadata_json,year,month,day,score',
+      '00000000-0000-4000-8000-000000000001,2026-02-21T12:00:00.000Z,user1,gpt-5,prompt1,test output,sha256:abc,{},2026,2,21,',
+    ])
+    expect(await exportArchiveCsv(fakeBucket, '_archive/missing.seg')).toBeNull()
+  })
+})
+
+describe('archive manifest', () => {
+  const entry = (key: string, minTs: string, maxTs: string, models: string[], rows = 1) =>
+    ({ key, rows, bytes: 100, raw_bytes: 400, min_ts: minTs, max_ts: maxTs, models, etag: 'e' })
+  const archives = [
+    entry('_archive/2026-01-31/1_a.seg', '2026-01-31T10:00:00.000Z', '2026-01-31T23:00:00.000Z', ['gpt-4']),
+    // Compacted just after midnight: January rows only, under a February key
+    entry('_archive/2026-02-01/1_b.seg', '2026-01-31T23:30:00.000Z', '2026-01-31T23:50:00.000Z', ['gpt-5']),
+    entry('_archive/2026-02-02/1_c.seg', '2026-02-02T08:00:00.000Z', '2026-02-02T09:00:00.000Z', ['gpt-4', 'gpt-5']),
+  ]
+  /** The manifest root and its month partitions for `entries` */
+  const manifestFiles = (entries: typeof archives, complete = true): Record<string, Uint8Array> => {
+    const root: ArchiveManifestJson = {
+      version: 2,
+      complete,
+      indexed_since: '2026-01-01T00:00:00.000Z',
+      partitions: { '2026-01': '2026-01-31T10:00:00.000Z', '2026-02': '2026-01-31T23:30:00.000Z' },
+    }
+    const partition = (month: string): ArchiveManifestPartitionJson =>
+      ({ version: 1, month, archives: entries.filter((e) => e.key.startsWith(`_archive/${month}`)) })
+    return {
+      '_archive/_manifest.json': encoder.encode(JSON.stringify(root)),
+      '_archive/_manifest/2026-01.json': encoder.encode(JSON.stringify(partition('2026-01'))),
+      '_archive/_manifest/2026-02.json': encoder.encode(JSON.stringify(partition('2026-02'))),
+    }
+  }
+  let files: Record<string, Uint8Array>
+
+  beforeEach(async () => {
+    files = {
+      ...manifestFiles(archives),
+      '_archive/2026-01-31/1_a.seg': await writeSegment([makeRecord({ timestamp: '2026-01-31T10:00:00.000Z', model_id: 'gpt-4', month: 1, day: 31 })]),
+      '_archive/2026-02-01/1_b.seg': await writeSegment([makeRecord({ timestamp: '2026-01-31T23:30:00.000Z', month: 1, day: 31 })]),
+      '_archive/2026-02-02/1_c.seg': await writeSegment([
+        makeRecord({ timestamp: '2026-02-02T08:00:00.000Z', model_id: 'gpt-4', day: 2 }),
+        makeRecord({ timestamp: '2026-02-02T09:00:00.000Z', day: 2 }),
+      ]),
+    }
+    for (const [key, body] of Object.entries(files)) {
+      if (key.startsWith('_archive/2')) files[key.replace('_archive/', '_archive_idx/')] = body
+    }
+    mockListFiles.mockResolvedValue([])
+    mockDownloadFile.mockImplementation(async (_bucket, key) => files[key])
+    mockDownloadFileWithEtag.mockImplementation(async (_bucket, key) =>
+      ({ body: files[key] ?? null, etag: files[key] ? 'e' : null }))
+  })
+
+  it('rebuilds from the manifest without listing archives', async () => {
+    const result = await rebuildChartJsonIncremental(fakeBucket)
+    expect(result).toMatchObject({ archivesProcessed: 3, done: true })
+    expect(mockListFiles.mock.calls.map(([, prefix]) => prefix)).not.toContain('_archive/')
+    expect(mockListFiles.mock.calls.map(([, prefix]) => prefix)).not.toContain('_archive_idx/')
+    expect(mockDownloadFile.mock.calls.map(([, key]) => key)).toEqual([
+      '_archive_idx/2026-01-31/1_a.seg',
+      '_archive_idx/2026-02-01/1_b.seg',
+      '_archive_idx/2026-02-02/1_c.seg',
+    ])
+  })
+
+  it('sizes rebuild batches by the months each archive really touches', async () => {
+    // Mocked calls are not charged, so only the 5 final writes are held back.
+    // Archives 1 and 2 touch only January (2 reads + 5 shard I/O); the key
+    // date alone would charge February's shard I/O for archive 2 as well.
+    const budget = new SubrequestBudget(5 + 7 + 1)
+    const result = await rebuildChartJsonIncremental(fakeBucket, budget)
+    expect(result.archivesProcessed).toBe(2)
+  })
+
+  it('caps the rows a rebuild batch holds in memory', async () => {
+    Object.assign(files, manifestFiles(archives.map((e) => ({ ...e, rows: 150_000 }))))
+    const result = await rebuildChartJsonIncremental(fakeBucket)
+    expect(result).toMatchObject({ archivesProcessed: 1, archivesRemaining: 2, done: false })
+  })
+
+  it('exports only archives that can hold the requested range and models', async () => {
+    const result = await exportArchivesCsv(fakeBucket, { start: '2026-02-01', models: ['gpt-4'] })
+    expect(result!.archives).toBe(1)
+    expect(mockDownloadFile.mock.calls.map(([, key]) => key)).toEqual(['_archive/2026-02-02/1_c.seg'])
+    const rows = result!.csv.split('\n').slice(1)
+    expect(rows).toHaveLength(1)
+    expect(rows[0]).toContain('2026-02-02T08:00:00.000Z,user1,gpt-4')
+
+    const january = await exportArchivesCsv(fakeBucket, { end: '2026-01-31' })
+    expect(january!.archives).toBe(2)
+    expect(january!.csv.split('\n')).toHaveLength(3)
+  })
+
+  it('reads only the partitions that can hold the requested range', async () => {
+    await exportArchivesCsv(fakeBucket, { start: '2026-02-01' })
+    const reads = mockDownloadFileWithEtag.mock.calls.map(([, key]) => key)
+    expect(reads).toContain('_archive/_manifest/2026-02.json')
+    expect(reads).not.toContain('_archive/_manifest/2026-01.json')
+  })
+
+  it('reads a legacy single-object manifest and splits it on its next update', async () => {
+    files['_archive/_manifest.json'] = encoder.encode(JSON.stringify({ version: 1, complete: false, archives }))
+    delete files['_archive/_manifest/2026-01.json']
+    delete files['_archive/_manifest/2026-02.json']
+    mockListFiles.mockImplementation(async (_bucket, prefix) =>
+      (prefix === '_archive/' ? Object.keys(files).filter((k) => k.startsWith('_archive/2')) : []))
+    // Entries without user filters are indexed again, a month at a time
+    expect(await migrateArchives(fakeBucket)).toMatchObject({ indexed: 1, archivesRemaining: 2, done: false })
+
+    const split = mockUploadMany.mock.calls.flatMap(([, files]) => files)
+    expect(split.map(({ key }) => key)).toEqual(['_archive/_manifest/2026-01.json', '_archive/_manifest/2026-02.json'])
+    const february = JSON.parse(decoder.decode(split[1].body)) as ArchiveManifestPartitionJson
+    expect(february.archives.map((e) => e.key)).toEqual(['_archive/2026-02-01/1_b.seg', '_archive/2026-02-02/1_c.seg'])
+    const root = mockUploadFileConditional.mock.calls.find(([, key]) => key === '_archive/_manifest.json')!
+    expect(JSON.parse(decoder.decode(root[2]))).toMatchObject({
+      version: 2,
+      complete: false,
+      partitions: { '2026-01': '2026-01-31T10:00:00.000Z', '2026-02': '2026-01-31T23:30:00.000Z' },
+    })
+  })
+
+  it('is not used for reads until complete', async () => {
+    Object.assign(files, manifestFiles(archives, false))
+    expect(await exportArchivesCsv(fakeBucket, {})).toBeNull()
+    mockListFiles.mockImplementation(async (_bucket, prefix) =>
+      (prefix === '_archive/' ? Object.keys(files).filter((k) => k.endsWith('.seg')) : []))
+    await rebuildChartJsonIncremental(fakeBucket)
+    expect(mockListFiles.mock.calls.map(([, prefix]) => prefix)).toContain('_archive/')
+  })
+})
+
+describe('output blobs', () => {
+  const HASH_A = 'sha256:' + 'a'.repeat(64)
+  const HASH_B = 'sha256:' + 'b'.repeat(64)
+  const entryCsv =
+    'id,timestamp,user_id,model_id,prompt_id,output,output_hash,metadata_json,year,month,day\n' +
+    `00000000-0000-4000-8000-000000000001,2026-02-21T00:00:00Z,user1,gpt-5,p1,"Paris, France",${HASH_A},{},2026,2,21\n` +
+    `00000000-0000-4000-8000-000000000002,2026-02-21T00:00:00Z,user2,gpt-5,p1,"Paris, France",${HASH_A},{},2026,2,21\n` +
+    `00000000-0000-4000-8000-000000000003,2026-02-21T00:00:00Z,user2,gpt-5,p2,Lyon,${HASH_B},{},2026,2,21`
+
+  beforeEach(async () => {
+    const compressed = await gzip(encoder.encode(entryCsv))
+    mockListFiles.mockImplementation(async (_bucket, prefix) =>
+      prefix === '_buffer/entries/' ? ['_buffer/entries/123_abc.csv.gz'] : []
+    )
+    mockDownloadFile.mockResolvedValue(compressed)
+    mockDownloadFileWithEtag.mockResolvedValue({ body: null, etag: null })
+  })
+
+  async function archivedSegment(): Promise<string> {
+    const [, , body] = mockUploadFile.mock.calls.find(([, key]) => key.startsWith('_archive/'))!
+    return JSON.stringify(await readSegmentRecords(body))
+  }
+
+  it('stores each distinct output once and archives rows by hash', async () => {
+    await compactBuffer(fakeBucket)
+
+    const blobs = mockUploadFile.mock.calls.filter(([, key]) => key.startsWith('_blobs/'))
+    expect(blobs.map(([, key]) => key).sort()).toEqual([`_blobs/${'a'.repeat(64)}`, `_blobs/${'b'.repeat(64)}`])
+    const paris = blobs.find(([, key]) => key.endsWith('a'.repeat(64)))!
+    expect(decoder.decode(await gunzip(paris[2]))).toBe('Paris, France')
+
+    const segment = await archivedSegment()
+    expect(segment).not.toContain('Paris')
+    expect(segment).not.toContain('Lyon')
+    expect(segment).toContain(HASH_A)
+  })
+
+  it('keeps text inline for outputs whose blob does not fit the budget', async () => {
+    // Mocked storage calls are not charged: 11 minus the 10 held back (segment
+    // and sidecar writes, entry delete, journal write and delete, legacy
+    // check, manifest update) leaves room for one blob
+    await compactBuffer(fakeBucket, new SubrequestBudget(11))
+
+    expect(mockUploadFile.mock.calls.filter(([, key]) => key.startsWith('_blobs/'))).toHaveLength(1)
+    const segment = await archivedSegment()
+    expect(segment).not.toContain('Paris')
+    expect(segment).toContain('Lyon')
+  })
+
+  it('reads text inline or from the blob', async () => {
+    expect(await readOutput(fakeBucket, { output: 'inline', output_hash: HASH_A })).toBe('inline')
+
+    mockDownloadFileWithEtag.mockResolvedValue({ body: await gzip(encoder.encode('Paris, France')), etag: 'e' })
+    expect(await readOutput(fakeBucket, { output: '', output_hash: HASH_A })).toBe('Paris, France')
+    expect(mockDownloadFileWithEtag).toHaveBeenLastCalledWith(fakeBucket, `_blobs/${'a'.repeat(64)}`, undefined)
+  })
+
+  it('exports blob-backed rows with their text unless asked for hashes only', async () => {
+    const segment = await writeSegment([
+      makeRecord({ output: '', output_hash: HASH_A }),
+      makeRecord({ output: '', output_hash: HASH_A }),
+      makeRecord({ output: '', output_hash: HASH_B }),
+    ])
+    const files: Record<string, Uint8Array> = {
+      '_archive/2026-02-21/1_a.seg': segment,
+      [`_blobs/${'a'.repeat(64)}`]: await gzip(encoder.encode('Paris, France')),
+    }
+    mockDownloadFileWithEtag.mockImplementation(async (_bucket, key) =>
+      ({ body: files[key] ?? null, etag: files[key] ? 'e' : null }))
+
+    // One read per distinct hash; HASH_B has no blob, so its row stays empty
+    const result = await exportArchiveCsv(fakeBucket, '_archive/2026-02-21/1_a.seg')
+    expect(result!.csv.split('\n').filter((l) => l.includes('"Paris, France"'))).toHaveLength(2)
+    expect(result!.unresolved).toBe(1)
+    expect(mockDownloadFileWithEtag.mock.calls.filter(([, key]) => key.startsWith('_blobs/'))).toHaveLength(2)
+
+    mockDownloadFileWithEtag.mockClear()
+    const hashOnly = await exportArchiveCsv(fakeBucket, '_archive/2026-02-21/1_a.seg', new SubrequestBudget(), 'hash')
+    expect(hashOnly!.csv).not.toContain('Paris')
+    expect(hashOnly!.unresolved).toBe(3)
+    expect(mockDownloadFileWithEtag).toHaveBeenCalledTimes(1)
   })
 })
 
@@ -374,14 +1488,14 @@ describe('CSV parsing (RFC 4180)', () => {
     await writeBufferEntry(fakeBucket, [makeRecord({ output: multiLineOutput })])
 
     // Read back the written CSV and verify it round-trips correctly
-    const [, , body] = mockUploadFile.mock.calls[0]
-    const csv = decoder.decode(await gunzip(body))
+    const [, , body] = mockUploadFileWithMetadata.mock.calls[0]
+    const csv = decoder.decode(await gunzip(ingestParts(body).rows))
     expect(csv).toContain('"line 1\nline 2, with comma\nline 3 ""quoted"""')
 
     // Now simulate reading it back via a compaction-like path:
     // feed the CSV through the same compression pipeline
     const recompressed = await gzip(encoder.encode(csv))
-    mockListFiles.mockResolvedValue(['_buffer/entries/123_abc.csv.gz'])
+    mockListFilesWithMetadata.mockResolvedValue([{ key: '_buffer/entries/123_abc.csv.gz', customMetadata: {} }])
     mockDownloadFile.mockResolvedValue(recompressed)
     mockDownloadFileWithEtag.mockResolvedValue({ body: null, etag: null })
 
@@ -400,7 +1514,7 @@ describe('CSV parsing (RFC 4180)', () => {
     const compressed = await gzip(encoder.encode(csv))
 
     // Entry file containing garbage rows
-    mockListFiles.mockResolvedValue(['_buffer/entries/123_abc.csv.gz'])
+    mockListFilesWithMetadata.mockResolvedValue([{ key: '_buffer/entries/123_abc.csv.gz', customMetadata: {} }])
     mockDownloadFile.mockResolvedValue(compressed)
     mockDownloadFileWithEtag.mockResolvedValue({ body: null, etag: null })
     mockUploadFile.mockResolvedValue(undefined)
@@ -421,7 +1535,7 @@ describe('deleteUserFromBuffer', () => {
       '00000000-0000-4000-8000-000000000003,2026-02-21T00:00:00Z,user1,gpt-4,p2,out3,sha256:c,{},2026,2,21'
     const compressed = await gzip(encoder.encode(csv))
 
-    mockListFiles.mockResolvedValue(['_buffer/entries/123_abc.csv.gz'])
+    mockListFilesWithMetadata.mockResolvedValue([{ key: '_buffer/entries/123_abc.csv.gz', customMetadata: {} }])
     mockDownloadFile.mockResolvedValue(compressed)
     // No legacy buffer
     mockDownloadFileWithEtag.mockResolvedValue({ body: null, etag: null })
@@ -436,4 +1550,262 @@ describe('deleteUserFromBuffer', () => {
     expect(resultCsv).not.toContain('user1')
     expect(resultCsv).toContain('user2')
   })
+
+  it('finds tagged entries from the listing without reading them', async () => {
+    mockListFilesWithMetadata.mockResolvedValue([
+      { key: '_buffer/entries/1_a.csv.gz', customMetadata: { user_id: 'user1', rows: '3' } },
+      { key: '_buffer/entries/2_b.csv.gz', customMetadata: { user_id: 'user2', rows: '5' } },
+      { key: '_buffer/entries/3_c.csv.gz', customMetadata: { user_id: 'user1', rows: '1' } },
+    ])
+    mockDownloadFileWithEtag.mockResolvedValue({ body: null, etag: null })
+
+    const removed = await deleteUserFromBuffer(fakeBucket, 'user1')
+
+    expect(removed).toBe(4)
+    expect(mockDownloadFile).not.toHaveBeenCalled()
+    expect(mockDeleteFiles).toHaveBeenCalledWith(
+      fakeBucket, ['_buffer/entries/1_a.csv.gz', '_buffer/entries/3_c.csv.gz'], undefined)
+  })
+
+  it('drops the user from the header of an untagged ingest entry', async () => {
+    const row = (n: number, user: string) =>
+      `00000000-0000-4000-8000-00000000000${n},2026-02-21T00:00:00Z,${user},gpt-5,p${n},out,sha256:a,{},2026,2,21`
+    const dr = (n: number, user: string) => ({ model_id: 'gpt-5', prompt_id: `p${n}`, output_hash: 'sha256:a', user_id: user })
+    mockListFilesWithMetadata.mockResolvedValue([{ key: '_buffer/entries/1_a.ing', customMetadata: {} }])
+    mockDownloadFile.mockResolvedValue(await ingestEntry(
+      { ts: 1, bucket: '2026-02-21-00', records: [dr(1, 'user1'), dr(2, 'user2')] },
+      `id,timestamp,user_id,model_id,prompt_id,output,output_hash,metadata_json,year,month,day\n${row(1, 'user1')}\n${row(2, 'user2')}`
+    ))
+    mockDownloadFileWithEtag.mockResolvedValue({ body: null, etag: null })
+    mockUploadFile.mockResolvedValue('etag')
+
+    expect(await deleteUserFromBuffer(fakeBucket, 'user1')).toBe(1)
+
+    const [, key, body] = mockUploadFile.mock.calls[0]
+    expect(key).toBe('_buffer/entries/1_a.ing')
+    const { header, rows } = ingestParts(body)
+    expect(header).toEqual({ ts: 1, bucket: '2026-02-21-00', records: [dr(2, 'user2')] })
+    expect(decoder.decode(await gunzip(rows))).not.toContain('user1')
+  })
+})
+
+describe('incremental rebuild', () => {
+  it('counts a segment compacted between its invocations once', async () => {
+    const files: Record<string, Uint8Array> = {}
+    const archives = []
+    for (const day of [1, 2, 3]) {
+      const key = `_archive/2026-02-0${day}/1_${day}.seg`
+      const records = [makeRecord({ timestamp: `2026-02-0${day}T12:00:00.000Z`, day })]
+      files[key] = await writeSegment(records)
+      files[key.replace('_archive/', '_archive_idx/')] = files[key]
+      // Large enough row counts that each rebuild invocation takes one archive
+      archives.push({
+        key, rows: 150_000, bytes: 100, raw_bytes: 400, models: ['gpt-5'], etag: 'e',
+        min_ts: records[0].timestamp, max_ts: records[0].timestamp,
+      })
+    }
+    const root: ArchiveManifestJson = {
+      version: 2, complete: true, indexed_since: '2026-01-01T00:00:00.000Z', partitions: { '2026-02': archives[0].min_ts },
+    }
+    files['_archive/_manifest.json'] = encoder.encode(JSON.stringify(root))
+    files['_archive/_manifest/2026-02.json'] = encoder.encode(JSON.stringify({ version: 1, month: '2026-02', archives }))
+    mockMemoryBucket(files)
+    const total = () => (JSON.parse(decoder.decode(files['_aggregated/chart_data.json'])) as ChartJson).total_submissions
+
+    expect(await rebuildChartJsonIncremental(fakeBucket)).toMatchObject({ archivesProcessed: 1, done: false })
+    expect(total()).toBe(1)
+
+    // A submission compacted mid-rebuild: its segment is new, its header merged into the partial chart
+    const ts = Date.UTC(2026, 1, 4, 12)
+    files[`_buffer/entries/${ts}_abc.ing`] = await ingestEntry(
+      { ts, bucket: '2026-02-04-12', records: [{ model_id: 'gpt-5', prompt_id: 'prompt1', output_hash: 'sha256:abc', user_id: 'user1' }] },
+      'id,timestamp,user_id,model_id,prompt_id,output,output_hash,metadata_json,year,month,day\n' +
+      '00000000-0000-4000-8000-000000000004,2026-02-04T12:00:00.000Z,user1,gpt-5,prompt1,test output,sha256:abc,{},2026,2,4',
+    )
+    expect((await compactBuffer(fakeBucket)).archived).toBe(1)
+    expect(total()).toBe(2)
+
+    let result
+    do result = await rebuildChartJsonIncremental(fakeBucket)
+    while (!result.done)
+    expect(total()).toBe(4)
+    const shard = JSON.parse(decoder.decode(files['_aggregated/chart/2026-02.json'])) as { data: Record<string, Record<string, { submissions: number }>> }
+    expect(shard.data['2026-02-04-12']['gpt-5'].submissions).toBe(1)
+  })
+})
+
+/** Back the storage mocks with `files`, an in-memory bucket that charges the budget like the real helpers. */
+function mockMemoryBucket(files: Record<string, Uint8Array>) {
+  const put = async (_b: R2Bucket, key: string, body: Uint8Array, ...rest: unknown[]) => {
+    ;(rest[rest.length - 1] as SubrequestBudget | undefined)?.charge()
+    files[key] = body
+    return 'e'
+  }
+  mockUploadFile.mockImplementation(put)
+  mockUploadFileConditional.mockImplementation(async (b, key, body, _etag, budget) => { await put(b, key, body, budget) })
+  mockDownloadFile.mockImplementation(async (_b, key, budget) => { budget?.charge(); return files[key] })
+  mockDownloadFileWithEtag.mockImplementation(async (_b, key, budget) => {
+    budget?.charge()
+    return { body: files[key] ?? null, etag: files[key] ? 'e' : null }
+  })
+  mockListFiles.mockImplementation(async (_b, prefix, maxKeys = 1000, budget) => {
+    budget?.charge()
+    return Object.keys(files).filter((k) => k.startsWith(prefix)).sort().slice(0, maxKeys)
+  })
+  mockDeleteFile.mockImplementation(async (_b, key, budget) => { budget?.charge(); delete files[key] })
+  mockDeleteFiles.mockImplementation(async (_b, keys, budget) => {
+    if (keys.length > 0) budget?.charge()
+    for (const k of keys) delete files[k]
+  })
+}
+
+describe('GDPR erasure', () => {
+  const A = '_archive/2026-02-01/1_a.seg'   // user1 and user2
+  const B = '_archive/2026-02-02/1_b.seg'   // user2 only
+  const C = '_archive/2026-02-03/1_c.seg'   // user1 only
+  let files: Record<string, Uint8Array>
+
+  const manifestOf = (): ArchiveManifestPartitionJson => JSON.parse(decoder.decode(files['_archive/_manifest/2026-02.json']))
+  const jobOf = (state: 'pending' | 'done'): ErasureJobJson | undefined => {
+    const body = files[`_erasure/${state}/user1.json`]
+    return body ? JSON.parse(decoder.decode(body)) : undefined
+  }
+
+  // user1's output in A is also user2's in B; C's is user1's alone
+  const SHARED = 'sha256:' + '1'.repeat(64)
+  const OWN = 'sha256:' + '2'.repeat(64)
+
+  beforeEach(async () => {
+    const rows: Record<string, StorageRecord[]> = {
+      [A]: [makeRecord({ day: 1, output: '', output_hash: SHARED }), makeRecord({ user_id: 'user2', day: 1 })],
+      [B]: [makeRecord({ user_id: 'user2', day: 2, output: '', output_hash: SHARED })],
+      [C]: [makeRecord({ day: 3, output: '', output_hash: OWN }), makeRecord({ day: 3, prompt_id: 'prompt2' })],
+    }
+    files = {}
+    const archives = []
+    for (const [key, records] of Object.entries(rows)) {
+      files[key] = await writeSegment(records)
+      files[key.replace('_archive/', '_archive_idx/')] = files[key]
+      archives.push({
+        key, rows: records.length, bytes: 100, raw_bytes: 400, models: ['gpt-5'], etag: 'e',
+        min_ts: records[0].timestamp, max_ts: records[0].timestamp,
+        user_bloom: createBloomFilter(records.map((r) => r.user_id)),
+        output_bloom: createBloomFilter(records.map((r) => r.output_hash)),
+      })
+    }
+    files[`_blobs/${'1'.repeat(64)}`] = encoder.encode('shared')
+    files[`_blobs/${'2'.repeat(64)}`] = encoder.encode('own')
+    const root: ArchiveManifestJson = {
+      version: 2, complete: true, indexed_since: '2026-01-01T00:00:00.000Z', partitions: { '2026-02': archives[0].min_ts },
+    }
+    files['_archive/_manifest.json'] = encoder.encode(JSON.stringify(root))
+    files['_archive/_manifest/2026-02.json'] = encoder.encode(JSON.stringify({ version: 1, month: '2026-02', archives }))
+    mockMemoryBucket(files)
+  })
+
+  it('waits until compaction has archived submissions made before the request', async () => {
+    files['_buffer/entries/1000_abc.csv.gz'] = new Uint8Array()
+    const job = await advanceErasureJob(fakeBucket, await requestErasure(fakeBucket, 'user1'))
+    expect(job.status).toBe('waiting')
+    expect(jobOf('pending')!.status).toBe('waiting')
+    expect(mockDownloadFile).not.toHaveBeenCalled()
+  })
+
+  it('skips archives the user filter rules out and rewrites the rest without the user', async () => {
+    const job = await advanceErasureJob(fakeBucket, await requestErasure(fakeBucket, 'user1'))
+
+    expect(job).toMatchObject({ status: 'done', archives: [A, C], archives_done: 2, rows_removed: 3 })
+    expect(mockDownloadFileWithEtag.mock.calls.map(([, key]) => key)).not.toContain(B)
+    expect((await readSegmentRecords(files[A])).map((r) => r.user_id)).toEqual(['user2'])
+    expect(files[C]).toBeUndefined()
+    expect(files['_archive_idx/2026-02-03/1_c.seg']).toBeUndefined()
+
+    const manifest = manifestOf()
+    expect(manifest.archives.map((e) => e.key)).toEqual([A, B])
+    expect(bloomMayContain(manifest.archives[0].user_bloom!, 'user1')).toBe(false)
+    const chart: ChartJson = JSON.parse(decoder.decode(files['_aggregated/chart_data.json']))
+    expect(chart.total_submissions).toBe(2)
+    expect(jobOf('pending')).toBeUndefined()
+    expect(jobOf('done')!.completed_at).not.toBeNull()
+  })
+
+  it('deletes only the blobs no remaining row references, reading just the archives their filters allow', async () => {
+    const job = await advanceErasureJob(fakeBucket, await requestErasure(fakeBucket, 'user1'))
+
+    expect(job).toMatchObject({ status: 'done', blobs_done: 2, blobs_removed: 1 })
+    expect(job.blobs!.sort()).toEqual([SHARED, OWN].sort())
+    expect(files[`_blobs/${'1'.repeat(64)}`]).toBeDefined()
+    expect(files[`_blobs/${'2'.repeat(64)}`]).toBeUndefined()
+    // After the chart rebuild reads both, A (rewritten without user1) is ruled
+    // out by its new filter and B holds the shared hash
+    const sidecarReads = mockDownloadFile.mock.calls.map(([, key]) => key).filter((k) => k.startsWith('_archive_idx/'))
+    expect(sidecarReads).toEqual(['_archive_idx/2026-02-01/1_a.seg', '_archive_idx/2026-02-02/1_b.seg', '_archive_idx/2026-02-02/1_b.seg'])
+  })
+
+  it('is not done while blobs remain to be checked', async () => {
+    let job: ErasureJobJson = {
+      ...(await requestErasure(fakeBucket, 'user1')),
+      status: 'blobs', archives: [], blobs: [SHARED, OWN],
+    }
+    // Too little left for the blob phase: the job stays in it
+    job = await advanceErasureJob(fakeBucket, job, new SubrequestBudget(5))
+    expect(job).toMatchObject({ status: 'blobs', blobs_done: 0 })
+    expect(jobOf('done')).toBeUndefined()
+
+    job = await advanceErasureJob(fakeBucket, job)
+    // The archives still hold both hashes, so nothing is deleted
+    expect(job).toMatchObject({ status: 'done', blobs_done: 2, blobs_removed: 0 })
+    expect(files[`_blobs/${'2'.repeat(64)}`]).toBeDefined()
+  })
+
+  it('keeps the blob of a reference still waiting in the buffer', async () => {
+    // user2 submitted user1's own output by reference after the erasure was requested
+    const job: ErasureJobJson = {
+      ...(await requestErasure(fakeBucket, 'user1')),
+      status: 'blobs', archives: [], blobs: [OWN],
+    }
+    const ts = Date.now()
+    files[`_buffer/entries/${ts}_ref.ing`] = await ingestEntry(
+      { ts, bucket: '2026-02-04-12', records: [{ model_id: 'gpt-5', prompt_id: 'prompt1', output_hash: OWN, user_id: 'user2' }] },
+      'id,timestamp,user_id,model_id,prompt_id,output,output_hash,metadata_json,year,month,day\n' +
+      `00000000-0000-4000-8000-000000000009,2026-02-04T12:00:00.000Z,user2,gpt-5,prompt1,,${OWN},{},2026,2,4`,
+    )
+    // C, the only archive holding the hash, is gone already
+    delete files[C]
+    delete files['_archive_idx/2026-02-03/1_c.seg']
+    files['_archive/_manifest/2026-02.json'] = encoder.encode(JSON.stringify({
+      ...manifestOf(), archives: manifestOf().archives.filter((e) => e.key !== C),
+    }))
+
+    expect(await advanceErasureJob(fakeBucket, job)).toMatchObject({ status: 'done', blobs_done: 1, blobs_removed: 0 })
+    expect(files[`_blobs/${'2'.repeat(64)}`]).toBeDefined()
+
+    // Without the buffered reference nothing holds the hash any more
+    delete files[`_buffer/entries/${ts}_ref.ing`]
+    expect(await advanceErasureJob(fakeBucket, job)).toMatchObject({ status: 'done', blobs_removed: 1 })
+    expect(files[`_blobs/${'2'.repeat(64)}`]).toBeUndefined()
+  })
+
+  it('resumes from its cursor when the budget runs out', async () => {
+    let job = await requestErasure(fakeBucket, 'user1')
+    let steps = 0
+    while (job.status !== 'done' && steps < 10) {
+      // One archive per step, then just enough for a rebuild batch
+      const limit = job.status === 'chart' ? 17 : 16
+      const budget = new SubrequestBudget(limit)
+      job = await advanceErasureJob(fakeBucket, jobOf('pending')!, budget)
+      expect(budget.used()).toBeLessThanOrEqual(limit)
+      steps++
+    }
+    expect(job).toMatchObject({ status: 'done', archives_done: 2, rows_removed: 3 })
+    expect(steps).toBeGreaterThan(2)
+    expect(manifestOf().archives.map((e) => e.key)).toEqual([A, B])
+  })
+
+  it('advances pending jobs from the cron', async () => {
+    await requestErasure(fakeBucket, 'user1')
+    const result = await runErasureJobs(fakeBucket)
+    expect(result).toMatchObject({ jobsCompleted: 1, jobsRemaining: 0, jobsWaiting: 0 })
+    expect(jobOf('done')!.status).toBe('done')
+  })
 })
@@ -6,34 +6,88 @@
  *   - R2 bucket binding passed as first param
  *
  * Storage layout:
- *   _buffer/buffer.csv.gz           <- appended per submit
- *   _archive/YYYY-MM-DD.csv.gz      <- daily compacted from buffer
- *   _aggregated/chart_data.json     <- rebuilt daily by cron
- *   _users/{user_id}/summary.json   <- updated per submit (real-time)
+ *   _buffer/buffer.csv.gz           <- legacy monolithic buffer (drained by compact)
+ *   _buffer/entries/{ts}_{rand}.ing <- one ingest entry per submit: chart delta header + gzipped CSV rows
+ *   _buffer/entries/{ts}_{rand}.csv.gz  <- legacy CSV-only entry (drained by compact)
+ *   _deltas/YYYY-MM-DD/{ts}_{rand}.json  <- legacy chart delta per submit (merged by compact)
+ *   _archive/YYYY-MM-DD.csv.gz      <- legacy single-object daily archive (read-only)
+ *   _archive/YYYY-MM-DD/{ts}_{rand}.seg  <- columnar archive segment per compact run (rewritten only by erasure)
+ *   _archive_idx/<archive key>      <- sidecar per archive object: only the columns aggregation reads
+ *   _archive/_manifest.json         <- archive manifest root: partition months and their earliest rows
+ *   _archive/_manifest/YYYY-MM.json <- per-archive stats and user filters of the archives keyed in that month
+ *   _blobs/{sha256 hex}             <- gzipped output text, one per distinct output_hash
+ *   _aggregated/chart_data.json     <- public chart index: totals + shard months
+ *   _aggregated/chart/YYYY-MM.json  <- one month of hourly buckets
+ *   _aggregated/chart/YYYY-MM/{1h,1d,1w}.json  <- that month pre-serialized for /api/data/chart, per level
+ *   _aggregated/chart_state.json    <- writer-only drift/contributor state
+ *   _users/{user_id}/summary.json   <- per-user totals, folded from summary deltas at compact
+ *   _summary_deltas/{user_id}/{ts}_{rand}.json  <- one summary increment per submit
+ *   _maintenance/summary_fold.json  <- last user whose summary deltas compaction folded
+ *   _maintenance/compact_batch.json <- entries a compaction is archiving, until it deletes them
+ *   _erasure/{pending,done}/{user_id}.json  <- GDPR erasure jobs
+ *   _maintenance/lease.json         <- held by a scheduled maintenance run and its chain (see maintenance.ts)
  */
 import {
+  downloadFile,
   downloadFileWithEtag,
+  downloadFileIfChanged,
+  fileExists,
   uploadFile,
+  uploadFileWithMetadata,
   uploadFileConditional,
   listFiles,
-  downloadFile,
+  listFilesWithMetadata,
+  listPrefixes,
+  downloadMany,
+  uploadMany,
   deleteFile,
   deleteFiles,
+  mapWithConcurrency,
+  SubrequestBudget,
 } from './storage'
 import type {
   StorageRecord,
   ChartJson,
+  ChartStateJson,
+  ChartShardJson,
+  ChartPoint,
+  ChartResponseJson,
+  ChartColumnarResponseJson,
+  ChartFragmentJson,
+  ChartSeriesField,
   UserSummaryJson,
+  SummaryDelta,
+  SummaryFoldCursorJson,
   ModelBucketStats,
   ChartDelta,
   DeltaRecord,
+  OutputRef,
+  AggregateRow,
+  ArchiveManifestEntry,
+  ArchiveManifestJson,
+  ArchiveManifestPartitionJson,
+  LegacyArchiveManifestJson,
+  ErasureJobJson,
+  CompactBatchJson,
 } from './schemas'
+import { createBloomFilter, bloomMayContain } from './bloom'
+import {
+  writeSegment,
+  readSegmentRecords,
+  readSegmentAggregateRows,
+  segmentRawBytes,
+  AGGREGATE_COLUMNS,
+} from './segment'
 
 const BUFFER_KEY = '_buffer/buffer.csv.gz'
 const CHART_KEY = '_aggregated/chart_data.json'
+const CHART_STATE_KEY = '_aggregated/chart_state.json'
+const CHART_SHARD_PREFIX = '_aggregated/chart/'
 const ARCHIVE_PREFIX = '_archive/'
+const ARCHIVE_IDX_PREFIX = '_archive_idx/'
 const USERS_PREFIX = '_users/'
 const DELTAS_PREFIX = '_deltas/'
+const BLOBS_PREFIX = '_blobs/'
 
 const CSV_HEADERS =
   'id,timestamp,user_id,model_id,prompt_id,output,output_hash,metadata_json,year,month,day,score'
@@ -115,12 +169,46 @@ function fieldsToRecord(fields: string[]): StorageRecord | null {
   }
 }
 
+function fieldsToAggregateRow(fields: string[]): AggregateRow | null {
+  if (fields.length !== 8) return null
+  const year = parseInt(fields[5], 10)
+  if (!Number.isFinite(year)) return null
+  return {
+    timestamp: fields[0],
+    user_id: fields[1],
+    model_id: fields[2],
+    prompt_id: fields[3],
+    output_hash: fields[4],
+    year,
+    month: parseInt(fields[6], 10),
+    day: parseInt(fields[7], 10),
+  }
+}
+
+function parseCsvBody(csv: string): StorageRecord[] {
+  const records: StorageRecord[] = []
+  parseCsvRows(csv, (fields) => {
+    const rec = fieldsToRecord(fields)
+    if (rec) records.push(rec)
+  })
+  return records
+}
+
+function parseSidecarBody(csv: string): AggregateRow[] {
+  const rows: AggregateRow[] = []
+  parseCsvRows(csv, (fields) => {
+    const row = fieldsToAggregateRow(fields)
+    if (row) rows.push(row)
+  })
+  return rows
+}
+
 /**
  * RFC 4180 CSV parser — handles quoted fields with embedded newlines, commas, and quotes.
  * Previous implementation split on \n first, breaking multi-line quoted fields.
+ * Skips the header line and calls `onRow` with the fields of every other row.
  */
-function parseCsvBody(csv: string): StorageRecord[] {
-  const records: StorageRecord[] = []
+function parseCsvRows(csv: string, onRow: (fields: string[]) => void): void {
   const len = csv.length
   let pos = 0
 
@@ -180,13 +268,446 @@ function parseCsvBody(csv: string): StorageRecord[] {
       }
     }
 
-    if (fields.length > 0) {
-      const rec = fieldsToRecord(fields)
-      if (rec) records.push(rec)
+    if (fields.length > 0) onRow(fields)
+  }
+}
+
+// -- Archive segments --
+
+const SEGMENT_EXT = '.seg'
+const CSV_ARCHIVE_EXT = '.csv.gz'
+
+/**
+ * Write records as a new, self-contained archive segment for `day`, plus its
+ * sidecar. Segments are never rewritten, so compaction cost is proportional to
+ * the new rows only — the previous download-gunzip-append-gzip cycle grew with
+ * every run of the day.
+ */
+async function writeArchiveSegment(
+  bucket: R2Bucket,
+  day: string,
+  records: StorageRecord[],
+  budget?: SubrequestBudget
+): Promise<ArchiveManifestEntry> {
+  const ts = Date.now()
+  const rand = Math.random().toString(36).slice(2, 8)
+  const key = `${ARCHIVE_PREFIX}${day}/${ts}_${rand}${SEGMENT_EXT}`
+  return writeArchiveObjects(bucket, key, records, budget)
+}
+
+/**
+ * Columnar segment at `key` plus its aggregation-only sidecar, in one batch.
+ * Returns the segment's manifest entry.
+ */
+async function writeArchiveObjects(
+  bucket: R2Bucket,
+  key: string,
+  records: StorageRecord[],
+  budget?: SubrequestBudget
+): Promise<ArchiveManifestEntry> {
+  const [segment, sidecar] = await Promise.all([
+    writeSegment(records),
+    writeSegment(records, AGGREGATE_COLUMNS),
+  ])
+  const [etag] = await uploadMany(bucket, [
+    { key, body: segment },
+    { key: archiveSidecarKey(key), body: sidecar },
+  ], budget)
+  return archiveEntry(key, records, segment, etag)
+}
+
+/** Parse an archive object of either format: columnar segment or legacy gzipped CSV. */
+async function parseArchive(key: string, body: Uint8Array): Promise<StorageRecord[]> {
+  return key.endsWith(SEGMENT_EXT)
+    ? readSegmentRecords(body)
+    : parseCsvBody(decoder.decode(await gunzip(body)))
+}
+
+/** `_archive/<rest>` → `_archive_idx/<rest>` */
+function archiveSidecarKey(archiveKey: string): string {
+  return ARCHIVE_IDX_PREFIX + archiveKey.slice(ARCHIVE_PREFIX.length)
+}
+
+/** Archive keys that have a sidecar (written by compaction since sidecars were introduced). */
+async function listSidecarArchiveKeys(bucket: R2Bucket, budget?: SubrequestBudget): Promise<Set<string>> {
+  const sidecars = await listFiles(bucket, ARCHIVE_IDX_PREFIX, Infinity, budget)
+  return new Set(sidecars.map(k => ARCHIVE_PREFIX + k.slice(ARCHIVE_IDX_PREFIX.length)))
+}
+
+/**
+ * Read the aggregation columns of several archives; result order matches
+ * `keys`. An archive with a sidecar is read through it, skipping the output
+ * and metadata text; a segment without one decompresses only those columns;
+ * a CSV archive without one is read in full.
+ */
+async function readAggregateRowsMany(
+  bucket: R2Bucket,
+  keys: string[],
+  withSidecar: Set<string>,
+  budget?: SubrequestBudget
+): Promise<AggregateRow[][]> {
+  const bodies = await downloadMany(bucket, keys.map(k => (withSidecar.has(k) ? archiveSidecarKey(k) : k)), budget)
+  return Promise.all(bodies.map(async (buf, i) => {
+    if (keys[i].endsWith(SEGMENT_EXT)) return readSegmentAggregateRows(buf)
+    const csv = decoder.decode(await gunzip(buf))
+    return withSidecar.has(keys[i]) ? parseSidecarBody(csv) : parseCsvBody(csv)
+  }))
+}
+
+const OUTPUT_HASH_RE = /^sha256:([0-9a-f]{64})$/
+
+/** `sha256:<hex>` → `_blobs/<hex>`; null for a hash in any other form. */
+function blobKey(outputHash: string): string | null {
+  const hex = OUTPUT_HASH_RE.exec(outputHash)?.[1]
+  return hex ? `${BLOBS_PREFIX}${hex}` : null
+}
+
+/**
+ * Move output text out of `records` into content-addressed blobs: one
+ * `_blobs/<hex>` per distinct output_hash that carries text, as many as fit in
+ * the budget after `reserve`. Returns the records with the text of every
+ * written blob dropped; a row whose blob did not fit keeps its text inline.
+ * Re-writing a blob is harmless — the key is derived from its content.
+ */
+async function externalizeOutputs(
+  bucket: R2Bucket,
+  records: StorageRecord[],
+  budget: SubrequestBudget,
+  reserve: number
+): Promise<StorageRecord[]> {
+  const pending = new Map<string, string>()
+  for (const r of records) {
+    const hex = OUTPUT_HASH_RE.exec(r.output_hash)?.[1]
+    if (hex && r.output !== '' && !pending.has(hex)) pending.set(hex, r.output)
+  }
+  const batch = Array.from(pending).slice(0, budget.fit(pending.size, 1, reserve))
+  if (batch.length === 0) return records
+
+  await uploadMany(bucket, await Promise.all(batch.map(async ([hex, output]) => ({
+    key: `${BLOBS_PREFIX}${hex}`,
+    body: await gzip(encoder.encode(output)),
+  }))), budget)
+
+  const stored = new Set(batch.map(([hex]) => `sha256:${hex}`))
+  return records.map(r => (stored.has(r.output_hash) && r.output !== '' ? { ...r, output: '' } : r))
+}
+
+/** An output's text: inline in its row, or read from its blob. Null if neither holds it. */
+export async function readOutput(
+  bucket: R2Bucket,
+  record: Pick<StorageRecord, 'output' | 'output_hash'>,
+  budget?: SubrequestBudget
+): Promise<string | null> {
+  if (record.output !== '') return record.output
+  const key = blobKey(record.output_hash)
+  if (!key) return null
+  const { body } = await downloadFileWithEtag(bucket, key, budget)
+  return body ? decoder.decode(await gunzip(body)) : null
+}
+
+/**
+ * List every archive object (legacy daily files and segments) in
+ * chronological order. A legacy `YYYY-MM-DD.csv.gz` sorts before the
+ * `YYYY-MM-DD/` segments of the same day since '.' < '/'. A CSV archive whose
+ * columnar copy already exists is the leftover of an interrupted migration
+ * and is skipped so its rows are not counted twice.
+ */
+async function listArchiveKeys(bucket: R2Bucket, budget?: SubrequestBudget): Promise<string[]> {
+  const keys = (await listFiles(bucket, ARCHIVE_PREFIX, Infinity, budget))
+    .filter(k => k.endsWith(CSV_ARCHIVE_EXT) || k.endsWith(SEGMENT_EXT))
+  const segments = new Set(keys.filter(k => k.endsWith(SEGMENT_EXT)))
+  return keys.filter(k => k.endsWith(SEGMENT_EXT) || !segments.has(migratedArchiveKey(k))).sort()
+}
+
+/** `…/name.csv.gz` → `…/name.seg`; a segment key maps to itself. */
+function migratedArchiveKey(key: string): string {
+  return key.endsWith(CSV_ARCHIVE_EXT) ? key.slice(0, -CSV_ARCHIVE_EXT.length) + SEGMENT_EXT : key
+}
+
+// -- Archive manifest --
+
+const ARCHIVE_MANIFEST_KEY = `${ARCHIVE_PREFIX}_manifest.json`
+const MANIFEST_PARTITION_PREFIX = `${ARCHIVE_PREFIX}_manifest/`
+const MANIFEST_IO = 4  // root and one partition, read + write each
+
+/** `_archive/YYYY-MM-DD…` → YYYY-MM, the manifest partition the archive is listed in */
+function manifestMonth(archiveKey: string): string {
+  return archiveKey.slice(ARCHIVE_PREFIX.length, ARCHIVE_PREFIX.length + 7)
+}
+
+function manifestPartitionKey(month: string): string {
+  return `${MANIFEST_PARTITION_PREFIX}${month}.json`
+}
+
+function compareKeys(a: { key: string }, b: { key: string }): number {
+  return a.key < b.key ? -1 : a.key > b.key ? 1 : 0
+}
+
+function archiveEntry(
+  key: string,
+  rows: readonly AggregateRow[],
+  segment: Uint8Array,
+  etag: string
+): ArchiveManifestEntry {
+  let minTs = ''
+  let maxTs = ''
+  const models = new Set<string>()
+  for (const r of rows) {
+    if (!minTs || r.timestamp < minTs) minTs = r.timestamp
+    if (r.timestamp > maxTs) maxTs = r.timestamp
+    models.add(r.model_id)
+  }
+  return {
+    key,
+    rows: rows.length,
+    bytes: segment.length,
+    raw_bytes: segmentRawBytes(segment),
+    min_ts: minTs,
+    max_ts: maxTs,
+    models: Array.from(models).sort(),
+    etag,
+    user_bloom: createBloomFilter(rows.map(r => r.user_id)),
+    output_bloom: createBloomFilter(rows.map(r => r.output_hash)),
+  }
+}
+
+/** Earliest row per partition month of `entries`. */
+function partitionsOf(entries: readonly ArchiveManifestEntry[]): Record<string, string> {
+  const partitions: Record<string, string> = {}
+  for (const e of entries) {
+    const month = manifestMonth(e.key)
+    if (partitions[month] === undefined || e.min_ts < partitions[month]) partitions[month] = e.min_ts
+  }
+  return partitions
+}
+
+/**
+ * The manifest root, or an empty one. A legacy single-object manifest is
+ * returned as the root it splits into, with its entries in `legacy`.
+ */
+async function readArchiveManifest(
+  bucket: R2Bucket,
+  budget?: SubrequestBudget
+): Promise<{ manifest: ArchiveManifestJson; etag: string | null; legacy: ArchiveManifestEntry[] | null }> {
+  const { body, etag } = await downloadFileWithEtag(bucket, ARCHIVE_MANIFEST_KEY, budget)
+  const indexedSince = new Date().toISOString()
+  if (!body) {
+    return { manifest: { version: 2, complete: false, indexed_since: indexedSince, partitions: {} }, etag: null, legacy: null }
+  }
+  const stored = JSON.parse(decoder.decode(body)) as ArchiveManifestJson | LegacyArchiveManifestJson
+  if (stored.version === 2) return { manifest: stored, etag, legacy: null }
+  const manifest: ArchiveManifestJson = {
+    version: 2, complete: stored.complete, indexed_since: indexedSince, partitions: partitionsOf(stored.archives),
+  }
+  return { manifest, etag, legacy: stored.archives }
+}
+
+async function readManifestPartition(
+  bucket: R2Bucket,
+  month: string,
+  budget?: SubrequestBudget
+): Promise<{ partition: ArchiveManifestPartitionJson; etag: string | null }> {
+  const { body, etag } = await downloadFileWithEtag(bucket, manifestPartitionKey(month), budget)
+  const partition: ArchiveManifestPartitionJson = body
+    ? JSON.parse(decoder.decode(body))
+    : { version: 1, month, archives: [] }
+  return { partition, etag }
+}
+
+/**
+ * Manifest entries sorted by key, from the partitions `select` keeps (all by
+ * default): the root plus one GET per partition. A legacy manifest holds them
+ * all in its one object.
+ */
+async function readArchiveEntries(
+  bucket: R2Bucket,
+  budget?: SubrequestBudget,
+  select?: (month: string, minTs: string) => boolean
+): Promise<{ manifest: ArchiveManifestJson; entries: ArchiveManifestEntry[] }> {
+  const root = await readArchiveManifest(bucket, budget)
+  return { manifest: root.manifest, entries: await readPartitions(bucket, root, budget, select) }
+}
+
+async function readPartitions(
+  bucket: R2Bucket,
+  { manifest, legacy }: { manifest: ArchiveManifestJson; legacy: ArchiveManifestEntry[] | null },
+  budget?: SubrequestBudget,
+  select?: (month: string, minTs: string) => boolean
+): Promise<ArchiveManifestEntry[]> {
+  if (legacy) return legacy
+  const months = Object.keys(manifest.partitions)
+    .filter(m => !select || select(m, manifest.partitions[m]))
+    .sort()
+  const partitions = await mapWithConcurrency(months, (month) => readManifestPartition(bucket, month, budget))
+  return partitions.flatMap(p => p.partition.archives)
+}
+
+interface ManifestUpdate {
+  add?: readonly ArchiveManifestEntry[]   // replaces any entry with the same key
+  remove?: readonly string[]
+  complete?: boolean
+  batch?: string                          // compaction batch whose segments `add` holds
+}
+
+/**
+ * Apply `update`: the root first, so it names every partition before an entry
+ * lands in one and only ever lowers a partition's earliest row (readers prune
+ * by it), then each touched partition. Both are conditional writes that
+ * re-read on conflict; the root is only written when it changes, so a
+ * compaction of this month's rows costs the root read and one partition.
+ */
+async function updateArchiveManifest(
+  bucket: R2Bucket,
+  update: ManifestUpdate,
+  budget?: SubrequestBudget
+): Promise<void> {
+  const { add = [], remove = [], complete, batch } = update
+  await updateManifestRoot(bucket, add, complete, batch, budget)
+  const months = Array.from(new Set([...add.map(e => manifestMonth(e.key)), ...remove.map(manifestMonth)])).sort()
+  await mapWithConcurrency(months, (month) => updateManifestPartition(
+    bucket,
+    month,
+    add.filter(e => manifestMonth(e.key) === month),
+    remove.filter(k => manifestMonth(k) === month),
+    budget
+  ))
+}
+
+async function updateManifestRoot(
+  bucket: R2Bucket,
+  add: readonly ArchiveManifestEntry[],
+  complete: boolean | undefined,
+  batch: string | undefined,
+  budget?: SubrequestBudget
+): Promise<void> {
+  for (let attempt = 0; attempt < MAX_RETRIES; attempt++) {
+    const { manifest, etag, legacy } = await readArchiveManifest(bucket, budget)
+    const next: ArchiveManifestJson = { ...manifest, partitions: { ...manifest.partitions } }
+    for (const [month, minTs] of Object.entries(partitionsOf(add))) {
+      if (next.partitions[month] === undefined || minTs < next.partitions[month]) next.partitions[month] = minTs
+    }
+    if (complete !== undefined) next.complete = complete
+    if (batch !== undefined) next.compacted_batch = batch
+    if (etag && !legacy && JSON.stringify(next) === JSON.stringify(manifest)) return
+
+    // A legacy manifest's entries move to their partitions before the root stops listing them
+    if (legacy) await splitLegacyManifest(bucket, legacy, budget)
+    const buf = encoder.encode(JSON.stringify(next))
+    try {
+      if (etag) {
+        await uploadFileConditional(bucket, ARCHIVE_MANIFEST_KEY, buf, etag, budget)
+      } else {
+        await uploadFile(bucket, ARCHIVE_MANIFEST_KEY, buf, budget)
+      }
+      return
+    } catch (err: unknown) {
+      const status = (err as { status?: number }).status
+      if (status === 412 && attempt < MAX_RETRIES - 1) continue
+      throw err
     }
   }
+}
 
-  return records
+/** One-time: write the entries of a single-object manifest as its month partitions. */
+async function splitLegacyManifest(
+  bucket: R2Bucket,
+  entries: readonly ArchiveManifestEntry[],
+  budget?: SubrequestBudget
+): Promise<void> {
+  const byMonth = new Map<string, ArchiveManifestEntry[]>()
+  for (const e of entries) {
+    const month = manifestMonth(e.key)
+    if (!byMonth.has(month)) byMonth.set(month, [])
+    byMonth.get(month)!.push(e)
+  }
+  await uploadMany(bucket, Array.from(byMonth, ([month, archives]) => {
+    const partition: ArchiveManifestPartitionJson = { version: 1, month, archives: archives.sort(compareKeys) }
+    return { key: manifestPartitionKey(month), body: encoder.encode(JSON.stringify(partition)) }
+  }), budget)
+}
+
+async function updateManifestPartition(
+  bucket: R2Bucket,
+  month: string,
+  add: readonly ArchiveManifestEntry[],
+  remove: readonly string[],
+  budget?: SubrequestBudget
+): Promise<void> {
+  for (let attempt = 0; attempt < MAX_RETRIES; attempt++) {
+    const { partition, etag } = await readManifestPartition(bucket, month, budget)
+    const byKey = new Map(partition.archives.map(e => [e.key, e]))
+    for (const key of remove) byKey.delete(key)
+    for (const e of add) byKey.set(e.key, e)
+    partition.archives = Array.from(byKey.values()).sort(compareKeys)
+
+    const buf = encoder.encode(JSON.stringify(partition))
+    try {
+      if (etag) {
+        await uploadFileConditional(bucket, manifestPartitionKey(month), buf, etag, budget)
+      } else {
+        await uploadFile(bucket, manifestPartitionKey(month), buf, budget)
+      }
+      return
+    } catch (err: unknown) {
+      const status = (err as { status?: number }).status
+      if (status === 412 && attempt < MAX_RETRIES - 1) continue
+      throw err
+    }
+  }
+}
+
+interface ArchiveIndex {
+  keys: string[]                                      // chronological
+  withSidecar: Set<string>
+  entries: Map<string, ArchiveManifestEntry> | null   // null while the manifest is incomplete
+}
+
+/**
+ * The archives to read: from the manifest when it is complete (the root and
+ * its partitions, no listing), otherwise by listing _archive/ and _archive_idx/.
+ */
+async function loadArchiveIndex(bucket: R2Bucket, budget?: SubrequestBudget): Promise<ArchiveIndex> {
+  const root = await readArchiveManifest(bucket, budget)
+  if (root.manifest.complete) {
+    const archives = await readPartitions(bucket, root, budget)
+    const keys = archives.map(e => e.key)
+    return { keys, withSidecar: new Set(keys), entries: new Map(archives.map(e => [e.key, e])) }
+  }
+  const [keys, withSidecar] = await Promise.all([
+    listArchiveKeys(bucket, budget),
+    listSidecarArchiveKeys(bucket, budget),
+  ])
+  return { keys, withSidecar, entries: null }
+}
+
+export interface ArchiveFilter {
+  start?: string               // inclusive ISO 8601 prefix, e.g. YYYY-MM-DD
+  end?: string                 // inclusive ISO 8601 prefix
+  models?: readonly string[]
+}
+
+/** Manifest entries that can hold rows matching `filter`. */
+function selectArchives(
+  entries: Iterable<ArchiveManifestEntry>,
+  filter: ArchiveFilter
+): ArchiveManifestEntry[] {
+  const { start, end, models } = filter
+  return Array.from(entries).filter(e =>
+    (!start || e.max_ts >= start) &&
+    (!end || e.min_ts.slice(0, end.length) <= end) &&
+    (!models || e.models.some(m => models.includes(m))))
+}
+
+/** YYYY-MM of every month from `minTs` through `maxTs`. */
+function monthsBetween(minTs: string, maxTs: string): string[] {
+  const months: string[] = []
+  const d = new Date(`${minTs.slice(0, 7)}-01T00:00:00Z`)
+  const last = maxTs.slice(0, 7)
+  for (let m = minTs.slice(0, 7); m <= last; m = d.toISOString().slice(0, 7)) {
+    months.push(m)
+    d.setUTCMonth(d.getUTCMonth() + 1)
+  }
+  return months
 }
 
 // -- Buffer operations --
@@ -194,28 +715,123 @@ function parseCsvBody(csv: string): StorageRecord[] {
 const MAX_RETRIES = 3
 const BUFFER_ENTRIES_PREFIX = '_buffer/entries/'
 
+/** `…/{ts}_{rand}.ext` → ts; NaN for keys without one. */
+function keyTimestamp(key: string): number {
+  return Number(key.slice(key.lastIndexOf('/') + 1).split('_')[0])
+}
+
+// Ingest entries: the rows plus the chart delta they contribute, so one PUT
+// per submit feeds both archiving and the chart. Entries written before this
+// format are plain gzipped CSV (.csv.gz) with a separate _deltas/ file.
+const INGEST_EXT = '.ing'
+const INGEST_MAGIC = [0x50, 0x49, 0x4e, 0x47]  // "PING"
+
+interface BufferEntry {
+  records: StorageRecord[]
+  delta: ChartDelta | null   // null for legacy CSV entries
+}
+
+function isIngestEntry(key: string): boolean {
+  return key.endsWith(INGEST_EXT)
+}
+
+/** The chart delta for records stored at `now`. */
+function chartDeltaOf(records: readonly StorageRecord[], now: Date): ChartDelta {
+  const day = now.toISOString().split('T')[0]
+  return {
+    ts: now.getTime(),
+    bucket: `${day}-${String(now.getUTCHours()).padStart(2, '0')}`,
+    records: records.map((r): DeltaRecord => ({
+      model_id: r.model_id,
+      prompt_id: r.prompt_id,
+      output_hash: r.output_hash,
+      user_id: r.user_id,
+    })),
+  }
+}
+
 /**
- * Write records as an individual entry file — O(1) R2 PUT, no reads.
+ * Ingest entry layout: "PING" | header length (u32 LE) | header | rows.
+ * The header is the ChartDelta as JSON, readable without inflating the
+ * outputs; rows is the gzipped CSV of the full records.
+ */
+async function encodeBufferEntry(records: StorageRecord[], delta: ChartDelta | null): Promise<Uint8Array> {
+  const rows = await gzip(encoder.encode(CSV_HEADERS + '\n' + records.map(recordToCsvRow).join('\n')))
+  if (!delta) return rows
+  const header = encoder.encode(JSON.stringify(delta))
+  const out = new Uint8Array(8 + header.length + rows.length)
+  out.set(INGEST_MAGIC)
+  new DataView(out.buffer).setUint32(4, header.length, true)
+  out.set(header, 8)
+  out.set(rows, 8 + header.length)
+  return out
+}
+
+async function parseBufferEntry(key: string, body: Uint8Array): Promise<BufferEntry> {
+  if (!isIngestEntry(key)) {
+    return { records: parseCsvBody(decoder.decode(await gunzip(body))), delta: null }
+  }
+  if (body.length < 8 || INGEST_MAGIC.some((b, i) => body[i] !== b)) {
+    throw new Error(`Not an ingest entry: ${key}`)
+  }
+  const end = 8 + new DataView(body.buffer, body.byteOffset, body.byteLength).getUint32(4, true)
+  return {
+    records: parseCsvBody(decoder.decode(await gunzip(body.subarray(end)))),
+    delta: JSON.parse(decoder.decode(body.subarray(8, end))) as ChartDelta,
+  }
+}
+
+/** Download and parse buffer entries of either format; result order matches `keys`. */
+async function readBufferEntries(
+  bucket: R2Bucket,
+  keys: string[],
+  budget?: SubrequestBudget
+): Promise<BufferEntry[]> {
+  const bodies = await downloadMany(bucket, keys, budget)
+  return Promise.all(bodies.map((buf, i) => parseBufferEntry(keys[i], buf)))
+}
+
+/**
+ * Write records as a single ingest entry — one R2 PUT, no reads. The entry
+ * carries the rows for archiving and, in its header, the chart delta that
+ * compaction merges, so a submit no longer writes a separate _deltas/ file.
  * Replaces appendToCsvBuffer which did O(n) decompress-append-recompress
  * and caused 503s when the buffer grew between compact runs.
+ * An entry holding one user's rows (every submit) is tagged with that user
+ * and its row count in custom metadata, so deleteUserFromBuffer can find it
+ * from a listing alone. `at` dates the key and the chart bucket; the queue
+ * consumer passes the time the records were submitted.
  */
 export async function writeBufferEntry(
   bucket: R2Bucket,
-  records: StorageRecord[]
+  records: StorageRecord[],
+  at: Date = new Date()
 ): Promise<void> {
   if (records.length === 0) return
 
-  const ts = Date.now()
   const rand = Math.random().toString(36).slice(2, 8)
-  const key = `${BUFFER_ENTRIES_PREFIX}${ts}_${rand}.csv.gz`
+  const key = `${BUFFER_ENTRIES_PREFIX}${at.getTime()}_${rand}${INGEST_EXT}`
 
-  const csv = CSV_HEADERS + '\n' + records.map(recordToCsvRow).join('\n')
-  const compressed = await gzip(encoder.encode(csv))
-  await uploadFile(bucket, key, compressed)
+  const body = await encodeBufferEntry(records, chartDeltaOf(records, at))
+  const userId = records[0].user_id
+  if (records.every(r => r.user_id === userId)) {
+    await uploadFileWithMetadata(bucket, key, body, { user_id: userId, rows: String(records.length) })
+  } else {
+    await uploadFile(bucket, key, body)
+  }
 }
 
 // -- Per-user summary --
 
+const SUMMARY_DELTAS_PREFIX = '_summary_deltas/'
+const SUMMARY_DELTA_INLINE_MAX = 1024        // R2 custom metadata is capped at 2 KiB per object
+const SUMMARY_FOLD_MIN_AGE_MS = 60_000
+const SUMMARY_FOLD_IO = 2                    // summary read + conditional write
+const SUMMARY_DELTAS_MAX = 1000              // deltas read per user: one listing page
+const SUMMARY_FOLD_CURSOR_KEY = '_maintenance/summary_fold.json'
+const SUMMARY_FOLD_FIXED = 3                 // cursor read, user listing, cursor write
+const SUMMARY_FOLD_PER_USER = 1 + SUMMARY_FOLD_IO + 1   // delta listing, fold, delete
+
 function userSummaryKey(userId: string): string {
   return `${USERS_PREFIX}${userId}/summary.json`
 }
@@ -242,186 +858,1195 @@ function migrateSummary(raw: Record<string, unknown>): UserSummaryJson {
   // v2: date_stats: Record<string, Record<string, { count: number }>>
   const dateStats = raw.date_stats as Record<string, Record<string, { count: number }>> | undefined
 
-  const source = dateCounts || dateStats
-  if (source) {
-    for (const [date, models] of Object.entries(source)) {
-      v3.submissions_by_date[date] = {}
-      for (const [model, val] of Object.entries(models)) {
-        const count = typeof val === 'number' ? val : (val as { count: number }).count || 0
-        v3.submissions_by_date[date][model] = count
-        v3.model_submissions[model] = (v3.model_submissions[model] || 0) + count
-      }
-    }
+  const source = dateCounts || dateStats
+  if (source) {
+    for (const [date, models] of Object.entries(source)) {
+      v3.submissions_by_date[date] = {}
+      for (const [model, val] of Object.entries(models)) {
+        const count = typeof val === 'number' ? val : (val as { count: number }).count || 0
+        v3.submissions_by_date[date][model] = count
+        v3.model_submissions[model] = (v3.model_submissions[model] || 0) + count
+      }
+    }
+  }
+
+  return v3
+}
+
+function emptySummary(): UserSummaryJson {
+  return { version: 3, submissions_by_date: {}, model_submissions: {}, total_submissions: 0 }
+}
+
+function parseSummary(body: Uint8Array): UserSummaryJson {
+  const raw = JSON.parse(decoder.decode(body))
+  return isLegacySummary(raw) ? migrateSummary(raw) : raw as UserSummaryJson
+}
+
+function applySummaryDelta(summary: UserSummaryJson, delta: SummaryDelta): void {
+  for (const [date, models] of Object.entries(delta)) {
+    if (!summary.submissions_by_date[date]) summary.submissions_by_date[date] = {}
+    const day = summary.submissions_by_date[date]
+    for (const [model, count] of Object.entries(models)) {
+      day[model] = (day[model] || 0) + count
+      summary.model_submissions[model] = (summary.model_submissions[model] || 0) + count
+      summary.total_submissions += count
+    }
+  }
+}
+
+/**
+ * Pending summary deltas under `prefix`, in key order. Counts come from the
+ * listing's custom metadata; only deltas too large to inline there are read.
+ */
+async function readSummaryDeltas(
+  bucket: R2Bucket,
+  prefix: string,
+  maxKeys: number,
+  budget?: SubrequestBudget
+): Promise<{ key: string; delta: SummaryDelta }[]> {
+  const listed = await listFilesWithMetadata(bucket, prefix, maxKeys, budget)
+  const unlisted = listed.filter(o => o.customMetadata.counts === undefined).map(o => o.key)
+  const bodies = new Map((await downloadMany(bucket, unlisted, budget)).map((b, i) => [unlisted[i], decoder.decode(b)]))
+  return listed.map(o => ({ key: o.key, delta: JSON.parse(o.customMetadata.counts ?? bodies.get(o.key)!) }))
+}
+
+function summaryDeltaOf(records: readonly StorageRecord[]): SummaryDelta {
+  const delta: SummaryDelta = {}
+  for (const r of records) {
+    const dateStr = `${r.year}-${String(r.month).padStart(2, '0')}-${String(r.day).padStart(2, '0')}`
+    if (!delta[dateStr]) delta[dateStr] = {}
+    delta[dateStr][r.model_id] = (delta[dateStr][r.model_id] || 0) + 1
+  }
+  return delta
+}
+
+/**
+ * Add `records` to `summary` (a new, empty one by default) and return it —
+ * the projection for responses that do not wait for the stored summary.
+ */
+export function summarizeRecords(
+  records: readonly StorageRecord[],
+  summary: UserSummaryJson = emptySummary()
+): UserSummaryJson {
+  applySummaryDelta(summary, summaryDeltaOf(records))
+  return summary
+}
+
+/**
+ * Record a submit's summary increment as its own append-only object — one PUT,
+ * no read and no etag race, however many submits of the user run at once.
+ * Compaction folds deltas into summary.json; readUserSummary adds the rest.
+ */
+export async function writeSummaryDelta(
+  bucket: R2Bucket,
+  userId: string,
+  records: StorageRecord[]
+): Promise<void> {
+  if (records.length === 0) return
+
+  const delta = summaryDeltaOf(records)
+  const ts = Date.now()
+  const rand = Math.random().toString(36).slice(2, 8)
+  const key = `${SUMMARY_DELTAS_PREFIX}${userId}/${ts}_${rand}.json`
+  const json = JSON.stringify(delta)
+  const body = encoder.encode(json)
+  await uploadFileWithMetadata(bucket, key, body, body.length <= SUMMARY_DELTA_INLINE_MAX ? { counts: json } : {})
+}
+
+/**
+ * summary.json plus the deltas not yet folded into it; null if the user has
+ * neither. At most SUMMARY_DELTAS_MAX deltas are read (one listing page), so
+ * a user submitting faster than compaction folds sees a lagging total until
+ * the fold catches up.
+ */
+export async function readUserSummary(
+  bucket: R2Bucket,
+  userId: string,
+  budget?: SubrequestBudget
+): Promise<UserSummaryJson | null> {
+  const [{ body }, deltas] = await Promise.all([
+    downloadFileWithEtag(bucket, userSummaryKey(userId), budget),
+    readSummaryDeltas(bucket, `${SUMMARY_DELTAS_PREFIX}${userId}/`, SUMMARY_DELTAS_MAX, budget),
+  ])
+  if (!body && deltas.length === 0) return null
+
+  const summary = body ? parseSummary(body) : emptySummary()
+  const foldedThrough = summary.folded_through ?? ''
+  for (const { key, delta } of deltas) {
+    if (key > foldedThrough) applySummaryDelta(summary, delta)
+  }
+  delete summary.folded_through
+  return summary
+}
+
+/** Fold `deltas` (key order) into the user's summary.json with a conditional write. */
+async function foldUserSummary(
+  bucket: R2Bucket,
+  userId: string,
+  deltas: readonly { key: string; delta: SummaryDelta }[],
+  budget?: SubrequestBudget
+): Promise<void> {
+  const key = userSummaryKey(userId)
+  for (let attempt = 0; attempt < MAX_RETRIES; attempt++) {
+    const { body, etag } = await downloadFileWithEtag(bucket, key, budget)
+    const summary = body ? parseSummary(body) : emptySummary()
+    const foldedThrough = summary.folded_through ?? ''
+    for (const d of deltas) {
+      if (d.key > foldedThrough) applySummaryDelta(summary, d.delta)
+    }
+    summary.folded_through = deltas[deltas.length - 1].key > foldedThrough
+      ? deltas[deltas.length - 1].key
+      : foldedThrough
+    const buf = encoder.encode(JSON.stringify(summary))
+
+    try {
+      if (etag) {
+        await uploadFileConditional(bucket, key, buf, etag, budget)
+      } else {
+        await uploadFile(bucket, key, buf, budget)
+      }
+      return
+    } catch (err: unknown) {
+      const status = (err as { status?: number }).status
+      if (status === 412 && attempt < MAX_RETRIES - 1) continue
+      throw err
+    }
+  }
+}
+
+/**
+ * Fold pending summary deltas into each user's summary.json, as many users
+ * as the budget allows. Users are taken in turn from the one after the
+ * stored cursor, wrapping around once the listing runs out, and each reads
+ * its own deltas (up to SUMMARY_DELTAS_MAX), so a heavy user cannot keep the
+ * others waiting. summary.json records the last folded key, so readers never
+ * count a delta twice between the write and the delete. Deltas younger than
+ * SUMMARY_FOLD_MIN_AGE_MS are left for the next run: a PUT still in flight
+ * could otherwise land behind that mark and be skipped by readers.
+ */
+export async function foldSummaryDeltas(
+  bucket: R2Bucket,
+  budget: SubrequestBudget = new SubrequestBudget()
+): Promise<{ usersFolded: number; deltasFolded: number }> {
+  const cutoff = Date.now() - SUMMARY_FOLD_MIN_AGE_MS
+  const { body } = await downloadFileWithEtag(bucket, SUMMARY_FOLD_CURSOR_KEY, budget)
+  const after = body ? (JSON.parse(decoder.decode(body)) as SummaryFoldCursorJson).after : ''
+
+  const maxUsers = budget.fit(1000, SUMMARY_FOLD_PER_USER, 1)
+  if (maxUsers === 0) return { usersFolded: 0, deltasFolded: 0 }
+  // Past every key of the cursor's user: keys after the "/" are ASCII
+  const startAfter = after ? `${SUMMARY_DELTAS_PREFIX}${after}/\uffff` : undefined
+  let prefixes = await listPrefixes(bucket, SUMMARY_DELTAS_PREFIX, maxUsers, startAfter, budget)
+  // The listing ran out before the budget did: start over from the first user
+  const wrapped = prefixes.length < maxUsers
+  if (prefixes.length === 0 && after) {
+    prefixes = await listPrefixes(bucket, SUMMARY_DELTAS_PREFIX, maxUsers, undefined, budget)
+  }
+  const users = prefixes
+    .slice(0, budget.fit(prefixes.length, SUMMARY_FOLD_PER_USER, 1))
+    .map(p => p.slice(SUMMARY_DELTAS_PREFIX.length, -1))
+
+  const folded = await mapWithConcurrency(users, async (userId) => {
+    const deltas = (await readSummaryDeltas(bucket, `${SUMMARY_DELTAS_PREFIX}${userId}/`, SUMMARY_DELTAS_MAX, budget))
+      .filter(d => keyTimestamp(d.key) <= cutoff)
+    if (deltas.length > 0) await foldUserSummary(bucket, userId, deltas, budget)
+    return deltas.map(d => d.key)
+  })
+  await deleteFiles(bucket, folded.flat(), budget)
+
+  const next = wrapped && users.length === prefixes.length ? '' : (users[users.length - 1] ?? after)
+  if (next !== after) {
+    const cursor: SummaryFoldCursorJson = { version: 1, after: next }
+    await uploadFile(bucket, SUMMARY_FOLD_CURSOR_KEY, encoder.encode(JSON.stringify(cursor)), budget)
+  }
+
+  return { usersFolded: folded.filter(keys => keys.length > 0).length, deltasFolded: folded.flat().length }
+}
+
+/** Delete the user's summary.json and every pending delta. */
+export async function deleteUserSummary(
+  bucket: R2Bucket,
+  userId: string,
+  budget?: SubrequestBudget
+): Promise<void> {
+  const deltas = await listFiles(bucket, `${SUMMARY_DELTAS_PREFIX}${userId}/`, Infinity, budget)
+  await deleteFiles(bucket, [userSummaryKey(userId), ...deltas], budget)
+}
+
+// -- Isolate-level write coalescing (submit path) --
+
+const COALESCE_MAX_RECORDS = 500
+const COALESCE_MAX_WINDOW_MS = 1000
+const COALESCE_JOIN_GRACE_MS = 1000   // past the window, a joiner stops waiting for the opener's flush
+
+/** Writes of one coalesced flush; the rows are durable once `entry` resolves. */
+export interface CoalescedWrites {
+  entry: Promise<void>
+  summary: Promise<void>
+}
+
+interface PendingBatch {
+  parts: StorageRecord[][]    // one per request, so a joiner that gives up can take its rows back
+  rows: number
+  timer: ReturnType<typeof setTimeout>
+  writes: CoalescedWrites
+  flushed: boolean
+  joiners: (() => void)[]     // called at the flush, to stop their fallback timers
+  flush: () => void
+}
+
+/** Open batches per bucket binding, one per user so entries stay tagged. */
+const pendingBatches = new WeakMap<R2Bucket, Map<string, PendingBatch>>()
+
+/**
+ * The coalescing window from the INGEST_COALESCE_MS binding, in ms; 0 (the
+ * default, and for anything unparseable) writes every submit on its own.
+ */
+export function coalesceWindowFromEnv(value: string | undefined): number {
+  const n = value ? parseInt(value, 10) : NaN
+  return Number.isFinite(n) && n > 0 ? Math.min(n, COALESCE_MAX_WINDOW_MS) : 0
+}
+
+/** A promise with its settle functions, for writes that start later. */
+function deferred(): { promise: Promise<void>; resolve: () => void; reject: (err: unknown) => void } {
+  let resolve!: () => void
+  let reject!: (err: unknown) => void
+  const promise = new Promise<void>((res, rej) => { resolve = res; reject = rej })
+  return { promise, resolve, reject }
+}
+
+/**
+ * Queue `records` with those other requests in this isolate submit for the
+ * same user within `windowMs`, and write the batch as one ingest entry and
+ * one summary delta once the window closes or it holds
+ * COALESCE_MAX_RECORDS rows. Every request in a batch gets the same writes,
+ * so a caller acknowledges only after `entry` resolves, and a failed write
+ * fails every request in the batch.
+ *
+ * The window's timer runs in the request that opened the batch, which hands
+ * the flush to its `waitUntil` so the batch is written even if that request
+ * goes away first. Should the timer still never fire, a request that joined
+ * the batch takes its rows back COALESCE_JOIN_GRACE_MS after its window and
+ * writes them itself.
+ */
+export function writeCoalesced(
+  bucket: R2Bucket,
+  userId: string,
+  records: StorageRecord[],
+  windowMs: number,
+  waitUntil?: ((work: Promise<unknown>) => void) | null
+): CoalescedWrites {
+  let batches = pendingBatches.get(bucket)
+  if (!batches) pendingBatches.set(bucket, batches = new Map())
+
+  const part = [...records]
+  const batch = batches.get(userId)
+  if (batch) {
+    batch.parts.push(part)
+    batch.rows += part.length
+    if (batch.rows >= COALESCE_MAX_RECORDS) {
+      batch.flush()
+      return batch.writes
+    }
+    return joinBatch(bucket, userId, batch, part, windowMs)
+  }
+
+  const entry = deferred()
+  const summary = deferred()
+  const open: PendingBatch = {
+    parts: [part],
+    rows: part.length,
+    timer: setTimeout(() => open.flush(), windowMs),
+    writes: { entry: entry.promise, summary: summary.promise },
+    flushed: false,
+    joiners: [],
+    flush: () => {
+      if (open.flushed) return
+      open.flushed = true
+      clearTimeout(open.timer)
+      if (batches!.get(userId) === open) batches!.delete(userId)
+      for (const joined of open.joiners) joined()
+      const rows = open.parts.flat()
+      writeBufferEntry(bucket, rows).then(entry.resolve, entry.reject)
+      writeSummaryDelta(bucket, userId, rows).then(summary.resolve, summary.reject)
+    },
+  }
+  batches.set(userId, open)
+  waitUntil?.(Promise.allSettled([entry.promise, summary.promise]))
+  if (open.rows >= COALESCE_MAX_RECORDS) open.flush()
+  return open.writes
+}
+
+/** A joiner's view of `batch`: its writes, or its own if the batch is not flushed in time. */
+function joinBatch(
+  bucket: R2Bucket,
+  userId: string,
+  batch: PendingBatch,
+  part: StorageRecord[],
+  windowMs: number
+): CoalescedWrites {
+  const entry = deferred()
+  const summary = deferred()
+  const timer = setTimeout(() => {
+    if (batch.flushed) return
+    batch.parts.splice(batch.parts.indexOf(part), 1)
+    batch.rows -= part.length
+    writeBufferEntry(bucket, part).then(entry.resolve, entry.reject)
+    writeSummaryDelta(bucket, userId, part).then(summary.resolve, summary.reject)
+  }, windowMs + COALESCE_JOIN_GRACE_MS)
+  batch.joiners.push(() => {
+    clearTimeout(timer)
+    batch.writes.entry.then(entry.resolve, entry.reject)
+    batch.writes.summary.then(summary.resolve, summary.reject)
+  })
+  return { entry: entry.promise, summary: summary.promise }
+}
+
+// -- Chart JSON aggregation (hash-based output consistency) --
+
+/** Hourly buckets: bucket (YYYY-MM-DD-HH) → model → stats */
+type ChartBuckets = Record<string, Record<string, ModelBucketStats>>
+
+/** Inclusive bucket range; bounds are YYYY-MM-DD or YYYY-MM-DD-HH. */
+export interface ChartRange {
+  start?: string
+  end?: string
+}
+
+/**
+ * Stored resolutions, finest first, with their size in hours. Hourly buckets
+ * are the source of truth; every shard write also stores its daily and weekly
+ * rollups (weeks keyed by their Monday, holding only that month's days).
+ */
+export const CHART_LEVELS = { '1h': 1, '1d': 24, '1w': 168 } as const
+export type ChartLevel = keyof typeof CHART_LEVELS
+
+function chartShardKey(month: string): string {
+  return `${CHART_SHARD_PREFIX}${month}.json`
+}
+
+/** Next to the shard, so pruning a month's shard listing also finds its fragments. */
+function chartFragmentKey(month: string, level: ChartLevel): string {
+  return `${CHART_SHARD_PREFIX}${month}/${level}.json`
+}
+
+function emptyChartJson(): ChartJson {
+  return { version: 7, months: [], models: [], total_submissions: 0, total_contributors: 0, last_updated: new Date().toISOString() }
+}
+
+function emptyChartState(): ChartStateJson {
+  return { version: 1, prev_hashes: {}, known_users: [] }
+}
+
+/** Group hourly buckets by the month (YYYY-MM) they fall in. */
+function splitByMonth(data: ChartBuckets): Map<string, ChartBuckets> {
+  const months = new Map<string, ChartBuckets>()
+  for (const [bucketKey, models] of Object.entries(data)) {
+    const month = bucketKey.slice(0, 7)
+    if (!months.has(month)) months.set(month, {})
+    months.get(month)![bucketKey] = models
+  }
+  return months
+}
+
+/** Monday (YYYY-MM-DD, UTC) of the week a day or hourly bucket falls in. */
+function weekStart(key: string): string {
+  const d = new Date(`${key.slice(0, 10)}T00:00:00Z`)
+  d.setUTCDate(d.getUTCDate() - ((d.getUTCDay() + 6) % 7))
+  return d.toISOString().slice(0, 10)
+}
+
+/** Rollup key of an hourly bucket at `level`. */
+function levelKey(bucketKey: string, level: ChartLevel): string {
+  if (level === '1d') return bucketKey.slice(0, 10)
+  if (level === '1w') return weekStart(bucketKey)
+  return bucketKey
+}
+
+function addStats(a: ModelBucketStats, b: ModelBucketStats): ModelBucketStats {
+  return {
+    submissions: a.submissions + b.submissions,
+    prompts_tested: a.prompts_tested + b.prompts_tested,
+    unique_outputs: a.unique_outputs + b.unique_outputs,
+    drifted_prompts: a.drifted_prompts + b.drifted_prompts,
+  }
+}
+
+/** Model-wise sum of two buckets as a fresh map; inputs are left untouched. */
+function sumModels(
+  a: Record<string, ModelBucketStats>,
+  b: Record<string, ModelBucketStats>
+): Record<string, ModelBucketStats> {
+  const out = { ...a }
+  for (const [model, stats] of Object.entries(b)) {
+    out[model] = out[model] ? addStats(out[model], stats) : stats
+  }
+  return out
+}
+
+/** Sum hourly buckets into `level` buckets — every stat is additive, as in the client rollup. */
+function rollUp(hourly: ChartBuckets, level: ChartLevel): ChartBuckets {
+  if (level === '1h') return hourly
+  const out: ChartBuckets = {}
+  for (const [bucketKey, models] of Object.entries(hourly)) {
+    const key = levelKey(bucketKey, level)
+    out[key] = out[key] ? sumModels(out[key], models) : models
+  }
+  return out
+}
+
+/** Whether a `level` key lies in the range; coarser keys match when their period overlaps it. */
+function inRange(key: string, range: ChartRange, level: ChartLevel = '1h'): boolean {
+  if (range.start && key < levelKey(range.start, level)) return false
+  // A day-only end bound covers every hour of that day
+  const end = range.end && (level === '1h' && range.end.length === 10 ? `${range.end}-23` : range.end)
+  if (end && key > (level === '1h' ? end : end.slice(0, 10))) return false
+  return true
+}
+
+function monthsInRange(months: string[], range: ChartRange): string[] {
+  return months.filter(m =>
+    (!range.start || m >= range.start.slice(0, 7)) && (!range.end || m <= range.end.slice(0, 7))
+  )
+}
+
+/**
+ * Split a pre-v7 chart (all buckets inline, v≤5 writer state, v3/v4 daily keys)
+ * into the chart index, its state, and the bucket data still to be sharded.
+ * Only needed until the first writer rewrites it.
+ */
+function migrateLegacyChart(parsed: Record<string, unknown>): { chart: ChartJson; state: ChartStateJson; data: ChartBuckets } {
+  let data = (parsed.data ?? {}) as ChartBuckets
+  // v4 → v5: append -00 to daily keys (10-char YYYY-MM-DD)
+  if ((parsed.version as number) < 5) {
+    data = Object.fromEntries(
+      Object.entries(data).map(([key, val]) => [key.length === 10 ? `${key}-00` : key, val])
+    )
+  }
+  return {
+    chart: {
+      version: 7,
+      months: Array.from(splitByMonth(data).keys()).sort(),
+      models: (parsed.models as string[]) ?? [],
+      total_submissions: (parsed.total_submissions as number) || 0,
+      total_contributors: (parsed.total_contributors as number) || 0,
+      last_updated: (parsed.last_updated as string) || new Date().toISOString(),
+    },
+    state: {
+      version: 1,
+      prev_hashes: (parsed._prev_hashes as Record<string, string>) ?? {},
+      known_users: (parsed._known_users as string[]) ?? [],
+    },
+    data,
+  }
+}
+
+/** Parse the chart index; a legacy chart also yields its inline bucket data. */
+function parseChartJson(body: Uint8Array): { chart: ChartJson; legacyData?: ChartBuckets } {
+  const parsed = JSON.parse(decoder.decode(body))
+  if (parsed.version >= 7) return { chart: parsed as ChartJson }
+  const { chart, data } = migrateLegacyChart(parsed)
+  return { chart, legacyData: data }
+}
+
+/** Read the chart index (totals + shard months) straight from R2 (uncached). */
+export async function readChartJson(
+  bucket: R2Bucket,
+  budget?: SubrequestBudget
+): Promise<ChartJson> {
+  const { body } = await downloadFileWithEtag(bucket, CHART_KEY, budget)
+  if (!body) return emptyChartJson()
+  return parseChartJson(body).chart
+}
+
+/**
+ * What a writer holds between reading and writing the chart: the index, the
+ * writer state, and the month shards it has loaded. Every loaded shard is
+ * written back, so only months the writer touches are loaded.
+ */
+interface ChartWriteSet {
+  chart: ChartJson
+  state: ChartStateJson
+  shards: Map<string, ChartBuckets>
+}
+
+function emptyChartWriteSet(): ChartWriteSet {
+  return { chart: emptyChartJson(), state: emptyChartState(), shards: new Map() }
+}
+
+/**
+ * Read the chart index together with its writer state; the result may be
+ * mutated. A legacy chart is split here into index, state and every month
+ * shard, which the caller's writeChartJson persists — a one-time rewrite.
+ */
+async function readChartForUpdate(
+  bucket: R2Bucket,
+  budget?: SubrequestBudget
+): Promise<ChartWriteSet> {
+  const [chartFile, stateFile] = await Promise.all([
+    downloadFileWithEtag(bucket, CHART_KEY, budget),
+    downloadFileWithEtag(bucket, CHART_STATE_KEY, budget),
+  ])
+
+  const set = emptyChartWriteSet()
+  if (chartFile.body) {
+    const parsed = JSON.parse(decoder.decode(chartFile.body))
+    if (parsed.version >= 7) {
+      set.chart = parsed as ChartJson
+    } else {
+      const legacy = migrateLegacyChart(parsed)
+      set.chart = legacy.chart
+      set.state = legacy.state
+      set.shards = splitByMonth(legacy.data)
+    }
+  }
+  if (stateFile.body) set.state = JSON.parse(decoder.decode(stateFile.body)) as ChartStateJson
+  return set
+}
+
+/** Load the given month shards into `set`; months without a shard start empty. */
+async function loadChartShards(
+  bucket: R2Bucket,
+  set: ChartWriteSet,
+  months: Iterable<string>,
+  budget?: SubrequestBudget
+): Promise<void> {
+  const missing = Array.from(new Set(months)).filter(m => !set.shards.has(m))
+  const stored = missing.filter(m => set.chart.months.includes(m))
+  const bodies = await downloadMany(bucket, stored.map(chartShardKey), budget)
+  stored.forEach((month, i) => {
+    set.shards.set(month, (JSON.parse(decoder.decode(bodies[i])) as ChartShardJson).data)
+  })
+  for (const month of missing) if (!set.shards.has(month)) set.shards.set(month, {})
+}
+
+/** The bucket map for `bucketKey`, creating it in its (already loaded) month shard. */
+function chartBucket(set: ChartWriteSet, bucketKey: string): Record<string, ModelBucketStats> {
+  const shard = set.shards.get(bucketKey.slice(0, 7))!
+  return (shard[bucketKey] ??= {})
+}
+
+/**
+ * How many leading `keys` (paths with YYYY-MM-DD right after `prefix`) can be
+ * read while still affording a shard read + write for each month they touch,
+ * on top of `reserve`. A key dated the 1st also counts the previous month,
+ * since compaction just after midnight archives the prior day's rows —
+ * unless `monthsOf` supplies each key's exact months.
+ */
+function fitMonthBatch(
+  keys: string[],
+  prefix: string,
+  budget: SubrequestBudget,
+  reserve: number,
+  loaded: Map<string, ChartBuckets>,
+  monthsOf?: (key: string) => string[]
+): number {
+  const months = new Set(loaded.keys())
+  let cost = reserve
+  let n = 0
+  for (const key of keys) {
+    const day = key.slice(prefix.length, prefix.length + 10)
+    const touched = monthsOf ? monthsOf(key) : [day.slice(0, 7)]
+    if (!monthsOf && day.endsWith('-01')) {
+      const d = new Date(`${day}T00:00:00Z`)
+      d.setUTCDate(0)
+      touched.push(d.toISOString().slice(0, 7))
+    }
+    const newMonths = touched.filter(m => !months.has(m))
+    const extra = 1 + newMonths.length * SHARD_IO
+    if (cost + extra > budget.remaining()) break
+    cost += extra
+    for (const m of newMonths) months.add(m)
+    n++
+  }
+  return n
+}
+
+/** Every per-model series field, in wire order. */
+export const CHART_SERIES_FIELDS: readonly ChartSeriesField[] = [
+  'submissions', 'prompts', 'unique_outputs', 'drifted', 'consistency',
+]
+
+/** Wide-format key suffix per field: `model`, `model_prompts`, ... */
+const WIDE_SUFFIX: Record<ChartSeriesField, string> = {
+  submissions: '',
+  prompts: '_prompts',
+  unique_outputs: '_unique_outputs',
+  drifted: '_drifted',
+  consistency: '_consistency',
+}
+
+function seriesValue(stats: ModelBucketStats, field: ChartSeriesField): number {
+  switch (field) {
+    case 'submissions': return stats.submissions
+    case 'prompts': return stats.prompts_tested
+    case 'unique_outputs': return stats.unique_outputs
+    case 'drifted': return stats.drifted_prompts
+    case 'consistency':
+      return stats.prompts_tested > 0
+        ? (stats.prompts_tested - stats.drifted_prompts) / stats.prompts_tested
+        : 1.0
+  }
+}
+
+/** Flatten buckets into the /api/data/chart body: sorted points, derived consistency. */
+export function buildChartResponse(
+  chart: ChartJson,
+  data: ChartBuckets,
+  level: ChartLevel = '1h',
+  fields: readonly ChartSeriesField[] = CHART_SERIES_FIELDS
+): ChartResponseJson {
+  const points = Object.entries(data)
+    .sort(([a], [b]) => a.localeCompare(b))
+    .map(([date, models]) => {
+      const point: ChartPoint = { date }
+      for (const [model, stats] of Object.entries(models)) {
+        for (const field of fields) point[`${model}${WIDE_SUFFIX[field]}`] = seriesValue(stats, field)
+      }
+      return point
+    })
+
+  return {
+    granularity: level,
+    data: points,
+    models: chart.models,
+    total_submissions: chart.total_submissions,
+    total_contributors: chart.total_contributors,
+    last_updated: chart.last_updated,
+  }
+}
+
+/**
+ * Columnar variant of buildChartResponse: one array per model and field,
+ * aligned with `dates`, so key names are sent once instead of per bucket.
+ * A model without data in a bucket gets null there.
+ */
+export function buildChartColumns(
+  chart: ChartJson,
+  data: ChartBuckets,
+  level: ChartLevel = '1h',
+  fields: readonly ChartSeriesField[] = CHART_SERIES_FIELDS
+): ChartColumnarResponseJson {
+  const dates = Object.keys(data).sort()
+  const series: ChartColumnarResponseJson['series'] = {}
+
+  dates.forEach((date, i) => {
+    for (const [model, stats] of Object.entries(data[date])) {
+      if (!series[model]) {
+        series[model] = {}
+        for (const field of fields) series[model][field] = new Array(dates.length).fill(null)
+      }
+      for (const field of fields) series[model][field]![i] = seriesValue(stats, field)
+    }
+  })
+
+  return {
+    granularity: level,
+    dates,
+    series,
+    models: chart.models,
+    total_submissions: chart.total_submissions,
+    total_contributors: chart.total_contributors,
+    last_updated: chart.last_updated,
+  }
+}
+
+/**
+ * A month of `level` buckets as the fragment the chart route concatenates:
+ * the columns buildChartColumns would send, each already serialized.
+ */
+function buildChartFragment(month: string, level: ChartLevel, data: ChartBuckets): ChartFragmentJson {
+  const { dates, series } = buildChartColumns(emptyChartJson(), data, level)
+  const serialized: ChartFragmentJson['series'] = {}
+  for (const [model, fields] of Object.entries(series)) {
+    serialized[model] = {} as Record<ChartSeriesField, string>
+    for (const field of CHART_SERIES_FIELDS) serialized[model][field] = JSON.stringify(fields[field]!).slice(1, -1)
+  }
+  return { version: 1, month, granularity: level, dates, series: serialized }
+}
+
+/**
+ * Write the loaded month shards with a fragment per level, then the writer
+ * state and the chart index. Shards go first so a reader never sees a month
+ * in the index before its shard.
+ */
+async function writeChartJson(
+  bucket: R2Bucket,
+  set: ChartWriteSet,
+  budget?: SubrequestBudget
+): Promise<void> {
+  const { chart, state, shards } = set
+  await uploadMany(bucket, Array.from(shards).flatMap(([month, data]) => {
+    const levels = { '1h': data, '1d': rollUp(data, '1d'), '1w': rollUp(data, '1w') }
+    const shard: ChartShardJson = { version: 2, month, data, daily: levels['1d'], weekly: levels['1w'] }
+    return [
+      { key: chartShardKey(month), body: encoder.encode(JSON.stringify(shard)) },
+      ...(Object.keys(levels) as ChartLevel[]).map((level) => ({
+        key: chartFragmentKey(month, level),
+        body: encoder.encode(JSON.stringify(buildChartFragment(month, level, levels[level]))),
+      })),
+    ]
+  }), budget)
+
+  chart.months = Array.from(new Set([...chart.months, ...shards.keys()])).sort()
+  await uploadMany(bucket, [
+    { key: CHART_STATE_KEY, body: encoder.encode(JSON.stringify(state)) },
+    { key: CHART_KEY, body: encoder.encode(JSON.stringify(chart)) },
+  ], budget)
+  invalidateChartCache()
+}
+
+/** Delete month shards and fragments the index no longer lists (e.g. after a full rebuild). */
+async function pruneChartShards(
+  bucket: R2Bucket,
+  chart: ChartJson,
+  budget?: SubrequestBudget
+): Promise<void> {
+  const keep = new Set(chart.months.flatMap(month => [
+    chartShardKey(month),
+    ...(Object.keys(CHART_LEVELS) as ChartLevel[]).map(level => chartFragmentKey(month, level)),
+  ]))
+  const stale = (await listFiles(bucket, CHART_SHARD_PREFIX, Infinity, budget)).filter(k => !keep.has(k))
+  await deleteFiles(bucket, stale, budget)
+}
+
+// -- Isolate-level chart cache (read paths) --
+
+/** How long a cached chart index is served before it is revalidated against R2. */
+const CHART_CACHE_TTL_MS = 15_000
+
+let chartCache: { chart: ChartJson; etag: string; checkedAt: number; legacyData?: ChartBuckets } | null = null
+
+/** Month shards by level, tagged with the index etag they were last confirmed against. */
+const shardCache = new Map<string, { levels: Record<ChartLevel, ChartBuckets>; etag: string; indexEtag: string }>()
+
+/** Fragments by key, tagged like shards; etag is null for one derived from its shard. */
+const fragmentCache = new Map<string, { fragment: ChartFragmentJson; etag: string | null; indexEtag: string }>()
+
+/** Drop the cached chart, shards and fragments; called by every writer in this isolate. */
+export function invalidateChartCache(): void {
+  chartCache = null
+  shardCache.clear()
+  fragmentCache.clear()
+  stateCache = null
+}
+
+async function loadChartIndexCached(bucket: R2Bucket): Promise<typeof chartCache> {
+  const now = Date.now()
+  if (chartCache && now - chartCache.checkedAt < CHART_CACHE_TTL_MS) return chartCache
+
+  const { body, etag, notModified } = await downloadFileIfChanged(bucket, CHART_KEY, chartCache?.etag ?? null)
+  if (notModified && chartCache) {
+    chartCache.checkedAt = now
+    return chartCache
+  }
+  if (!body || !etag) {
+    chartCache = null
+    return null
   }
 
-  return v3
+  chartCache = { ...parseChartJson(body), etag, checkedAt: now }
+  return chartCache
+}
+
+/**
+ * Read the chart index through the isolate cache for hot read paths.
+ * Within CHART_CACHE_TTL_MS no R2 call is made; after that a conditional GET
+ * revalidates by etag, so the body is only transferred and parsed when the
+ * chart actually changed. The result is shared — callers must not mutate it.
+ */
+export async function readChartJsonCached(bucket: R2Bucket): Promise<ChartJson> {
+  return (await loadChartIndexCached(bucket))?.chart ?? emptyChartJson()
 }
 
-export async function updateUserSummary(
+/** Etag of the current chart index (null before the first write); changes on every write. */
+export async function readChartEtagCached(bucket: R2Bucket): Promise<string | null> {
+  return (await loadChartIndexCached(bucket))?.etag ?? null
+}
+
+/**
+ * A shard is reused without any R2 call while the index etag it was confirmed
+ * against is current; once the index moves, a conditional GET transfers the
+ * shard only if that month actually changed.
+ */
+async function readChartShardCached(
   bucket: R2Bucket,
-  userId: string,
-  records: StorageRecord[]
-): Promise<UserSummaryJson> {
-  if (records.length === 0) {
-    return { version: 3, submissions_by_date: {}, model_submissions: {}, total_submissions: 0 }
+  month: string,
+  indexEtag: string,
+  level: ChartLevel
+): Promise<ChartBuckets> {
+  const cached = shardCache.get(month)
+  if (cached && cached.indexEtag === indexEtag) return cached.levels[level]
+
+  const { body, etag, notModified } = await downloadFileIfChanged(bucket, chartShardKey(month), cached?.etag ?? null)
+  if (notModified && cached) {
+    cached.indexEtag = indexEtag
+    return cached.levels[level]
+  }
+  if (!body || !etag) {
+    shardCache.delete(month)
+    return {}
   }
 
-  for (let attempt = 0; attempt < MAX_RETRIES; attempt++) {
-    const key = userSummaryKey(userId)
-    const { body, etag } = await downloadFileWithEtag(bucket, key)
+  // v1 shards predate stored rollups; derive them once per fetch
+  const shard = JSON.parse(decoder.decode(body)) as ChartShardJson
+  const levels = {
+    '1h': shard.data,
+    '1d': shard.daily ?? rollUp(shard.data, '1d'),
+    '1w': shard.weekly ?? rollUp(shard.data, '1w'),
+  }
+  shardCache.set(month, { levels, etag, indexEtag })
+  return levels[level]
+}
 
-    let summary: UserSummaryJson
-    if (body) {
-      const raw = JSON.parse(decoder.decode(body))
-      summary = isLegacySummary(raw) ? migrateSummary(raw) : raw as UserSummaryJson
-    } else {
-      summary = { version: 3, submissions_by_date: {}, model_submissions: {}, total_submissions: 0 }
+/**
+ * Read the chart index plus the `level` buckets inside `range`, fetching only
+ * the month shards that overlap it. Results are shared — callers must not mutate them.
+ */
+export async function readChartRange(
+  bucket: R2Bucket,
+  range: ChartRange = {},
+  level: ChartLevel = '1h'
+): Promise<{ chart: ChartJson; data: ChartBuckets }> {
+  const index = await loadChartIndexCached(bucket)
+  if (!index) return { chart: emptyChartJson(), data: {} }
+
+  // A week that starts in the previous month has its first days in that month's shard
+  const shardRange = level === '1w' && range.start ? { ...range, start: weekStart(range.start) } : range
+  const parts = index.legacyData
+    ? [rollUp(index.legacyData, level)]
+    : await mapWithConcurrency(monthsInRange(index.chart.months, shardRange), (month) =>
+        readChartShardCached(bucket, month, index.etag, level)
+      )
+
+  const data: ChartBuckets = {}
+  for (const part of parts) {
+    for (const [key, models] of Object.entries(part)) {
+      if (!inRange(key, range, level)) continue
+      // Weekly partials from adjacent month shards share a key
+      data[key] = data[key] ? sumModels(data[key], models) : models
     }
+  }
+  return { chart: index.chart, data }
+}
 
-    for (const r of records) {
-      const dateStr = `${r.year}-${String(r.month).padStart(2, '0')}-${String(r.day).padStart(2, '0')}`
+/**
+ * A month's fragment at `level`, cached like shards. A month whose shard was
+ * written before fragments existed gets one derived from the shard.
+ */
+async function readChartFragmentCached(
+  bucket: R2Bucket,
+  month: string,
+  indexEtag: string,
+  level: ChartLevel
+): Promise<ChartFragmentJson> {
+  const key = chartFragmentKey(month, level)
+  const cached = fragmentCache.get(key)
+  if (cached && cached.indexEtag === indexEtag) return cached.fragment
+
+  const { body, etag, notModified } = await downloadFileIfChanged(bucket, key, cached?.etag ?? null)
+  if (notModified && cached) {
+    cached.indexEtag = indexEtag
+    return cached.fragment
+  }
+  const fragment = body
+    ? JSON.parse(decoder.decode(body)) as ChartFragmentJson
+    : buildChartFragment(month, level, await readChartShardCached(bucket, month, indexEtag, level))
+  fragmentCache.set(key, { fragment, etag: body ? etag : null, indexEtag })
+  return fragment
+}
 
-      if (!summary.submissions_by_date[dateStr]) summary.submissions_by_date[dateStr] = {}
-      summary.submissions_by_date[dateStr][r.model_id] =
-        (summary.submissions_by_date[dateStr][r.model_id] || 0) + 1
+const NULL_TOKEN = 'null'
+const SUMMED_SERIES: readonly ChartSeriesField[] = ['submissions', 'prompts', 'unique_outputs', 'drifted']
 
-      summary.model_submissions[r.model_id] =
-        (summary.model_submissions[r.model_id] || 0) + 1
+/** A series' value tokens; a model missing from the fragment has none there. */
+function fragmentTokens(fragment: ChartFragmentJson, model: string, field: ChartSeriesField): string[] {
+  const values = fragment.series[model]?.[field]
+  return values === undefined ? new Array(fragment.dates.length).fill(NULL_TOKEN) : values.split(',')
+}
 
-      summary.total_submissions++
-    }
+/** Rebuild a fragment from per-model token arrays, dropping models left without data. */
+function fragmentOf(
+  base: ChartFragmentJson,
+  dates: string[],
+  tokens: Map<string, Record<ChartSeriesField, string[]>>
+): ChartFragmentJson {
+  const series: ChartFragmentJson['series'] = {}
+  for (const [model, fields] of tokens) {
+    if (fields.submissions.every(t => t === NULL_TOKEN)) continue
+    series[model] = {} as Record<ChartSeriesField, string>
+    for (const field of CHART_SERIES_FIELDS) series[model][field] = fields[field].join(',')
+  }
+  return { ...base, dates, series }
+}
 
-    const buf = encoder.encode(JSON.stringify(summary))
+function splitFragment(fragment: ChartFragmentJson): Map<string, Record<ChartSeriesField, string[]>> {
+  const tokens = new Map<string, Record<ChartSeriesField, string[]>>()
+  for (const model of Object.keys(fragment.series)) {
+    const fields = {} as Record<ChartSeriesField, string[]>
+    for (const field of CHART_SERIES_FIELDS) fields[field] = fragmentTokens(fragment, model, field)
+    tokens.set(model, fields)
+  }
+  return tokens
+}
 
-    try {
-      if (etag) {
-        await uploadFileConditional(bucket, key, buf, etag)
-      } else {
-        await uploadFile(bucket, key, buf)
+/** The part of a fragment inside `range`; only a month cut by a bound is split. */
+function cutFragment(fragment: ChartFragmentJson, range: ChartRange, level: ChartLevel): ChartFragmentJson {
+  const { dates } = fragment
+  let lo = 0
+  while (lo < dates.length && !inRange(dates[lo], range, level)) lo++
+  let hi = lo
+  while (hi < dates.length && inRange(dates[hi], range, level)) hi++
+  if (lo === 0 && hi === dates.length) return fragment
+
+  const tokens = splitFragment(fragment)
+  for (const fields of tokens.values()) {
+    for (const field of CHART_SERIES_FIELDS) fields[field] = fields[field].slice(lo, hi)
+  }
+  return fragmentOf(fragment, dates.slice(lo, hi), tokens)
+}
+
+/**
+ * Fold the first point of `next` into the last point of `prev` — a week whose
+ * days fall in two month shards — summing like rollUp and re-deriving consistency.
+ */
+function joinBoundaryWeek(prev: ChartFragmentJson, next: ChartFragmentJson): [ChartFragmentJson, ChartFragmentJson] {
+  const prevTokens = splitFragment(prev)
+  const nextTokens = splitFragment(next)
+  const last = prev.dates.length - 1
+  for (const model of new Set([...prevTokens.keys(), ...nextTokens.keys()])) {
+    const a = prevTokens.get(model) ?? Object.fromEntries(
+      CHART_SERIES_FIELDS.map(f => [f, fragmentTokens(prev, model, f)])) as Record<ChartSeriesField, string[]>
+    const b = nextTokens.get(model)
+    if (b) {
+      for (const field of SUMMED_SERIES) {
+        const [x, y] = [a[field][last], b[field][0]]
+        a[field][last] = x === NULL_TOKEN ? y : y === NULL_TOKEN ? x : String(Number(x) + Number(y))
       }
-      return summary
-    } catch (err: unknown) {
-      const status = (err as { status?: number }).status
-      if (status === 412 && attempt < MAX_RETRIES - 1) continue
-      throw err
+      const prompts = a.prompts[last]
+      a.consistency[last] = prompts === NULL_TOKEN ? NULL_TOKEN : String(seriesValue({
+        submissions: 0, unique_outputs: 0, prompts_tested: Number(prompts), drifted_prompts: Number(a.drifted[last]),
+      }, 'consistency'))
     }
+    prevTokens.set(model, a)
+    if (b) for (const field of CHART_SERIES_FIELDS) b[field] = b[field].slice(1)
   }
-
-  throw new Error('updateUserSummary: exhausted retries')
+  return [fragmentOf(prev, prev.dates, prevTokens), fragmentOf(next, next.dates.slice(1), nextTokens)]
 }
 
-export async function readUserSummary(
+/**
+ * The /api/data/chart body for `range` at `level`, concatenated from the
+ * month fragments that overlap it: no shard is parsed and no point is built
+ * from stats. Only a month cut by a range bound, or a week spanning two
+ * months, has its series split and re-joined.
+ */
+export async function readChartResponseBody(
   bucket: R2Bucket,
-  userId: string
-): Promise<UserSummaryJson | null> {
-  const { body } = await downloadFileWithEtag(bucket, userSummaryKey(userId))
-  if (!body) return null
-  const raw = JSON.parse(decoder.decode(body))
-  return isLegacySummary(raw) ? migrateSummary(raw) : raw as UserSummaryJson
-}
+  range: ChartRange,
+  level: ChartLevel,
+  format: 'wide' | 'columnar' = 'wide',
+  fields: readonly ChartSeriesField[] = CHART_SERIES_FIELDS
+): Promise<string> {
+  const index = await loadChartIndexCached(bucket)
+  const chart = index?.chart ?? emptyChartJson()
+
+  const shardRange = level === '1w' && range.start ? { ...range, start: weekStart(range.start) } : range
+  const fragments = !index ? []
+    : index.legacyData
+      ? Array.from(splitByMonth(index.legacyData)).sort(([a], [b]) => a.localeCompare(b))
+          .map(([month, data]) => buildChartFragment(month, level, rollUp(data, level)))
+      : await mapWithConcurrency(monthsInRange(index.chart.months, shardRange), (month) =>
+          readChartFragmentCached(bucket, month, index.etag, level)
+        )
+
+  const parts: ChartFragmentJson[] = []
+  for (const fragment of fragments) {
+    let part = cutFragment(fragment, range, level)
+    if (part.dates.length === 0) continue
+    const prev = parts[parts.length - 1]
+    if (prev && prev.dates[prev.dates.length - 1] === part.dates[0]) {
+      ;[parts[parts.length - 1], part] = joinBoundaryWeek(prev, part)
+      if (part.dates.length === 0) continue
+    }
+    parts.push(part)
+  }
 
-// -- Chart JSON aggregation (hash-based output consistency) --
+  const models = Array.from(new Set(parts.flatMap(p => Object.keys(p.series))))
+  const dates = parts.flatMap(p => p.dates)
+  const tail = JSON.stringify({
+    models: chart.models,
+    total_submissions: chart.total_submissions,
+    total_contributors: chart.total_contributors,
+    last_updated: chart.last_updated,
+  }).slice(1)
+
+  if (format === 'columnar') {
+    const series = models.map(model => JSON.stringify(model) + ':{' + fields.map(field =>
+      JSON.stringify(field) + ':[' + parts.map(p =>
+        p.series[model]?.[field] ?? new Array(p.dates.length).fill(NULL_TOKEN).join(',')).join(',') + ']'
+    ).join(',') + '}')
+    return `{"granularity":${JSON.stringify(level)},"dates":${JSON.stringify(dates)},"series":{${series.join(',')}},${tail}`
+  }
 
-export async function readChartJson(bucket: R2Bucket): Promise<ChartJson> {
-  const { body } = await downloadFileWithEtag(bucket, CHART_KEY)
-  if (!body) return { version: 5, data: {}, models: [], total_submissions: 0, total_contributors: 0, last_updated: new Date().toISOString(), _prev_hashes: {}, _known_users: [] }
-  const parsed = JSON.parse(decoder.decode(body))
-  // Migrate v3/v4 fields
-  if (!parsed._prev_hashes) parsed._prev_hashes = {}
-  if (!parsed._known_users) parsed._known_users = []
-  if (!parsed.last_updated) parsed.last_updated = new Date().toISOString()
-  // Migrate v4 → v5: append -00 to daily keys (10-char YYYY-MM-DD)
-  if (parsed.version < 5) {
-    const migrated: Record<string, Record<string, ModelBucketStats>> = {}
-    for (const [key, val] of Object.entries(parsed.data)) {
-      const newKey = key.length === 10 ? `${key}-00` : key
-      migrated[newKey] = val as Record<string, ModelBucketStats>
+  const columns = models.map(model => ({
+    keys: fields.map(field => JSON.stringify(`${model}${WIDE_SUFFIX[field]}`)),
+    values: fields.map(field => parts.flatMap(p => fragmentTokens(p, model, field))),
+  }))
+  const points = dates.map((date, i) => {
+    let point = `{"date":${JSON.stringify(date)}`
+    for (const { keys, values } of columns) {
+      if (values[0][i] === NULL_TOKEN) continue
+      keys.forEach((key, f) => { point += `,${key}:${values[f][i]}` })
     }
-    parsed.data = migrated
-  }
-  parsed.version = 5
-  return parsed as ChartJson
+    return point + '}'
+  })
+  return `{"granularity":${JSON.stringify(level)},"data":[${points.join(',')}],${tail}`
 }
 
-// -- Delta operations --
-
 /**
- * Write a delta file for incremental chart aggregation.
- * O(1) R2 PUT, no reads — safe for concurrent submits.
+ * The level to serve: the coarsest stored level no coarser than the requested
+ * granularity, made coarser still while the range would exceed `maxPoints`.
  */
-export async function writeDelta(
-  bucket: R2Bucket,
-  records: StorageRecord[]
-): Promise<void> {
-  if (records.length === 0) return
+export function pickChartLevel(
+  chart: ChartJson,
+  range: ChartRange,
+  opts: { granularityHours?: number; maxPoints?: number } = {}
+): ChartLevel {
+  const levels = Object.keys(CHART_LEVELS) as ChartLevel[]
+  let i = 0
+  while (i + 1 < levels.length && CHART_LEVELS[levels[i + 1]] <= (opts.granularityHours ?? 1)) i++
+  if (!opts.maxPoints) return levels[i]
+
+  const first = range.start ?? (chart.months.length > 0 ? `${chart.months[0]}-01` : undefined)
+  if (!first) return levels[i]
+  const last = range.end ?? new Date().toISOString().slice(0, 13).replace('T', '-')
+  const hourOf = (bound: string, fallback: string) =>
+    Date.parse(`${bound.slice(0, 10)}T${bound.length > 10 ? bound.slice(11, 13) : fallback}:00:00Z`)
+  const spanHours = (hourOf(last, '23') - hourOf(first, '00')) / 3_600_000 + 1
+
+  while (i + 1 < levels.length && Math.ceil(spanHours / CHART_LEVELS[levels[i]]) > opts.maxPoints) i++
+  return levels[i]
+}
 
-  const now = new Date()
-  const day = now.toISOString().split('T')[0]
-  const hourlyBucket = `${day}-${String(now.getUTCHours()).padStart(2, '0')}`
-  const ts = now.getTime()
-  const rand = Math.random().toString(36).slice(2, 8)
-  const key = `${DELTAS_PREFIX}${day}/${ts}_${rand}.json`
+// -- Known output hashes (hash-first submission) --
 
-  const delta: ChartDelta = {
-    ts,
-    bucket: hourlyBucket,
-    records: records.map((r): DeltaRecord => ({
-      model_id: r.model_id,
-      prompt_id: r.prompt_id,
-      output_hash: r.output_hash,
-      user_id: r.user_id,
-    })),
+let stateCache: { state: ChartStateJson; etag: string; checkedAt: number } | null = null
+
+/** Writer state through an isolate cache, revalidated like the chart index. Shared — do not mutate. */
+async function readChartStateCached(bucket: R2Bucket): Promise<ChartStateJson | null> {
+  const now = Date.now()
+  if (stateCache && now - stateCache.checkedAt < CHART_CACHE_TTL_MS) return stateCache.state
+
+  const { body, etag, notModified } = await downloadFileIfChanged(bucket, CHART_STATE_KEY, stateCache?.etag ?? null)
+  if (notModified && stateCache) {
+    stateCache.checkedAt = now
+    return stateCache.state
+  }
+  if (!body || !etag) {
+    stateCache = null
+    return null
   }
 
-  await uploadFile(bucket, key, encoder.encode(JSON.stringify(delta)))
+  stateCache = { state: JSON.parse(decoder.decode(body)) as ChartStateJson, etag, checkedAt: now }
+  return stateCache.state
 }
 
 /**
- * Merge delta files into existing chart_data.json.
- * O(deltas) R2 ops — does NOT read archives.
+ * For each reference, whether the server holds its output text, so the record
+ * may be submitted by reference: its output_hash is the latest merged for its
+ * model|prompt pair and `_blobs/<hex>` exists. A row that kept its text inline
+ * (its blob did not fit a compaction) does not count — erasing that row's user
+ * would leave the references unresolvable. The blob check is one HEAD per
+ * distinct candidate hash, as many as `budget` allows after `reserve`; the
+ * rest answer false and are sent with their text.
  */
-// Workers free tier: 50 subrequests per invocation.
-// Precise per-phase accounting (no safety margin — every call is tracked):
-//   ALWAYS: 2 lists + 1 legacy check = 3
-//   ENTRY phase: archive read + archive write + batch delete = 3
-//   DELTA phase: chart read + chart write + batch delete = 3
-//   VARIABLE: 1 get per entry file + 1 get per delta file
-const SUBREQUEST_LIMIT = 50
-const MAX_DELTAS_PER_RUN = 40 // standalone cap (used by mergeDeltas when called independently)
-
-export async function mergeDeltas(
+export async function knownOutputHashes(
   bucket: R2Bucket,
-  maxDeltas?: number,
-  prelistedKeys?: string[]
-): Promise<{ merged: number }> {
-  const cap = maxDeltas ?? MAX_DELTAS_PER_RUN
-
-  // 1. Read current chart
-  const chart = await readChartJson(bucket)
+  refs: readonly OutputRef[],
+  budget?: SubrequestBudget,
+  reserve: number = 0
+): Promise<boolean[]> {
+  if (refs.length === 0) return []
+  const state = await readChartStateCached(bucket)
+  const latest = refs.map(r => state?.prev_hashes[`${r.model_id}|${r.prompt_id}`] === r.output_hash)
+  const candidates = Array.from(new Set(refs.filter((_, i) => latest[i]).map(r => r.output_hash)))
+  const checked = budget ? candidates.slice(0, budget.fit(candidates.length, 1, reserve)) : candidates
+  const exists = await mapWithConcurrency(checked, (hash) => fileExists(bucket, blobKey(hash)!, budget))
+  const stored = new Set(checked.filter((_, i) => exists[i]))
+  return refs.map((r, i) => latest[i] && stored.has(r.output_hash))
+}
 
-  // 2. List delta files (skip if caller already listed them)
-  const allDeltaKeys = prelistedKeys ?? await listFiles(bucket, DELTAS_PREFIX)
-  if (allDeltaKeys.length === 0) return { merged: 0 }
-  const deltaKeys = allDeltaKeys.slice(0, cap)
+// -- Delta operations --
 
-  // 3. Read and parse deltas (remaining picked up on next run)
-  const deltas: ChartDelta[] = []
-  for (const key of deltaKeys) {
-    const buf = await downloadFile(bucket, key)
-    deltas.push(JSON.parse(decoder.decode(buf)) as ChartDelta)
-  }
+// Calls each job still has to make after its variable reads. Budgets are
+// charged per real R2 call (see SubrequestBudget), so these are the only
+// numbers to touch when a job gains or loses a fixed call.
+const CHART_READS = 2  // chart index + writer state
+const CHART_WRITES = 2  // chart index + writer state
+const SHARD_WRITES = 1 + 3  // per written month: shard + one fragment per level
+const SHARD_IO = 1 + SHARD_WRITES  // per touched month: shard read + writes
+const DELTA_MERGE_WRITES = CHART_WRITES + 1  // + batch delete
+const ENTRY_ARCHIVE_WRITES = 3  // segment + sidecar write + batch delete
+const COMPACT_JOURNAL_WRITES = 2  // batch journal write + delete
+const COMPACT_BATCH_KEY = '_maintenance/compact_batch.json'
+const MERGE_MIN = CHART_READS + SHARD_IO + DELTA_MERGE_WRITES + 1  // one delta through mergeDeltas
+const REBUILD_WRITES = CHART_WRITES + 3  // + cursor write/delete + final shard list/prune
+
+/** A delta's hourly bucket; v4 delta files carried only a day. */
+function deltaBucketKey(delta: ChartDelta): string {
+  return delta.bucket || (delta as unknown as { day: string }).day + '-00'
+}
 
-  // 4. Sort chronologically
+/**
+ * Merge chart deltas into the chart: `inline` ones already in hand (ingest
+ * entry headers read by compaction) and delta files under _deltas/.
+ * O(deltas) R2 ops — does NOT read archives, and only the month shards the
+ * deltas fall in are read and rewritten. Every inline delta is merged (the
+ * caller sized its batch for their months); of the files, as many as the
+ * budget allows are read and the rest are picked up on the next run.
+ * Inline deltas of a compaction `batch` the writer state already records as
+ * merged are skipped, so a compaction retried after its chart write does
+ * not count them twice.
+ */
+export async function mergeDeltas(
+  bucket: R2Bucket,
+  budget: SubrequestBudget = new SubrequestBudget(),
+  prelistedKeys?: string[],
+  inline: ChartDelta[] = [],
+  batch?: string
+): Promise<{ merged: number; deltasRemaining: number }> {
+  // 1. List delta files (skip if caller already listed them)
+  const allDeltaKeys = prelistedKeys ?? await listFiles(bucket, DELTAS_PREFIX, 1000, budget)
+  if (allDeltaKeys.length === 0 && inline.length === 0) return { merged: 0, deltasRemaining: 0 }
+
+  // 2. Read current chart index and writer state, and the shards inline deltas touch
+  const set = await readChartForUpdate(bucket, budget)
+  const { chart, state } = set
+  if (batch !== undefined && state.merged_batch === batch) inline = []
+  await loadChartShards(bucket, set, inline.map(d => deltaBucketKey(d).slice(0, 7)), budget)
+
+  // Shards already loaded (inline months, one-time legacy split) only cost their writes
+  const reserve = DELTA_MERGE_WRITES + set.shards.size * SHARD_WRITES
+  const deltaKeys = allDeltaKeys.slice(0, fitMonthBatch(allDeltaKeys, DELTAS_PREFIX, budget, reserve, set.shards))
+  if (deltaKeys.length === 0 && inline.length === 0) return { merged: 0, deltasRemaining: allDeltaKeys.length }
+
+  // 3. Read and parse delta files (remaining picked up on next run)
+  const deltas: ChartDelta[] = [
+    ...inline,
+    ...(await downloadMany(bucket, deltaKeys, budget)).map((buf) => JSON.parse(decoder.decode(buf)) as ChartDelta),
+  ]
+
+  // 4. Sort chronologically; support both v5 (bucket) and v4 legacy (day) delta files
   deltas.sort((a, b) => a.ts - b.ts)
+  const bucketKeys = deltas.map(deltaBucketKey)
 
-  // 5. Merge into chart
+  // 5. Load the month shards the deltas touch, then merge
+  await loadChartShards(bucket, set, bucketKeys.map((k) => k.slice(0, 7)), budget)
   const modelSet = new Set(chart.models)
-  const knownUsers = new Set(chart._known_users)
+  const knownUsers = new Set(state.known_users)
 
-  for (const delta of deltas) {
-    // Support both v5 (bucket) and v4 legacy (day) delta files
-    const bucketKey = (delta as ChartDelta).bucket || (delta as unknown as { day: string }).day + '-00'
-    if (!chart.data[bucketKey]) chart.data[bucketKey] = {}
+  for (const [i, delta] of deltas.entries()) {
+    const buckets = chartBucket(set, bucketKeys[i])
 
     // Group delta records by model
     const byModel = new Map<string, DeltaRecord[]>()
@@ -433,7 +2058,7 @@ export async function mergeDeltas(
     }
 
     for (const [model, records] of byModel) {
-      const existing: ModelBucketStats = chart.data[bucketKey][model] || {
+      const existing: ModelBucketStats = buckets[model] || {
         submissions: 0,
         prompts_tested: 0,
         unique_outputs: 0,
@@ -446,12 +2071,12 @@ export async function mergeDeltas(
 
       for (const r of records) {
         const prevKey = `${model}|${r.prompt_id}`
-        const prevHash = chart._prev_hashes[prevKey]
+        const prevHash = state.prev_hashes[prevKey]
 
         if (prevHash !== undefined && prevHash !== r.output_hash) {
           newDrifted++
         }
-        chart._prev_hashes[prevKey] = r.output_hash
+        state.prev_hashes[prevKey] = r.output_hash
 
         if (!promptHashes.has(r.prompt_id)) promptHashes.set(r.prompt_id, new Set())
         promptHashes.get(r.prompt_id)!.add(r.output_hash)
@@ -461,50 +2086,47 @@ export async function mergeDeltas(
       existing.prompts_tested += promptHashes.size  // new prompts in this delta
       existing.unique_outputs += Array.from(promptHashes.values()).reduce((sum, s) => sum + s.size, 0)
       existing.drifted_prompts += newDrifted
-      chart.data[bucketKey][model] = existing
+      buckets[model] = existing
 
       chart.total_submissions += records.length
     }
   }
 
   chart.models = Array.from(modelSet).sort()
-  chart._known_users = Array.from(knownUsers)
+  state.known_users = Array.from(knownUsers)
+  if (batch !== undefined && inline.length > 0) state.merged_batch = batch
   chart.total_contributors = knownUsers.size
   chart.last_updated = new Date().toISOString()
 
-  // 6. Write updated chart
-  await uploadFile(bucket, CHART_KEY, encoder.encode(JSON.stringify(chart)))
+  // 6. Write touched shards, state and index
+  await writeChartJson(bucket, set, budget)
 
-  // 7. Delete processed deltas
-  await deleteFiles(bucket, deltaKeys)
+  // 7. Delete processed delta files
+  await deleteFiles(bucket, deltaKeys, budget)
 
-  return { merged: deltas.length }
+  return { merged: deltas.length, deltasRemaining: allDeltaKeys.length - deltaKeys.length }
 }
 
 /**
- * Load all records from archives + current buffer.
+ * Load the aggregation columns of all records from archives (through their
+ * sidecars where present) + current buffer.
  * Shared by rebuildChartJson and rebuildUserSummaries.
  */
-async function loadAllRecords(bucket: R2Bucket): Promise<StorageRecord[]> {
-  const allRecords: StorageRecord[] = []
-  const archiveKeys = await listFiles(bucket, ARCHIVE_PREFIX)
-  for (const key of archiveKeys) {
-    if (!key.endsWith('.csv.gz')) continue
-    const buf = await downloadFile(bucket, key)
-    const csv = decoder.decode(await gunzip(buf))
-    allRecords.push(...parseCsvBody(csv))
+async function loadAllAggregateRows(bucket: R2Bucket, budget?: SubrequestBudget): Promise<AggregateRow[]> {
+  const allRecords: AggregateRow[] = []
+  const { keys, withSidecar } = await loadArchiveIndex(bucket, budget)
+  for (const rows of await readAggregateRowsMany(bucket, keys, withSidecar, budget)) {
+    allRecords.push(...rows)
   }
 
   // Read individual buffer entries
-  const entryKeys = await listFiles(bucket, BUFFER_ENTRIES_PREFIX)
-  for (const key of entryKeys) {
-    const buf = await downloadFile(bucket, key)
-    const csv = decoder.decode(await gunzip(buf))
-    allRecords.push(...parseCsvBody(csv))
+  const entryKeys = await listFiles(bucket, BUFFER_ENTRIES_PREFIX, 1000, budget)
+  for (const { records } of await readBufferEntries(bucket, entryKeys, budget)) {
+    allRecords.push(...records)
   }
 
   // Legacy monolithic buffer (if it still exists)
-  const { body: bufferBody } = await downloadFileWithEtag(bucket, BUFFER_KEY)
+  const { body: bufferBody } = await downloadFileWithEtag(bucket, BUFFER_KEY, budget)
   if (bufferBody) {
     const bufferCsv = decoder.decode(await gunzip(bufferBody))
     allRecords.push(...parseCsvBody(bufferCsv))
@@ -514,19 +2136,22 @@ async function loadAllRecords(bucket: R2Bucket): Promise<StorageRecord[]> {
 }
 
 /**
- * Rebuild chart_data.json from all archive CSVs.
+ * Rebuild the chart index and every month shard from all archive CSVs.
  * Tracks hash-based output consistency:
  *   - prevHash: last-seen output_hash per (model_id, prompt_id)
  *   - A prompt "drifted" if its hash differs from the previous day's hash
  */
-export async function rebuildChartJson(bucket: R2Bucket): Promise<void> {
-  const allRecords = await loadAllRecords(bucket)
+export async function rebuildChartJson(
+  bucket: R2Bucket,
+  budget?: SubrequestBudget
+): Promise<void> {
+  const allRecords = await loadAllAggregateRows(bucket, budget)
 
   // 2. Sort by timestamp
   allRecords.sort((a, b) => a.timestamp.localeCompare(b.timestamp))
 
   // 3. Group by (bucket, model) — bucket = YYYY-MM-DD-HH
-  const grouped = new Map<string, Map<string, StorageRecord[]>>()
+  const grouped = new Map<string, Map<string, AggregateRow[]>>()
   const modelSet = new Set<string>()
   for (const r of allRecords) {
     const dateStr = `${r.year}-${String(r.month).padStart(2, '0')}-${String(r.day).padStart(2, '0')}`
@@ -541,7 +2166,7 @@ export async function rebuildChartJson(bucket: R2Bucket): Promise<void> {
 
   // 4. Compute stats with drift tracking
   const prevHashMap = new Map<string, string>() // `${model}|${prompt}` → last hash
-  const data: Record<string, Record<string, ModelBucketStats>> = {}
+  const data: ChartBuckets = {}
   let totalSubmissions = 0
   const userSet = new Set<string>()
 
@@ -586,35 +2211,40 @@ export async function rebuildChartJson(bucket: R2Bucket): Promise<void> {
     }
   }
 
-  // 5. Build v5 chart with _prev_hashes and _known_users
-  const prevHashes: Record<string, string> = {}
-  for (const [k, v] of prevHashMap) prevHashes[k] = v
-
-  const knownUsers = Array.from(userSet)
-
-  const chart: ChartJson = {
-    version: 5,
-    data,
-    models: Array.from(modelSet).sort(),
-    total_submissions: totalSubmissions,
-    total_contributors: knownUsers.length,
-    last_updated: new Date().toISOString(),
-    _prev_hashes: prevHashes,
-    _known_users: knownUsers,
+  // 5. Build a fresh index, its shards, and the writer state mergeDeltas continues from
+  const set: ChartWriteSet = {
+    chart: {
+      version: 7,
+      months: [],
+      models: Array.from(modelSet).sort(),
+      total_submissions: totalSubmissions,
+      total_contributors: userSet.size,
+      last_updated: new Date().toISOString(),
+    },
+    state: {
+      version: 1,
+      prev_hashes: Object.fromEntries(prevHashMap),
+      known_users: Array.from(userSet),
+    },
+    shards: splitByMonth(data),
   }
 
-  await uploadFile(bucket, CHART_KEY, encoder.encode(JSON.stringify(chart)))
+  await writeChartJson(bucket, set, budget)
+  await pruneChartShards(bucket, set.chart, budget)
 }
 
 /**
  * Rebuild all user summaries from archives + buffer.
  * Fixes summaries corrupted by the silent uploadFileConditional bug.
  */
-export async function rebuildUserSummaries(bucket: R2Bucket): Promise<{ users: number; diagnostics: Record<string, { total: number; models: Record<string, number> }> }> {
-  const allRecords = await loadAllRecords(bucket)
+export async function rebuildUserSummaries(
+  bucket: R2Bucket,
+  budget?: SubrequestBudget
+): Promise<{ users: number; diagnostics: Record<string, { total: number; models: Record<string, number> }> }> {
+  const allRecords = await loadAllAggregateRows(bucket, budget)
 
   // Group by user_id
-  const byUser = new Map<string, StorageRecord[]>()
+  const byUser = new Map<string, AggregateRow[]>()
   for (const r of allRecords) {
     if (!byUser.has(r.user_id)) byUser.set(r.user_id, [])
     byUser.get(r.user_id)!.push(r)
@@ -630,7 +2260,8 @@ export async function rebuildUserSummaries(bucket: R2Bucket): Promise<{ users: n
     diagnostics[userId] = { total: records.length, models }
   }
 
-  // Build and write each user summary
+  // Build each user summary, then write them concurrently
+  const files: { key: string; body: Uint8Array }[] = []
   for (const [userId, records] of byUser) {
     const summary: UserSummaryJson = {
       version: 3,
@@ -649,44 +2280,48 @@ export async function rebuildUserSummaries(bucket: R2Bucket): Promise<{ users: n
       summary.total_submissions++
     }
 
-    const key = `${USERS_PREFIX}${userId}/summary.json`
-    await uploadFile(bucket, key, encoder.encode(JSON.stringify(summary)))
+    files.push({ key: userSummaryKey(userId), body: encoder.encode(JSON.stringify(summary)) })
   }
+  await uploadMany(bucket, files, budget)
 
   return { users: byUser.size, diagnostics }
 }
 
-// -- Incremental rebuild (cursor-based, Workers 50-subrequest safe) --
+// -- Incremental rebuild (cursor-based, sized to the subrequest budget) --
 
 const REBUILD_CURSOR_KEY = '_rebuild/cursor.json'
+const REBUILD_MAX_ROWS = 200_000  // rows held in memory per batch, when the manifest knows them
 
 interface RebuildCursor {
   processedArchives: string[]
+  archives?: string[]   // listed when the rebuild started; absent on cursors written before
 }
 
 /**
- * Rebuild chart_data.json from archives in batches of up to 45 per Worker invocation.
+ * Rebuild the chart from archives, as many per Worker invocation as the
+ * subrequest budget allows (45 on the free tier).
  * Persists progress in _rebuild/cursor.json so the GitHub Actions loop can resume.
- * Always starts from an empty chart (full recompute, not additive on top of delta state).
+ * Always starts from an empty chart (full recompute, not additive on top of delta state):
+ * the index only lists months written by this rebuild, and shards of months it
+ * never reached are pruned when it finishes. Only the archives listed when it
+ * started are read: segments compacted between its invocations are merged into
+ * the chart by compaction itself and would otherwise be counted twice.
  */
 export async function rebuildChartJsonIncremental(
-  bucket: R2Bucket
-): Promise<{ archivesProcessed: number; archivesRemaining: number; done: boolean }> {
-  // Subrequest budget per invocation (50 limit):
-  //   cursor read + archive list + chart read (skipped first batch) + chart write + cursor write/delete = 5 fixed
-  //   Remaining 45 → archive reads
-  const MAX_ARCHIVES = SUBREQUEST_LIMIT - 5  // 45
-
+  bucket: R2Bucket,
+  budget: SubrequestBudget = new SubrequestBudget()
+): Promise<{ archivesProcessed: number; archivesRemaining: number; done: boolean; subrequestsUsed: number }> {
   // 1. Read cursor
-  const { body: cursorBody } = await downloadFileWithEtag(bucket, REBUILD_CURSOR_KEY)
+  const { body: cursorBody } = await downloadFileWithEtag(bucket, REBUILD_CURSOR_KEY, budget)
   const cursor: RebuildCursor = cursorBody
     ? (JSON.parse(decoder.decode(cursorBody)) as RebuildCursor)
     : { processedArchives: [] }
 
-  // 2. List all archive keys — sorted = chronological (YYYY-MM-DD prefix)
-  const allArchiveKeys = (await listFiles(bucket, ARCHIVE_PREFIX))
-    .filter(k => k.endsWith('.csv.gz'))
-    .sort()
+  // 2. All archive keys — sorted = chronological (YYYY-MM-DD prefix, then segment ts).
+  // On resume, those the rebuild started with and that still exist.
+  const index = await loadArchiveIndex(bucket, budget)
+  const listed = new Set(index.keys)
+  const allArchiveKeys = cursor.archives ? cursor.archives.filter(k => listed.has(k)) : index.keys
 
   // 3. Diff against cursor
   const processedSet = new Set(cursor.processedArchives)
@@ -694,48 +2329,56 @@ export async function rebuildChartJsonIncremental(
 
   // No archives exist and no prior progress
   if (pending.length === 0 && cursor.processedArchives.length === 0) {
-    return { archivesProcessed: 0, archivesRemaining: 0, done: true }
+    return { archivesProcessed: 0, archivesRemaining: 0, done: true, subrequestsUsed: budget.used() }
   }
 
   // All archives already processed in prior batches — finalize
   if (pending.length === 0) {
-    await deleteFile(bucket, REBUILD_CURSOR_KEY)
-    return { archivesProcessed: 0, archivesRemaining: 0, done: true }
+    await pruneChartShards(bucket, await readChartJson(bucket, budget), budget)
+    await deleteFile(bucket, REBUILD_CURSOR_KEY, budget)
+    return { archivesProcessed: 0, archivesRemaining: 0, done: true, subrequestsUsed: budget.used() }
   }
 
-  // 4. Load chart — empty on first batch, existing on resume
-  let chart: ChartJson
-  if (cursor.processedArchives.length === 0) {
-    chart = {
-      version: 5,
-      data: {},
-      models: [],
-      total_submissions: 0,
-      total_contributors: 0,
-      last_updated: new Date().toISOString(),
-      _prev_hashes: {},
-      _known_users: [],
+  // 4. Load chart index and state — empty on first batch, existing on resume
+  const set = cursor.processedArchives.length === 0
+    ? emptyChartWriteSet()
+    : await readChartForUpdate(bucket, budget)
+  const { chart, state } = set
+
+  // 5. Process as many archives as the remaining budget allows, reading sidecars where
+  // present. Manifest stats give each archive's exact months and cap the rows held at once.
+  const { withSidecar, entries } = index
+  const reserve = REBUILD_WRITES + set.shards.size * SHARD_WRITES
+  const monthsOf = entries
+    ? (key: string) => monthsBetween(entries.get(key)!.min_ts, entries.get(key)!.max_ts)
+    : undefined
+  let fits = fitMonthBatch(pending, ARCHIVE_PREFIX, budget, reserve, set.shards, monthsOf)
+  if (entries) {
+    let rows = 0
+    for (let i = 0; i < fits; i++) {
+      rows += entries.get(pending[i])!.rows
+      if (i > 0 && rows > REBUILD_MAX_ROWS) fits = i
     }
-  } else {
-    chart = await readChartJson(bucket)
   }
-
-  // 5. Process batch
-  const batch = pending.slice(0, MAX_ARCHIVES)
+  const batch = pending.slice(0, fits)
+  if (batch.length === 0) {
+    return { archivesProcessed: 0, archivesRemaining: pending.length, done: false, subrequestsUsed: budget.used() }
+  }
   const modelSet = new Set(chart.models)
-  const knownUsers = new Set(chart._known_users)
-  const prevHashMap = new Map(Object.entries(chart._prev_hashes))
+  const knownUsers = new Set(state.known_users)
+  const prevHashMap = new Map(Object.entries(state.prev_hashes))
 
-  for (const archiveKey of batch) {
-    const buf = await downloadFile(bucket, archiveKey)
-    const csv = decoder.decode(await gunzip(buf))
-    const records = parseCsvBody(csv)
+  // Fetch the whole batch concurrently; processing stays sequential for drift tracking
+  const batchRecords = await readAggregateRowsMany(bucket, batch, withSidecar, budget)
+  const months = batchRecords.flatMap(records => records.map(r => `${r.year}-${String(r.month).padStart(2, '0')}`))
+  await loadChartShards(bucket, set, months, budget)
 
+  for (const records of batchRecords) {
     // Sort chronologically within archive for correct drift tracking
     records.sort((a, b) => a.timestamp.localeCompare(b.timestamp))
 
     // Group by (hourly bucket, model)
-    const grouped = new Map<string, Map<string, StorageRecord[]>>()
+    const grouped = new Map<string, Map<string, AggregateRow[]>>()
     for (const r of records) {
       const dateStr = `${r.year}-${String(r.month).padStart(2, '0')}-${String(r.day).padStart(2, '0')}`
       const hour = r.timestamp.length >= 13 ? r.timestamp.slice(11, 13) : '00'
@@ -750,7 +2393,7 @@ export async function rebuildChartJsonIncremental(
 
     // Compute stats per (bucket, model) in chronological order
     for (const bucketKey of Array.from(grouped.keys()).sort()) {
-      if (!chart.data[bucketKey]) chart.data[bucketKey] = {}
+      const buckets = chartBucket(set, bucketKey)
       const byModel = grouped.get(bucketKey)!
 
       for (const [model, recs] of byModel) {
@@ -772,11 +2415,12 @@ export async function rebuildChartJsonIncremental(
           prevHashMap.set(hashKey, hash)
         }
 
-        // Upsert — each archive covers a distinct calendar day so hourly buckets never overlap
-        const existing = chart.data[bucketKey][model] ?? {
+        // Upsert — segments of the same day can share hourly buckets; counts are additive
+        // across segments, matching how mergeDeltas folds successive deltas into a bucket
+        const existing = buckets[model] ?? {
           submissions: 0, prompts_tested: 0, unique_outputs: 0, drifted_prompts: 0,
         }
-        chart.data[bucketKey][model] = {
+        buckets[model] = {
           submissions: existing.submissions + recs.length,
           prompts_tested: existing.prompts_tested + promptIds.size,
           unique_outputs: existing.unique_outputs + outputHashes.size,
@@ -788,154 +2432,390 @@ export async function rebuildChartJsonIncremental(
   }
 
   chart.models = Array.from(modelSet).sort()
-  chart._known_users = Array.from(knownUsers)
+  state.known_users = Array.from(knownUsers)
+  state.prev_hashes = Object.fromEntries(prevHashMap)
   chart.total_contributors = knownUsers.size
-  chart._prev_hashes = Object.fromEntries(prevHashMap)
   chart.last_updated = new Date().toISOString()
 
   const newProcessed = [...cursor.processedArchives, ...batch]
   const archivesRemaining = pending.length - batch.length
   const isDone = archivesRemaining === 0
 
-  // 6. Write chart
-  await uploadFile(bucket, CHART_KEY, encoder.encode(JSON.stringify(chart)))
+  // 6. Write touched shards, state and index
+  await writeChartJson(bucket, set, budget)
 
   // 7. Advance or delete cursor
   if (isDone) {
-    await deleteFile(bucket, REBUILD_CURSOR_KEY)
+    await pruneChartShards(bucket, chart, budget)
+    await deleteFile(bucket, REBUILD_CURSOR_KEY, budget)
   } else {
-    const newCursor: RebuildCursor = { processedArchives: newProcessed }
-    await uploadFile(bucket, REBUILD_CURSOR_KEY, encoder.encode(JSON.stringify(newCursor)))
+    const newCursor: RebuildCursor = { processedArchives: newProcessed, archives: allArchiveKeys }
+    await uploadFile(bucket, REBUILD_CURSOR_KEY, encoder.encode(JSON.stringify(newCursor)), budget)
   }
 
-  return { archivesProcessed: batch.length, archivesRemaining, done: isDone }
+  return { archivesProcessed: batch.length, archivesRemaining, done: isDone, subrequestsUsed: budget.used() }
 }
 
-// -- Compact (cron) --
+// -- Archive format migration --
 
-export async function compactBuffer(
-  bucket: R2Bucket
-): Promise<{ archived: number; deltasMerged: number; entriesRemaining?: number }> {
-  // 1. List both entries and deltas upfront to allocate subrequest budget
-  const allEntryKeys = await listFiles(bucket, BUFFER_ENTRIES_PREFIX)
-  const allDeltaKeys = await listFiles(bucket, DELTAS_PREFIX)
+const MIGRATE_PER_ARCHIVE = 3  // CSV read + segment and sidecar writes
+const INDEX_PER_ARCHIVE = 1    // segment read
+const ORPHAN_GRACE_MS = 60 * 60_000  // longer than any compaction runs between its segment and manifest writes
 
-  // Entries-first dynamic allocation — archiving is the primary goal
-  const ALWAYS_FIXED = 3  // 2 lists above + 1 legacy buffer check below
-  const PHASE_FIXED = 3   // per active phase: read + write + batch delete
-  let available = SUBREQUEST_LIMIT - ALWAYS_FIXED  // 47
+/**
+ * Bring archives to the current layout, as many per invocation as the budget
+ * allows, one manifest partition (month) at a time:
+ *   - legacy `.csv.gz` archives become columnar segments at the same path with
+ *     a `.seg` extension (so chronological order is unchanged), each with a
+ *     segment sidecar; the CSV archive and its CSV sidecar are deleted
+ *     afterwards. Re-running after an interruption rewrites the same segment.
+ *   - segments written before the archive manifest (or its user filters)
+ *     existed are indexed.
+ *   - unindexed segments written since the manifest indexes every segment are
+ *     orphans of a compaction that failed before its manifest update — their
+ *     entries were archived again by a later run — and are deleted once older
+ *     than ORPHAN_GRACE_MS rather than indexed a second time.
+ * Once nothing is left the manifest is marked complete and readers stop
+ * listing _archive/. Refuses to run while an incremental rebuild is in
+ * progress, since its cursor records archive keys.
+ */
+export async function migrateArchives(
+  bucket: R2Bucket,
+  budget: SubrequestBudget = new SubrequestBudget()
+): Promise<{ migrated: number; indexed: number; orphansRemoved: number; archivesRemaining: number; done: boolean; subrequestsUsed: number }> {
+  const { body: cursor } = await downloadFileWithEtag(bucket, REBUILD_CURSOR_KEY, budget)
+  if (cursor) {
+    const err = new Error('Rebuild in progress; migrate after it completes') as Error & { status: number }
+    err.status = 409
+    throw err
+  }
 
-  let maxEntries = 0
-  if (allEntryKeys.length > 0) {
-    available -= PHASE_FIXED  // reserve archive read/write/delete
-    maxEntries = Math.min(allEntryKeys.length, available)
-    available -= maxEntries
+  const [{ manifest, entries: listed }, archiveKeys, withSidecar] = await Promise.all([
+    readArchiveEntries(bucket, budget),
+    listFiles(bucket, ARCHIVE_PREFIX, Infinity, budget),
+    listSidecarArchiveKeys(bucket, budget),
+  ])
+  const csvKeys = archiveKeys.filter(k => k.endsWith(CSV_ARCHIVE_EXT)).sort()
+  // Entries from before user or output filters existed are indexed again to gain them
+  const indexed = listed.filter(e => e.user_bloom && e.output_bloom).map(e => e.key)
+  const skip = new Set([...indexed, ...csvKeys.map(migratedArchiveKey)])
+  const indexedSince = Date.parse(manifest.indexed_since)
+  const isOrphan = (k: string) => keyTimestamp(k) >= indexedSince
+  const segments = archiveKeys.filter(k => k.endsWith(SEGMENT_EXT) && !skip.has(k))
+  const unindexed = segments.filter(k => !isOrphan(k)).sort()
+  const orphans = segments.filter(k => isOrphan(k) && keyTimestamp(k) <= Date.now() - ORPHAN_GRACE_MS)
+
+  // The oldest month with work; one partition keeps the manifest update at MANIFEST_IO
+  const month = [...csvKeys, ...unindexed].map(manifestMonth).sort()[0]
+  const inMonth = (keys: string[]) => keys.filter(k => manifestMonth(k) === month)
+  const reserve = 2 + MANIFEST_IO  // CSV and orphan deletes + manifest update
+  const csvBatch = inMonth(csvKeys)
+  const batch = csvBatch.slice(0, budget.fit(csvBatch.length, MIGRATE_PER_ARCHIVE, reserve))
+  const indexBatch = inMonth(unindexed)
+  const toIndex = indexBatch.slice(0, budget.fit(
+    indexBatch.length, INDEX_PER_ARCHIVE, reserve + batch.length * MIGRATE_PER_ARCHIVE))
+
+  // One archive in memory per worker rather than the whole batch
+  const entries = await mapWithConcurrency(batch, async (key) => {
+    const records = await parseArchive(key, await downloadFile(bucket, key, budget))
+    return writeArchiveObjects(bucket, migratedArchiveKey(key), records, budget)
+  })
+  entries.push(...await mapWithConcurrency(toIndex, async (key) => {
+    const { body, etag } = await downloadFileWithEtag(bucket, key, budget)
+    return archiveEntry(key, await readSegmentAggregateRows(body!), body!, etag!)
+  }))
+  const stale = batch.flatMap(k => (withSidecar.has(k) ? [k, archiveSidecarKey(k)] : [k]))
+  await deleteFiles(bucket, stale, budget)
+  await deleteFiles(bucket, orphans.flatMap(k => [k, archiveSidecarKey(k)]), budget)
+
+  const archivesRemaining = csvKeys.length - batch.length + unindexed.length - toIndex.length
+  const done = archivesRemaining === 0
+  if (entries.length > 0 || (done && !manifest.complete)) {
+    await updateArchiveManifest(bucket, { add: entries, complete: done || undefined }, budget)
+  }
+  return {
+    migrated: batch.length,
+    indexed: toIndex.length,
+    orphansRemoved: orphans.length,
+    archivesRemaining,
+    done,
+    subrequestsUsed: budget.used(),
   }
+}
+
+/**
+ * Fill in the output text of blob-backed and by-reference rows: one blob read
+ * per distinct hash, as many as fit in the budget. Rows left with an empty
+ * output (blob missing or over budget) are counted in `unresolved`; their
+ * output_hash still identifies the text.
+ */
+async function resolveOutputs(
+  bucket: R2Bucket,
+  records: StorageRecord[],
+  budget: SubrequestBudget
+): Promise<{ records: StorageRecord[]; unresolved: number }> {
+  const hashes = Array.from(new Set(records.filter(r => r.output === '' && blobKey(r.output_hash)).map(r => r.output_hash)))
+  const batch = hashes.slice(0, budget.fit(hashes.length))
+  const texts = await mapWithConcurrency(batch, (hash) => readOutput(bucket, { output: '', output_hash: hash }, budget))
+  const resolved = new Map<string, string>()
+  batch.forEach((hash, i) => { if (texts[i] !== null) resolved.set(hash, texts[i]!) })
+
+  let unresolved = 0
+  const filled = records.map((r) => {
+    if (r.output !== '') return r
+    const output = resolved.get(r.output_hash)
+    if (output === undefined) {
+      unresolved++
+      return r
+    }
+    return { ...r, output }
+  })
+  return { records: filled, unresolved }
+}
+
+/**
+ * What the `output` column of an export holds: `text` resolves blob-backed and
+ * by-reference rows within the budget (rows it cannot resolve stay empty and
+ * are counted); `hash` reads no blobs and leaves every such row empty, for
+ * consumers that key outputs by output_hash.
+ */
+export type ExportOutputs = 'text' | 'hash'
+
+/**
+ * An archive object as CSV in the original 12-column layout, whatever its
+ * stored format. Returns null when `key` does not exist.
+ */
+export async function exportArchiveCsv(
+  bucket: R2Bucket,
+  key: string,
+  budget: SubrequestBudget = new SubrequestBudget(),
+  outputs: ExportOutputs = 'text'
+): Promise<{ csv: string; unresolved: number } | null> {
+  const { body } = await downloadFileWithEtag(bucket, key, budget)
+  if (!body) return null
+  const parsed = await parseArchive(key, body)
+  const { records, unresolved } = outputs === 'text'
+    ? await resolveOutputs(bucket, parsed, budget)
+    : { records: parsed, unresolved: parsed.filter(r => r.output === '').length }
+  return { csv: CSV_HEADERS + '\n' + records.map(recordToCsvRow).join('\n'), unresolved }
+}
 
-  let maxDeltaReads = 0
-  if (allDeltaKeys.length > 0 && available > PHASE_FIXED) {
-    available -= PHASE_FIXED  // reserve chart read/write/delete
-    maxDeltaReads = Math.min(allDeltaKeys.length, available)
+/**
+ * Rows matching `filter` as CSV, read only from the archives whose manifest
+ * stats say they can hold such rows — as many as the budget allows;
+ * `remaining` counts the matching archives left unread. Resolving outputs
+ * holds back half the budget for blob reads. Null while the manifest is
+ * incomplete.
+ */
+export async function exportArchivesCsv(
+  bucket: R2Bucket,
+  filter: ArchiveFilter,
+  budget: SubrequestBudget = new SubrequestBudget(),
+  outputs: ExportOutputs = 'text'
+): Promise<{ csv: string; archives: number; remaining: number; unresolved: number } | null> {
+  const { start, end, models } = filter
+  // A partition only holds rows up to the end of its month
+  const { manifest, entries } = await readArchiveEntries(bucket, budget, (month, minTs) =>
+    (!start || month >= start.slice(0, 7)) && (!end || minTs.slice(0, end.length) <= end))
+  if (!manifest.complete) return null
+
+  const matching = selectArchives(entries, filter).map(e => e.key)
+  const blobReserve = outputs === 'text' ? Math.floor(budget.remaining() / 2) : 0
+  const keys = matching.slice(0, budget.fit(matching.length, 1, blobReserve))
+  const rows: StorageRecord[] = []
+  const bodies = await downloadMany(bucket, keys, budget)
+  for (let i = 0; i < keys.length; i++) {
+    for (const r of await parseArchive(keys[i], bodies[i])) {
+      if (start && r.timestamp < start) continue
+      if (end && r.timestamp.slice(0, end.length) > end) continue
+      if (models && !models.includes(r.model_id)) continue
+      rows.push(r)
+    }
   }
+  const { records, unresolved } = outputs === 'text'
+    ? await resolveOutputs(bucket, rows, budget)
+    : { records: rows, unresolved: rows.filter(r => r.output === '').length }
+  const csv = [CSV_HEADERS, ...records.map(recordToCsvRow)].join('\n')
+  return { csv, archives: keys.length, remaining: matching.length - keys.length, unresolved }
+}
 
-  const entryKeys = allEntryKeys.slice(0, maxEntries)
+// -- Compact (cron) --
+
+/**
+ * Archive buffer entries, merge their chart deltas, then delete them. The
+ * batch is journaled before the manifest update, and the manifest root and
+ * the chart's writer state each record the id of the batch they hold; a run
+ * that fails before its entries are deleted is resumed as cut by the next
+ * one, which skips whichever of the two already has it, so no row is
+ * archived or counted twice.
+ */
+export async function compactBuffer(
+  bucket: R2Bucket,
+  budget: SubrequestBudget = new SubrequestBudget()
+): Promise<{ archived: number; deltasMerged: number; summariesFolded: number; entriesRemaining?: number; deltasRemaining?: number; subrequestsUsed: number }> {
+  // 1. List both entries and deltas upfront so the budget reflects real work
+  const allEntryKeys = await listFiles(bucket, BUFFER_ENTRIES_PREFIX, 1000, budget)
+  const allDeltaKeys = await listFiles(bucket, DELTAS_PREFIX, 1000, budget)
+  const { body: journal } = await downloadFileWithEtag(bucket, COMPACT_BATCH_KEY, budget)
+  const resumed = journal ? JSON.parse(decoder.decode(journal)) as CompactBatchJson : null
+
+  // Entries first — archiving is the primary goal. Hold back the legacy
+  // buffer check, the archive writes, the journal and the manifest update,
+  // and for ingest entries the chart merge their headers feed: the chart
+  // read/write once plus a shard read/write per month they touch. Delta
+  // files get whatever is left.
+  const LEGACY_CHECK = 1
+  const archiveReserve = LEGACY_CHECK + ENTRY_ARCHIVE_WRITES + COMPACT_JOURNAL_WRITES + MANIFEST_IO
+  const chartReserve = allEntryKeys.some(isIngestEntry) ? CHART_READS + CHART_WRITES : 0
+  let entryKeys: string[]
+  let batch: string
+  let archivedBefore = false
+  if (resumed) {
+    // Entries of a failed run sort first and are still listed
+    const listed = new Set(allEntryKeys)
+    entryKeys = resumed.entries.filter(k => listed.has(k))
+    batch = resumed.id
+    archivedBefore = (await readArchiveManifest(bucket, budget)).manifest.compacted_batch === batch
+  } else {
+    const maxEntries = fitMonthBatch(
+      allEntryKeys, BUFFER_ENTRIES_PREFIX, budget, archiveReserve + chartReserve, new Map(),
+      (key) => isIngestEntry(key) ? [new Date(keyTimestamp(key)).toISOString().slice(0, 7)] : []
+    )
+    entryKeys = allEntryKeys.slice(0, maxEntries)
+    batch = `${Date.now()}_${Math.random().toString(36).slice(2, 8)}`
+  }
+  const today = new Date().toISOString().split('T')[0]
+  const written: ArchiveManifestEntry[] = []
+  const inline: ChartDelta[] = []
   let archived = 0
 
   if (entryKeys.length > 0) {
-    // Read capped entry files and collect records
+    // Read capped entry files and collect records and chart deltas
     const allRecords: StorageRecord[] = []
-    for (const key of entryKeys) {
-      const buf = await downloadFile(bucket, key)
-      const csv = decoder.decode(await gunzip(buf))
-      allRecords.push(...parseCsvBody(csv))
+    for (const { records, delta } of await readBufferEntries(bucket, entryKeys, budget)) {
+      allRecords.push(...records)
+      if (delta) inline.push(delta)
     }
 
-    if (allRecords.length > 0) {
-      const today = new Date().toISOString().split('T')[0]
-      const archiveKey = `${ARCHIVE_PREFIX}${today}.csv.gz`
-
-      const { body: existingArchive } = await downloadFileWithEtag(bucket, archiveKey)
-      let archiveCsv: string
-      if (existingArchive) {
-        const existing = decoder.decode(await gunzip(existingArchive))
-        archiveCsv = existing.trimEnd() + '\n' + allRecords.map(recordToCsvRow).join('\n')
-      } else {
-        archiveCsv = CSV_HEADERS + '\n' + allRecords.map(recordToCsvRow).join('\n')
-      }
-      await uploadFile(bucket, archiveKey, await gzip(encoder.encode(archiveCsv)))
+    if (allRecords.length > 0 && !archivedBefore) {
+      // Blobs get what is left after the archive writes, the legacy check, the
+      // inline chart merge and one delta file merge
+      const inlineMonths = new Set(inline.map(d => deltaBucketKey(d).slice(0, 7)))
+      const reserve = archiveReserve
+        + (inline.length > 0 ? CHART_READS + CHART_WRITES + inlineMonths.size * SHARD_IO : 0)
+        + (allDeltaKeys.length > 0 ? MERGE_MIN : 0)
+      const rows = await externalizeOutputs(bucket, allRecords, budget, reserve)
+      written.push(await writeArchiveSegment(bucket, today, rows, budget))
       archived = allRecords.length
     }
-
-    // Delete processed entries
-    await deleteFiles(bucket, entryKeys)
   }
 
-  // 1b. Also drain legacy monolithic buffer if it exists
-  const { body } = await downloadFileWithEtag(bucket, BUFFER_KEY)
-  if (body) {
+  // 1b. Also drain legacy monolithic buffer if it exists (a resumed batch
+  // whose segments are listed archived it already)
+  const { body } = await downloadFileWithEtag(bucket, BUFFER_KEY, budget)
+  if (body && !archivedBefore) {
     const csv = decoder.decode(await gunzip(body))
     const legacyRecords = parseCsvBody(csv)
     if (legacyRecords.length > 0) {
-      const today = new Date().toISOString().split('T')[0]
-      const archiveKey = `${ARCHIVE_PREFIX}${today}.csv.gz`
-
-      const { body: existingArchive } = await downloadFileWithEtag(bucket, archiveKey)
-      let archiveCsv: string
-      if (existingArchive) {
-        const existing = decoder.decode(await gunzip(existingArchive))
-        archiveCsv = existing.trimEnd() + '\n' + legacyRecords.map(recordToCsvRow).join('\n')
-      } else {
-        archiveCsv = CSV_HEADERS + '\n' + legacyRecords.map(recordToCsvRow).join('\n')
-      }
-      await uploadFile(bucket, archiveKey, await gzip(encoder.encode(archiveCsv)))
+      written.push(await writeArchiveSegment(bucket, today, legacyRecords, budget))
       archived += legacyRecords.length
     }
-    // Delete legacy buffer
-    await deleteFile(bucket, BUFFER_KEY)
   }
 
-  // 2. Merge deltas only if budget allows — skip to avoid wasting chart read/write subrequests
+  // 1c. Journal the batch, then record the new segments in the archive
+  // manifest. Should that fail they are deleted again, since their rows stay
+  // buffered for the next run; migrateArchives removes any a crash leaves
+  // behind.
+  const journaled = resumed !== null || entryKeys.length > 0 || written.length > 0
+  if (!resumed && journaled) {
+    const entry: CompactBatchJson = { version: 1, id: batch, entries: entryKeys }
+    await uploadFile(bucket, COMPACT_BATCH_KEY, encoder.encode(JSON.stringify(entry)), budget)
+  }
+  if (written.length > 0) {
+    try {
+      await updateArchiveManifest(bucket, { add: written, batch }, budget)
+    } catch (err) {
+      await deleteFiles(bucket, written.flatMap(e => [e.key, archiveSidecarKey(e.key)]), budget).catch(() => {})
+      throw err
+    }
+  }
+  if (body) await deleteFile(bucket, BUFFER_KEY, budget)
+
+  // 2. Merge the chart: every archived entry's header, plus delta files with
+  // what is left — mergeDeltas sizes its own batch and, without headers,
+  // skips the chart read/write entirely when no delta read would fit
   let merged = 0
-  if (maxDeltaReads > 0) {
-    ;({ merged } = await mergeDeltas(bucket, maxDeltaReads, allDeltaKeys))
+  let deltasRemaining = allDeltaKeys.length
+  if (inline.length > 0 || (allDeltaKeys.length > 0 && budget.fit(1, 1, CHART_READS + SHARD_IO + DELTA_MERGE_WRITES) > 0)) {
+    ;({ merged, deltasRemaining } = await mergeDeltas(bucket, budget, allDeltaKeys, inline, batch))
+  }
+
+  // 2b. Delete processed entries, once both the archive and the chart hold
+  // them, and then the journal
+  await deleteFiles(bucket, entryKeys, budget)
+  if (journaled) await deleteFile(bucket, COMPACT_BATCH_KEY, budget)
+
+  // 3. Fold per-user summary deltas with the rest (cursor, user listing, at least one user)
+  let summariesFolded = 0
+  if (budget.fit(1, SUMMARY_FOLD_FIXED + SUMMARY_FOLD_PER_USER) > 0) {
+    ;({ usersFolded: summariesFolded } = await foldSummaryDeltas(bucket, budget))
   }
 
   const entriesRemaining = allEntryKeys.length > entryKeys.length
     ? allEntryKeys.length - entryKeys.length
     : undefined
 
-  return { archived, deltasMerged: merged, entriesRemaining }
+  return {
+    archived,
+    deltasMerged: merged,
+    summariesFolded,
+    entriesRemaining,
+    deltasRemaining: deltasRemaining > 0 ? deltasRemaining : undefined,
+    subrequestsUsed: budget.used(),
+  }
 }
 
 // -- GDPR helpers --
 
+/**
+ * Remove the user's rows from the buffer. Entries tagged with the user are
+ * deleted unread and entries tagged with anyone else are skipped; only
+ * untagged entries (written before tagging, or mixing users) are read.
+ */
 export async function deleteUserFromBuffer(
   bucket: R2Bucket,
-  userId: string
+  userId: string,
+  budget?: SubrequestBudget
 ): Promise<number> {
   let removed = 0
 
   // Process individual buffer entries
-  const entryKeys = await listFiles(bucket, BUFFER_ENTRIES_PREFIX)
-  for (const key of entryKeys) {
-    const buf = await downloadFile(bucket, key)
-    const csv = decoder.decode(await gunzip(buf))
-    const records = parseCsvBody(csv)
+  const listed = await listFilesWithMetadata(bucket, BUFFER_ENTRIES_PREFIX, 1000, budget)
+  const own = listed.filter(o => o.customMetadata.user_id === userId)
+  for (const o of own) removed += Number(o.customMetadata.rows)
+  const entryKeys = listed.filter(o => o.customMetadata.user_id === undefined).map(o => o.key)
+  const entries = await readBufferEntries(bucket, entryKeys, budget)
+  const rewrites: { key: string; body: Uint8Array }[] = []
+  const emptied: string[] = []
+  for (let i = 0; i < entryKeys.length; i++) {
+    const { records, delta } = entries[i]
     const filtered = records.filter((r) => r.user_id !== userId)
     const diff = records.length - filtered.length
     if (diff > 0) {
       removed += diff
       if (filtered.length > 0) {
-        const newCsv = CSV_HEADERS + '\n' + filtered.map(recordToCsvRow).join('\n')
-        await uploadFile(bucket, key, await gzip(encoder.encode(newCsv)))
+        const keep = delta && { ...delta, records: delta.records.filter((r) => r.user_id !== userId) }
+        rewrites.push({ key: entryKeys[i], body: await encodeBufferEntry(filtered, keep) })
       } else {
-        await deleteFile(bucket, key)
+        emptied.push(entryKeys[i])
       }
     }
   }
+  await uploadMany(bucket, rewrites, budget)
+  await deleteFiles(bucket, [...own.map(o => o.key), ...emptied], budget)
 
   // Legacy monolithic buffer
-  const { body, etag } = await downloadFileWithEtag(bucket, BUFFER_KEY)
+  const { body, etag } = await downloadFileWithEtag(bucket, BUFFER_KEY, budget)
   if (body) {
     const csv = decoder.decode(await gunzip(body))
     const allRecords = parseCsvBody(csv)
@@ -946,12 +2826,301 @@ export async function deleteUserFromBuffer(
       const newCsv = CSV_HEADERS + '\n' + filtered.map(recordToCsvRow).join('\n')
       const compressed = await gzip(encoder.encode(newCsv))
       if (etag) {
-        await uploadFileConditional(bucket, BUFFER_KEY, compressed, etag)
+        await uploadFileConditional(bucket, BUFFER_KEY, compressed, etag, budget)
       } else {
-        await uploadFile(bucket, BUFFER_KEY, compressed)
+        await uploadFile(bucket, BUFFER_KEY, compressed, budget)
       }
     }
   }
 
   return removed
 }
+
+// -- GDPR erasure (resumable job) --
+
+const ERASURE_PENDING_PREFIX = '_erasure/pending/'
+const ERASURE_DONE_PREFIX = '_erasure/done/'
+const ERASURE_JOB_WRITES = 2    // job write + pending-job delete on completion
+const ERASE_WAIT_CHECK = 2      // buffer + delta listing
+const ERASE_PER_ARCHIVE = 4     // archive read (+ its segment, if migrated meanwhile) + segment and sidecar writes
+const ERASE_ARCHIVE_RESERVE = 2 + MANIFEST_IO + ERASURE_JOB_WRITES  // stale-object and rebuild-cursor deletes
+const ERASE_CHART_MIN = 2 + CHART_READS + SHARD_IO + REBUILD_WRITES  // cursor + archive index, one archive rebuilt
+const ERASE_BLOB_MIN = 2 + 1 + 1 + 1  // manifest root and a partition, buffer listing, one sidecar, the blob delete
+
+async function writeErasureJob(
+  bucket: R2Bucket,
+  job: ErasureJobJson,
+  budget?: SubrequestBudget
+): Promise<void> {
+  job.updated_at = new Date().toISOString()
+  const body = encoder.encode(JSON.stringify(job))
+  if (job.status === 'done') {
+    await uploadFile(bucket, `${ERASURE_DONE_PREFIX}${job.user_id}.json`, body, budget)
+    await deleteFile(bucket, `${ERASURE_PENDING_PREFIX}${job.user_id}.json`, budget)
+  } else {
+    await uploadFile(bucket, `${ERASURE_PENDING_PREFIX}${job.user_id}.json`, body, budget)
+  }
+}
+
+/** Start (or restart) erasing every stored submission of `userId`. */
+export async function requestErasure(
+  bucket: R2Bucket,
+  userId: string,
+  budget?: SubrequestBudget
+): Promise<ErasureJobJson> {
+  const now = new Date().toISOString()
+  const job: ErasureJobJson = {
+    version: 1,
+    user_id: userId,
+    status: 'waiting',
+    requested_at: now,
+    updated_at: now,
+    completed_at: null,
+    archives: null,
+    archives_done: 0,
+    rows_removed: 0,
+    blobs: [],
+    blobs_done: 0,
+    blobs_removed: 0,
+  }
+  await writeErasureJob(bucket, job, budget)
+  return job
+}
+
+/** The user's pending erasure job, else their last completed one; null if none. */
+export async function readErasureJob(
+  bucket: R2Bucket,
+  userId: string,
+  budget?: SubrequestBudget
+): Promise<ErasureJobJson | null> {
+  const [pending, done] = await Promise.all([
+    downloadFileWithEtag(bucket, `${ERASURE_PENDING_PREFIX}${userId}.json`, budget),
+    downloadFileWithEtag(bucket, `${ERASURE_DONE_PREFIX}${userId}.json`, budget),
+  ])
+  const body = pending.body ?? done.body
+  return body ? (JSON.parse(decoder.decode(body)) as ErasureJobJson) : null
+}
+
+/**
+ * Archives that may hold rows of `userId` written before `before`: those
+ * whose manifest filter may contain the user, or every archive while the
+ * manifest is incomplete.
+ */
+async function planErasure(
+  bucket: R2Bucket,
+  userId: string,
+  before: string,
+  budget?: SubrequestBudget
+): Promise<string[]> {
+  const root = await readArchiveManifest(bucket, budget)
+  if (!root.manifest.complete) return listArchiveKeys(bucket, budget)
+  return (await readPartitions(bucket, root, budget, (_month, minTs) => minTs <= before))
+    .filter(e => e.min_ts <= before && (!e.user_bloom || bloomMayContain(e.user_bloom, userId)))
+    .map(e => e.key)
+}
+
+/**
+ * Rewrite the next planned archives without the user's rows, as many as the
+ * budget allows. An archive left empty is deleted; a CSV archive becomes a
+ * segment like migrateArchives would make it.
+ */
+async function eraseFromArchives(
+  bucket: R2Bucket,
+  job: ErasureJobJson,
+  budget: SubrequestBudget
+): Promise<void> {
+  const planned = job.archives!
+  const pending = planned.slice(job.archives_done)
+  // Archives of one manifest partition per step, so the update stays at MANIFEST_IO
+  const month = pending.length > 0 ? manifestMonth(pending[0]) : ''
+  const sameMonth = pending.findIndex(k => manifestMonth(k) !== month)
+  const candidates = sameMonth === -1 ? pending : pending.slice(0, sameMonth)
+  const batch = candidates.slice(0, budget.fit(candidates.length, ERASE_PER_ARCHIVE, ERASE_ARCHIVE_RESERVE))
+
+  const results = await mapWithConcurrency(batch, async (plannedKey) => {
+    let key = plannedKey
+    let { body } = await downloadFileWithEtag(bucket, key, budget)
+    if (!body && migratedArchiveKey(key) !== key) {
+      key = migratedArchiveKey(key)
+      ;({ body } = await downloadFileWithEtag(bucket, key, budget))
+    }
+    const records = body ? await parseArchive(key, body) : []
+    const kept = records.filter(r => r.user_id !== job.user_id)
+    const removed = records.length - kept.length
+    const hashes = records.filter(r => r.user_id === job.user_id && blobKey(r.output_hash)).map(r => r.output_hash)
+    // Nothing to do for a filter false positive
+    if (removed === 0) return { removed, hashes, entry: null, emptied: null, stale: [] }
+    const stale = migratedArchiveKey(key) === key ? [] : [key, archiveSidecarKey(key)]
+    if (kept.length === 0) return { removed, hashes, entry: null, emptied: key, stale: [key, archiveSidecarKey(key)] }
+    const entry = await writeArchiveObjects(bucket, migratedArchiveKey(key), kept, budget)
+    return { removed, hashes, entry, emptied: null, stale }
+  })
+
+  // Manifest first, so a complete manifest never lists a deleted archive
+  const add = results.flatMap(r => (r.entry ? [r.entry] : []))
+  const remove = results.flatMap(r => (r.emptied ? [r.emptied] : []))
+  if (add.length > 0 || remove.length > 0) await updateArchiveManifest(bucket, { add, remove }, budget)
+  await deleteFiles(bucket, results.flatMap(r => r.stale), budget)
+
+  job.archives_done += batch.length
+  const blobs = new Set(job.blobs)
+  for (const r of results) {
+    job.rows_removed += r.removed
+    for (const hash of r.hashes) blobs.add(hash)
+  }
+  job.blobs = Array.from(blobs)
+  if (job.archives_done === planned.length) {
+    // A rebuild already under way has read unscrubbed archives; start it over
+    await deleteFile(bucket, REBUILD_CURSOR_KEY, budget)
+    job.status = 'chart'
+  }
+}
+
+/**
+ * Output hashes of the by-reference rows (empty output) in the buffer, whose
+ * text only their blob holds; null when the entries cannot all be read within
+ * the budget after `reserve`.
+ */
+async function bufferedReferences(
+  bucket: R2Bucket,
+  budget: SubrequestBudget,
+  reserve: number
+): Promise<Set<string> | null> {
+  const keys = await listFiles(bucket, BUFFER_ENTRIES_PREFIX, 1000, budget)
+  if (keys.length === 1000 || budget.fit(keys.length, 1, reserve) < keys.length) return null
+  const entries = await readBufferEntries(bucket, keys, budget)
+  return new Set(entries.flatMap(e => e.records.filter(r => r.output === '').map(r => r.output_hash)))
+}
+
+/**
+ * Delete the blobs of the user's outputs that no remaining row references, as
+ * many hashes as the budget allows. This runs after the chart rebuild, so the
+ * writer state no longer names the user's outputs and no new reference to
+ * them is accepted (see knownOutputHashes). References accepted before that
+ * and still buffered are read from the buffer entries first; while those do
+ * not fit in the budget the job waits for compaction to archive them. The
+ * manifest's per-archive output filters name the archives that may still hold
+ * a hash; their sidecars are read one at a time, since the first row found
+ * settles it. Archives without a filter (or every archive, while the manifest
+ * is incomplete) are read for every hash.
+ */
+async function eraseUnreferencedBlobs(
+  bucket: R2Bucket,
+  job: ErasureJobJson,
+  budget: SubrequestBudget
+): Promise<void> {
+  const hashes = job.blobs ?? []
+  const { keys, withSidecar, entries } = await loadArchiveIndex(bucket, budget)
+  // Hold back a sidecar read, the blob delete and the job write
+  const buffered = await bufferedReferences(bucket, budget, 1 + 1 + ERASURE_JOB_WRITES)
+  if (!buffered) return
+  const seen = new Map<string, Set<string>>()   // archive → its output hashes
+  const unreferenced: string[] = []
+  let done = job.blobs_done ?? 0
+
+  scan: for (; done < hashes.length; done++) {
+    const hash = hashes[done]
+    let referenced = buffered.has(hash)
+    for (const key of referenced ? [] : keys) {
+      const filter = entries?.get(key)?.output_bloom
+      if (filter && !bloomMayContain(filter, hash)) continue
+      let archived = seen.get(key)
+      if (!archived) {
+        // Hold back the blob delete and the job write
+        if (budget.fit(1, 1, 1 + ERASURE_JOB_WRITES) === 0) break scan
+        const [rows] = await readAggregateRowsMany(bucket, [key], withSidecar, budget)
+        archived = new Set(rows.map(r => r.output_hash))
+        seen.set(key, archived)
+      }
+      if (archived.has(hash)) {
+        referenced = true
+        break
+      }
+    }
+    if (!referenced) unreferenced.push(hash)
+  }
+
+  await deleteFiles(bucket, unreferenced.map(h => blobKey(h)!), budget)
+  job.blobs_done = done
+  job.blobs_removed = (job.blobs_removed ?? 0) + unreferenced.length
+  if (done === hashes.length) {
+    job.status = 'done'
+    job.completed_at = new Date().toISOString()
+  }
+}
+
+/**
+ * Advance an erasure job as far as the budget allows and persist it:
+ *   waiting  — until compaction has archived every buffer entry and merged
+ *              every delta written before the request, so no earlier row of
+ *              the user can reach an archive after planning
+ *   archives — rewrite each planned archive without the user's rows; the
+ *              manifest's per-archive user filters skip the rest unread
+ *   chart    — recompute the chart with the incremental rebuild
+ *   blobs    — delete the output blobs of those rows that no other row
+ *              references (blobs are content-addressed and may be shared)
+ */
+export async function advanceErasureJob(
+  bucket: R2Bucket,
+  job: ErasureJobJson,
+  budget: SubrequestBudget = new SubrequestBudget()
+): Promise<ErasureJobJson> {
+  const next: ErasureJobJson = { ...job }
+  const requestedMs = Date.parse(next.requested_at)
+
+  if (next.status === 'waiting' && budget.fit(1, ERASE_WAIT_CHECK, ERASURE_JOB_WRITES) > 0) {
+    // Both listings are chronological: the first key is the oldest
+    const [buffered, deltas] = await Promise.all([
+      listFiles(bucket, '_buffer/', 1, budget),
+      listFiles(bucket, DELTAS_PREFIX, 1, budget),
+    ])
+    const draining = [...buffered, ...deltas].some(k => k === BUFFER_KEY || keyTimestamp(k) <= requestedMs)
+    if (!draining) next.status = 'archives'
+  }
+
+  if (next.status === 'archives' && budget.fit(1, 1, ERASE_ARCHIVE_RESERVE) > 0) {
+    if (next.archives === null) next.archives = await planErasure(bucket, next.user_id, next.requested_at, budget)
+    await eraseFromArchives(bucket, next, budget)
+  }
+
+  if (next.status === 'chart' && budget.fit(1, ERASE_CHART_MIN, ERASURE_JOB_WRITES) > 0) {
+    const sub = new SubrequestBudget(budget.remaining() - ERASURE_JOB_WRITES)
+    const { done } = await rebuildChartJsonIncremental(bucket, sub)
+    budget.charge(sub.used())
+    if (done) next.status = 'blobs'
+  }
+
+  if (next.status === 'blobs' && budget.fit(1, ERASE_BLOB_MIN, ERASURE_JOB_WRITES) > 0) {
+    await eraseUnreferencedBlobs(bucket, next, budget)
+  }
+
+  await writeErasureJob(bucket, next, budget)
+  return next
+}
+
+/**
+ * Advance every pending erasure job in turn (cron). `jobsRemaining` counts the
+ * jobs that could make progress now; `jobsWaiting` those waiting for compaction.
+ */
+export async function runErasureJobs(
+  bucket: R2Bucket,
+  budget: SubrequestBudget = new SubrequestBudget()
+): Promise<{ jobsCompleted: number; jobsRemaining: number; jobsWaiting: number; subrequestsUsed: number }> {
+  const keys = await listFiles(bucket, ERASURE_PENDING_PREFIX, 1000, budget)
+  let jobsCompleted = 0
+  let jobsRemaining = 0
+  let jobsWaiting = 0
+  for (const key of keys) {
+    if (budget.fit(1, 1 + ERASE_WAIT_CHECK, ERASURE_JOB_WRITES) === 0) {
+      jobsRemaining++
+      continue
+    }
+    const { body } = await downloadFileWithEtag(bucket, key, budget)
+    if (!body) continue
+    const job = await advanceErasureJob(bucket, JSON.parse(decoder.decode(body)) as ErasureJobJson, budget)
+    if (job.status === 'done') jobsCompleted++
+    else if (job.status === 'waiting') jobsWaiting++
+    else jobsRemaining++
+  }
+  return { jobsCompleted, jobsRemaining, jobsWaiting, subrequestsUsed: budget.used() }
+}
@@ -0,0 +1,29 @@
+/**
+ * Batch submit hashing: 1000 results, previous sequential path vs sha256HexMany.
+ * Run with `npm run bench`.
+ */
+import { bench, describe } from 'vitest'
+import { sha256HexMany } from './crypto'
+
+const inputs = Array.from({ length: 1000 }, (_, i) =>
+  `gpt-4o|prompt-${i}|${'model output text '.repeat(20)}${i}`)
+
+/** The per-item implementation submit.ts used before. */
+async function sha256hexLegacy(input: string): Promise<string> {
+  const data = new TextEncoder().encode(input)
+  const hash = await crypto.subtle.digest('SHA-256', data)
+  return Array.from(new Uint8Array(hash))
+    .map((b) => b.toString(16).padStart(2, '0'))
+    .join('')
+}
+
+describe('hash 1000 batch results', () => {
+  bench('sequential await + map/padStart/join', async () => {
+    const out: string[] = []
+    for (const input of inputs) out.push(await sha256hexLegacy(input))
+  })
+
+  bench('sha256HexMany (concurrent + hex table)', async () => {
+    await sha256HexMany(inputs)
+  })
+})
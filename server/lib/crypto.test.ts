@@ -0,0 +1,28 @@
+// @vitest-environment node
+import { describe, it, expect } from 'vitest'
+import { createHash } from 'crypto'
+import { toHex, sha256Hex, sha256HexMany } from './crypto'
+
+const nodeSha256 = (s: string) => createHash('sha256').update(s).digest('hex')
+
+describe('toHex', () => {
+  it('encodes every byte value as two lowercase digits', () => {
+    const bytes = Uint8Array.from({ length: 256 }, (_, i) => i)
+    expect(toHex(bytes)).toBe(Buffer.from(bytes).toString('hex'))
+    expect(toHex(new Uint8Array())).toBe('')
+  })
+})
+
+describe('sha256Hex', () => {
+  it('matches node:crypto for strings and bytes', async () => {
+    expect(await sha256Hex('gpt-4o|p1|héllo')).toBe(nodeSha256('gpt-4o|p1|héllo'))
+    expect(await sha256Hex(new TextEncoder().encode('abc'))).toBe(nodeSha256('abc'))
+  })
+})
+
+describe('sha256HexMany', () => {
+  it('returns digests in input order', async () => {
+    const inputs = Array.from({ length: 50 }, (_, i) => `model|prompt-${i}|output ${i}`)
+    expect(await sha256HexMany(inputs)).toEqual(inputs.map(nodeSha256))
+  })
+})
@@ -0,0 +1,30 @@
+/**
+ * Hashing helpers on WebCrypto (Workers-compatible), shared by submit and auth.
+ */
+
+const encoder = new TextEncoder()
+
+/** Two-character lowercase hex for every byte value. */
+const HEX_TABLE = Array.from({ length: 256 }, (_, b) => b.toString(16).padStart(2, '0'))
+
+/** Lowercase hex of `bytes` via table lookup — no per-byte toString/padStart. */
+export function toHex(bytes: Uint8Array): string {
+  let hex = ''
+  for (let i = 0; i < bytes.length; i++) hex += HEX_TABLE[bytes[i]]
+  return hex
+}
+
+/** SHA-256 of a UTF-8 string (or raw bytes) as lowercase hex. */
+export async function sha256Hex(input: string | Uint8Array): Promise<string> {
+  const data = typeof input === 'string' ? encoder.encode(input) : input
+  return toHex(new Uint8Array(await crypto.subtle.digest('SHA-256', data)))
+}
+
+/**
+ * Hash every input concurrently; results match `inputs` order.
+ * All digests are issued before any is awaited, so the runtime can overlap
+ * them instead of paying one round trip through the event loop per item.
+ */
+export function sha256HexMany(inputs: readonly string[]): Promise<string[]> {
+  return Promise.all(inputs.map((input) => sha256Hex(input)))
+}
@@ -0,0 +1,210 @@
+import { describe, it, expect, vi, beforeEach } from 'vitest'
+import type { MaintenanceMessage, MaintenanceLeaseJson } from './schemas'
+
+vi.mock('./buffer', () => ({
+  compactBuffer: vi.fn(),
+  runErasureJobs: vi.fn(),
+}))
+
+import { runMaintenance, consumeMaintenanceBatch, withMaintenanceLease, MAX_CHAIN } from './maintenance'
+import { compactBuffer, runErasureJobs } from './buffer'
+import { MemoryQueue } from './queue'
+import { SubrequestBudget } from './storage'
+
+const mockCompactBuffer = vi.mocked(compactBuffer)
+const mockRunErasureJobs = vi.mocked(runErasureJobs)
+
+const LEASE_KEY = '_maintenance/lease.json'
+
+/** In-memory R2 stand-in: get/put with etag preconditions, delete. */
+function makeBucket() {
+  const objects = new Map<string, { body: Uint8Array; etag: string }>()
+  let version = 0
+  const bucket = {
+    async get(key: string) {
+      const obj = objects.get(key)
+      if (!obj) return null
+      return { key, etag: obj.etag, arrayBuffer: async () => obj.body.slice().buffer }
+    },
+    async put(key: string, body: Uint8Array, opts?: { onlyIf?: { etagMatches?: string } }) {
+      const match = opts?.onlyIf?.etagMatches
+      if (match !== undefined && objects.get(key)?.etag !== match) return null
+      const etag = `v${++version}`
+      objects.set(key, { body: new Uint8Array(body), etag })
+      return { key, etag }
+    },
+    async delete(keys: string | string[]) {
+      for (const key of Array.isArray(keys) ? keys : [keys]) objects.delete(key)
+    },
+  }
+  const lease = () => {
+    const obj = objects.get(LEASE_KEY)
+    return obj ? JSON.parse(new TextDecoder().decode(obj.body)) as MaintenanceLeaseJson : null
+  }
+  const setLease = (value: MaintenanceLeaseJson) => bucket.put(LEASE_KEY, new TextEncoder().encode(JSON.stringify(value)))
+  return { bucket: bucket as unknown as R2Bucket, lease, setLease }
+}
+
+/**
+ * compactBuffer whose first `backlog` runs leave entries behind and the one
+ * after drains them. Runs with work charge up to `cost` calls; after that a
+ * run costs just its listings.
+ */
+function compactWithBacklog(backlog: number, cost = 20) {
+  let left = backlog
+  mockCompactBuffer.mockImplementation(async (_bucket, budget) => {
+    const working = left-- >= 0
+    budget!.charge(Math.min(working ? cost : 3, budget!.remaining()))
+    const entriesRemaining = left >= 0 ? 5 : undefined
+    return { archived: working ? 10 : 0, deltasMerged: 0, summariesFolded: 0, entriesRemaining, subrequestsUsed: budget!.used() }
+  })
+}
+
+beforeEach(() => {
+  vi.clearAllMocks()
+  mockRunErasureJobs.mockResolvedValue({ jobsCompleted: 0, jobsRemaining: 0, jobsWaiting: 0, subrequestsUsed: 1 })
+})
+
+describe('runMaintenance', () => {
+  it('repeats passes within the budget and releases the lease once drained', async () => {
+    const { bucket, lease } = makeBucket()
+    compactWithBacklog(1, 5)
+
+    const result = await runMaintenance(bucket, new SubrequestBudget(50))
+    expect(result).toMatchObject({ status: 'completed', passes: 2, archived: 20, backlog: false })
+    expect(mockRunErasureJobs).toHaveBeenCalledTimes(2)
+    expect(lease()).toBeNull()
+  })
+
+  it('chains through the queue while the backlog outlasts the budget', async () => {
+    const { bucket, lease } = makeBucket()
+    const queue = new MemoryQueue<MaintenanceMessage>()
+    compactWithBacklog(2, 100)
+
+    const first = await runMaintenance(bucket, new SubrequestBudget(50), { queue: queue as unknown as Queue<MaintenanceMessage> })
+    expect(first.status).toBe('chained')
+    const holder = lease()!.holder
+    expect(queue.size).toBe(1)
+
+    // Each link runs under the chain's lease with a fresh budget
+    const links: (string | undefined)[] = []
+    while (queue.size > 0) {
+      await queue.drain(async (batch) => {
+        const result = await consumeMaintenanceBatch(bucket, batch, new SubrequestBudget(50), queue as unknown as Queue<MaintenanceMessage>)
+        links.push(result?.status)
+        if (lease()) expect(lease()!.holder).toBe(holder)
+      })
+    }
+    // The draining link spends its whole budget, so erasure jobs get one more
+    expect(links).toEqual(['chained', 'chained', 'completed'])
+    expect(lease()).toBeNull()
+  })
+
+  it('stops chaining after MAX_CHAIN links', async () => {
+    const { bucket } = makeBucket()
+    const queue = new MemoryQueue<MaintenanceMessage>()
+    compactWithBacklog(Infinity, 100)
+
+    const result = await runMaintenance(bucket, new SubrequestBudget(50), {
+      queue: queue as unknown as Queue<MaintenanceMessage>, chain: MAX_CHAIN,
+    })
+    expect(result).toMatchObject({ status: 'completed', backlog: true })
+    expect(queue.size).toBe(0)
+  })
+
+  it('skips while another run holds the lease, and takes over an expired one', async () => {
+    const { bucket, lease, setLease } = makeBucket()
+    compactWithBacklog(0)
+
+    await setLease({ holder: 'other', expires_at: new Date(Date.now() + 60_000).toISOString() })
+    expect((await runMaintenance(bucket)).status).toBe('skipped')
+    expect(mockCompactBuffer).not.toHaveBeenCalled()
+    expect(lease()!.holder).toBe('other')
+
+    await setLease({ holder: 'other', expires_at: new Date(Date.now() - 1).toISOString() })
+    expect((await runMaintenance(bucket)).status).toBe('completed')
+    expect(lease()).toBeNull()
+  })
+
+  it('renews the lease between passes once half its TTL has gone', async () => {
+    const { bucket, lease } = makeBucket()
+    const now = vi.spyOn(Date, 'now')
+    let clock = Date.parse('2026-03-01T00:00:00Z')
+    now.mockImplementation(() => clock)
+    const expiries: string[] = []
+    let left = 2
+    mockCompactBuffer.mockImplementation(async (_bucket, budget) => {
+      expiries.push(lease()!.expires_at)
+      budget!.charge(5)
+      clock += 2 * 60_000
+      return { archived: 10, deltasMerged: 0, summariesFolded: 0, entriesRemaining: --left >= 0 ? 5 : undefined, subrequestsUsed: budget!.used() }
+    })
+
+    try {
+      const result = await runMaintenance(bucket, new SubrequestBudget(100))
+      expect(result).toMatchObject({ status: 'completed', passes: 3 })
+      // Taken at 0:00, still fresh at 0:02, renewed at 0:04 for another five minutes
+      expect(expiries).toEqual(['2026-03-01T00:05:00.000Z', '2026-03-01T00:05:00.000Z', '2026-03-01T00:09:00.000Z'])
+      expect(lease()).toBeNull()
+    } finally {
+      now.mockRestore()
+    }
+  })
+
+  it('stops without releasing a lease another run took over', async () => {
+    const { bucket, lease, setLease } = makeBucket()
+    const now = vi.spyOn(Date, 'now')
+    let clock = Date.parse('2026-03-01T00:00:00Z')
+    now.mockImplementation(() => clock)
+    mockCompactBuffer.mockImplementation(async (_bucket, budget) => {
+      budget!.charge(5)
+      clock += 6 * 60_000
+      await setLease({ holder: 'other', expires_at: new Date(clock + 60_000).toISOString() })
+      return { archived: 10, deltasMerged: 0, summariesFolded: 0, entriesRemaining: 5, subrequestsUsed: budget!.used() }
+    })
+
+    try {
+      const result = await runMaintenance(bucket, new SubrequestBudget(100))
+      expect(result).toMatchObject({ status: 'lost', passes: 1, backlog: true })
+      expect(mockCompactBuffer).toHaveBeenCalledTimes(1)
+      expect(lease()!.holder).toBe('other')
+    } finally {
+      now.mockRestore()
+    }
+  })
+})
+
+describe('withMaintenanceLease', () => {
+  it('runs under the lease and releases it, leaving room for the release', async () => {
+    const { bucket, lease } = makeBucket()
+    const budget = new SubrequestBudget(20)
+    const result = await withMaintenanceLease(bucket, budget, async (sub) => {
+      expect(lease()).not.toBeNull()
+      // Lease read and write spent, one call held back for the release
+      expect(sub.remaining()).toBe(17)
+      sub.charge(sub.remaining())
+      return 'done'
+    })
+    expect(result).toBe('done')
+    expect(lease()).toBeNull()
+    expect(budget.used()).toBe(20)
+  })
+
+  it('does not run while a scheduled run holds the lease', async () => {
+    const { bucket, lease, setLease } = makeBucket()
+    await setLease({ holder: 'cron', expires_at: new Date(Date.now() + 60_000).toISOString() })
+    const fn = vi.fn(async () => 'done')
+
+    expect(await withMaintenanceLease(bucket, new SubrequestBudget(20), fn)).toBeNull()
+    expect(fn).not.toHaveBeenCalled()
+    expect(lease()!.holder).toBe('cron')
+  })
+
+  it('releases the lease when the run throws', async () => {
+    const { bucket, lease } = makeBucket()
+    await expect(withMaintenanceLease(bucket, new SubrequestBudget(20), async () => {
+      throw new Error('boom')
+    })).rejects.toThrow('boom')
+    expect(lease()).toBeNull()
+  })
+})
@@ -0,0 +1,167 @@
+/**
+ * Scheduled maintenance: compaction (archive, chart merge, summary folds)
+ * followed by pending GDPR erasure jobs, run from the worker's cron trigger.
+ * While a backlog remains, a run hands off to a fresh invocation through a
+ * message on MAINTENANCE_QUEUE instead of waiting for the next tick. A lease
+ * object keeps cron ticks, chains and manual admin runs from compacting the
+ * same entries twice.
+ */
+import type { MaintenanceMessage, MaintenanceLeaseJson } from './schemas'
+import { compactBuffer, runErasureJobs } from './buffer'
+import {
+  downloadFileWithEtag,
+  uploadFile,
+  uploadFileConditional,
+  deleteFile,
+  SubrequestBudget,
+} from './storage'
+
+const LEASE_KEY = '_maintenance/lease.json'
+const LEASE_TTL_MS = 5 * 60_000
+const LEASE_RENEW_AFTER_MS = LEASE_TTL_MS / 2
+const LEASE_RENEW = 2      // lease read + conditional write
+const HANDOFF_RESERVE = 1  // lease release or chain message
+const PASS_MIN = 8         // compaction listings, legacy check, one entry and its archive writes
+const ERASURE_MIN = 6      // pending-job listing + one job's read, wait check and writes
+
+/** Chain links after a cron tick before the rest is left to the next tick */
+export const MAX_CHAIN = 50
+
+const encoder = new TextEncoder()
+const decoder = new TextDecoder()
+
+export interface MaintenanceResult {
+  status: 'completed' | 'chained' | 'skipped' | 'lost'   // skipped: another run holds the lease; lost: it expired and was taken over
+  passes: number
+  archived: number
+  deltasMerged: number
+  jobsCompleted: number
+  backlog: boolean
+  chain: number
+  subrequestsUsed: number
+}
+
+export function isMaintenanceMessage(body: unknown): body is MaintenanceMessage {
+  return (body as { kind?: unknown } | null)?.kind === 'maintenance'
+}
+
+/**
+ * Take the lease for `holder`: free, expired or already theirs, in which case
+ * it is renewed. A concurrent taker loses the etag race and gets false.
+ */
+async function acquireLease(bucket: R2Bucket, holder: string, budget: SubrequestBudget): Promise<boolean> {
+  const { body, etag } = await downloadFileWithEtag(bucket, LEASE_KEY, budget)
+  if (body) {
+    const lease = JSON.parse(decoder.decode(body)) as MaintenanceLeaseJson
+    if (lease.holder !== holder && Date.parse(lease.expires_at) > Date.now()) return false
+  }
+  const next: MaintenanceLeaseJson = { holder, expires_at: new Date(Date.now() + LEASE_TTL_MS).toISOString() }
+  const buf = encoder.encode(JSON.stringify(next))
+  try {
+    if (etag) {
+      await uploadFileConditional(bucket, LEASE_KEY, buf, etag, budget)
+    } else {
+      await uploadFile(bucket, LEASE_KEY, buf, budget)
+    }
+  } catch (err: unknown) {
+    if ((err as { status?: number }).status === 412) return false
+    throw err
+  }
+  return true
+}
+
+/**
+ * Run `fn` under the maintenance lease with a fresh holder, for manual admin
+ * runs; null without running it while another run holds the lease. `fn` gets
+ * a budget that leaves room for the release.
+ */
+export async function withMaintenanceLease<T>(
+  bucket: R2Bucket,
+  budget: SubrequestBudget,
+  fn: (budget: SubrequestBudget) => Promise<T>
+): Promise<T | null> {
+  if (!await acquireLease(bucket, crypto.randomUUID(), budget)) return null
+  const sub = new SubrequestBudget(budget.remaining() - HANDOFF_RESERVE)
+  try {
+    return await fn(sub)
+  } finally {
+    budget.charge(sub.used())
+    await deleteFile(bucket, LEASE_KEY, budget)
+  }
+}
+
+/**
+ * One link of scheduled maintenance: compaction then erasure jobs, repeated
+ * while a backlog remains and the budget allows. If the backlog outlasts the
+ * budget and a queue is bound, the lease is kept and a message carries the
+ * run on (up to MAX_CHAIN links); otherwise the lease is released and the
+ * next cron tick continues. The lease is renewed between passes once half
+ * its TTL has gone; a run that finds it taken over stops where it is.
+ */
+export async function runMaintenance(
+  bucket: R2Bucket,
+  budget: SubrequestBudget = new SubrequestBudget(),
+  { queue, holder = crypto.randomUUID(), chain = 0 }: {
+    queue?: Queue<MaintenanceMessage>
+    holder?: string
+    chain?: number
+  } = {}
+): Promise<MaintenanceResult> {
+  const result: MaintenanceResult = {
+    status: 'completed', passes: 0, archived: 0, deltasMerged: 0, jobsCompleted: 0, backlog: true, chain, subrequestsUsed: 0,
+  }
+  if (!await acquireLease(bucket, holder, budget)) {
+    return { ...result, status: 'skipped', subrequestsUsed: budget.used() }
+  }
+
+  let renewAt = Date.now() + LEASE_RENEW_AFTER_MS
+  while (result.backlog) {
+    const renew = Date.now() >= renewAt
+    if (budget.remaining() < (renew ? LEASE_RENEW : 0) + PASS_MIN + HANDOFF_RESERVE) break
+    if (renew) {
+      if (!await acquireLease(bucket, holder, budget)) {
+        return { ...result, status: 'lost', subrequestsUsed: budget.used() }
+      }
+      renewAt = Date.now() + LEASE_RENEW_AFTER_MS
+    }
+    const sub = new SubrequestBudget(budget.remaining() - HANDOFF_RESERVE)
+    const compact = await compactBuffer(bucket, sub)
+    // Erasure gets what compaction left; without room for it, another pass does
+    const erasure = sub.remaining() >= ERASURE_MIN ? await runErasureJobs(bucket, sub) : null
+    budget.charge(sub.used())
+
+    result.passes++
+    result.archived += compact.archived
+    result.deltasMerged += compact.deltasMerged
+    result.jobsCompleted += erasure?.jobsCompleted ?? 0
+    result.backlog = compact.entriesRemaining !== undefined
+      || compact.deltasRemaining !== undefined
+      || erasure === null
+      || erasure.jobsRemaining > 0
+  }
+
+  if (result.backlog && queue && chain < MAX_CHAIN) {
+    await queue.send({ kind: 'maintenance', holder, chain: chain + 1 })
+    result.status = 'chained'
+  } else {
+    await deleteFile(bucket, LEASE_KEY, budget)
+  }
+  return { ...result, subrequestsUsed: budget.used() }
+}
+
+/**
+ * Queue consumer for chain messages: runs the next link under the lease the
+ * chain holds. Redelivered or duplicate messages in one batch run it once.
+ */
+export async function consumeMaintenanceBatch(
+  bucket: R2Bucket,
+  batch: MessageBatch<MaintenanceMessage>,
+  budget: SubrequestBudget = new SubrequestBudget(),
+  queue?: Queue<MaintenanceMessage>
+): Promise<MaintenanceResult | null> {
+  const [first] = batch.messages
+  if (!first) return null
+  const result = await runMaintenance(bucket, budget, { queue, holder: first.body.holder, chain: first.body.chain })
+  batch.ackAll()
+  return result
+}
@@ -0,0 +1,74 @@
+// @vitest-environment node
+import { describe, it, expect } from 'vitest'
+import { readNdjsonLines, type NdjsonLimits } from './ndjson'
+
+const encoder = new TextEncoder()
+const LIMITS: NdjsonLimits = { maxLineBytes: 64, maxTotalBytes: 1024 }
+
+/** A body delivered in the given chunks, recording whether it was cancelled. */
+function streamOf(chunks: string[]) {
+  const state = { cancelled: false }
+  let i = 0
+  const body = new ReadableStream<Uint8Array>({
+    pull(controller) {
+      if (i < chunks.length) controller.enqueue(encoder.encode(chunks[i++]))
+      else controller.close()
+    },
+    cancel() { state.cancelled = true },
+  })
+  return { body, state }
+}
+
+async function collect(chunks: string[], limits = LIMITS) {
+  const out: [number, string][] = []
+  for await (const { line, lineNumber } of readNdjsonLines(streamOf(chunks).body, limits)) {
+    out.push([lineNumber, line])
+  }
+  return out
+}
+
+describe('readNdjsonLines', () => {
+  it('reassembles lines split across chunks and skips blank lines', async () => {
+    expect(await collect(['{"a":', '1}\n\n{"b"', ':2}\r\n', '{"c":3}'])).toEqual([
+      [1, '{"a":1}'],
+      [3, '{"b":2}'],
+      [4, '{"c":3}'],
+    ])
+  })
+
+  it('decodes multi-byte characters split between chunks', async () => {
+    const bytes = encoder.encode('"héllo"\n')
+    const body = new ReadableStream<Uint8Array>({
+      start(controller) {
+        controller.enqueue(bytes.slice(0, 3))
+        controller.enqueue(bytes.slice(3))
+        controller.close()
+      },
+    })
+    const lines = []
+    for await (const { line, bytes } of readNdjsonLines(body, LIMITS)) lines.push([line, bytes])
+    // Sizes are in bytes, not UTF-16 code units
+    expect(lines).toEqual([['"héllo"', 8]])
+  })
+
+  it('rejects an over-long line with status 413 before it completes', async () => {
+    const { body, state } = streamOf(['{"ok":1}\n', 'x'.repeat(40), 'x'.repeat(40), '\n'])
+    const seen: string[] = []
+    const err = await (async () => {
+      try {
+        for await (const { line } of readNdjsonLines(body, LIMITS)) seen.push(line)
+      } catch (e) {
+        return e as Error & { status: number }
+      }
+    })()
+    expect(seen).toEqual(['{"ok":1}'])
+    expect(err?.status).toBe(413)
+    expect(err?.message).toContain('Line 2')
+    expect(state.cancelled).toBe(true)
+  })
+
+  it('rejects a body over the total limit', async () => {
+    const chunks = Array.from({ length: 40 }, (_, i) => `{"n":${i}}${' '.repeat(20)}\n`)
+    await expect(collect(chunks)).rejects.toMatchObject({ status: 413 })
+  })
+})
@@ -0,0 +1,98 @@
+/**
+ * Incremental NDJSON reader for request bodies — yields one line at a time so
+ * an upload is never held in memory as a whole. Byte limits are enforced on
+ * the raw stream, before a line is decoded or parsed.
+ */
+
+export interface NdjsonLimits {
+  maxLineBytes: number
+  maxTotalBytes: number
+}
+
+export interface NdjsonLine {
+  line: string
+  lineNumber: number  // 1-based, counting blank lines
+  bytes: number       // raw size, including a dropped trailing \r
+}
+
+const NEWLINE = 0x0a
+
+function tooLarge(message: string): Error & { status: number } {
+  const err = new Error(message) as Error & { status: number }
+  err.status = 413
+  return err
+}
+
+function joinBytes(parts: Uint8Array[], last: Uint8Array): Uint8Array {
+  if (parts.length === 0) return last
+  const out = new Uint8Array(parts.reduce((n, p) => n + p.length, last.length))
+  let offset = 0
+  for (const p of [...parts, last]) {
+    out.set(p, offset)
+    offset += p.length
+  }
+  return out
+}
+
+/**
+ * Split `body` into lines, skipping blank ones (a trailing \r is dropped).
+ * Throws an error with status 413 once a line or the whole body exceeds its
+ * limit. Stopping early cancels the stream so the rest is never read.
+ */
+export async function* readNdjsonLines(
+  body: ReadableStream<Uint8Array>,
+  limits: NdjsonLimits
+): AsyncGenerator<NdjsonLine> {
+  const decoder = new TextDecoder()
+  const reader = body.getReader()
+  let partial: Uint8Array[] = []
+  let partialBytes = 0
+  let totalBytes = 0
+  let lineNumber = 0
+  let finished = false
+
+  const emit = (tail: Uint8Array): NdjsonLine | null => {
+    lineNumber++
+    const raw = joinBytes(partial, tail)
+    const line = decoder.decode(raw).replace(/\r$/, '')
+    partial = []
+    partialBytes = 0
+    return line.trim() ? { line, lineNumber, bytes: raw.length } : null
+  }
+  const lineTooLong = () => tooLarge(`Line ${lineNumber + 1} exceeds ${limits.maxLineBytes} bytes`)
+
+  try {
+    for (;;) {
+      const { done, value } = await reader.read()
+      if (done) break
+      totalBytes += value.length
+      if (totalBytes > limits.maxTotalBytes) {
+        throw tooLarge(`Body exceeds ${limits.maxTotalBytes} bytes`)
+      }
+
+      let start = 0
+      for (let nl = value.indexOf(NEWLINE); nl !== -1; nl = value.indexOf(NEWLINE, start)) {
+        if (partialBytes + nl - start > limits.maxLineBytes) throw lineTooLong()
+        const next = emit(value.subarray(start, nl))
+        start = nl + 1
+        if (next) yield next
+      }
+
+      const rest = value.subarray(start)
+      if (partialBytes + rest.length > limits.maxLineBytes) throw lineTooLong()
+      if (rest.length > 0) {
+        // Copy so the (possibly large) network chunk is not retained
+        partial.push(rest.slice())
+        partialBytes += rest.length
+      }
+    }
+    finished = true
+    if (partialBytes > 0) {
+      const last = emit(new Uint8Array())
+      if (last) yield last
+    }
+  } finally {
+    if (finished) reader.releaseLock()
+    else await reader.cancel().catch(() => {})
+  }
+}
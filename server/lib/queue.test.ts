@@ -0,0 +1,144 @@
+import { describe, it, expect, vi, beforeEach } from 'vitest'
+import type { IngestMessage, StorageRecord } from './schemas'
+
+vi.mock('./buffer', () => ({
+  writeBufferEntry: vi.fn(),
+  writeSummaryDelta: vi.fn(),
+  readErasureJob: vi.fn(),
+}))
+
+import { enqueueRecords, consumeIngestBatch, MemoryQueue } from './queue'
+import { writeBufferEntry, writeSummaryDelta, readErasureJob } from './buffer'
+import { SubrequestBudget } from './storage'
+
+const mockWriteBufferEntry = vi.mocked(writeBufferEntry)
+const mockWriteSummaryDelta = vi.mocked(writeSummaryDelta)
+const mockReadErasureJob = vi.mocked(readErasureJob)
+const fakeBucket = {} as R2Bucket
+
+function makeRecord(overrides: Partial<StorageRecord> = {}): StorageRecord {
+  return {
+    id: '00000000-0000-4000-8000-000000000001',
+    timestamp: '2026-02-21T12:00:00.000Z',
+    user_id: 'user1',
+    model_id: 'gpt-5',
+    prompt_id: 'prompt1',
+    output: 'test output',
+    output_hash: 'sha256:abc',
+    metadata_json: '{}',
+    year: 2026,
+    month: 2,
+    day: 21,
+    score: null,
+    ...overrides,
+  }
+}
+
+/** Enqueue through a MemoryQueue and hand every message to the consumer. */
+async function drainTo(queue: MemoryQueue<IngestMessage>, budget?: SubrequestBudget) {
+  const results: { stored: number; retried: number; dropped: number }[] = []
+  await queue.drain(async (batch) => { results.push(await consumeIngestBatch(fakeBucket, batch, budget)) })
+  return results
+}
+
+beforeEach(() => {
+  vi.clearAllMocks()
+  mockWriteBufferEntry.mockResolvedValue(undefined)
+  mockWriteSummaryDelta.mockResolvedValue(undefined)
+  mockReadErasureJob.mockResolvedValue(null)
+})
+
+describe('enqueueRecords', () => {
+  it('splits records into messages under the size cap', async () => {
+    const queue = new MemoryQueue<IngestMessage>()
+    const big = 'x'.repeat(50 * 1024)
+    const records = [1, 2, 3, 4, 5].map(() => makeRecord({ output: big }))
+
+    expect(await enqueueRecords(queue as unknown as Queue<IngestMessage>, 'user1', records)).toBe(true)
+    // Two ~50 KiB records per 120 KiB message
+    expect(queue.size).toBe(3)
+  })
+
+  it('refuses records too large for a message, sending nothing', async () => {
+    const queue = new MemoryQueue<IngestMessage>()
+    const records = [makeRecord(), makeRecord({ output: 'x'.repeat(200 * 1024) })]
+    expect(await enqueueRecords(queue as unknown as Queue<IngestMessage>, 'user1', records)).toBe(false)
+    expect(queue.size).toBe(0)
+  })
+})
+
+describe('consumeIngestBatch', () => {
+  it('writes one buffer entry and summary delta per user and acknowledges', async () => {
+    const queue = new MemoryQueue<IngestMessage>()
+    const send = (userId: string, n: number) =>
+      enqueueRecords(queue as unknown as Queue<IngestMessage>, userId, Array.from({ length: n }, () => makeRecord({ user_id: userId })))
+    await send('user1', 2)
+    await send('user2', 1)
+    await send('user1', 3)
+
+    expect(await drainTo(queue)).toEqual([{ stored: 6, retried: 0, dropped: 0 }])
+    expect(mockWriteBufferEntry.mock.calls.map(([, records]) => records.length)).toEqual([5, 1])
+    expect(mockWriteSummaryDelta.mock.calls.map(([, userId]) => userId)).toEqual(['user1', 'user2'])
+    expect(queue.size).toBe(0)
+  })
+
+  it('retries a user whose write fails, and users past the budget', async () => {
+    const queue = new MemoryQueue<IngestMessage>()
+    for (const userId of ['user1', 'user2', 'user3']) {
+      await enqueueRecords(queue as unknown as Queue<IngestMessage>, userId, [makeRecord({ user_id: userId })])
+    }
+    mockWriteBufferEntry.mockRejectedValueOnce(new Error('R2 down'))
+
+    // Room for two users' reads and writes: user1 fails, user3 does not fit
+    expect(await drainTo(queue, new SubrequestBudget(8))).toEqual([{ stored: 1, retried: 2, dropped: 0 }])
+    expect(queue.size).toBe(2)
+
+    expect(await drainTo(queue)).toEqual([{ stored: 2, retried: 0, dropped: 0 }])
+    expect(queue.size).toBe(0)
+  })
+
+  it('dates each entry by when its records were submitted, not when they are delivered', async () => {
+    const queue = new MemoryQueue<IngestMessage>()
+    await enqueueRecords(queue as unknown as Queue<IngestMessage>, 'user1', [
+      makeRecord({ timestamp: '2026-02-21T12:10:00.000Z' }),
+      makeRecord({ timestamp: '2026-02-21T13:05:00.000Z' }),
+      makeRecord({ timestamp: '2026-02-21T12:40:00.000Z' }),
+    ])
+
+    await drainTo(queue)
+
+    expect(mockWriteBufferEntry.mock.calls.map(([, records, at]) => [records.length, at!.toISOString()])).toEqual([
+      [2, '2026-02-21T12:10:00.000Z'],
+      [1, '2026-02-21T13:05:00.000Z'],
+    ])
+    expect(mockWriteSummaryDelta).toHaveBeenCalledTimes(1)
+  })
+
+  it("drops records submitted before the user's erasure request", async () => {
+    const queue = new MemoryQueue<IngestMessage>()
+    await enqueueRecords(queue as unknown as Queue<IngestMessage>, 'user1', [
+      makeRecord({ timestamp: '2026-02-21T12:00:00.000Z' }),
+      makeRecord({ timestamp: '2026-02-21T12:30:00.000Z' }),
+    ])
+    mockReadErasureJob.mockResolvedValue({ requested_at: '2026-02-21T12:15:00.000Z' } as Awaited<ReturnType<typeof readErasureJob>>)
+
+    expect(await drainTo(queue)).toEqual([{ stored: 1, retried: 0, dropped: 1 }])
+    expect(mockWriteBufferEntry.mock.calls[0][1].map((r) => r.timestamp)).toEqual(['2026-02-21T12:30:00.000Z'])
+    expect(mockWriteSummaryDelta.mock.calls[0][2]).toHaveLength(1)
+    expect(queue.size).toBe(0)
+  })
+})
+
+describe('MemoryQueue', () => {
+  it('redelivers unacknowledged messages when the consumer throws', async () => {
+    const queue = new MemoryQueue<string>()
+    await queue.sendBatch([{ body: 'a' }, { body: 'b' }])
+    await queue.drain(async (batch) => {
+      batch.messages[0].ack()
+      throw new Error('consumer failed')
+    })
+    const attempts: number[] = []
+    await queue.drain(async (batch) => { for (const m of batch.messages) attempts.push(m.attempts) })
+    expect(attempts).toEqual([2])
+  })
+})
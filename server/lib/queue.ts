@@ -0,0 +1,206 @@
+/**
+ * Queue-backed ingest. With an INGEST_QUEUE producer bound, the submit routes
+ * validate and hash, enqueue the records and answer 202; the worker's queue()
+ * handler later writes each batch as one buffer entry and one summary delta
+ * per user. MemoryQueue stands in for the binding in dev and tests.
+ */
+import type { IngestMessage, StorageRecord } from './schemas'
+import { writeBufferEntry, writeSummaryDelta, readErasureJob } from './buffer'
+import { mapWithConcurrency, MAX_CONCURRENT_REQUESTS, SubrequestBudget } from './storage'
+
+/** Queues caps: 128 KB per message, 100 messages and 256 KB per sendBatch. Kept under with room for framing. */
+const MAX_MESSAGE_BYTES = 120 * 1024
+const MAX_SEND_MESSAGES = 100
+const MAX_SEND_BYTES = 240 * 1024
+const INGEST_READS = 2   // pending + completed erasure job, per user in a batch
+const INGEST_WRITES = 1  // summary delta per user, plus a buffer entry per submit hour
+
+const encoder = new TextEncoder()
+
+function messageBytes(message: IngestMessage): number {
+  return encoder.encode(JSON.stringify(message)).length
+}
+
+/**
+ * Records split into messages under the size cap, or null if any single
+ * record is too large to travel by queue (the caller then stores inline).
+ */
+function packMessages(userId: string, records: StorageRecord[]): { body: IngestMessage; bytes: number }[] | null {
+  const overhead = messageBytes({ version: 1, user_id: userId, records: [] })
+  const packed: { body: IngestMessage; bytes: number }[] = []
+  let current: { body: IngestMessage; bytes: number } | null = null
+  for (const record of records) {
+    const size = encoder.encode(JSON.stringify(record)).length + 1
+    if (overhead + size > MAX_MESSAGE_BYTES) return null
+    if (!current || current.bytes + size > MAX_MESSAGE_BYTES) {
+      current = { body: { version: 1, user_id: userId, records: [] }, bytes: overhead }
+      packed.push(current)
+    }
+    current.body.records.push(record)
+    current.bytes += size
+  }
+  return packed
+}
+
+/**
+ * Enqueue `records` for the ingest consumer. Returns false without sending
+ * anything when a record exceeds the message size cap.
+ */
+export async function enqueueRecords(
+  queue: Queue<IngestMessage>,
+  userId: string,
+  records: StorageRecord[]
+): Promise<boolean> {
+  const messages = packMessages(userId, records)
+  if (!messages) return false
+
+  let batch: MessageSendRequest<IngestMessage>[] = []
+  let batchBytes = 0
+  for (const { body, bytes } of messages) {
+    if (batch.length === MAX_SEND_MESSAGES || batchBytes + bytes > MAX_SEND_BYTES) {
+      await queue.sendBatch(batch)
+      batch = []
+      batchBytes = 0
+    }
+    batch.push({ body })
+    batchBytes += bytes
+  }
+  if (batch.length > 0) await queue.sendBatch(batch)
+  return true
+}
+
+/** Records grouped by the hour they were submitted in, so each entry keeps its own chart bucket. */
+function bySubmitHour(records: StorageRecord[]): StorageRecord[][] {
+  const hours = new Map<string, StorageRecord[]>()
+  for (const r of records) {
+    const hour = r.timestamp.slice(0, 13)
+    if (!hours.has(hour)) hours.set(hour, [])
+    hours.get(hour)!.push(r)
+  }
+  return Array.from(hours.values())
+}
+
+/**
+ * Queue consumer: write the batch's records as one summary delta per user
+ * and a buffer entry per hour they were submitted in, dated by their own
+ * timestamps rather than by delivery, then acknowledge that user's messages.
+ * Records submitted before the user's latest erasure request are dropped:
+ * the job may already have planned, or finished, without them. A user whose
+ * writes fail, or who does not fit in the subrequest budget, has their
+ * messages retried. Delivery is at-least-once, so a redelivered message
+ * whose write had succeeded is stored twice.
+ */
+export async function consumeIngestBatch(
+  bucket: R2Bucket,
+  batch: MessageBatch<IngestMessage>,
+  budget: SubrequestBudget = new SubrequestBudget()
+): Promise<{ stored: number; retried: number; dropped: number }> {
+  const byUser = new Map<string, Message<IngestMessage>[]>()
+  for (const message of batch.messages) {
+    const userId = message.body.user_id
+    if (!byUser.has(userId)) byUser.set(userId, [])
+    byUser.get(userId)!.push(message)
+  }
+
+  // Users in order while their reads and writes (an entry per submit hour) fit
+  const groups = Array.from(byUser, ([userId, messages]) => {
+    const records = messages.flatMap((m) => m.body.records)
+    return { userId, messages, records, calls: INGEST_READS + INGEST_WRITES + bySubmitHour(records).length }
+  })
+  let fit = 0
+  for (let cost = 0; fit < groups.length && cost + groups[fit].calls <= budget.remaining(); fit++) {
+    cost += groups[fit].calls
+  }
+  let stored = 0
+  let retried = 0
+  let dropped = 0
+  for (const { messages } of groups.slice(fit)) {
+    for (const m of messages) m.retry()
+    retried += messages.length
+  }
+
+  await mapWithConcurrency(groups.slice(0, fit), async ({ userId, messages, records }) => {
+    try {
+      const erasure = await readErasureJob(bucket, userId, budget)
+      const kept = erasure ? records.filter((r) => r.timestamp > erasure.requested_at) : records
+      const hours = bySubmitHour(kept)
+      budget.charge(INGEST_WRITES + hours.length)
+      await Promise.all([
+        ...hours.map((hour) => writeBufferEntry(bucket, hour, new Date(hour[0].timestamp))),
+        writeSummaryDelta(bucket, userId, kept),
+      ])
+      for (const m of messages) m.ack()
+      stored += kept.length
+      dropped += records.length - kept.length
+    } catch {
+      for (const m of messages) m.retry()
+      retried += messages.length
+    }
+  }, MAX_CONCURRENT_REQUESTS / INGEST_READS)
+
+  return { stored, retried, dropped }
+}
+
+/**
+ * In-memory stand-in for a Queue binding. Messages wait until drain() hands
+ * them to a consumer in batches; as on Cloudflare, a message the consumer
+ * retries — or leaves unacknowledged when it throws — is delivered again on
+ * a later drain.
+ */
+export class MemoryQueue<Body> {
+  readonly name: string
+  private pending: { id: string; body: Body; timestamp: Date; attempts: number }[] = []
+  private nextId = 0
+
+  constructor(name: string = 'memory') {
+    this.name = name
+  }
+
+  /** Messages waiting for delivery */
+  get size(): number {
+    return this.pending.length
+  }
+
+  async send(body: Body): Promise<void> {
+    this.pending.push({ id: String(++this.nextId), body, timestamp: new Date(), attempts: 0 })
+  }
+
+  async sendBatch(messages: Iterable<MessageSendRequest<Body>>): Promise<void> {
+    for (const { body } of messages) await this.send(body)
+  }
+
+  /** Deliver every message pending now, `maxBatchSize` at a time. */
+  async drain(consume: (batch: MessageBatch<Body>) => Promise<unknown>, maxBatchSize: number = 100): Promise<void> {
+    const queued = this.pending
+    this.pending = []
+    while (queued.length > 0) {
+      const taken = queued.splice(0, maxBatchSize)
+      const outcome = new Map<number, 'ack' | 'retry'>()
+      const messages = taken.map((m, i) => ({
+        id: m.id,
+        timestamp: m.timestamp,
+        body: m.body,
+        attempts: m.attempts + 1,
+        ack: () => { if (!outcome.has(i)) outcome.set(i, 'ack') },
+        retry: () => { if (!outcome.has(i)) outcome.set(i, 'retry') },
+      }))
+      const batch = {
+        queue: this.name,
+        messages,
+        ackAll: () => messages.forEach((m) => m.ack()),
+        retryAll: () => messages.forEach((m) => m.retry()),
+      }
+      let failed = false
+      try {
+        await consume(batch as unknown as MessageBatch<Body>)
+      } catch {
+        failed = true
+      }
+      taken.forEach((m, i) => {
+        if ((outcome.get(i) ?? (failed ? 'retry' : 'ack')) === 'retry') {
+          this.pending.push({ ...m, attempts: m.attempts + 1 })
+        }
+      })
+    }
+  }
+}
@@ -3,6 +3,7 @@
  * Zod is Workers-compatible, no changes needed from lib/schemas.ts.
  */
 import { z } from "zod";
+import type { BloomFilter } from "./bloom";
 
 export const SubmissionRequestSchema = z.object({
   model_id: z.string().max(256),
@@ -14,6 +15,40 @@ export const SubmissionRequestSchema = z.object({
 
 export type SubmissionRequest = z.infer<typeof SubmissionRequestSchema>;
 
+/** Stored form of an output hash: `sha256:` + 64 lowercase hex digits */
+export const OutputHashSchema = z.string().regex(/^sha256:[0-9a-f]{64}$/);
+
+/**
+ * Hash-first submission: a result whose output the server already holds,
+ * sent by reference (see POST /api/submit/negotiate) instead of as text.
+ */
+export const SubmissionRefSchema = z.object({
+  model_id: z.string().max(256),
+  prompt_id: z.string().max(256),
+  output_hash: OutputHashSchema,
+  score: z.number().min(0).max(1).nullable().optional(),
+  metadata: z.record(z.string(), z.unknown()).optional().default({}),
+});
+
+export type SubmissionRef = z.infer<typeof SubmissionRefSchema>;
+
+/** A result carrying its output, or a reference to one (tried in that order) */
+export const SubmissionOrRefSchema = z.union([SubmissionRequestSchema, SubmissionRefSchema]);
+
+export type SubmissionOrRef = z.infer<typeof SubmissionOrRefSchema>;
+
+export const OutputRefSchema = z.object({
+  model_id: z.string().max(256),
+  prompt_id: z.string().max(256),
+  output_hash: OutputHashSchema,
+});
+
+export type OutputRef = z.infer<typeof OutputRefSchema>;
+
+export const NegotiateRequestSchema = z.object({
+  results: z.array(OutputRefSchema).max(1000),
+});
+
 export const BatchSubmissionRequestSchema = z.object({
   suite_version: z.string(),
   suite_hash: z.string(),
@@ -21,7 +56,7 @@ export const BatchSubmissionRequestSchema = z.object({
   temperature: z.number(),
   seed: z.number().nullable().optional(),
   timestamp: z.string(),
-  results: z.array(SubmissionRequestSchema).max(1000),
+  results: z.array(SubmissionOrRefSchema).max(1000),
 });
 
 export type BatchSubmissionRequest = z.infer<
@@ -44,6 +79,12 @@ export interface StorageRecord {
   score: number | null;
 }
 
+/** The columns chart/summary aggregation reads; archive sidecars hold only these */
+export type AggregateRow = Pick<
+  StorageRecord,
+  'timestamp' | 'user_id' | 'model_id' | 'prompt_id' | 'output_hash' | 'year' | 'month' | 'day'
+>;
+
 /** Hash-based output consistency stats for a model in a given bucket */
 export interface ModelBucketStats {
   submissions: number;       // total submission records
@@ -55,16 +96,75 @@ export interface ModelBucketStats {
 /** @deprecated Use ModelBucketStats */
 export type ModelDayStats = ModelBucketStats;
 
-/** Aggregated chart data stored as _aggregated/chart_data.json */
+/** Chart index stored as _aggregated/chart_data.json (public — no writer state, no buckets) */
 export interface ChartJson {
-  version: 5;
-  data: Record<string, Record<string, ModelBucketStats>>;  // bucket (YYYY-MM-DD-HH) → model → stats
+  version: 7;
+  months: string[];                        // YYYY-MM with a shard, sorted
   models: string[];
   total_submissions: number;
   total_contributors: number;
   last_updated: string;                    // ISO 8601 timestamp of last rebuild/merge
-  _prev_hashes: Record<string, string>;   // "model|prompt" → last output_hash
-  _known_users: string[];                  // deduplicated contributor list
+}
+
+/** One month of hourly buckets plus their rollups, stored as _aggregated/chart/YYYY-MM.json */
+export interface ChartShardJson {
+  version: 1 | 2;
+  month: string;                           // YYYY-MM
+  data: Record<string, Record<string, ModelBucketStats>>;     // bucket (YYYY-MM-DD-HH) → model → stats
+  daily?: Record<string, Record<string, ModelBucketStats>>;   // v2: YYYY-MM-DD → model → stats
+  weekly?: Record<string, Record<string, ModelBucketStats>>;  // v2: week's Monday → this month's days only
+}
+
+/** Writer-only aggregation state stored as _aggregated/chart_state.json */
+export interface ChartStateJson {
+  version: 1;
+  prev_hashes: Record<string, string>;    // "model|prompt" → last output_hash
+  known_users: string[];                   // deduplicated contributor list
+  merged_batch?: string;                   // id of the last compaction batch whose entry headers are merged
+}
+
+/** One point of the /api/data/chart series: `model` (submissions), `model_prompts`, ... per model */
+export interface ChartPoint {
+  date: string;
+  [key: string]: string | number;
+}
+
+/** Body of GET /api/data/chart */
+export interface ChartResponseJson {
+  granularity: '1h' | '1d' | '1w';         // stored level the points were served from
+  data: ChartPoint[];
+  models: string[];
+  total_submissions: number;
+  total_contributors: number;
+  last_updated: string;
+}
+
+/** Per-model series of the chart API: `model`, `model_prompts`, ... in the wide format */
+export type ChartSeriesField = 'submissions' | 'prompts' | 'unique_outputs' | 'drifted' | 'consistency';
+
+/** Body of GET /api/data/chart?format=columnar — every array is aligned with `dates` */
+export interface ChartColumnarResponseJson {
+  granularity: '1h' | '1d' | '1w';
+  dates: string[];
+  series: Record<string, Partial<Record<ChartSeriesField, (number | null)[]>>>;  // model → field → values (null = no data)
+  models: string[];
+  total_submissions: number;
+  total_contributors: number;
+  last_updated: string;
+}
+
+/**
+ * One month of one chart level, pre-serialized when its shard is written and
+ * stored as _aggregated/chart/YYYY-MM/{level}.json. Each series is the body of
+ * its JSON array (values joined by commas), aligned with `dates`, so the chart
+ * route concatenates fragments instead of building the response.
+ */
+export interface ChartFragmentJson {
+  version: 1;
+  month: string;                           // YYYY-MM
+  granularity: '1h' | '1d' | '1w';
+  dates: string[];                         // sorted level keys
+  series: Record<string, Record<ChartSeriesField, string>>;  // model → field → "1,null,3"
 }
 
 /** Delta record written per submit for incremental chart aggregation */
@@ -75,17 +175,111 @@ export interface DeltaRecord {
   user_id: string;
 }
 
-/** Delta file written to _deltas/{day}/{timestamp}_{random}.json */
+/** Chart delta: the header of each buffer ingest entry, and legacy files under _deltas/{day}/{timestamp}_{random}.json */
 export interface ChartDelta {
   ts: number;         // Date.now()
   bucket: string;     // "YYYY-MM-DD-HH"
   records: DeltaRecord[];
 }
 
+/** Queue message carrying validated, hashed records from a submit to the ingest consumer */
+export interface IngestMessage {
+  version: 1;
+  user_id: string;
+  records: StorageRecord[];
+}
+
+/** Queue message handing a scheduled maintenance run on to the next invocation */
+export interface MaintenanceMessage {
+  kind: 'maintenance';
+  holder: string;   // lease holder the chain runs under
+  chain: number;    // links so far; the chain stops at a fixed length
+}
+
+/** Lease stored as _maintenance/lease.json while a scheduled run or its chain compacts */
+export interface MaintenanceLeaseJson {
+  holder: string;
+  expires_at: string;   // ISO 8601; an expired lease may be taken over
+}
+
+/** One archive object's statistics, kept in the archive manifest */
+export interface ArchiveManifestEntry {
+  key: string;         // _archive/... segment key
+  rows: number;
+  bytes: number;       // stored (compressed) size
+  raw_bytes: number;   // decompressed column bytes
+  min_ts: string;      // ISO 8601, earliest row
+  max_ts: string;      // ISO 8601, latest row
+  models: string[];    // distinct model_id values, sorted
+  etag: string;
+  user_bloom?: BloomFilter;   // user_id values; absent on entries written before filters existed
+  output_bloom?: BloomFilter; // output_hash values; absent on entries written before output filters
+}
+
+/**
+ * Archive manifest root stored as _archive/_manifest.json. Entries live in one
+ * partition per month of their key (see ArchiveManifestPartitionJson); the
+ * root names the partitions and what range pruning needs.
+ */
+export interface ArchiveManifestJson {
+  version: 2;
+  complete: boolean;   // every archive object is listed; until then readers list _archive/
+  indexed_since: string;   // ISO 8601; segments written since then are indexed when written
+  partitions: Record<string, string>;   // YYYY-MM → min_ts of its earliest row (only ever lowered)
+  compacted_batch?: string;   // id of the last compaction batch whose segments are listed
+}
+
+/** One month of archive entries, stored as _archive/_manifest/YYYY-MM.json; every listed archive has a sidecar */
+export interface ArchiveManifestPartitionJson {
+  version: 1;
+  month: string;                      // YYYY-MM of the archive keys, not of their rows
+  archives: ArchiveManifestEntry[];   // sorted by key (chronological)
+}
+
+/** Single-object manifest written before partitions; split on its next update */
+export interface LegacyArchiveManifestJson {
+  version: 1;
+  complete: boolean;
+  archives: ArchiveManifestEntry[];
+}
+
+/** Compaction batch journaled as _maintenance/compact_batch.json until its entries are deleted */
+export interface CompactBatchJson {
+  version: 1;
+  id: string;          // recorded by the manifest root and the writer state once each holds the batch
+  entries: string[];   // buffer entry keys, in the order they were archived
+}
+
+/** Resumable GDPR erasure job, stored as _erasure/pending/{user_id}.json and moved to _erasure/done/ */
+export interface ErasureJobJson {
+  version: 1;
+  user_id: string;
+  status: 'waiting' | 'archives' | 'chart' | 'blobs' | 'done';   // waiting: for compaction to archive earlier submissions
+  requested_at: string;
+  updated_at: string;
+  completed_at: string | null;
+  archives: string[] | null;   // archives that may hold the user's rows; null until planned
+  archives_done: number;       // cursor into `archives`
+  rows_removed: number;
+  blobs?: string[];            // output hashes of the removed rows, whose blobs may now be unreferenced
+  blobs_done?: number;         // cursor into `blobs`
+  blobs_removed?: number;      // blobs deleted because no remaining archive row referenced them
+}
+
 /** Per-user summary stored as _users/{user_id}/summary.json */
 export interface UserSummaryJson {
   version: 3;
   submissions_by_date: Record<string, Record<string, number>>;  // date → model → count
   model_submissions: Record<string, number>;                     // model → total
   total_submissions: number;
+  folded_through?: string;   // last summary delta key folded in by compaction; later ones are pending
+}
+
+/** Round-robin position of the summary fold, stored as _maintenance/summary_fold.json */
+export interface SummaryFoldCursorJson {
+  version: 1;
+  after: string;   // user whose deltas were folded last; "" starts from the first user
 }
+
+/** Summary increment written per submit to _summary_deltas/{user_id}/{ts}_{random}.json: date → model → count */
+export type SummaryDelta = Record<string, Record<string, number>>;
@@ -0,0 +1,89 @@
+// @vitest-environment node
+import { describe, it, expect } from 'vitest'
+import type { StorageRecord } from './schemas'
+import {
+  writeSegment,
+  readSegmentRecords,
+  readSegmentAggregateRows,
+  isSegment,
+  segmentRawBytes,
+  AGGREGATE_COLUMNS,
+} from './segment'
+
+const HASH_A = 'sha256:' + 'a'.repeat(64)
+const HASH_B = 'sha256:' + '0123456789abcdef'.repeat(4)
+
+function makeRecord(i: number, overrides: Partial<StorageRecord> = {}): StorageRecord {
+  return {
+    id: `00000000-0000-4000-8000-${String(i).padStart(12, '0')}`,
+    timestamp: new Date(Date.UTC(2026, 1, 21, 12, 0, i)).toISOString(),
+    user_id: `user${i % 3}`,
+    model_id: i % 2 ? 'gpt-5' : 'claude-opus',
+    prompt_id: `prompt-${i % 5}`,
+    output: '',
+    output_hash: i % 2 ? HASH_A : HASH_B,
+    metadata_json: '{}',
+    year: 2026,
+    month: 2,
+    day: 21,
+    score: i % 4 ? i / 10 : null,
+    ...overrides,
+  }
+}
+
+describe('segment', () => {
+  it('round-trips full records', async () => {
+    const records = Array.from({ length: 50 }, (_, i) => makeRecord(i))
+    records[7] = makeRecord(7, { output: 'line 1\nline 2, "quoted" é', metadata_json: '{"temperature":0.7}' })
+    const bytes = await writeSegment(records)
+    expect(isSegment(bytes)).toBe(true)
+    expect(await readSegmentRecords(bytes)).toEqual(records)
+  })
+
+  it('round-trips timestamps across days and out of order', async () => {
+    const timestamps = ['2026-02-28T23:59:59.999Z', '2026-03-01T00:00:00.001Z', '2025-12-31T10:00:00.050Z', '2026-03-01T09:05:07.000Z']
+    const records = timestamps.map((timestamp, i) => makeRecord(i, { timestamp }))
+    expect((await readSegmentRecords(await writeSegment(records))).map(r => r.timestamp)).toEqual(timestamps)
+  })
+
+  it('falls back to plain encodings for values the compact ones cannot hold', async () => {
+    // Legacy rows: non-canonical timestamp, short hash, upper-case UUID
+    const records = [
+      makeRecord(1, { id: '00000000-0000-4000-8000-00000000000A', timestamp: '2026-02-21T00:00:00Z', output_hash: 'sha256:abc' }),
+      makeRecord(2, { year: 2025, month: 12, day: 31 }),
+    ]
+    expect(await readSegmentRecords(await writeSegment(records))).toEqual(records)
+  })
+
+  it('reads the aggregation columns from full segments and sidecars', async () => {
+    const records = Array.from({ length: 10 }, (_, i) => makeRecord(i, { output: 'x'.repeat(1000) }))
+    const expected = records.map(({ timestamp, user_id, model_id, prompt_id, output_hash, year, month, day }) =>
+      ({ timestamp, user_id, model_id, prompt_id, output_hash, year, month, day }))
+
+    const full = await writeSegment(records)
+    const sidecar = await writeSegment(records, AGGREGATE_COLUMNS)
+    expect(sidecar.length).toBeLessThan(full.length)
+    expect(await readSegmentAggregateRows(full)).toEqual(expected)
+    expect(await readSegmentAggregateRows(sidecar)).toEqual(expected)
+    await expect(readSegmentRecords(sidecar)).rejects.toThrow('no id column')
+  })
+
+  it('reports the decompressed column size without decompressing', async () => {
+    const records = Array.from({ length: 20 }, (_, i) => makeRecord(i, { output: 'y'.repeat(500) }))
+    const bytes = await writeSegment(records)
+    // The output column alone holds 20 × (1-byte length + 500 bytes)
+    expect(segmentRawBytes(bytes)).toBeGreaterThan(20 * 501)
+    expect(segmentRawBytes(bytes)).toBeGreaterThan(bytes.length)
+  })
+
+  it('handles an empty segment', async () => {
+    expect(await readSegmentRecords(await writeSegment([]))).toEqual([])
+  })
+
+  it('rejects other data', async () => {
+    expect(isSegment(new Uint8Array([0x1f, 0x8b, 0x08]))).toBe(false)
+    await expect(readSegmentRecords(new Uint8Array([0x1f, 0x8b]))).rejects.toThrow('Not an archive segment')
+    const bytes = await writeSegment([makeRecord(1)])
+    await expect(readSegmentRecords(bytes.subarray(0, bytes.length - 4))).rejects.toThrow('Truncated segment')
+  })
+})
@@ -0,0 +1,456 @@
+/**
+ * Columnar archive segments. Each column is encoded for its content —
+ * dictionary strings, 32-byte hashes, 16-byte UUIDs, delta-encoded
+ * timestamps and dates — and gzipped on its own, so a reader decompresses
+ * only the columns it asks for.
+ *
+ * Layout (integers are unsigned LEB128 varints):
+ *   "PSEG" | version (u8) | row count | column count
+ *   per column: name length | name (UTF-8) | encoding (u8) | body length
+ *   column bodies (each gzipped), in header order
+ */
+import type { StorageRecord, AggregateRow } from './schemas'
+import { toHex } from './crypto'
+
+export const SEGMENT_VERSION = 1
+const MAGIC = [0x50, 0x53, 0x45, 0x47]  // "PSEG"
+
+/** Segment column names; year/month/day travel together as `date` (YYYYMMDD) */
+export type SegmentColumn =
+  | 'id' | 'timestamp' | 'user_id' | 'model_id' | 'prompt_id'
+  | 'output' | 'output_hash' | 'metadata_json' | 'date' | 'score'
+
+/** Every StorageRecord field */
+export const RECORD_COLUMNS: readonly SegmentColumn[] = [
+  'id', 'timestamp', 'user_id', 'model_id', 'prompt_id',
+  'output', 'output_hash', 'metadata_json', 'date', 'score',
+]
+
+/** The AggregateRow fields — what chart and summary rebuilds read */
+export const AGGREGATE_COLUMNS: readonly SegmentColumn[] = [
+  'timestamp', 'user_id', 'model_id', 'prompt_id', 'output_hash', 'date',
+]
+
+// Column encodings
+const ENC_STRING = 0  // length-prefixed UTF-8 per row
+const ENC_DICT = 1    // distinct values once, then an index per row
+const ENC_DELTA = 2   // zigzag deltas of integers
+const ENC_HASH = 3    // dictionary of "sha256:<hex>" values as 32 raw bytes each
+const ENC_UUID = 4    // canonical lowercase UUID as 16 raw bytes
+const ENC_SCORE = 5   // presence byte, then float64 (LE) when present
+
+const HASH_RE = /^sha256:[0-9a-f]{64}$/
+const UUID_RE = /^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$/
+
+const encoder = new TextEncoder()
+const decoder = new TextDecoder()
+
+async function gzip(data: Uint8Array): Promise<Uint8Array> {
+  const cs = new CompressionStream('gzip')
+  const writer = cs.writable.getWriter()
+  writer.write(data as unknown as BufferSource)
+  writer.close()
+  return new Uint8Array(await new Response(cs.readable).arrayBuffer())
+}
+
+async function gunzip(data: Uint8Array): Promise<Uint8Array> {
+  const ds = new DecompressionStream('gzip')
+  const writer = ds.writable.getWriter()
+  writer.write(data as unknown as BufferSource)
+  writer.close()
+  return new Uint8Array(await new Response(ds.readable).arrayBuffer())
+}
+
+// -- Byte buffers --
+
+class ByteWriter {
+  private buf = new Uint8Array(1024)
+  private len = 0
+
+  private reserve(n: number): void {
+    if (this.len + n <= this.buf.length) return
+    let size = this.buf.length * 2
+    while (size < this.len + n) size *= 2
+    const next = new Uint8Array(size)
+    next.set(this.buf.subarray(0, this.len))
+    this.buf = next
+  }
+
+  u8(b: number): void {
+    this.reserve(1)
+    this.buf[this.len++] = b
+  }
+
+  /** Non-negative integer up to 2^53; arithmetic rather than bitwise so ms timestamps fit */
+  varint(n: number): void {
+    this.reserve(8)
+    while (n >= 0x80) {
+      this.buf[this.len++] = (n % 0x80) | 0x80
+      n = Math.floor(n / 0x80)
+    }
+    this.buf[this.len++] = n
+  }
+
+  bytes(b: Uint8Array): void {
+    this.reserve(b.length)
+    this.buf.set(b, this.len)
+    this.len += b.length
+  }
+
+  string(s: string): void {
+    const b = encoder.encode(s)
+    this.varint(b.length)
+    this.bytes(b)
+  }
+
+  f64(x: number): void {
+    this.reserve(8)
+    new DataView(this.buf.buffer).setFloat64(this.len, x, true)
+    this.len += 8
+  }
+
+  finish(): Uint8Array {
+    return this.buf.subarray(0, this.len)
+  }
+}
+
+class ByteReader {
+  private readonly buf: Uint8Array
+  private pos = 0
+
+  constructor(buf: Uint8Array) {
+    this.buf = buf
+  }
+
+  private need(n: number): void {
+    if (this.pos + n > this.buf.length) throw new Error('Truncated segment')
+  }
+
+  u8(): number {
+    this.need(1)
+    return this.buf[this.pos++]
+  }
+
+  varint(): number {
+    let n = 0
+    let scale = 1
+    for (;;) {
+      const b = this.u8()
+      n += (b & 0x7f) * scale
+      if (b < 0x80) return n
+      scale *= 0x80
+    }
+  }
+
+  bytes(n: number): Uint8Array {
+    this.need(n)
+    const out = this.buf.subarray(this.pos, this.pos + n)
+    this.pos += n
+    return out
+  }
+
+  string(): string {
+    return decoder.decode(this.bytes(this.varint()))
+  }
+
+  f64(): number {
+    this.need(8)
+    const x = new DataView(this.buf.buffer, this.buf.byteOffset).getFloat64(this.pos, true)
+    this.pos += 8
+    return x
+  }
+}
+
+const DAY_MS = 86_400_000
+const pad2 = (n: number) => (n < 10 ? '0' + n : String(n))
+
+/**
+ * Replace epoch ms with toISOString() output in place. Rows of a segment
+ * mostly share a UTC day, so the date part is formatted once per day and
+ * only the time is built per row.
+ */
+function formatTimestamps(values: (number | string)[]): void {
+  let dayStart = -1
+  let prefix = ''
+  for (let i = 0; i < values.length; i++) {
+    const ms = values[i] as number
+    if (ms < dayStart || ms >= dayStart + DAY_MS) {
+      dayStart = ms - (ms % DAY_MS)
+      prefix = new Date(dayStart).toISOString().slice(0, 11)
+    }
+    const t = ms - dayStart
+    const millis = t % 1000
+    values[i] = prefix +
+      pad2(Math.floor(t / 3_600_000)) + ':' +
+      pad2(Math.floor(t / 60_000) % 60) + ':' +
+      pad2(Math.floor(t / 1000) % 60) + '.' +
+      (millis < 10 ? '00' : millis < 100 ? '0' : '') + millis + 'Z'
+  }
+}
+
+const zigzag = (n: number) => (n >= 0 ? n * 2 : -n * 2 - 1)
+const unzigzag = (n: number) => (n % 2 === 0 ? n / 2 : -(n + 1) / 2)
+
+function hexToBytes(hex: string, out: Uint8Array): void {
+  for (let i = 0; i < out.length; i++) out[i] = parseInt(hex.substr(i * 2, 2), 16)
+}
+
+// -- Column encoders --
+
+type ColumnValue = string | number | null
+
+function columnValues(rows: readonly AggregateRow[], column: SegmentColumn): ColumnValue[] {
+  if (column === 'date') return rows.map(r => r.year * 10000 + r.month * 100 + r.day)
+  return rows.map(r => (r as Partial<StorageRecord>)[column] as ColumnValue)
+}
+
+/** Distinct values in first-seen order, and each row's index into them */
+function dictionaryEncode(values: readonly string[]): { dict: string[]; ids: number[] } {
+  const index = new Map<string, number>()
+  const ids = values.map(v => {
+    let id = index.get(v)
+    if (id === undefined) index.set(v, (id = index.size))
+    return id
+  })
+  return { dict: Array.from(index.keys()), ids }
+}
+
+/** Pick the tightest encoding that round-trips every value of the column. */
+function chooseEncoding(column: SegmentColumn, values: ColumnValue[]): number {
+  switch (column) {
+    case 'id':
+      return values.every(v => UUID_RE.test(v as string)) ? ENC_UUID : ENC_STRING
+    case 'timestamp':
+      return values.every(v => {
+        const ms = Date.parse(v as string)
+        return Number.isFinite(ms) && ms >= 0 && new Date(ms).toISOString() === v
+      }) ? ENC_DELTA : ENC_DICT
+    case 'output_hash':
+      return values.every(v => HASH_RE.test(v as string)) ? ENC_HASH : ENC_DICT
+    case 'date':
+      return ENC_DELTA
+    case 'score':
+      return ENC_SCORE
+    case 'output':
+      return ENC_STRING
+    default:
+      return ENC_DICT
+  }
+}
+
+function encodeColumn(encoding: number, column: SegmentColumn, values: ColumnValue[]): Uint8Array {
+  const w = new ByteWriter()
+  switch (encoding) {
+    case ENC_STRING:
+      for (const v of values) w.string(v as string)
+      break
+    case ENC_DICT: {
+      const { dict, ids } = dictionaryEncode(values as string[])
+      w.varint(dict.length)
+      for (const s of dict) w.string(s)
+      for (const id of ids) w.varint(id)
+      break
+    }
+    case ENC_DELTA: {
+      let prev = 0
+      for (const v of values) {
+        const n = column === 'timestamp' ? Date.parse(v as string) : (v as number)
+        w.varint(zigzag(n - prev))
+        prev = n
+      }
+      break
+    }
+    case ENC_HASH: {
+      const { dict, ids } = dictionaryEncode(values as string[])
+      w.varint(dict.length)
+      const raw = new Uint8Array(32)
+      for (const hash of dict) {
+        hexToBytes(hash.slice(7), raw)
+        w.bytes(raw)
+      }
+      for (const id of ids) w.varint(id)
+      break
+    }
+    case ENC_UUID: {
+      const raw = new Uint8Array(16)
+      for (const v of values) {
+        hexToBytes((v as string).replace(/-/g, ''), raw)
+        w.bytes(raw)
+      }
+      break
+    }
+    case ENC_SCORE:
+      for (const v of values) {
+        w.u8(v === null ? 0 : 1)
+        if (v !== null) w.f64(v as number)
+      }
+      break
+  }
+  return w.finish()
+}
+
+function decodeColumn(encoding: number, column: SegmentColumn, body: Uint8Array, rows: number): ColumnValue[] {
+  const r = new ByteReader(body)
+  const out = new Array<ColumnValue>(rows)
+  switch (encoding) {
+    case ENC_STRING:
+      for (let i = 0; i < rows; i++) out[i] = r.string()
+      break
+    case ENC_DICT: {
+      const dict = Array.from({ length: r.varint() }, () => r.string())
+      for (let i = 0; i < rows; i++) out[i] = dict[r.varint()]
+      break
+    }
+    case ENC_DELTA: {
+      let prev = 0
+      for (let i = 0; i < rows; i++) {
+        prev += unzigzag(r.varint())
+        out[i] = prev
+      }
+      if (column === 'timestamp') formatTimestamps(out as number[])
+      break
+    }
+    case ENC_HASH: {
+      const dict = Array.from({ length: r.varint() }, () => 'sha256:' + toHex(r.bytes(32)))
+      for (let i = 0; i < rows; i++) out[i] = dict[r.varint()]
+      break
+    }
+    case ENC_UUID:
+      for (let i = 0; i < rows; i++) {
+        const hex = toHex(r.bytes(16))
+        out[i] = `${hex.slice(0, 8)}-${hex.slice(8, 12)}-${hex.slice(12, 16)}-${hex.slice(16, 20)}-${hex.slice(20)}`
+      }
+      break
+    case ENC_SCORE:
+      for (let i = 0; i < rows; i++) out[i] = r.u8() === 0 ? null : r.f64()
+      break
+    default:
+      throw new Error(`Unknown segment encoding ${encoding} for ${column}`)
+  }
+  return out
+}
+
+// -- Segment read/write --
+
+/** Encode rows as a segment holding `columns` (all StorageRecord fields by default). */
+export async function writeSegment(
+  rows: readonly AggregateRow[],
+  columns: readonly SegmentColumn[] = RECORD_COLUMNS
+): Promise<Uint8Array> {
+  const encoded = await Promise.all(columns.map(async (column) => {
+    const values = columnValues(rows, column)
+    const encoding = chooseEncoding(column, values)
+    return { column, encoding, body: await gzip(encodeColumn(encoding, column, values)) }
+  }))
+
+  const w = new ByteWriter()
+  for (const b of MAGIC) w.u8(b)
+  w.u8(SEGMENT_VERSION)
+  w.varint(rows.length)
+  w.varint(encoded.length)
+  for (const { column, encoding, body } of encoded) {
+    w.string(column)
+    w.u8(encoding)
+    w.varint(body.length)
+  }
+  for (const { body } of encoded) w.bytes(body)
+  return w.finish()
+}
+
+export function isSegment(bytes: Uint8Array): boolean {
+  return MAGIC.every((b, i) => bytes[i] === b)
+}
+
+function readHeader(bytes: Uint8Array): {
+  rows: number
+  header: { column: SegmentColumn; encoding: number; length: number }[]
+  reader: ByteReader
+} {
+  if (!isSegment(bytes)) throw new Error('Not an archive segment')
+  const reader = new ByteReader(bytes.subarray(MAGIC.length))
+  const version = reader.u8()
+  if (version !== SEGMENT_VERSION) throw new Error(`Unsupported segment version ${version}`)
+  const rows = reader.varint()
+  const header = Array.from({ length: reader.varint() }, () => ({
+    column: reader.string() as SegmentColumn,
+    encoding: reader.u8(),
+    length: reader.varint(),
+  }))
+  return { rows, header, reader }
+}
+
+/**
+ * Total decompressed size of the column bodies, from the size each gzip
+ * member records in its last four bytes — nothing is decompressed.
+ */
+export function segmentRawBytes(bytes: Uint8Array): number {
+  const { header, reader } = readHeader(bytes)
+  let total = 0
+  for (const { length } of header) {
+    const body = reader.bytes(length)
+    total += new DataView(body.buffer, body.byteOffset).getUint32(length - 4, true)
+  }
+  return total
+}
+
+/** Decode only `wanted`; the other column bodies are skipped without decompressing. */
+async function readColumns(
+  bytes: Uint8Array,
+  wanted: readonly SegmentColumn[]
+): Promise<{ rows: number; columns: Map<SegmentColumn, ColumnValue[]> }> {
+  const { rows, header, reader: r } = readHeader(bytes)
+
+  const bodies = new Map<SegmentColumn, Promise<ColumnValue[]>>()
+  for (const { column, encoding, length } of header) {
+    const body = r.bytes(length)
+    if (wanted.includes(column)) {
+      bodies.set(column, gunzip(body).then(raw => decodeColumn(encoding, column, raw, rows)))
+    }
+  }
+  const columns = new Map<SegmentColumn, ColumnValue[]>()
+  for (const column of wanted) {
+    const values = bodies.get(column)
+    if (!values) throw new Error(`Segment has no ${column} column`)
+    columns.set(column, await values)
+  }
+  return { rows, columns }
+}
+
+function splitDate(yyyymmdd: number): { year: number; month: number; day: number } {
+  return { year: Math.floor(yyyymmdd / 10000), month: Math.floor(yyyymmdd / 100) % 100, day: yyyymmdd % 100 }
+}
+
+/** Full records; the segment must hold every RECORD_COLUMNS column. */
+export async function readSegmentRecords(bytes: Uint8Array): Promise<StorageRecord[]> {
+  const { rows, columns } = await readColumns(bytes, RECORD_COLUMNS)
+  const col = (name: SegmentColumn) => columns.get(name)!
+  const [id, timestamp, userId, modelId, promptId, output, outputHash, metadata, date, score] =
+    RECORD_COLUMNS.map(col)
+  return Array.from({ length: rows }, (_, i) => ({
+    id: id[i] as string,
+    timestamp: timestamp[i] as string,
+    user_id: userId[i] as string,
+    model_id: modelId[i] as string,
+    prompt_id: promptId[i] as string,
+    output: output[i] as string,
+    output_hash: outputHash[i] as string,
+    metadata_json: metadata[i] as string,
+    ...splitDate(date[i] as number),
+    score: score[i] as number | null,
+  }))
+}
+
+/** Only the aggregation columns — works on full segments and on sidecars. */
+export async function readSegmentAggregateRows(bytes: Uint8Array): Promise<AggregateRow[]> {
+  const { rows, columns } = await readColumns(bytes, AGGREGATE_COLUMNS)
+  const [timestamp, userId, modelId, promptId, outputHash, date] =
+    AGGREGATE_COLUMNS.map(name => columns.get(name)!)
+  return Array.from({ length: rows }, (_, i) => ({
+    timestamp: timestamp[i] as string,
+    user_id: userId[i] as string,
+    model_id: modelId[i] as string,
+    prompt_id: promptId[i] as string,
+    output_hash: outputHash[i] as string,
+    ...splitDate(date[i] as number),
+  }))
+}
@@ -0,0 +1,189 @@
+import { describe, it, expect } from 'vitest'
+import {
+  mapWithConcurrency,
+  downloadMany,
+  uploadMany,
+  uploadFileWithMetadata,
+  listFiles,
+  listFilesWithMetadata,
+  listPrefixes,
+  deleteFiles,
+  SubrequestBudget,
+  subrequestBudgetFromEnv,
+} from './storage'
+
+const encoder = new TextEncoder()
+const decoder = new TextDecoder()
+
+function sleep(ms: number): Promise<void> {
+  return new Promise((resolve) => setTimeout(resolve, ms))
+}
+
+/** Minimal in-memory R2 stand-in covering get/put/list/delete. */
+function makeBucket(initial: Record<string, string> = {}) {
+  const store = new Map(Object.entries(initial).map(([k, v]) => [k, encoder.encode(v)]))
+  const metadata = new Map<string, Record<string, string>>()
+  let bodiesRead = 0
+  const bucket = {
+    async get(key: string) {
+      const body = store.get(key)
+      if (!body) return null
+      bodiesRead++
+      return { arrayBuffer: async () => body.slice().buffer }
+    },
+    async put(key: string, body: Uint8Array, options?: { customMetadata?: Record<string, string> }) {
+      store.set(key, body)
+      if (options?.customMetadata) metadata.set(key, options.customMetadata)
+      return { etag: `etag-${key}` }
+    },
+    async list({ prefix, limit, cursor, include, delimiter, startAfter }: {
+      prefix: string; limit: number; cursor?: string; include?: string[]; delimiter?: string; startAfter?: string
+    }) {
+      const keys = Array.from(store.keys()).filter((k) => k.startsWith(prefix) && (!startAfter || k > startAfter)).sort()
+      if (delimiter) {
+        const prefixes = [...new Set(keys.map((k) => k.slice(0, k.indexOf(delimiter, prefix.length) + 1)).filter(Boolean))]
+        return { objects: [], delimitedPrefixes: prefixes.slice(0, limit), truncated: prefixes.length > limit }
+      }
+      const start = cursor ? parseInt(cursor, 10) : 0
+      const page = keys.slice(start, start + limit)
+      const truncated = start + limit < keys.length
+      const objects = page.map((key) =>
+        (include?.includes('customMetadata') ? { key, customMetadata: metadata.get(key) } : { key }))
+      return { objects, truncated, cursor: String(start + limit) }
+    },
+    async delete(keys: string | string[]) {
+      for (const key of ([] as string[]).concat(keys)) store.delete(key)
+    },
+  }
+  return { bucket: bucket as unknown as R2Bucket, store, bodiesRead: () => bodiesRead }
+}
+
+describe('mapWithConcurrency', () => {
+  it('preserves input order regardless of completion order', async () => {
+    const result = await mapWithConcurrency([30, 10, 20, 0], async (ms, i) => {
+      await sleep(ms)
+      return i
+    })
+    expect(result).toEqual([0, 1, 2, 3])
+  })
+
+  it('never exceeds the concurrency limit', async () => {
+    let inFlight = 0
+    let peak = 0
+    await mapWithConcurrency(Array.from({ length: 20 }, (_, i) => i), async () => {
+      inFlight++
+      peak = Math.max(peak, inFlight)
+      await sleep(1)
+      inFlight--
+    }, 4)
+    expect(peak).toBe(4)
+  })
+
+  it('rethrows the first failure and stops scheduling new work', async () => {
+    const started: number[] = []
+    await expect(
+      mapWithConcurrency([0, 1, 2, 3, 4, 5], async (n) => {
+        started.push(n)
+        if (n === 1) throw new Error('boom')
+        await sleep(5)
+        return n
+      }, 2)
+    ).rejects.toThrow('boom')
+    expect(started).not.toContain(5)
+  })
+
+  it('returns an empty array for no items', async () => {
+    expect(await mapWithConcurrency([], async (x) => x)).toEqual([])
+  })
+})
+
+describe('downloadMany / uploadMany', () => {
+  it('downloads bodies in key order', async () => {
+    const { bucket } = makeBucket({ a: 'first', b: 'second' })
+    const bodies = await downloadMany(bucket, ['b', 'a'])
+    expect(bodies.map((b) => decoder.decode(b))).toEqual(['second', 'first'])
+  })
+
+  it('rejects when any key is missing', async () => {
+    const { bucket } = makeBucket({ a: 'first' })
+    await expect(downloadMany(bucket, ['a', 'missing'])).rejects.toThrow('Not found: missing')
+  })
+
+  it('uploads every file and returns the etags in order', async () => {
+    const { bucket, store } = makeBucket()
+    const etags = await uploadMany(bucket, [
+      { key: 'x', body: encoder.encode('1') },
+      { key: 'y', body: encoder.encode('2') },
+    ])
+    expect(etags).toEqual(['etag-x', 'etag-y'])
+    expect(decoder.decode(store.get('x'))).toBe('1')
+    expect(decoder.decode(store.get('y'))).toBe('2')
+  })
+})
+
+describe('SubrequestBudget', () => {
+  it('fits items into what remains after the reserve', () => {
+    const budget = new SubrequestBudget(50)
+    budget.charge(3)
+    expect(budget.remaining()).toBe(47)
+    expect(budget.fit(100, 1, 2)).toBe(45)
+    expect(budget.fit(10, 1, 2)).toBe(10)
+    expect(budget.fit(100, 2, 1)).toBe(23)
+    expect(budget.fit(100, 1, 60)).toBe(0)
+  })
+
+  it('reads the limit from the SUBREQUEST_LIMIT binding', () => {
+    expect(subrequestBudgetFromEnv(undefined).limit).toBe(50)
+    expect(subrequestBudgetFromEnv('free').limit).toBe(50)
+    expect(subrequestBudgetFromEnv('paid').limit).toBe(1000)
+    expect(subrequestBudgetFromEnv('200').limit).toBe(200)
+    expect(subrequestBudgetFromEnv('nonsense').limit).toBe(50)
+  })
+
+  it('charges one call per list page and per delete chunk', async () => {
+    const files: Record<string, string> = {}
+    for (let i = 0; i < 2500; i++) files[`p/${String(i).padStart(4, '0')}`] = ''
+    const { bucket } = makeBucket(files)
+    const budget = new SubrequestBudget()
+
+    const keys = await listFiles(bucket, 'p/', Infinity, budget)
+    expect(keys).toHaveLength(2500)
+    expect(budget.used()).toBe(3)
+
+    await deleteFiles(bucket, keys, budget)
+    expect(budget.used()).toBe(6)
+  })
+
+  it('charges every object in a batch download', async () => {
+    const { bucket } = makeBucket({ a: '1', b: '2' })
+    const budget = new SubrequestBudget()
+    await downloadMany(bucket, ['a', 'b'], budget)
+    expect(budget.used()).toBe(2)
+  })
+})
+
+describe('listFilesWithMetadata', () => {
+  it('lists custom metadata without reading bodies', async () => {
+    const { bucket, bodiesRead } = makeBucket({ 'p/plain': '' })
+    await uploadFileWithMetadata(bucket, 'p/tagged', encoder.encode('x'), { user_id: 'u1' })
+
+    const budget = new SubrequestBudget()
+    expect(await listFilesWithMetadata(bucket, 'p/', 1000, budget)).toEqual([
+      { key: 'p/plain', customMetadata: {} },
+      { key: 'p/tagged', customMetadata: { user_id: 'u1' } },
+    ])
+    expect(budget.used()).toBe(1)
+    expect(bodiesRead()).toBe(0)
+  })
+})
+
+describe('listPrefixes', () => {
+  it('lists the next level of prefixes after a key in one call', async () => {
+    const { bucket } = makeBucket({ 'p/a/1': '', 'p/a/2': '', 'p/b/1': '', 'p/c/1': '', 'p/top': '' })
+
+    const budget = new SubrequestBudget()
+    expect(await listPrefixes(bucket, 'p/', 1000, undefined, budget)).toEqual(['p/a/', 'p/b/', 'p/c/'])
+    expect(await listPrefixes(bucket, 'p/', 1, 'p/a/\uffff', budget)).toEqual(['p/b/'])
+    expect(budget.used()).toBe(2)
+  })
+})
@@ -1,9 +1,68 @@
 /**
  * R2 storage abstraction — replaces @aws-sdk/client-s3 with native R2 bindings.
- * Every function takes the R2 bucket binding as first param (no module-level singleton).
+ * Every function takes the R2 bucket binding as first param (no module-level singleton)
+ * and an optional SubrequestBudget as last param, charged once per binding call.
  */
 
-export async function downloadFile(bucket: R2Bucket, key: string): Promise<Uint8Array> {
+// -- Subrequest accounting --
+
+/** Workers subrequest limits per invocation by plan. */
+export const SUBREQUEST_LIMITS = { free: 50, paid: 1000 } as const;
+
+/**
+ * Counts the R2 calls an invocation has actually made against its plan limit.
+ * Jobs size their variable work with fit() after their fixed calls are known,
+ * so adding a call anywhere shrinks the batch instead of breaking the job.
+ */
+export class SubrequestBudget {
+  readonly limit: number;
+  private spent = 0;
+
+  constructor(limit: number = SUBREQUEST_LIMITS.free) {
+    this.limit = limit;
+  }
+
+  charge(n: number = 1): void {
+    this.spent += n;
+  }
+
+  used(): number {
+    return this.spent;
+  }
+
+  remaining(): number {
+    return Math.max(0, this.limit - this.spent);
+  }
+
+  /**
+   * How many of `count` items costing `perItem` calls each fit in the remaining
+   * budget while holding back `reserve` calls for work that must follow them.
+   */
+  fit(count: number, perItem: number = 1, reserve: number = 0): number {
+    const affordable = Math.floor((this.remaining() - reserve) / perItem);
+    return Math.max(0, Math.min(count, affordable));
+  }
+}
+
+/**
+ * Build a budget from the SUBREQUEST_LIMIT binding: "free" (default), "paid",
+ * or an explicit positive integer.
+ */
+export function subrequestBudgetFromEnv(value: string | undefined): SubrequestBudget {
+  if (value === 'paid') return new SubrequestBudget(SUBREQUEST_LIMITS.paid);
+  const n = value ? parseInt(value, 10) : NaN;
+  if (Number.isFinite(n) && n > 0) return new SubrequestBudget(n);
+  return new SubrequestBudget(SUBREQUEST_LIMITS.free);
+}
+
+// -- Single-object operations --
+
+export async function downloadFile(
+  bucket: R2Bucket,
+  key: string,
+  budget?: SubrequestBudget
+): Promise<Uint8Array> {
+  budget?.charge();
   const obj = await bucket.get(key);
   if (!obj) throw new Error(`Not found: ${key}`);
   return new Uint8Array(await obj.arrayBuffer());
@@ -11,23 +70,77 @@ export async function downloadFile(bucket: R2Bucket, key: string): Promise<Uint8
 
 export async function downloadFileWithEtag(
   bucket: R2Bucket,
-  key: string
+  key: string,
+  budget?: SubrequestBudget
 ): Promise<{ body: Uint8Array | null; etag: string | null }> {
+  budget?.charge();
   const obj = await bucket.get(key);
   if (!obj) return { body: null, etag: null };
   return { body: new Uint8Array(await obj.arrayBuffer()), etag: obj.etag };
 }
 
-export async function uploadFile(bucket: R2Bucket, key: string, body: Uint8Array): Promise<void> {
-  await bucket.put(key, body);
+/**
+ * Conditional GET: when the stored etag still equals `etag` R2 returns only
+ * metadata, so no body is transferred and `notModified` is set.
+ */
+export async function downloadFileIfChanged(
+  bucket: R2Bucket,
+  key: string,
+  etag: string | null,
+  budget?: SubrequestBudget
+): Promise<{ body: Uint8Array | null; etag: string | null; notModified: boolean }> {
+  budget?.charge();
+  const obj = etag
+    ? await bucket.get(key, { onlyIf: { etagDoesNotMatch: etag } })
+    : await bucket.get(key);
+  if (!obj) return { body: null, etag: null, notModified: false };
+  if (!('body' in obj)) return { body: null, etag: obj.etag, notModified: true };
+  return { body: new Uint8Array(await obj.arrayBuffer()), etag: obj.etag, notModified: false };
+}
+
+/** Whether an object exists, from a HEAD request — no body is transferred. */
+export async function fileExists(
+  bucket: R2Bucket,
+  key: string,
+  budget?: SubrequestBudget
+): Promise<boolean> {
+  budget?.charge();
+  return (await bucket.head(key)) !== null;
+}
+
+/** Returns the etag of the stored object. */
+export async function uploadFile(
+  bucket: R2Bucket,
+  key: string,
+  body: Uint8Array,
+  budget?: SubrequestBudget
+): Promise<string> {
+  budget?.charge();
+  const obj = await bucket.put(key, body);
+  return obj.etag;
+}
+
+/** uploadFile plus R2 custom metadata, which listFilesWithMetadata returns without reading bodies. */
+export async function uploadFileWithMetadata(
+  bucket: R2Bucket,
+  key: string,
+  body: Uint8Array,
+  customMetadata: Record<string, string>,
+  budget?: SubrequestBudget
+): Promise<string> {
+  budget?.charge();
+  const obj = await bucket.put(key, body, { customMetadata });
+  return obj.etag;
 }
 
 export async function uploadFileConditional(
   bucket: R2Bucket,
   key: string,
   body: Uint8Array,
-  etag: string
+  etag: string,
+  budget?: SubrequestBudget
 ): Promise<void> {
+  budget?.charge();
   const result = await bucket.put(key, body, { onlyIf: { etagMatches: etag } });
   if (result === null) {
     const err = new Error(`Precondition failed: ${key}`) as Error & { status: number };
@@ -36,37 +149,158 @@ export async function uploadFileConditional(
   }
 }
 
-export async function listFiles(
+async function listObjects(
   bucket: R2Bucket,
   prefix: string,
-  maxKeys: number = 1000
-): Promise<string[]> {
-  const keys: string[] = [];
+  maxKeys: number,
+  include: R2ListOptions['include'],
+  budget?: SubrequestBudget
+): Promise<R2Object[]> {
+  const objects: R2Object[] = [];
   let cursor: string | undefined;
 
   do {
+    budget?.charge();
     const listed = await bucket.list({
       prefix,
-      limit: Math.min(maxKeys - keys.length, 1000),
+      limit: Math.min(maxKeys - objects.length, 1000),
       cursor,
+      ...(include ? { include } : {}),
     });
-    for (const obj of listed.objects) {
-      keys.push(obj.key);
-    }
+    objects.push(...listed.objects);
     cursor = listed.truncated ? listed.cursor : undefined;
-  } while (cursor && keys.length < maxKeys);
+  } while (cursor && objects.length < maxKeys);
 
-  return keys;
+  return objects;
 }
 
-export async function deleteFile(bucket: R2Bucket, key: string): Promise<void> {
+export async function listFiles(
+  bucket: R2Bucket,
+  prefix: string,
+  maxKeys: number = 1000,
+  budget?: SubrequestBudget
+): Promise<string[]> {
+  return (await listObjects(bucket, prefix, maxKeys, undefined, budget)).map((obj) => obj.key);
+}
+
+/** Listed keys with their custom metadata ({} when none was set); no bodies are read. */
+export async function listFilesWithMetadata(
+  bucket: R2Bucket,
+  prefix: string,
+  maxKeys: number = 1000,
+  budget?: SubrequestBudget
+): Promise<{ key: string; customMetadata: Record<string, string> }[]> {
+  const objects = await listObjects(bucket, prefix, maxKeys, ['customMetadata'], budget);
+  return objects.map((obj) => ({ key: obj.key, customMetadata: obj.customMetadata ?? {} }));
+}
+
+/**
+ * The prefixes one level below `prefix` (through the next "/") that sort after
+ * `startAfter`, in key order — one list call, so at most 1000.
+ */
+export async function listPrefixes(
+  bucket: R2Bucket,
+  prefix: string,
+  maxPrefixes: number = 1000,
+  startAfter?: string,
+  budget?: SubrequestBudget
+): Promise<string[]> {
+  budget?.charge();
+  const listed = await bucket.list({
+    prefix,
+    delimiter: '/',
+    limit: Math.min(maxPrefixes, 1000),
+    ...(startAfter ? { startAfter } : {}),
+  });
+  return listed.delimitedPrefixes;
+}
+
+export async function deleteFile(
+  bucket: R2Bucket,
+  key: string,
+  budget?: SubrequestBudget
+): Promise<void> {
+  budget?.charge();
   await bucket.delete(key);
 }
 
-export async function deleteFiles(bucket: R2Bucket, keys: string[]): Promise<void> {
+export async function deleteFiles(
+  bucket: R2Bucket,
+  keys: string[],
+  budget?: SubrequestBudget
+): Promise<void> {
   if (keys.length === 0) return;
   // R2 delete accepts up to 1000 keys at once
   for (let i = 0; i < keys.length; i += 1000) {
+    budget?.charge();
     await bucket.delete(keys.slice(i, i + 1000));
   }
 }
+
+// -- Bounded-concurrency batch helpers --
+
+/**
+ * Workers allow 6 simultaneous open connections per invocation; further
+ * requests queue behind them, so there is no benefit in issuing more.
+ */
+export const MAX_CONCURRENT_REQUESTS = 6;
+
+/**
+ * Map `items` through `fn` with at most `limit` calls in flight.
+ * Results are returned in input order. On failure no new calls are started,
+ * in-flight calls are allowed to settle, and the first error is rethrown.
+ */
+export async function mapWithConcurrency<T, R>(
+  items: readonly T[],
+  fn: (item: T, index: number) => Promise<R>,
+  limit: number = MAX_CONCURRENT_REQUESTS
+): Promise<R[]> {
+  const results = new Array<R>(items.length);
+  let next = 0;
+  let failed = false;
+  let firstError: unknown;
+
+  async function worker(): Promise<void> {
+    while (!failed && next < items.length) {
+      const i = next++;
+      try {
+        results[i] = await fn(items[i], i);
+      } catch (err) {
+        if (!failed) {
+          failed = true;
+          firstError = err;
+        }
+      }
+    }
+  }
+
+  const workers: Promise<void>[] = [];
+  for (let w = 0; w < Math.min(Math.max(1, limit), items.length); w++) {
+    workers.push(worker());
+  }
+  await Promise.all(workers);
+
+  if (failed) throw firstError;
+  return results;
+}
+
+/** Download several objects concurrently; result order matches `keys`. */
+export async function downloadMany(
+  bucket: R2Bucket,
+  keys: readonly string[],
+  budget?: SubrequestBudget
+): Promise<Uint8Array[]> {
+  return mapWithConcurrency(keys, (key) => downloadFile(bucket, key, budget));
+}
+
+/**
+ * Upload several objects concurrently; resolves to their etags in `files`
+ * order. Rejects if any single upload fails.
+ */
+export async function uploadMany(
+  bucket: R2Bucket,
+  files: readonly { key: string; body: Uint8Array }[],
+  budget?: SubrequestBudget
+): Promise<string[]> {
+  return mapWithConcurrency(files, ({ key, body }) => uploadFile(bucket, key, body, budget));
+}
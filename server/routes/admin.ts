@@ -1,7 +1,17 @@
 import { Hono } from 'hono'
-import { compactBuffer, rebuildChartJsonIncremental } from '../lib/buffer'
+import {
+  compactBuffer,
+  rebuildChartJsonIncremental,
+  migrateArchives,
+  runErasureJobs,
+  exportArchiveCsv,
+  exportArchivesCsv,
+  type ExportOutputs,
+} from '../lib/buffer'
+import { withMaintenanceLease } from '../lib/maintenance'
+import { subrequestBudgetFromEnv } from '../lib/storage'
 
-type Env = { Bindings: { PRAMANA_DATA: R2Bucket; CRON_SECRET: string } }
+type Env = { Bindings: { PRAMANA_DATA: R2Bucket; CRON_SECRET: string; SUBREQUEST_LIMIT?: string } }
 
 function requireCronAuth(c: { req: { header: (name: string) => string | undefined }; env: { CRON_SECRET: string }; json: (body: unknown, status: number) => Response }): Response | null {
   const authHeader = c.req.header('Authorization')
@@ -17,8 +27,10 @@ export const adminRoutes = new Hono<Env>()
     if (denied) return denied
 
     try {
-      const result = await compactBuffer(c.env.PRAMANA_DATA)
-      return c.json({ status: 'completed', ...result })
+      const budget = subrequestBudgetFromEnv(c.env.SUBREQUEST_LIMIT)
+      const result = await withMaintenanceLease(c.env.PRAMANA_DATA, budget, (sub) => compactBuffer(c.env.PRAMANA_DATA, sub))
+      if (!result) return c.json({ status: 'error', error: 'Maintenance run in progress' }, 409)
+      return c.json({ status: 'completed', ...result, subrequestsUsed: budget.used() })
     } catch (err: unknown) {
       const message = err instanceof Error ? err.message : String(err)
       const stack = err instanceof Error ? err.stack : undefined
@@ -30,11 +42,95 @@ export const adminRoutes = new Hono<Env>()
     if (denied) return denied
 
     try {
-      const result = await rebuildChartJsonIncremental(c.env.PRAMANA_DATA)
-      return c.json({ status: result.done ? 'completed' : 'in_progress', ...result })
+      const budget = subrequestBudgetFromEnv(c.env.SUBREQUEST_LIMIT)
+      const result = await withMaintenanceLease(c.env.PRAMANA_DATA, budget, (sub) => rebuildChartJsonIncremental(c.env.PRAMANA_DATA, sub))
+      if (!result) return c.json({ status: 'error', error: 'Maintenance run in progress' }, 409)
+      return c.json({ status: result.done ? 'completed' : 'in_progress', ...result, subrequestsUsed: budget.used() })
     } catch (err: unknown) {
       const message = err instanceof Error ? err.message : String(err)
       const stack = err instanceof Error ? err.stack : undefined
       return c.json({ status: 'error', error: message, stack }, 500)
     }
   })
+  .post('/migrate', async (c) => {
+    const denied = requireCronAuth(c)
+    if (denied) return denied
+
+    try {
+      const budget = subrequestBudgetFromEnv(c.env.SUBREQUEST_LIMIT)
+      const result = await withMaintenanceLease(c.env.PRAMANA_DATA, budget, (sub) => migrateArchives(c.env.PRAMANA_DATA, sub))
+      if (!result) return c.json({ status: 'error', error: 'Maintenance run in progress' }, 409)
+      return c.json({ status: result.done ? 'completed' : 'in_progress', ...result, subrequestsUsed: budget.used() })
+    } catch (err: unknown) {
+      const message = err instanceof Error ? err.message : String(err)
+      if ((err as { status?: number }).status === 409) return c.json({ status: 'error', error: message }, 409)
+      const stack = err instanceof Error ? err.stack : undefined
+      return c.json({ status: 'error', error: message, stack }, 500)
+    }
+  })
+  .post('/erase', async (c) => {
+    const denied = requireCronAuth(c)
+    if (denied) return denied
+
+    try {
+      const budget = subrequestBudgetFromEnv(c.env.SUBREQUEST_LIMIT)
+      const result = await withMaintenanceLease(c.env.PRAMANA_DATA, budget, (sub) => runErasureJobs(c.env.PRAMANA_DATA, sub))
+      if (!result) return c.json({ status: 'error', error: 'Maintenance run in progress' }, 409)
+      return c.json({ status: 'completed', ...result, subrequestsUsed: budget.used() })
+    } catch (err: unknown) {
+      const message = err instanceof Error ? err.message : String(err)
+      const stack = err instanceof Error ? err.stack : undefined
+      return c.json({ status: 'error', error: message, stack }, 500)
+    }
+  })
+  /**
+   * CSV for tools that predate the columnar format: one archive object by
+   * `key`, or the rows within start/end (YYYY-MM-DD, inclusive) and `model`
+   * (comma-separated) from just the archives the manifest says can hold them.
+   * Rows archived without their text (blob-backed or by reference) get it from
+   * their blob within the subrequest budget; X-Outputs-Unresolved counts the
+   * rows whose `output` is still empty. `outputs=hash` skips the blob reads
+   * and leaves those rows to be keyed by output_hash.
+   */
+  .get('/archive', async (c) => {
+    const denied = requireCronAuth(c)
+    if (denied) return denied
+
+    const outputs = c.req.query('outputs') ?? 'text'
+    if (outputs !== 'text' && outputs !== 'hash') {
+      return c.json({ error: 'outputs must be one of: text, hash' }, 400)
+    }
+    const budget = subrequestBudgetFromEnv(c.env.SUBREQUEST_LIMIT)
+
+    const key = c.req.query('key')
+    if (key !== undefined) {
+      if (!/^_archive\/[\w/.-]+\.(csv\.gz|seg)$/.test(key) || key.includes('..')) {
+        return c.json({ error: 'key must name an _archive/ object' }, 400)
+      }
+      const result = await exportArchiveCsv(c.env.PRAMANA_DATA, key, budget, outputs as ExportOutputs)
+      if (result === null) return c.json({ error: 'Not found' }, 404)
+      return c.body(result.csv, 200, {
+        'Content-Type': 'text/csv; charset=utf-8',
+        'X-Outputs-Unresolved': String(result.unresolved),
+      })
+    }
+
+    const start = c.req.query('start') || undefined
+    const end = c.req.query('end') || undefined
+    for (const bound of [start, end]) {
+      if (bound !== undefined && !/^\d{4}-\d{2}-\d{2}$/.test(bound)) {
+        return c.json({ error: 'start/end must be YYYY-MM-DD' }, 400)
+      }
+    }
+    const model = c.req.query('model')
+    const models = model ? model.split(',').map((m) => m.trim()) : undefined
+
+    const result = await exportArchivesCsv(c.env.PRAMANA_DATA, { start, end, models }, budget, outputs as ExportOutputs)
+    if (!result) return c.json({ error: 'Archive manifest incomplete; run /api/admin/migrate first' }, 409)
+    return c.body(result.csv, 200, {
+      'Content-Type': 'text/csv; charset=utf-8',
+      'X-Archives-Read': String(result.archives),
+      'X-Archives-Remaining': String(result.remaining),
+      'X-Outputs-Unresolved': String(result.unresolved),
+    })
+  })
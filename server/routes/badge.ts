@@ -1,5 +1,5 @@
 import { Hono } from 'hono'
-import { readChartJson } from '../lib/buffer'
+import { readChartJsonCached, readChartRange } from '../lib/buffer'
 import type { ModelDayStats } from '../lib/schemas'
 
 type Env = { Bindings: { PRAMANA_DATA: R2Bucket } }
@@ -30,21 +30,26 @@ function makeBadgeSvg(label: string, status: string, color: string): string {
 
 export const badgeRoutes = new Hono<Env>().get('/:model', async (c) => {
   const model = c.req.param('model')
-  const chart = await readChartJson(c.env.PRAMANA_DATA)
+  const bucket = c.env.PRAMANA_DATA
+  const index = await readChartJsonCached(bucket)
 
-  if (!chart.models.includes(model)) {
+  if (!index.models.includes(model)) {
     return c.text('Model not found', 404)
   }
 
+  // The latest buckets sit in the last one or two month shards
+  const recentMonths = index.months.slice(-2)
+  const { data } = await readChartRange(bucket, recentMonths.length > 0 ? { start: `${recentMonths[0]}-01` } : {})
+
   // Compute consistency over last 7 days
-  const dates = Object.keys(chart.data).sort()
+  const dates = Object.keys(data).sort()
   const recentDates = dates.slice(-7)
 
   let totalPrompts = 0
   let totalDrifted = 0
 
   for (const date of recentDates) {
-    const s = chart.data[date]?.[model]
+    const s = data[date]?.[model]
     if (s) {
       totalPrompts += s.prompts_tested
       totalDrifted += s.drifted_prompts
@@ -0,0 +1,137 @@
+// @vitest-environment node
+/**
+ * Chart data route tests — range queries over month shards, conditional GET.
+ */
+import { describe, it, expect, beforeEach } from 'vitest'
+import { Hono } from 'hono'
+import { dataRoutes } from './data'
+import { invalidateChartCache } from '../lib/buffer'
+
+const encoder = new TextEncoder()
+
+/** In-memory R2 stand-in: get (with etagDoesNotMatch) only; records the keys read. */
+function makeBucket(files: Record<string, unknown>, reads: string[]) {
+  const bucket = {
+    async get(key: string, opts?: { onlyIf?: { etagDoesNotMatch?: string } }) {
+      reads.push(key)
+      if (files[key] === undefined) return null
+      const body = encoder.encode(JSON.stringify(files[key]))
+      const etag = `etag-${key}`
+      if (opts?.onlyIf?.etagDoesNotMatch === etag) return { key, etag }
+      return { key, etag, body: new Response(body).body, arrayBuffer: async () => body.slice().buffer }
+    },
+  }
+  return bucket as unknown as R2Bucket
+}
+
+function makeApp(files: Record<string, unknown>) {
+  const reads: string[] = []
+  const app = new Hono<{ Bindings: { PRAMANA_DATA: R2Bucket } }>()
+  app.route('/data', dataRoutes)
+  const env = { PRAMANA_DATA: makeBucket(files, reads) }
+  return {
+    reads,
+    request: (path: string, init?: RequestInit) => app.request(path, init, env),
+  }
+}
+
+const stats = (n: number, drifted = 0) =>
+  ({ submissions: n, prompts_tested: n, unique_outputs: n, drifted_prompts: drifted })
+
+const files = {
+  '_aggregated/chart_data.json': {
+    version: 7,
+    months: ['2026-01', '2026-02'],
+    models: ['gpt-5'],
+    total_submissions: 3,
+    total_contributors: 1,
+    last_updated: '2026-02-21T15:00:00.000Z',
+  },
+  '_aggregated/chart/2026-01.json': { version: 1, month: '2026-01', data: { '2026-01-15-08': { 'gpt-5': stats(1) } } },
+  '_aggregated/chart/2026-02.json': { version: 1, month: '2026-02', data: { '2026-02-21-14': { 'gpt-5': stats(2, 1) } } },
+}
+
+beforeEach(() => {
+  invalidateChartCache()
+})
+
+describe('GET /data/chart', () => {
+  it('returns every month when no range is given', async () => {
+    const app = makeApp(files)
+    const res = await app.request('/data/chart')
+    expect(res.status).toBe(200)
+    const body = await res.json() as { data: Record<string, number | string>[]; total_submissions: number }
+    expect(body.data.map((p) => p.date)).toEqual(['2026-01-15-08', '2026-02-21-14'])
+    expect(body.data[1]['gpt-5_consistency']).toBe(0.5)
+    expect(body.total_submissions).toBe(3)
+  })
+
+  it('reads only the shards overlapping start/end', async () => {
+    const app = makeApp(files)
+    const res = await app.request('/data/chart?start=2026-02-01&end=2026-02-28')
+    const body = await res.json() as { data: Record<string, number | string>[] }
+    expect(body.data.map((p) => p.date)).toEqual(['2026-02-21-14'])
+    expect(app.reads).not.toContain('_aggregated/chart/2026-01.json')
+  })
+
+  it('answers 304 when If-None-Match matches the range etag', async () => {
+    const app = makeApp(files)
+    const first = await app.request('/data/chart?start=2026-02-01')
+    const etag = first.headers.get('etag')!
+    expect(etag).toMatch(/^W\//)
+
+    const res = await app.request('/data/chart?start=2026-02-01', { headers: { 'If-None-Match': etag } })
+    expect(res.status).toBe(304)
+
+    // A different range is a different representation
+    const other = await app.request('/data/chart', { headers: { 'If-None-Match': etag } })
+    expect(other.status).toBe(200)
+  })
+
+  it('serves a coarser stored level for granularity and max_points', async () => {
+    const app = makeApp(files)
+    const daily = await (await app.request('/data/chart?granularity=1d')).json() as { granularity: string; data: { date: string }[] }
+    expect(daily.granularity).toBe('1d')
+    expect(daily.data.map((p) => p.date)).toEqual(['2026-01-15', '2026-02-21'])
+
+    const capped = await (await app.request('/data/chart?start=2026-01-01&end=2026-02-28&max_points=20')).json() as { granularity: string }
+    expect(capped.granularity).toBe('1w')
+
+    const hourly = await (await app.request('/data/chart?granularity=4h')).json() as { granularity: string }
+    expect(hourly.granularity).toBe('1h')
+  })
+
+  it('returns columnar series with field projection', async () => {
+    const app = makeApp(files)
+    const res = await app.request('/data/chart?format=columnar&fields=consistency,submissions')
+    expect(res.status).toBe(200)
+    const body = await res.json() as { dates: string[]; series: Record<string, Record<string, (number | null)[]>> }
+    expect(body.dates).toEqual(['2026-01-15-08', '2026-02-21-14'])
+    expect(body.series['gpt-5']).toEqual({ consistency: [1, 0.5], submissions: [1, 2] })
+  })
+
+  it('projects fields in the wide format too', async () => {
+    const app = makeApp(files)
+    const body = await (await app.request('/data/chart?fields=drifted')).json() as { data: Record<string, unknown>[] }
+    expect(body.data[1]).toEqual({ date: '2026-02-21-14', 'gpt-5_drifted': 1 })
+  })
+
+  it('rejects malformed parameters', async () => {
+    const app = makeApp(files)
+    expect((await app.request('/data/chart?start=last-week')).status).toBe(400)
+    expect((await app.request('/data/chart?start=2026-03-01&end=2026-02-01')).status).toBe(400)
+    expect((await app.request('/data/chart?granularity=daily')).status).toBe(400)
+    expect((await app.request('/data/chart?max_points=0')).status).toBe(400)
+    expect((await app.request('/data/chart?format=csv')).status).toBe(400)
+    expect((await app.request('/data/chart?fields=consistency,latency')).status).toBe(400)
+  })
+
+  it('returns an empty series before the first aggregation', async () => {
+    const app = makeApp({})
+    const res = await app.request('/data/chart')
+    expect(res.status).toBe(200)
+    const body = await res.json() as { data: unknown[]; models: string[] }
+    expect(body.data).toEqual([])
+    expect(body.models).toEqual([])
+  })
+})
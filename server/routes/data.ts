@@ -1,39 +1,85 @@
 import { Hono } from 'hono'
-import { readChartJson } from '../lib/buffer'
-import type { ModelBucketStats } from '../lib/schemas'
+import {
+  readChartEtagCached,
+  readChartJsonCached,
+  readChartResponseBody,
+  pickChartLevel,
+  CHART_SERIES_FIELDS,
+} from '../lib/buffer'
+import type { ChartSeriesField } from '../lib/schemas'
 
 type Env = { Bindings: { PRAMANA_DATA: R2Bucket } }
 
+const CACHE_CONTROL = 'public, max-age=60, stale-while-revalidate=300'
+
+/** start/end bounds: a day (YYYY-MM-DD) or an hourly bucket (YYYY-MM-DD-HH), both inclusive */
+const RANGE_BOUND_RE = /^\d{4}-\d{2}-\d{2}(-\d{2})?$/
+
+/** granularity: a bucket size in hours, days or weeks, e.g. 4h, 1d, 1w */
+const GRANULARITY_RE = /^(\d+)([hdw])$/
+const UNIT_HOURS: Record<string, number> = { h: 1, d: 24, w: 168 }
+
+/** Strip quotes / weak prefix so an If-None-Match value compares against our etag. */
+function parseIfNoneMatch(header: string | undefined): string | null {
+  if (!header) return null
+  return header.trim().replace(/^W\//, '').replace(/^"|"$/g, '') || null
+}
+
 export const dataRoutes = new Hono<Env>().get('/chart', async (c) => {
-  const chart = await readChartJson(c.env.PRAMANA_DATA)
-
-  const data = Object.entries(chart.data)
-    .sort(([a], [b]) => a.localeCompare(b))
-    .map(([date, models]) => {
-      const point: Record<string, string | number> = { date }
-      for (const [model, stats] of Object.entries(models) as [string, ModelBucketStats][]) {
-        point[model] = stats.submissions
-        point[`${model}_prompts`] = stats.prompts_tested
-        point[`${model}_unique_outputs`] = stats.unique_outputs
-        point[`${model}_drifted`] = stats.drifted_prompts
-        point[`${model}_consistency`] = stats.prompts_tested > 0
-          ? (stats.prompts_tested - stats.drifted_prompts) / stats.prompts_tested
-          : 1.0
-      }
-      return point
-    })
-
-  return c.json(
-    {
-      data,
-      models: chart.models,
-      total_submissions: chart.total_submissions,
-      total_contributors: chart.total_contributors,
-      last_updated: chart.last_updated,
-    },
-    200,
-    {
-      'Cache-Control': 'public, max-age=60, stale-while-revalidate=300',
+  const bucket = c.env.PRAMANA_DATA
+  const start = c.req.query('start') || undefined
+  const end = c.req.query('end') || undefined
+  for (const bound of [start, end]) {
+    if (bound !== undefined && !RANGE_BOUND_RE.test(bound)) {
+      return c.json({ error: 'start/end must be YYYY-MM-DD or YYYY-MM-DD-HH' }, 400)
     }
-  )
+  }
+  if (start && end && start > end) {
+    return c.json({ error: 'start must not be after end' }, 400)
+  }
+
+  const granularity = c.req.query('granularity')
+  const unit = granularity ? GRANULARITY_RE.exec(granularity) : null
+  if (granularity && (!unit || Number(unit[1]) === 0)) {
+    return c.json({ error: 'granularity must look like 1h, 4h, 1d or 1w' }, 400)
+  }
+  const maxPointsParam = c.req.query('max_points')
+  const maxPoints = maxPointsParam ? Number(maxPointsParam) : undefined
+  if (maxPoints !== undefined && !(Number.isInteger(maxPoints) && maxPoints > 0)) {
+    return c.json({ error: 'max_points must be a positive integer' }, 400)
+  }
+
+  const format = c.req.query('format') ?? 'wide'
+  if (format !== 'wide' && format !== 'columnar') {
+    return c.json({ error: 'format must be wide or columnar' }, 400)
+  }
+  const fieldsParam = c.req.query('fields')
+  const fields = fieldsParam
+    ? fieldsParam.split(',').map((f) => f.trim()) as ChartSeriesField[]
+    : CHART_SERIES_FIELDS
+  const unknown = fields.filter((f) => !CHART_SERIES_FIELDS.includes(f))
+  if (unknown.length > 0 || fields.length === 0) {
+    return c.json({ error: `fields must be a comma-separated subset of ${CHART_SERIES_FIELDS.join(',')}` }, 400)
+  }
+
+  const range = { start, end }
+  const level = pickChartLevel(await readChartJsonCached(bucket), range, {
+    granularityHours: unit ? Number(unit[1]) * UNIT_HOURS[unit[2]] : undefined,
+    maxPoints,
+  })
+
+  // The chart index is rewritten on every merge/rebuild, so its etag versions every range
+  const indexEtag = await readChartEtagCached(bucket)
+  const etag = indexEtag
+    ? [indexEtag, start ?? '', end ?? '', level, format, fields.join(',')].join(':')
+    : null
+  const headers: Record<string, string> = { 'Cache-Control': CACHE_CONTROL }
+  if (etag) headers.ETag = `W/"${etag}"`
+  if (etag && parseIfNoneMatch(c.req.header('If-None-Match')) === etag) {
+    return new Response(null, { status: 304, headers })
+  }
+
+  // Concatenated from the pre-serialized fragments of the months overlapping the range
+  const body = await readChartResponseBody(bucket, range, level, format, fields)
+  return c.body(body, 200, { ...headers, 'Content-Type': 'application/json' })
 })
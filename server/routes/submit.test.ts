@@ -0,0 +1,332 @@
+// @vitest-environment node
+/**
+ * Submit route tests — compressed bodies, NDJSON streaming (chunked flushes,
+ * per-line errors, limits), hash-first negotiation and references.
+ */
+import { describe, it, expect, beforeEach } from 'vitest'
+import { createHash } from 'crypto'
+import { Hono } from 'hono'
+import { submitRoutes } from './submit'
+import { invalidateChartCache } from '../lib/buffer'
+import { MemoryQueue, consumeIngestBatch } from '../lib/queue'
+import type { IngestMessage } from '../lib/schemas'
+
+/** In-memory R2 stand-in: get/head/put with etag preconditions and custom metadata, plus list. */
+function makeBucket(seed: Record<string, unknown> = {}) {
+  const objects = new Map<string, { body: Uint8Array; etag: string; customMetadata?: Record<string, string> }>()
+  let version = 0
+  for (const [key, value] of Object.entries(seed)) {
+    objects.set(key, { body: new TextEncoder().encode(JSON.stringify(value)), etag: `v${++version}` })
+  }
+  const bucket = {
+    async get(key: string, opts?: { onlyIf?: { etagDoesNotMatch?: string } }) {
+      const obj = objects.get(key)
+      if (!obj) return null
+      if (opts?.onlyIf?.etagDoesNotMatch === obj.etag) return { key, etag: obj.etag }
+      return { key, etag: obj.etag, body: new Response(obj.body).body, arrayBuffer: async () => obj.body.slice().buffer }
+    },
+    async head(key: string) {
+      const obj = objects.get(key)
+      return obj ? { key, etag: obj.etag } : null
+    },
+    async put(key: string, body: Uint8Array, opts?: { onlyIf?: { etagMatches?: string }; customMetadata?: Record<string, string> }) {
+      const match = opts?.onlyIf?.etagMatches
+      if (match !== undefined && objects.get(key)?.etag !== match) return null
+      const etag = `v${++version}`
+      objects.set(key, { body: new Uint8Array(body), etag, customMetadata: opts?.customMetadata })
+      return { key, etag }
+    },
+    async list({ prefix }: { prefix: string }) {
+      const keys = Array.from(objects.keys()).filter((k) => k.startsWith(prefix)).sort()
+      return { objects: keys.map((key) => ({ key, customMetadata: objects.get(key)!.customMetadata })), truncated: false }
+    },
+  }
+  const read = (key: string) => new TextDecoder().decode(objects.get(key)!.body)
+  /** The chart delta header of an ingest entry: "PING" | length (u32 LE) | JSON */
+  const header = (key: string) => {
+    const body = objects.get(key)!.body
+    const end = 8 + new DataView(body.buffer, body.byteOffset).getUint32(4, true)
+    return JSON.parse(new TextDecoder().decode(body.subarray(8, end)))
+  }
+  return { bucket: bucket as unknown as R2Bucket, keys: () => Array.from(objects.keys()), read, header }
+}
+
+function makeApp(seed?: Record<string, unknown>, vars: Record<string, unknown> = {}) {
+  const store = makeBucket(seed)
+  const app = new Hono<{ Bindings: { PRAMANA_DATA: R2Bucket; JWT_SECRET: string; INGEST_COALESCE_MS?: string; INGEST_QUEUE?: Queue<IngestMessage> } }>()
+  app.route('/submit', submitRoutes)
+  const env = { PRAMANA_DATA: store.bucket, JWT_SECRET: 'test-secret-at-least-32-characters-long', ...vars }
+  const deferred: Promise<unknown>[] = []
+  const ctx = { waitUntil: (work: Promise<unknown>) => { deferred.push(work) }, passThroughOnException() {} }
+  return {
+    bucket: store.bucket,
+    keys: store.keys,
+    read: store.read,
+    header: store.header,
+    deferred,
+    stream: (body: string) => app.request('/submit/stream', { method: 'POST', body }, env, ctx),
+    post: (path: string, body: BodyInit, headers: Record<string, string> = {}) =>
+      app.request(path, { method: 'POST', body, headers }, env, ctx),
+  }
+}
+
+async function gzip(text: string): Promise<Uint8Array> {
+  const stream = new Blob([text]).stream().pipeThrough(new CompressionStream('gzip'))
+  return new Uint8Array(await new Response(stream).arrayBuffer())
+}
+
+beforeEach(() => {
+  invalidateChartCache()
+})
+
+const line = (i: number) => JSON.stringify({ model_id: 'gpt-4o', prompt_id: `p${i}`, output: `out ${i}` })
+
+describe('POST /submit/stream', () => {
+  it('stores every line and returns ids and hashes in order', async () => {
+    const app = makeApp()
+    const res = await app.stream(Array.from({ length: 1200 }, (_, i) => line(i)).join('\n') + '\n')
+    expect(res.status).toBe(200)
+    const body = await res.json() as { submitted: number; results: { hash: string }[]; user_summary: { total_submissions: number } }
+    expect(body.submitted).toBe(1200)
+    expect(body.results[0].hash).toMatch(/^sha256:[0-9a-f]{64}$/)
+    expect(body.user_summary.total_submissions).toBe(1200)
+
+    // 1200 lines flush as three bounded chunks: 500 + 500 + 200, one ingest
+    // entry each with the chart delta in its header — no separate delta files
+    const entries = app.keys().filter((k) => k.startsWith('_buffer/entries/'))
+    expect(entries).toHaveLength(3)
+    expect(entries.map((k) => app.header(k).records.length).sort()).toEqual([200, 500, 500])
+    expect(app.keys().filter((k) => k.startsWith('_deltas/'))).toEqual([])
+  })
+
+  it('stops at an invalid line and reports what was already stored', async () => {
+    const app = makeApp()
+    const lines = Array.from({ length: 501 }, (_, i) => line(i))
+    lines.push('{"model_id": "gpt-4o"}', line(999))
+    const res = await app.stream(lines.join('\n'))
+    expect(res.status).toBe(400)
+    const body = await res.json() as { line: number; submitted: number }
+    expect(body.line).toBe(502)
+    expect(body.submitted).toBe(500)
+
+    const bad = await app.stream(`${line(0)}\nnot json\n`)
+    expect(bad.status).toBe(400)
+    expect((await bad.json() as { error: string; submitted: number })).toMatchObject({ error: 'Invalid JSON', submitted: 0 })
+  })
+
+  it('stops with 413 before a chunk the subrequest budget cannot store', async () => {
+    // Two chunks' writes fit in 5 calls; the third would overrun the limit
+    const app = makeApp(undefined, { SUBREQUEST_LIMIT: '5' })
+    const res = await app.stream(Array.from({ length: 1200 }, (_, i) => line(i)).join('\n') + '\n')
+    expect(res.status).toBe(413)
+    const body = await res.json() as { line: number; submitted: number; results: unknown[] }
+    expect(body).toMatchObject({ line: 1001, submitted: 1000 })
+    expect(body.results).toHaveLength(1000)
+    expect(app.keys().filter((k) => k.startsWith('_buffer/entries/'))).toHaveLength(2)
+  })
+
+  it('counts multi-byte output in bytes toward the chunk size', async () => {
+    // 3 × 3 MiB of 3-byte characters passes the 8 MiB threshold in bytes, not in code units
+    const app = makeApp()
+    const wide = (i: number) => JSON.stringify({ model_id: 'm', prompt_id: `p${i}`, output: '€'.repeat(1024 * 1024) })
+    const res = await app.stream([0, 1, 2, 3].map(wide).join('\n'))
+    expect(res.status).toBe(200)
+    const entries = app.keys().filter((k) => k.startsWith('_buffer/entries/'))
+    expect(entries.map((k) => app.header(k).records.length).sort()).toEqual([1, 3])
+  })
+
+  it('rejects a line over the per-line limit with 413', async () => {
+    const app = makeApp()
+    const huge = JSON.stringify({ model_id: 'm', prompt_id: 'p', output: 'x'.repeat(5 * 1024 * 1024) })
+    const res = await app.stream(`${line(0)}\n${huge}\n`)
+    expect(res.status).toBe(413)
+    expect((await res.json() as { submitted: number }).submitted).toBe(0)
+  })
+})
+
+describe('Content-Encoding on submit routes', () => {
+  const batch = (n: number) => JSON.stringify({
+    suite_version: '1', suite_hash: 'h', model_id: 'gpt-4o', temperature: 0, timestamp: '2026-02-22T12:00:00Z',
+    results: Array.from({ length: n }, (_, i) => JSON.parse(line(i))),
+  })
+
+  it('accepts gzip batch, single and stream bodies', async () => {
+    const app = makeApp()
+    const res = await app.post('/submit/batch', await gzip(batch(20)), { 'Content-Encoding': 'gzip' })
+    expect(res.status).toBe(200)
+    expect((await res.json() as { submitted: number }).submitted).toBe(20)
+
+    const single = await app.post('/submit', await gzip(line(1)), { 'Content-Encoding': 'gzip' })
+    expect((await single.json() as { status: string }).status).toBe('accepted')
+
+    const stream = await app.post('/submit/stream', await gzip(`${line(1)}\n${line(2)}\n`), { 'Content-Encoding': 'gzip' })
+    expect((await stream.json() as { submitted: number }).submitted).toBe(2)
+  })
+
+  it('rejects unsupported encodings and bodies that expand past the cap', async () => {
+    const app = makeApp()
+    expect((await app.post('/submit', line(1), { 'Content-Encoding': 'br' })).status).toBe(415)
+
+    const bomb = await gzip(JSON.stringify({ model_id: 'm', prompt_id: 'p', output: '0'.repeat(16 << 20) }))
+    expect((await app.post('/submit', bomb, { 'Content-Encoding': 'gzip' })).status).toBe(413)
+  })
+})
+
+describe('hash-first submission', () => {
+  const hashOf = (output: string) =>
+    'sha256:' + createHash('sha256').update(`gpt-4o|p1|${output}`).digest('hex')
+  const blobOf = (hash: string) => `_blobs/${hash.slice('sha256:'.length)}`
+  const state = {
+    '_aggregated/chart_state.json': { version: 1, prev_hashes: { 'gpt-4o|p1': hashOf('Paris') }, known_users: [] },
+    [blobOf(hashOf('Paris'))]: 'Paris',
+  }
+  const ref = (prompt_id: string, output: string) => ({ model_id: 'gpt-4o', prompt_id, output_hash: hashOf(output) })
+  const batch = (results: unknown[]) => JSON.stringify({
+    suite_version: '1', suite_hash: 'h', model_id: 'gpt-4o', temperature: 0, timestamp: '2026-02-22T12:00:00Z', results,
+  })
+
+  it('reports which output hashes are already held', async () => {
+    const app = makeApp(state)
+    const res = await app.post('/submit/negotiate', JSON.stringify({
+      results: [ref('p1', 'Paris'), ref('p1', 'Lyon'), ref('p2', 'Paris')],
+    }))
+    expect(await res.json()).toEqual({ known: [true, false, false] })
+
+    expect((await app.post('/submit/negotiate', JSON.stringify({ results: [{ ...ref('p1', 'x'), output_hash: 'abc' }] }))).status).toBe(400)
+  })
+
+  it('does not count a latest hash as held until its blob exists', async () => {
+    const { [blobOf(hashOf('Paris'))]: _blob, ...inlineOnly } = state
+    const app = makeApp(inlineOnly)
+    const res = await app.post('/submit/negotiate', JSON.stringify({ results: [ref('p1', 'Paris')] }))
+    expect(await res.json()).toEqual({ known: [false] })
+    expect((await app.post('/submit/batch', batch([ref('p1', 'Paris')]))).status).toBe(409)
+  })
+
+  it('stores known references without their text next to full results', async () => {
+    const app = makeApp(state)
+    const res = await app.post('/submit/batch', batch([ref('p1', 'Paris'), JSON.parse(line(7))]))
+    expect(res.status).toBe(200)
+    const body = await res.json() as { results: { hash: string }[] }
+    expect(body.results[0].hash).toBe(hashOf('Paris'))
+
+    const entry = app.keys().find((k) => k.startsWith('_buffer/entries/'))!
+    const records = (app.header(entry) as { records: { prompt_id: string; output_hash: string }[] }).records
+    expect(records.map((r) => r.output_hash)).toEqual([hashOf('Paris'), body.results[1].hash])
+  })
+
+  it('rejects a batch with an unknown reference before storing anything', async () => {
+    const app = makeApp(state)
+    const res = await app.post('/submit/batch', batch([JSON.parse(line(1)), ref('p1', 'Lyon')]))
+    expect(res.status).toBe(409)
+    expect((await res.json() as { unknown: number[] }).unknown).toEqual([1])
+    expect(app.keys().filter((k) => k.startsWith('_buffer/'))).toEqual([])
+
+    const stream = await app.stream(`${JSON.stringify(ref('p1', 'Paris'))}\n${JSON.stringify(ref('p9', 'x'))}\n`)
+    expect(stream.status).toBe(409)
+    expect((await stream.json() as { lines: number[] }).lines).toEqual([2])
+  })
+})
+
+describe('?summary= modes', () => {
+  const summaryDeltas = (app: ReturnType<typeof makeApp>) => app.keys().filter((k) => k.startsWith('_summary_deltas/'))
+
+  it('echoes the stored summary by default', async () => {
+    const app = makeApp()
+    await app.post('/submit', line(1))
+    const res = await app.post('/submit', line(2))
+    expect((await res.json() as { user_summary: { total_submissions: number } }).user_summary.total_submissions).toBe(2)
+    expect(app.deferred).toHaveLength(0)
+  })
+
+  it('async defers the summary write and projects the summary from the request', async () => {
+    const app = makeApp()
+    await app.post('/submit', line(1))
+    const res = await app.post('/submit?summary=async', line(2))
+    expect(res.status).toBe(200)
+    const body = await res.json() as { user_summary: { total_submissions: number; model_submissions: Record<string, number> } }
+    expect(body.user_summary.total_submissions).toBe(1)
+    expect(body.user_summary.model_submissions).toEqual({ 'gpt-4o': 1 })
+    expect(app.keys().filter((k) => k.startsWith('_buffer/entries/'))).toHaveLength(2)
+
+    expect(app.deferred).toHaveLength(1)
+    await Promise.all(app.deferred)
+    expect(summaryDeltas(app)).toHaveLength(2)
+  })
+
+  it('none omits the summary; batch and stream defer it too', async () => {
+    const app = makeApp()
+    const single = await app.post('/submit?summary=none', line(1))
+    expect(await single.json()).not.toHaveProperty('user_summary')
+
+    const stream = await app.post('/submit/stream?summary=async', `${line(2)}\n${line(3)}\n`)
+    expect((await stream.json() as { user_summary: { total_submissions: number } }).user_summary.total_submissions).toBe(2)
+
+    await app.post('/submit/batch?summary=none', JSON.stringify({
+      suite_version: '1', suite_hash: 'h', model_id: 'gpt-4o', temperature: 0, timestamp: '2026-02-22T12:00:00Z',
+      results: [JSON.parse(line(4))],
+    }))
+    expect(app.deferred).toHaveLength(3)
+    await Promise.all(app.deferred)
+    expect(summaryDeltas(app)).toHaveLength(3)
+  })
+
+  it('rejects unknown modes', async () => {
+    const app = makeApp()
+    expect((await app.post('/submit?summary=later', line(1))).status).toBe(400)
+    expect(app.keys()).toEqual([])
+  })
+})
+
+describe('write coalescing', () => {
+  const prefixed = (app: ReturnType<typeof makeApp>, prefix: string) => app.keys().filter((k) => k.startsWith(prefix))
+
+  it('writes concurrent single submits as one entry and one summary delta', async () => {
+    const app = makeApp(undefined, { INGEST_COALESCE_MS: '20' })
+    const responses = await Promise.all(Array.from({ length: 5 }, (_, i) => app.post('/submit', line(i))))
+    expect(responses.map((r) => r.status)).toEqual([200, 200, 200, 200, 200])
+
+    // Each acknowledged only after the shared write, which holds all five rows
+    const [entry] = prefixed(app, '_buffer/entries/')
+    expect(prefixed(app, '_buffer/entries/')).toHaveLength(1)
+    expect(app.header(entry).records).toHaveLength(5)
+    expect(prefixed(app, '_summary_deltas/')).toHaveLength(1)
+    const last = await responses[4].json() as { user_summary: { total_submissions: number } }
+    expect(last.user_summary.total_submissions).toBe(5)
+  })
+
+  it('writes each submit on its own when the window is unset', async () => {
+    const app = makeApp()
+    await Promise.all([app.post('/submit', line(1)), app.post('/submit', line(2))])
+    expect(prefixed(app, '_buffer/entries/')).toHaveLength(2)
+  })
+})
+
+describe('queue-backed ingest', () => {
+  it('answers 202 after enqueueing and leaves the writes to the consumer', async () => {
+    const queue = new MemoryQueue<IngestMessage>()
+    const app = makeApp(undefined, { INGEST_QUEUE: queue })
+
+    const single = await app.post('/submit', line(1))
+    expect(single.status).toBe(202)
+    const body = await single.json() as { status: string; user_summary: { total_submissions: number } }
+    expect(body.status).toBe('queued')
+    expect(body.user_summary.total_submissions).toBe(1)
+    const batch = await app.post('/submit/batch', JSON.stringify({
+      suite_version: '1', suite_hash: 'h', model_id: 'gpt-4o', temperature: 0, timestamp: '2026-02-22T12:00:00Z',
+      results: [JSON.parse(line(2)), JSON.parse(line(3))],
+    }))
+    expect(batch.status).toBe(202)
+    const stream = await app.stream(`${line(4)}\n`)
+    expect(stream.status).toBe(202)
+    expect(app.keys()).toEqual([])
+
+    // One consumer batch: a single entry and summary delta for the user's four results
+    await queue.drain((b) => consumeIngestBatch(app.bucket, b))
+    const entries = app.keys().filter((k) => k.startsWith('_buffer/entries/'))
+    expect(entries).toHaveLength(1)
+    expect(app.header(entries[0]).records).toHaveLength(4)
+    expect(app.keys().filter((k) => k.startsWith('_summary_deltas/'))).toHaveLength(1)
+    expect(queue.size).toBe(0)
+  })
+})
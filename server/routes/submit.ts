@@ -1,32 +1,199 @@
 /**
- * POST /api/submit — single + batch submission.
+ * POST /api/submit — single, batch and streaming (NDJSON) submission, plus
+ * hash-first negotiation so known outputs are sent by reference.
  */
 import { Hono } from 'hono'
 import { softAuth } from '../middleware/auth'
 import {
   SubmissionRequestSchema,
   BatchSubmissionRequestSchema,
+  SubmissionOrRefSchema,
+  NegotiateRequestSchema,
+  type SubmissionRequest,
+  type SubmissionOrRef,
+  type SubmissionRef,
   type StorageRecord,
+  type UserSummaryJson,
+  type IngestMessage,
 } from '../lib/schemas'
-import { writeBufferEntry, updateUserSummary, writeDelta } from '../lib/buffer'
+import {
+  writeBufferEntry,
+  writeSummaryDelta,
+  readUserSummary,
+  summarizeRecords,
+  knownOutputHashes,
+  writeCoalesced,
+  coalesceWindowFromEnv,
+} from '../lib/buffer'
+import { enqueueRecords } from '../lib/queue'
+import { subrequestBudgetFromEnv, type SubrequestBudget } from '../lib/storage'
+import { sha256Hex, sha256HexMany } from '../lib/crypto'
+import { readNdjsonLines } from '../lib/ndjson'
+import { decodedBody, readJsonBody, bodyErrorStatus } from '../lib/body'
 
 type Env = {
-  Bindings: { PRAMANA_DATA: R2Bucket; JWT_SECRET: string }
+  Bindings: {
+    PRAMANA_DATA: R2Bucket
+    JWT_SECRET: string
+    SUBREQUEST_LIMIT?: string
+    INGEST_COALESCE_MS?: string
+    INGEST_QUEUE?: Queue<IngestMessage>
+  }
   Variables: { userId: string }
 }
 
-async function sha256hex(input: string): Promise<string> {
-  const data = new TextEncoder().encode(input)
-  const hash = await crypto.subtle.digest('SHA-256', data)
-  return Array.from(new Uint8Array(hash))
-    .map((b) => b.toString(16).padStart(2, '0'))
-    .join('')
+/**
+ * Decoded (post Content-Encoding) size caps for the JSON routes. A single
+ * result holds at most a 1 MiB output; larger uploads belong on /stream.
+ */
+const SUBMIT_MAX_BYTES = 8 * 1024 * 1024
+const BATCH_MAX_BYTES = 64 * 1024 * 1024
+const NEGOTIATE_MAX_BYTES = 1024 * 1024
+
+/** /stream limits: a line holds one result (a 1 MiB output may grow when JSON-escaped) */
+const STREAM_MAX_LINE_BYTES = 4 * 1024 * 1024
+const STREAM_MAX_TOTAL_BYTES = 100 * 1024 * 1024  // Workers request body limit (Free/Pro)
+
+/** /stream writes a buffer entry whenever either threshold is reached */
+const STREAM_FLUSH_RECORDS = 500
+const STREAM_FLUSH_BYTES = 8 * 1024 * 1024
+
+/** Subrequests one storeRecords call makes: buffer entry + summary delta */
+const STORE_WRITES = 2
+
+function hashInput(submission: SubmissionRequest): string {
+  return `${submission.model_id}|${submission.prompt_id}|${submission.output}`
+}
+
+/**
+ * Output hash per result: computed for results carrying text, taken as given
+ * for references to outputs the server already holds. Any reference it does
+ * not hold, or could not check within `budget` after `reserve`, is returned in
+ * `unknown` (indexes into `results`) instead.
+ */
+async function resolveOutputHashes(
+  bucket: R2Bucket,
+  results: readonly SubmissionOrRef[],
+  budget: SubrequestBudget,
+  reserve: number
+): Promise<{ hashes: string[]; unknown: number[] }> {
+  const hashes = new Array<string>(results.length)
+  const textIdx: number[] = []
+  const refIdx: number[] = []
+  results.forEach((r, i) => ('output' in r ? textIdx : refIdx).push(i))
+
+  const [computed, known] = await Promise.all([
+    sha256HexMany(textIdx.map((i) => hashInput(results[i] as SubmissionRequest))),
+    knownOutputHashes(bucket, refIdx.map((i) => results[i] as SubmissionRef), budget, reserve),
+  ])
+  textIdx.forEach((i, j) => { hashes[i] = `sha256:${computed[j]}` })
+  const unknown: number[] = []
+  refIdx.forEach((i, j) => {
+    if (known[j]) hashes[i] = (results[i] as SubmissionRef).output_hash
+    else unknown.push(i)
+  })
+  return { hashes, unknown }
+}
+
+/** References are stored with an empty output; the text lives in the `_blobs/` object of their hash. */
+function toStorageRecord(
+  submission: SubmissionOrRef,
+  userId: string,
+  now: Date,
+  outputHash: string
+): StorageRecord {
+  return {
+    id: crypto.randomUUID(),
+    timestamp: now.toISOString(),
+    user_id: userId,
+    model_id: submission.model_id,
+    prompt_id: submission.prompt_id,
+    output: 'output' in submission ? submission.output : '',
+    output_hash: outputHash,
+    metadata_json: JSON.stringify(submission.metadata ?? {}),
+    year: now.getUTCFullYear(),
+    month: now.getUTCMonth() + 1,
+    day: now.getUTCDate(),
+    score: submission.score ?? null,
+  }
+}
+
+/**
+ * ?summary= on the submit routes:
+ *   full  — (default) the summary delta is written before responding and the
+ *           stored summary is echoed as `user_summary` (single and stream)
+ *   async — the summary delta is written after the response (waitUntil) and
+ *           `user_summary` is projected from this request's results alone
+ *   none  — as async, without `user_summary`
+ */
+type SummaryMode = 'full' | 'async' | 'none'
+const SUMMARY_MODES: readonly SummaryMode[] = ['full', 'async', 'none']
+
+function summaryMode(value: string | undefined): SummaryMode | null {
+  if (value === undefined) return 'full'
+  return (SUMMARY_MODES as readonly string[]).includes(value) ? value as SummaryMode : null
+}
+
+/**
+ * The ExecutionContext's waitUntil, or null without one (the Node dev
+ * server), in which case deferred work is awaited like any other write.
+ */
+function waitUntilOf(c: { executionCtx: ExecutionContext }): ((work: Promise<unknown>) => void) | null {
+  try {
+    const ctx = c.executionCtx
+    return (work) => ctx.waitUntil(work)
+  } catch {
+    return null
+  }
+}
+
+interface StoreOptions {
+  deferSummary?: ((work: Promise<unknown>) => void) | null
+  coalesceMs?: number
+  waitUntil?: ((work: Promise<unknown>) => void) | null
+  queue?: Queue<IngestMessage>
+}
+
+/**
+ * Persist records: buffer ingest entry (rows + chart delta) and user summary
+ * delta in parallel. Both are blind PUTs, so concurrent submits never contend.
+ * With `deferSummary` the summary delta is handed to it instead of awaited,
+ * so the response waits only for the buffer entry. A `coalesceMs` window
+ * shares both writes with the user's other submits in this isolate; a
+ * batch this request opens is flushed through `waitUntil`.
+ * With a `queue` the records are enqueued for the ingest consumer instead
+ * ('queued'), unless one is too large for a queue message.
+ */
+async function storeRecords(
+  bucket: R2Bucket,
+  userId: string,
+  records: StorageRecord[],
+  { deferSummary, coalesceMs = 0, waitUntil, queue }: StoreOptions = {}
+): Promise<'stored' | 'queued'> {
+  if (queue && await enqueueRecords(queue, userId, records)) return 'queued'
+  const { entry, summary } = coalesceMs > 0
+    ? writeCoalesced(bucket, userId, records, coalesceMs, waitUntil)
+    : { entry: writeBufferEntry(bucket, records), summary: writeSummaryDelta(bucket, userId, records) }
+  if (deferSummary) deferSummary(summary)
+  await Promise.all([entry, deferSummary ? null : summary])
+  return 'stored'
 }
 
+const INVALID_SUMMARY_MODE = `summary must be one of: ${SUMMARY_MODES.join(', ')}`
+
 export const submitRoutes = new Hono<Env>()
   .use('/*', softAuth)
   .post('/', async (c) => {
-    const body = await c.req.json()
+    const mode = summaryMode(c.req.query('summary'))
+    if (!mode) return c.json({ error: INVALID_SUMMARY_MODE }, 400)
+    let body: unknown
+    try {
+      body = await readJsonBody(c.req.raw, SUBMIT_MAX_BYTES)
+    } catch (err) {
+      const status = bodyErrorStatus(err)
+      if (!status) throw err
+      return c.json({ error: (err as Error).message }, status)
+    }
     const parsed = SubmissionRequestSchema.safeParse(body)
     if (!parsed.success) {
       return c.json(
@@ -37,43 +204,39 @@ export const submitRoutes = new Hono<Env>()
 
     const submission = parsed.data
     const userId = c.get('userId')
-    const now = new Date()
-    const id = crypto.randomUUID()
-
-    const hashInput = `${submission.model_id}|${submission.prompt_id}|${submission.output}`
-    const outputHash = await sha256hex(hashInput)
-
-    const record: StorageRecord = {
-      id,
-      timestamp: now.toISOString(),
-      user_id: userId,
-      model_id: submission.model_id,
-      prompt_id: submission.prompt_id,
-      output: submission.output,
-      output_hash: `sha256:${outputHash}`,
-      metadata_json: JSON.stringify(submission.metadata ?? {}),
-      year: now.getUTCFullYear(),
-      month: now.getUTCMonth() + 1,
-      day: now.getUTCDate(),
-      score: submission.score ?? null,
-    }
+    const outputHash = `sha256:${await sha256Hex(hashInput(submission))}`
+    const record = toStorageRecord(submission, userId, new Date(), outputHash)
 
-    const bucket = c.env.PRAMANA_DATA
-    const [, summary] = await Promise.all([
-      writeBufferEntry(bucket, [record]),
-      updateUserSummary(bucket, userId, [record]),
-      writeDelta(bucket, [record]),
-    ])
+    const outcome = await storeRecords(c.env.PRAMANA_DATA, userId, [record], {
+      deferSummary: mode === 'full' ? null : waitUntilOf(c),
+      // Single results are the bursty case, so only they wait to share a write
+      coalesceMs: coalesceWindowFromEnv(c.env.INGEST_COALESCE_MS),
+      waitUntil: waitUntilOf(c),
+      queue: c.env.INGEST_QUEUE,
+    })
+    // Queued records are not stored yet, so full mode can only project too
+    const summary = mode === 'none' ? undefined
+      : mode === 'full' && outcome === 'stored' ? await readUserSummary(c.env.PRAMANA_DATA, userId)
+      : summarizeRecords([record])
 
     return c.json({
-      status: 'accepted',
-      id,
-      hash: `sha256:${outputHash}`,
+      status: outcome === 'queued' ? 'queued' : 'accepted',
+      id: record.id,
+      hash: record.output_hash,
       user_summary: summary,
-    })
+    }, outcome === 'queued' ? 202 : 200)
   })
   .post('/batch', async (c) => {
-    const body = await c.req.json()
+    const mode = summaryMode(c.req.query('summary'))
+    if (!mode) return c.json({ error: INVALID_SUMMARY_MODE }, 400)
+    let body: unknown
+    try {
+      body = await readJsonBody(c.req.raw, BATCH_MAX_BYTES)
+    } catch (err) {
+      const status = bodyErrorStatus(err)
+      if (!status) throw err
+      return c.json({ error: (err as Error).message }, status)
+    }
     const parsed = BatchSubmissionRequestSchema.safeParse(body)
     if (!parsed.success) {
       return c.json(
@@ -86,42 +249,167 @@ export const submitRoutes = new Hono<Env>()
     const userId = c.get('userId')
     const now = new Date()
 
-    const records: StorageRecord[] = []
-    const results: { id: string; hash: string }[] = []
+    // Nothing is stored unless every reference resolves; the client resends those with text
+    const budget = subrequestBudgetFromEnv(c.env.SUBREQUEST_LIMIT)
+    const { hashes, unknown } = await resolveOutputHashes(c.env.PRAMANA_DATA, batch.results, budget, STORE_WRITES)
+    if (unknown.length > 0) {
+      return c.json({ error: 'Unknown output_hash; resend these results with output', unknown }, 409)
+    }
+    const records = batch.results.map((submission, i) =>
+      toStorageRecord(submission, userId, now, hashes[i]))
 
-    for (const submission of batch.results) {
-      const id = crypto.randomUUID()
-      const hashInput = `${submission.model_id}|${submission.prompt_id}|${submission.output}`
-      const outputHash = await sha256hex(hashInput)
-
-      records.push({
-        id,
-        timestamp: now.toISOString(),
-        user_id: userId,
-        model_id: submission.model_id,
-        prompt_id: submission.prompt_id,
-        output: submission.output,
-        output_hash: `sha256:${outputHash}`,
-        metadata_json: JSON.stringify(submission.metadata ?? {}),
-        year: now.getUTCFullYear(),
-        month: now.getUTCMonth() + 1,
-        day: now.getUTCDate(),
-        score: submission.score ?? null,
-      })
-
-      results.push({ id, hash: `sha256:${outputHash}` })
+    const outcome = await storeRecords(c.env.PRAMANA_DATA, userId, records, {
+      deferSummary: mode === 'full' ? null : waitUntilOf(c),
+      queue: c.env.INGEST_QUEUE,
+    })
+
+    return c.json({
+      status: outcome === 'queued' ? 'queued' : 'completed',
+      submitted: records.length,
+      results: records.map((r) => ({ id: r.id, hash: r.output_hash })),
+      ...(mode === 'async' ? { user_summary: summarizeRecords(records) } : {}),
+    }, outcome === 'queued' ? 202 : 200)
+  })
+  /**
+   * Hash-first negotiation: for each (model_id, prompt_id, output_hash) say
+   * whether the server already holds that output. Known results can then be
+   * submitted with `output_hash` in place of `output`. Results beyond what the
+   * subrequest budget can check answer false.
+   */
+  .post('/negotiate', async (c) => {
+    let body: unknown
+    try {
+      body = await readJsonBody(c.req.raw, NEGOTIATE_MAX_BYTES)
+    } catch (err) {
+      const status = bodyErrorStatus(err)
+      if (!status) throw err
+      return c.json({ error: (err as Error).message }, status)
     }
+    const parsed = NegotiateRequestSchema.safeParse(body)
+    if (!parsed.success) {
+      return c.json(
+        { error: 'Validation failed', details: parsed.error.flatten() },
+        400
+      )
+    }
+
+    const budget = subrequestBudgetFromEnv(c.env.SUBREQUEST_LIMIT)
+    const known = await knownOutputHashes(c.env.PRAMANA_DATA, parsed.data.results, budget)
+    return c.json({ known })
+  })
+  /**
+   * One result (or reference) per line, same fields as a /batch result. Lines
+   * are validated as they arrive and hashed and stored in bounded chunks, so
+   * memory does not grow with the upload. On a bad line or an unknown reference
+   * the request stops: chunks already stored stay stored and are listed in
+   * `results`; the unflushed remainder is dropped. A chunk the subrequest budget
+   * can no longer store stops it the same way, with 413 and the `line` to
+   * resend from.
+   */
+  .post('/stream', async (c) => {
+    const mode = summaryMode(c.req.query('summary'))
+    if (!mode) return c.json({ error: INVALID_SUMMARY_MODE }, 400)
+    if (Number(c.req.header('Content-Length')) > STREAM_MAX_TOTAL_BYTES) {
+      return c.json({ error: `Body exceeds ${STREAM_MAX_TOTAL_BYTES} bytes` }, 413)
+    }
+    let body: ReadableStream<Uint8Array> | null
+    try {
+      // The total cap applies to decoded bytes, so it also bounds compressed uploads
+      body = decodedBody(c.req.raw, STREAM_MAX_TOTAL_BYTES)
+    } catch (err) {
+      const status = bodyErrorStatus(err)
+      if (!status) throw err
+      return c.json({ error: (err as Error).message }, status)
+    }
+    if (!body) return c.json({ error: 'Request body required' }, 400)
 
     const bucket = c.env.PRAMANA_DATA
-    await Promise.all([
-      writeBufferEntry(bucket, records),
-      updateUserSummary(bucket, userId, records),
-      writeDelta(bucket, records),
-    ])
+    const userId = c.get('userId')
+    const budget = subrequestBudgetFromEnv(c.env.SUBREQUEST_LIMIT)
+    const results: { id: string; hash: string }[] = []
+    const store: StoreOptions = { deferSummary: mode === 'full' ? null : waitUntilOf(c), queue: c.env.INGEST_QUEUE }
+    const projected: UserSummaryJson | undefined = mode === 'none' ? undefined : summarizeRecords([])
+    let queued = false
+    let pending: { submission: SubmissionOrRef; lineNumber: number }[] = []
+    let pendingBytes = 0
+
+    /** Store the pending chunk; returns the response that stops the request instead, if any. */
+    const flush = async (): Promise<Response | null> => {
+      if (pending.length === 0) return null
+      const chunk = pending
+      pending = []
+      pendingBytes = 0
+      if (budget.fit(1, STORE_WRITES) === 0) {
+        return c.json({
+          error: `Subrequest budget exhausted; resend from line ${chunk[0].lineNumber}`,
+          line: chunk[0].lineNumber,
+          submitted: results.length,
+          results,
+        }, 413)
+      }
+      const { hashes, unknown } = await resolveOutputHashes(bucket, chunk.map((p) => p.submission), budget, STORE_WRITES)
+      if (unknown.length > 0) {
+        return c.json({
+          error: 'Unknown output_hash; resend these lines with output',
+          lines: unknown.map((i) => chunk[i].lineNumber),
+          submitted: results.length,
+          results,
+        }, 409)
+      }
+      const now = new Date()
+      const records = chunk.map(({ submission }, i) => toStorageRecord(submission, userId, now, hashes[i]))
+      if (await storeRecords(bucket, userId, records, store) === 'queued') queued = true
+      budget.charge(STORE_WRITES)
+      if (projected) summarizeRecords(records, projected)
+      for (const r of records) results.push({ id: r.id, hash: r.output_hash })
+      return null
+    }
+
+    try {
+      for await (const { line, lineNumber, bytes } of readNdjsonLines(body, {
+        maxLineBytes: STREAM_MAX_LINE_BYTES,
+        maxTotalBytes: STREAM_MAX_TOTAL_BYTES,
+      })) {
+        let json: unknown
+        try {
+          json = JSON.parse(line)
+        } catch {
+          return c.json({ error: 'Invalid JSON', line: lineNumber, submitted: results.length, results }, 400)
+        }
+        const parsed = SubmissionOrRefSchema.safeParse(json)
+        if (!parsed.success) {
+          return c.json({
+            error: 'Validation failed',
+            line: lineNumber,
+            details: parsed.error.flatten(),
+            submitted: results.length,
+            results,
+          }, 400)
+        }
+
+        pending.push({ submission: parsed.data, lineNumber })
+        pendingBytes += bytes
+        if (pending.length >= STREAM_FLUSH_RECORDS || pendingBytes >= STREAM_FLUSH_BYTES) {
+          const stopped = await flush()
+          if (stopped) return stopped
+        }
+      }
+    } catch (err) {
+      // Limit breaches (413) and undecodable compressed data (400)
+      const status = bodyErrorStatus(err)
+      if (!status) throw err
+      return c.json({ error: (err as Error).message, submitted: results.length, results }, status)
+    }
+    const stopped = await flush()
+    if (stopped) return stopped
+    const summary = results.length === 0 ? undefined
+      : mode === 'full' && !queued ? await readUserSummary(bucket, userId)
+      : projected
 
     return c.json({
-      status: 'completed',
+      status: queued ? 'queued' : 'completed',
       submitted: results.length,
       results,
-    })
+      user_summary: summary,
+    }, queued ? 202 : 200)
   })
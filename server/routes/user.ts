@@ -3,11 +3,18 @@
  */
 import { Hono } from 'hono'
 import { requireAuth } from '../middleware/auth'
-import { readUserSummary, readChartJson, deleteUserFromBuffer, rebuildChartJson } from '../lib/buffer'
-import { listFiles, deleteFiles, deleteFile } from '../lib/storage'
+import {
+  readUserSummary,
+  deleteUserSummary,
+  deleteUserFromBuffer,
+  requestErasure,
+  advanceErasureJob,
+  readErasureJob,
+} from '../lib/buffer'
+import { subrequestBudgetFromEnv } from '../lib/storage'
 
 type Env = {
-  Bindings: { PRAMANA_DATA: R2Bucket; JWT_SECRET: string }
+  Bindings: { PRAMANA_DATA: R2Bucket; JWT_SECRET: string; SUBREQUEST_LIMIT?: string }
   Variables: { userId: string }
 }
 
@@ -18,16 +25,37 @@ export const userRoutes = new Hono<Env>()
     const userId = c.get('userId')
     const bucket = c.env.PRAMANA_DATA
 
-    const bufferRowsRemoved = await deleteUserFromBuffer(bucket, userId)
-    await deleteFile(bucket, `_users/${userId}/summary.json`)
-    await rebuildChartJson(bucket)
+    const budget = subrequestBudgetFromEnv(c.env.SUBREQUEST_LIMIT)
 
+    // Buffered rows go now: entries are found by their user tag, not by reading them
+    const bufferRowsRemoved = await deleteUserFromBuffer(bucket, userId, budget)
+    await deleteUserSummary(bucket, userId, budget)
+    // Archived rows are erased by a resumable job (continued by the compaction
+    // cron); take its first step within this request
+    const job = await advanceErasureJob(bucket, await requestErasure(bucket, userId, budget), budget)
+
+    if (job.status === 'done') {
+      return c.json({
+        status: 'deleted',
+        user_id: userId,
+        buffer_rows_removed: bufferRowsRemoved,
+        rows_removed: job.rows_removed,
+        blobs_removed: job.blobs_removed ?? 0,
+        message: 'All your data has been permanently deleted',
+      })
+    }
     return c.json({
-      status: 'deleted',
+      status: 'pending',
       user_id: userId,
       buffer_rows_removed: bufferRowsRemoved,
-      message: 'All your data has been permanently deleted',
-    })
+      erasure: job,
+      message: 'Your summary has been deleted; your submissions are being erased (see /api/user/me/erasure)',
+    }, 202)
+  })
+  .get('/me/erasure', async (c) => {
+    const job = await readErasureJob(c.env.PRAMANA_DATA, c.get('userId'))
+    if (!job) return c.json({ error: 'No erasure requested' }, 404)
+    return c.json(job)
   })
   .get('/me/stats', async (c) => {
     const userId = c.get('userId')
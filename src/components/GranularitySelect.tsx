@@ -14,6 +14,7 @@ const GRANULARITY_OPTIONS: { value: Granularity; label: string }[] = [
   { value: '6h', label: '6 hours' },
   { value: '8h', label: '8 hours' },
   { value: '1d', label: '1 day' },
+  { value: '1w', label: '1 week' },
 ];
 
 export default function GranularitySelect({ value, onChange }: GranularitySelectProps) {
@@ -0,0 +1,110 @@
+import { describe, it, expect } from 'vitest'
+
+import { aggregateColumns, columnsToRows } from './aggregate'
+import type { ChartColumns } from './types'
+
+/** Six hourly buckets over two days (2026-02-22 is a Sunday), gpt-5 missing in two of them. */
+const hourly: ChartColumns = {
+  dates: ['2026-02-22-01', '2026-02-22-03', '2026-02-22-05', '2026-02-22-22', '2026-02-23-00', '2026-02-23-07'],
+  series: {
+    'gpt-5': {
+      submissions: [1, 2, null, 4, null, 6],
+      prompts: [1, 2, null, 4, null, 5],
+      drifted: [0, 1, null, 0, null, 5],
+    },
+    'claude-4': {
+      submissions: [null, 3, 1, null, 2, null],
+      prompts: [null, 3, 1, null, 2, null],
+      drifted: [null, 0, 1, null, 0, null],
+    },
+  },
+}
+
+describe('aggregateColumns', () => {
+  it('keeps hourly buckets at 1h and derives consistency', () => {
+    const out = aggregateColumns(hourly, '1h', ['gpt-5'])
+    expect(out.dates).toEqual(hourly.dates)
+    expect(out.series['gpt-5'].submissions).toEqual([1, 2, null, 4, null, 6])
+    expect(out.series['gpt-5'].consistency).toEqual([1, 0.5, null, 1, null, 0])
+  })
+
+  it('sums hours into 4h buckets', () => {
+    const out = aggregateColumns(hourly, '4h', ['gpt-5', 'claude-4'])
+    expect(out.dates).toEqual(['2026-02-22-00', '2026-02-22-04', '2026-02-22-20', '2026-02-23-00', '2026-02-23-04'])
+    expect(out.series['gpt-5'].submissions).toEqual([3, null, 4, null, 6])
+    expect(out.series['claude-4'].submissions).toEqual([3, 1, null, 2, null])
+    // 3 prompts, 1 drifted across the two summed hours
+    expect(out.series['gpt-5'].consistency).toEqual([2 / 3, null, 1, null, 0])
+  })
+
+  it('sums into days, and weeks keyed by their Monday', () => {
+    const daily = aggregateColumns(hourly, '1d', ['gpt-5', 'claude-4'])
+    expect(daily.dates).toEqual(['2026-02-22', '2026-02-23'])
+    expect(daily.series['gpt-5'].submissions).toEqual([7, 6])
+    expect(daily.series['claude-4'].submissions).toEqual([4, 2])
+
+    const weekly = aggregateColumns(hourly, '1w', ['gpt-5', 'claude-4'])
+    expect(weekly.dates).toEqual(['2026-02-16', '2026-02-23'])
+    expect(weekly.series['claude-4'].drifted).toEqual([1, 0])
+    expect(weekly.series['claude-4'].consistency).toEqual([0.75, 1])
+  })
+
+  it('passes daily keys through sub-day granularities', () => {
+    const out = aggregateColumns({ dates: ['2026-02-22', '2026-02-23'], series: { 'gpt-5': { submissions: [1, 2] } } }, '4h', ['gpt-5'])
+    expect(out.dates).toEqual(['2026-02-22', '2026-02-23'])
+    expect(out.series['gpt-5'].submissions).toEqual([1, 2])
+  })
+
+  it('keeps only the selected models, skipping ones without a series', () => {
+    const out = aggregateColumns(hourly, '1d', ['claude-4', 'absent'])
+    expect(Object.keys(out.series)).toEqual(['claude-4'])
+  })
+
+  it('only produces the fields that were fetched', () => {
+    const submissionsOnly: ChartColumns = {
+      dates: hourly.dates,
+      series: { 'gpt-5': { submissions: hourly.series['gpt-5'].submissions } },
+    }
+    const out = aggregateColumns(submissionsOnly, '1d', ['gpt-5'])
+    expect(Object.keys(out.series['gpt-5'])).toEqual(['submissions'])
+    // Without drifted there is nothing to derive consistency from
+    const noDrift = aggregateColumns({ dates: ['2026-02-22-01'], series: { 'gpt-5': { prompts: [2] } } }, '1h', ['gpt-5'])
+    expect(noDrift.series['gpt-5'].consistency).toBeUndefined()
+  })
+
+  it('treats a bucket with no prompts as consistent', () => {
+    const out = aggregateColumns({
+      dates: ['2026-02-22-01'],
+      series: { 'gpt-5': { prompts: [0], drifted: [0] } },
+    }, '1h', ['gpt-5'])
+    expect(out.series['gpt-5'].consistency).toEqual([1])
+  })
+})
+
+describe('columnsToRows', () => {
+  it('builds one row per date with model-suffixed keys, filling buckets without data', () => {
+    const columns = aggregateColumns(hourly, '1d', ['gpt-5', 'claude-4'])
+    const rows = columnsToRows({
+      dates: ['2026-02-22-01', '2026-02-22-03'],
+      series: {
+        'gpt-5': { submissions: [1, null], prompts: [1, null] },
+        'claude-4': { submissions: [null, 3], consistency: [null, 0.5] },
+      },
+    }, ['gpt-5', 'claude-4'])
+    // Counts fill with 0 and consistency with 1.0, as the charts plotted before columns
+    expect(rows).toEqual([
+      { date: '2026-02-22-01', 'gpt-5': 1, 'gpt-5_prompts': 1, 'claude-4': 0, 'claude-4_consistency': 1 },
+      { date: '2026-02-22-03', 'gpt-5': 0, 'gpt-5_prompts': 0, 'claude-4': 3, 'claude-4_consistency': 0.5 },
+    ])
+
+    // Series stay aligned across models after aggregation
+    const daily = columnsToRows(columns, ['gpt-5', 'claude-4'])
+    expect(daily.map((r) => r.date)).toEqual(['2026-02-22', '2026-02-23'])
+    expect(daily[1]).toMatchObject({ 'gpt-5': 6, 'gpt-5_drifted': 5, 'claude-4': 2, 'claude-4_drifted': 0 })
+  })
+
+  it('skips models without a series', () => {
+    const rows = columnsToRows({ dates: ['2026-02-22'], series: { 'gpt-5': { submissions: [1] } } }, ['gpt-5', 'absent'])
+    expect(rows).toEqual([{ date: '2026-02-22', 'gpt-5': 1 }])
+  })
+})
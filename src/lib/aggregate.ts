@@ -1,4 +1,4 @@
-import type { ChartDataPoint, Granularity } from './types';
+import type { ChartColumns, ChartDataPoint, ChartSeries, ChartSeriesField, Granularity } from './types';
 
 const GRANULARITY_HOURS: Record<Granularity, number> = {
   '1h': 1,
@@ -7,62 +7,103 @@ const GRANULARITY_HOURS: Record<Granularity, number> = {
   '6h': 6,
   '8h': 8,
   '1d': 24,
+  '1w': 168,
+};
+
+/** Additive fields; consistency is re-derived from prompts and drifted after summing. */
+const SUMMED_FIELDS: ChartSeriesField[] = ['submissions', 'prompts', 'unique_outputs', 'drifted'];
+
+/** Row key suffix per field, as read by DriftChart: `model`, `model_prompts`, ... */
+const ROW_SUFFIX: Record<ChartSeriesField, string> = {
+  submissions: '',
+  prompts: '_prompts',
+  unique_outputs: '_unique_outputs',
+  drifted: '_drifted',
+  consistency: '_consistency',
 };
 
 /**
- * Aggregate hourly chart data (YYYY-MM-DD-HH keys) into coarser buckets.
- * Pure function — no side effects.
+ * Aggregate hourly (YYYY-MM-DD-HH) or daily (YYYY-MM-DD) columnar chart data into
+ * coarser buckets, keeping only `models`. Consistency is only produced when
+ * prompts and drifted were fetched. Pure function — no side effects.
  */
-export function aggregateByGranularity(
-  data: ChartDataPoint[],
+export function aggregateColumns(
+  columns: ChartColumns,
   granularity: Granularity,
   models: string[],
-): ChartDataPoint[] {
-  if (granularity === '1h') return data;
-
+): ChartColumns {
   const size = GRANULARITY_HOURS[granularity];
-  const groups = new Map<string, ChartDataPoint[]>();
 
-  for (const point of data) {
-    const bucketKey = snapBucket(point.date, size);
-    if (!groups.has(bucketKey)) groups.set(bucketKey, []);
-    groups.get(bucketKey)!.push(point);
+  // Dates arrive sorted and snapping preserves order, so each bucket is a run
+  const dates: string[] = [];
+  const slot: number[] = [];
+  for (const date of columns.dates) {
+    const bucketKey = snapBucket(date, size);
+    if (dates[dates.length - 1] !== bucketKey) dates.push(bucketKey);
+    slot.push(dates.length - 1);
   }
 
-  const result: ChartDataPoint[] = [];
-  for (const [bucketKey, points] of Array.from(groups.entries()).sort(([a], [b]) => a.localeCompare(b))) {
-    const merged: ChartDataPoint = { date: bucketKey };
+  const series: Record<string, ChartSeries> = {};
+  for (const model of models) {
+    const input = columns.series[model];
+    if (!input) continue;
 
-    for (const model of models) {
-      let submissions = 0;
-      let prompts = 0;
-      let uniqueOutputs = 0;
-      let drifted = 0;
-
-      for (const p of points) {
-        submissions += (p[model] as number) || 0;
-        prompts += (p[`${model}_prompts`] as number) || 0;
-        uniqueOutputs += (p[`${model}_unique_outputs`] as number) || 0;
-        drifted += (p[`${model}_drifted`] as number) || 0;
-      }
-
-      merged[model] = submissions;
-      merged[`${model}_prompts`] = prompts;
-      merged[`${model}_unique_outputs`] = uniqueOutputs;
-      merged[`${model}_drifted`] = drifted;
-      merged[`${model}_consistency`] = prompts > 0
-        ? (prompts - drifted) / prompts
-        : 1.0;
+    const output: ChartSeries = {};
+    for (const field of SUMMED_FIELDS) {
+      const values = input[field];
+      if (!values) continue;
+      const summed: (number | null)[] = new Array(dates.length).fill(null);
+      values.forEach((v, i) => {
+        if (v !== null) summed[slot[i]] = (summed[slot[i]] ?? 0) + v;
+      });
+      output[field] = summed;
     }
 
-    result.push(merged);
+    const { prompts, drifted } = output;
+    if (prompts && drifted) {
+      output.consistency = prompts.map((p, i) => {
+        if (p === null) return null;
+        return p > 0 ? (p - (drifted[i] ?? 0)) / p : 1.0;
+      });
+    }
+    series[model] = output;
   }
 
-  return result;
+  return { dates, series };
 }
 
-/** Snap an hourly key (YYYY-MM-DD-HH) to the start of its granularity bucket. */
+/** Row value for a bucket where a model has no data: no submissions, fully consistent. */
+const ROW_FILL: Record<ChartSeriesField, number> = {
+  submissions: 0,
+  prompts: 0,
+  unique_outputs: 0,
+  drifted: 0,
+  consistency: 1.0,
+};
+
+/** Expand columns into the per-date rows the chart library plots; nulls get their ROW_FILL value. */
+export function columnsToRows(columns: ChartColumns, models: string[]): ChartDataPoint[] {
+  return columns.dates.map((date, i) => {
+    const row: ChartDataPoint = { date };
+    for (const model of models) {
+      const series = columns.series[model];
+      if (!series) continue;
+      for (const [field, values] of Object.entries(series) as [ChartSeriesField, (number | null)[]][]) {
+        row[`${model}${ROW_SUFFIX[field]}`] = values[i] ?? ROW_FILL[field];
+      }
+    }
+    return row;
+  });
+}
+
+/** Snap an hourly or daily key to the start of its granularity bucket. */
 function snapBucket(date: string, sizeHours: number): string {
+  if (sizeHours >= 168) {
+    // Weekly: the Monday (UTC) of the bucket's week, matching the server rollup
+    const d = new Date(`${date.slice(0, 10)}T00:00:00Z`);
+    d.setUTCDate(d.getUTCDate() - ((d.getUTCDay() + 6) % 7));
+    return d.toISOString().slice(0, 10);
+  }
   if (sizeHours >= 24) {
     // Daily: truncate to YYYY-MM-DD
     return date.slice(0, 10);
@@ -9,6 +9,8 @@ export interface ChartDataPoint {
 }
 
 export interface ChartApiResponse {
+  /** Stored level the points come from; coarser than requested when max_points demanded it */
+  granularity?: '1h' | '1d' | '1w';
   data: ChartDataPoint[];
   models: string[];
   total_submissions: number;
@@ -16,6 +18,25 @@ export interface ChartApiResponse {
   last_updated?: string;
 }
 
+export type ChartSeriesField = 'submissions' | 'prompts' | 'unique_outputs' | 'drifted' | 'consistency';
+
+/** One model's values per field, aligned with `dates`; null where the model has no data. */
+export type ChartSeries = Partial<Record<ChartSeriesField, (number | null)[]>>;
+
+export interface ChartColumns {
+  dates: string[];
+  series: Record<string, ChartSeries>;
+}
+
+/** /api/data/chart?format=columnar — only the series named in `fields` are present */
+export interface ChartColumnarApiResponse extends ChartColumns {
+  granularity?: '1h' | '1d' | '1w';
+  models: string[];
+  total_submissions: number;
+  total_contributors: number;
+  last_updated?: string;
+}
+
 export interface UserStatsResponse {
   user_id: string;
   total_submissions: number;
@@ -25,7 +46,7 @@ export interface UserStatsResponse {
   last_submission: string | null;
 }
 
-export type Granularity = '1h' | '2h' | '4h' | '6h' | '8h' | '1d';
+export type Granularity = '1h' | '2h' | '4h' | '6h' | '8h' | '1d' | '1w';
 
 export interface UserSummaryResponse {
   version: 3;
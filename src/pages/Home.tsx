@@ -5,8 +5,8 @@ import FilterPanel from '@/components/FilterPanel';
 import type { Filters } from '@/components/FilterPanel';
 import Button from '@/components/Button';
 import CopyButton from '@/components/CopyButton';
-import type { ChartDataPoint, ChartApiResponse } from '@/lib/types';
-import { aggregateByGranularity } from '@/lib/aggregate';
+import type { ChartColumns, ChartColumnarApiResponse } from '@/lib/types';
+import { aggregateColumns, columnsToRows } from '@/lib/aggregate';
 
 const VIEW_OPTIONS: { value: ChartView; label: string }[] = [
   { value: 'consistency', label: 'Consistency' },
@@ -14,6 +14,12 @@ const VIEW_OPTIONS: { value: ChartView; label: string }[] = [
   { value: 'drift-events', label: 'Drift Events' },
 ];
 
+/** Upper bound on points requested from the chart API; the server coarsens past it */
+const MAX_CHART_POINTS = 1000;
+
+/** Series the dashboard uses; consistency is derived client-side after rollup */
+const CHART_FIELDS = 'submissions,prompts,drifted';
+
 function consistencyBadgeClass(v: number): string {
   if (v >= 0.95) return 'badge-good';
   if (v >= 0.80) return 'badge-warn';
@@ -35,7 +41,7 @@ export default function Home() {
   });
 
   const [chartView, setChartView] = useState<ChartView>('consistency');
-  const [rawData, setRawData] = useState<ChartDataPoint[]>([]);
+  const [rawData, setRawData] = useState<ChartColumns>({ dates: [], series: {} });
   const [availableModels, setAvailableModels] = useState<string[]>([]);
   const [totalSubmissions, setTotalSubmissions] = useState(0);
   const [totalContributors, setTotalContributors] = useState(0);
@@ -51,13 +57,23 @@ export default function Home() {
       setError(null);
 
       try {
-        const res = await fetch('/api/data/chart');
+        // Only the months covering the selected window are read server-side, and
+        // long windows come back pre-rolled to daily/weekly points
+        const params = new URLSearchParams({
+          start: filters.startDate,
+          end: filters.endDate,
+          granularity: filters.granularity,
+          max_points: String(MAX_CHART_POINTS),
+          format: 'columnar',
+          fields: CHART_FIELDS,
+        });
+        const res = await fetch(`/api/data/chart?${params}`);
         if (!res.ok) throw new Error(`API error: ${res.status}`);
 
-        const json = await res.json() as ChartApiResponse;
+        const json = await res.json() as ChartColumnarApiResponse;
         if (cancelled) return;
 
-        setRawData(json.data || []);
+        setRawData({ dates: json.dates || [], series: json.series || {} });
         setTotalSubmissions(json.total_submissions || 0);
         setTotalContributors(json.total_contributors || 0);
         setLastUpdated(json.last_updated ?? null);
@@ -74,35 +90,40 @@ export default function Home() {
 
     loadData();
     return () => { cancelled = true; };
-  }, []);
+  }, [filters.startDate, filters.endDate, filters.granularity]);
 
   const displayModels = filters.selectedModels.length > 0
     ? filters.selectedModels
     : availableModels;
 
-  const chartData = useMemo(() => {
-    const filtered = rawData.filter((d) => {
-      // Slice bucket key to 10 chars (YYYY-MM-DD) for date comparison
-      const dateOnly = d.date.slice(0, 10);
-      return dateOnly >= filters.startDate && dateOnly <= filters.endDate;
-    });
-    return aggregateByGranularity(filtered, filters.granularity, displayModels);
-  }, [rawData, filters.startDate, filters.endDate, filters.granularity, displayModels]);
+  // The API already limits points to the selected window (a weekly point may
+  // start before it), so only the granularity rollup happens here
+  const columns = useMemo(
+    () => aggregateColumns(rawData, filters.granularity, displayModels),
+    [rawData, filters.granularity, displayModels],
+  );
+
+  // Rows are only built for the chart library; stats below read the columns
+  const chartData = useMemo(
+    () => columnsToRows(columns, displayModels),
+    [columns, displayModels],
+  );
 
   // Weighted average consistency from latest data point
   const overallConsistency = useMemo(() => {
-    if (chartData.length === 0 || displayModels.length === 0) return null;
-    const latest = chartData[chartData.length - 1];
+    const latest = columns.dates.length - 1;
+    if (latest < 0 || displayModels.length === 0) return null;
     let totalPrompts = 0;
     let weightedSum = 0;
     for (const model of displayModels) {
-      const prompts = (latest[`${model}_prompts`] as number) || 0;
-      const consistency = (latest[`${model}_consistency`] as number) || 0;
+      const series = columns.series[model];
+      const prompts = series?.prompts?.[latest] || 0;
+      const consistency = series?.consistency?.[latest] || 0;
       weightedSum += prompts * consistency;
       totalPrompts += prompts;
     }
     return totalPrompts > 0 ? weightedSum / totalPrompts : null;
-  }, [chartData, displayModels]);
+  }, [columns, displayModels]);
 
   // Model table: sorted by consistency ascending (worst first)
   const modelTableData = useMemo(() => {
@@ -112,13 +133,15 @@ export default function Home() {
       let totalDrifted = 0;
       let lastActive: string | null = null;
 
-      for (const point of chartData) {
-        const subs = point[model] as number | undefined;
+      const series = columns.series[model];
+      for (let i = 0; i < columns.dates.length; i++) {
+        const date = columns.dates[i];
+        const subs = series?.submissions?.[i];
         if (subs && subs > 0) {
           totalSubs += subs;
-          totalPrompts += (point[`${model}_prompts`] as number) || 0;
-          totalDrifted += (point[`${model}_drifted`] as number) || 0;
-          if (!lastActive || point.date > lastActive) lastActive = point.date as string;
+          totalPrompts += series?.prompts?.[i] || 0;
+          totalDrifted += series?.drifted?.[i] || 0;
+          if (!lastActive || date > lastActive) lastActive = date;
         }
       }
 
@@ -130,7 +153,7 @@ export default function Home() {
     });
 
     return rows.sort((a, b) => a.consistency - b.consistency);
-  }, [displayModels, chartData]);
+  }, [displayModels, columns]);
 
   return (
     <main className="min-h-screen bg-mesh">
@@ -4,7 +4,8 @@ import { useAuth } from '@/lib/auth';
 import DriftChart from '@/components/DriftChart';
 import type { ChartView } from '@/components/DriftChart';
 import Button from '@/components/Button';
-import type { UserStatsResponse, ChartApiResponse, ChartDataPoint } from '@/lib/types';
+import type { UserStatsResponse, ChartColumns, ChartColumnarApiResponse } from '@/lib/types';
+import { aggregateColumns, columnsToRows } from '@/lib/aggregate';
 import MultiSelect from '@/components/MultiSelect';
 
 function consistencyColor(v: number): string {
@@ -31,11 +32,17 @@ const VIEW_OPTIONS: { value: ChartView; label: string }[] = [
   { value: 'drift-events', label: 'Drift Events' },
 ];
 
+/** Upper bound on points requested from the chart API; the server coarsens past it */
+const MAX_CHART_POINTS = 1000;
+
+/** Series the chart uses; consistency is derived client-side */
+const CHART_FIELDS = 'submissions,prompts,drifted';
+
 export default function MyStats() {
   const { session, status } = useAuth();
   const navigate = useNavigate();
   const [stats, setStats] = useState<UserStatsResponse | null>(null);
-  const [chartData, setChartData] = useState<ChartDataPoint[]>([]);
+  const [rawColumns, setRawColumns] = useState<ChartColumns>({ dates: [], series: {} });
   const [chartModels, setChartModels] = useState<string[]>([]);
   const [selectedModels, setSelectedModels] = useState<string[]>([]);
   const [chartView, setChartView] = useState<ChartView>('consistency');
@@ -53,13 +60,17 @@ export default function MyStats() {
     Promise.all([
       fetch('/api/user/me/stats', { credentials: 'include' })
         .then((r) => (r.ok ? r.json() as Promise<UserStatsResponse> : null)),
-      fetch('/api/data/chart')
-        .then((r) => (r.ok ? r.json() as Promise<ChartApiResponse> : null)),
+      fetch(`/api/data/chart?${new URLSearchParams({
+        max_points: String(MAX_CHART_POINTS),
+        format: 'columnar',
+        fields: CHART_FIELDS,
+      })}`)
+        .then((r) => (r.ok ? r.json() as Promise<ChartColumnarApiResponse> : null)),
     ])
       .then(([statsData, chartResp]) => {
         setStats(statsData);
         if (chartResp) {
-          setChartData(chartResp.data || []);
+          setRawColumns({ dates: chartResp.dates || [], series: chartResp.series || {} });
           setChartModels(chartResp.models || []);
         }
       })
@@ -76,41 +87,52 @@ export default function MyStats() {
     ? userModels.filter(m => selectedModels.includes(m))
     : userModels;
 
+  // Columns as served (hourly, or coarser past MAX_CHART_POINTS) with consistency
+  // derived; rows are only built for the chart
+  const columns = useMemo(
+    () => aggregateColumns(rawColumns, '1h', displayModels),
+    [rawColumns, displayModels],
+  );
+
+  const chartData = useMemo(
+    () => columnsToRows(columns, displayModels),
+    [columns, displayModels],
+  );
+
   const latestConsistency = useMemo(() => {
-    if (chartData.length === 0) return {} as Record<string, number>;
-    const latest = chartData[chartData.length - 1];
+    const latest = columns.dates.length - 1;
+    if (latest < 0) return {} as Record<string, number>;
     const result: Record<string, number> = {};
     for (const model of displayModels) {
-      result[model] = (latest[`${model}_consistency`] as number) ?? 1.0;
+      result[model] = columns.series[model]?.consistency?.[latest] ?? 1.0;
     }
     return result;
-  }, [chartData, displayModels]);
+  }, [columns, displayModels]);
 
   const avgConsistency = useMemo(() => {
-    if (chartData.length === 0 || displayModels.length === 0) return null;
-    const latest = chartData[chartData.length - 1];
+    const latest = columns.dates.length - 1;
+    if (latest < 0 || displayModels.length === 0) return null;
     let totalPrompts = 0;
     let weightedSum = 0;
     for (const model of displayModels) {
-      const prompts = (latest[`${model}_prompts`] as number) || 0;
-      const consistency = (latest[`${model}_consistency`] as number) || 0;
+      const series = columns.series[model];
+      const prompts = series?.prompts?.[latest] || 0;
+      const consistency = series?.consistency?.[latest] || 0;
       weightedSum += prompts * consistency;
       totalPrompts += prompts;
     }
     return totalPrompts > 0 ? weightedSum / totalPrompts : null;
-  }, [chartData, displayModels]);
+  }, [columns, displayModels]);
 
   const modelDriftTotals = useMemo(() => {
     const totals: Record<string, number> = {};
     for (const model of displayModels) {
       let sum = 0;
-      for (const point of chartData) {
-        sum += (point[`${model}_drifted`] as number) || 0;
-      }
+      for (const v of columns.series[model]?.drifted ?? []) sum += v ?? 0;
       totals[model] = sum;
     }
     return totals;
-  }, [chartData, displayModels]);
+  }, [columns, displayModels]);
 
   if (status === 'loading' || (status === 'authenticated' && loading)) {
     return (
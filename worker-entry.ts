@@ -10,6 +10,10 @@ import { dataRoutes } from './server/routes/data'
 import { userRoutes } from './server/routes/user'
 import { adminRoutes } from './server/routes/admin'
 import { authRoutes } from './server/routes/auth'
+import { consumeIngestBatch } from './server/lib/queue'
+import { runMaintenance, consumeMaintenanceBatch, isMaintenanceMessage } from './server/lib/maintenance'
+import { subrequestBudgetFromEnv } from './server/lib/storage'
+import type { IngestMessage, MaintenanceMessage } from './server/lib/schemas'
 
 type Env = {
   Bindings: {
@@ -21,6 +25,10 @@ type Env = {
     GOOGLE_CLIENT_ID: string
     GOOGLE_CLIENT_SECRET: string
     CRON_SECRET: string
+    SUBREQUEST_LIMIT?: string
+    INGEST_COALESCE_MS?: string
+    INGEST_QUEUE?: Queue<IngestMessage>
+    MAINTENANCE_QUEUE?: Queue<MaintenanceMessage>
   }
 }
 
@@ -48,4 +56,21 @@ app.all('*', async (c) => {
 
 export default {
   fetch: app.fetch,
+  /** Cron trigger: compaction and erasure jobs (see server/lib/maintenance.ts) */
+  async scheduled(_controller: ScheduledController, env: Env['Bindings'], ctx: ExecutionContext) {
+    const budget = subrequestBudgetFromEnv(env.SUBREQUEST_LIMIT)
+    ctx.waitUntil(runMaintenance(env.PRAMANA_DATA, budget, { queue: env.MAINTENANCE_QUEUE }))
+  },
+  /**
+   * Queue consumers: maintenance chain links, and batches enqueued by the
+   * submit routes (see server/lib/queue.ts). Each queue carries one kind.
+   */
+  async queue(batch: MessageBatch<IngestMessage | MaintenanceMessage>, env: Env['Bindings']) {
+    const budget = subrequestBudgetFromEnv(env.SUBREQUEST_LIMIT)
+    if (batch.messages.length > 0 && batch.messages.every((m) => isMaintenanceMessage(m.body))) {
+      await consumeMaintenanceBatch(env.PRAMANA_DATA, batch as MessageBatch<MaintenanceMessage>, budget, env.MAINTENANCE_QUEUE)
+    } else {
+      await consumeIngestBatch(env.PRAMANA_DATA, batch as MessageBatch<IngestMessage>, budget)
+    }
+  },
 }